@@ -8,6 +8,7 @@ import pytz  # Add this for timezone handling
 from swarm import Swarm, Agent
 from dateutil.parser import parse as parse_date
 import traceback
+from tools.llm_cache import cached_swarm_run
 
 # Set key variables 
 # Load environment variables
@@ -268,7 +269,7 @@ def process_single_file(filename, datasets_folder, output_folder, threshold_date
 
         messages = [{"role": "user", "content": user_message}]
         try:
-            response = client.run(agent=analyst_agent, messages=messages)
+            response = cached_swarm_run(client, analyst_agent, messages)
             assistant_reply = response.messages[-1]["content"]
         except Exception as e:
             error_msg = f"Error getting AI response: {str(e)}"
@@ -32,6 +32,9 @@ from tools.generateAnomalyCharts import generate_anomalies_summary_with_charts
 from tools.genChart import generate_time_series_chart
 from webChat import get_dashboard_metric
 from tools.store_anomalies import get_anomalies, get_anomaly_details as get_anomaly_details_from_db  # Import the new functions
+from tools.anomaly_search import search_anomalies
+from tools.agent_runtime import parallel_tool_calls, context_writer, take_tool_outcomes
+from tools.explanation_bundle import get_explanation_bundle, bundle_prompt_context
 
 # Configure logging
 # log_level = os.getenv("LOG_LEVEL", "INFO") # REMOVED: Configured in main.py
@@ -81,9 +84,9 @@ if not openai_api_key:
 # Initialize OpenAI client
 client = OpenAI()
 
-# Initialize Swarm client
+# Initialize Swarm client; the tool calls of one turn run concurrently
 debug_mode = os.getenv("DEBUG_MODE", "false").lower() == "true"
-swarm_client = Swarm()
+swarm_client = parallel_tool_calls(Swarm())
 
 # Set models
 EMBEDDING_MODEL = "text-embedding-3-large"
@@ -196,6 +199,7 @@ def get_anomalies(context_variables):
     """
     return {"anomalies": context_variables.get("anomalies", [])}
 
+@context_writer
 def run_anomaly_detection(context_variables, group_field, numeric_field, date_field, period_type='month', min_diff=2):
     """
     Wrapper tool for anomaly_detection that stores results in context.
@@ -215,6 +219,7 @@ def run_anomaly_detection(context_variables, group_field, numeric_field, date_fi
     
     return results
 
+@context_writer
 def set_analysis_parameters(context_variables, metric_name, period_type='month'):
     """
     Tool to set current metric and period type for analysis.
@@ -535,9 +540,19 @@ Periods: {previous_period} → {recent_period}
 """)
     
     try:
+        # Start from the bundle prebuilt by the metric generation run when there is one
+        bundle = get_explanation_bundle(metric_id, district, period_type) if metric_id else None
+        dashboard_data = docs_results = anomaly_results = None
+        if bundle:
+            logger.info(f"Using explanation bundle built at {datetime.fromtimestamp(bundle['built_at']).isoformat()}")
+            dashboard_data = {"metric_id": metric_id, "district": bundle["district"], "data": bundle["metric"],
+                              "columns": bundle["columns"]}
+            docs_results = {"results": bundle["docs"]}
+            if bundle["top_groups"]:
+                anomaly_results = {"results": bundle["top_groups"]}
+        
         # If metric_id is available, try to get dashboard metric data
-        dashboard_data = None
-        if metric_id and district is not None:
+        if bundle is None and metric_id and district is not None:
             try:
                 district_num = 0  # Default to citywide
                 if district != 'all':
@@ -553,8 +568,7 @@ Periods: {previous_period} → {recent_period}
                 logger.error(f"Error getting dashboard metric: {str(e)}")
         
         # Check for relevant documentation from Qdrant
-        docs_results = None
-        if metric_name:
+        if bundle is None and metric_name:
             try:
                 # Search for documentation about this metric
                 docs_results = query_docs(
@@ -567,10 +581,9 @@ Periods: {previous_period} → {recent_period}
                 logger.error(f"Error querying docs: {str(e)}")
         
         # Try to get anomaly data for this metric
-        anomaly_results = None
         try:
             anomaly_query = None
-            if metric_id:
+            if bundle is None and metric_id:
                 anomaly_query = query_anomalies_db(
                     context_variables,
                     query_type='by_metric',
@@ -584,7 +597,7 @@ Periods: {previous_period} → {recent_period}
                 # Found some anomalies related to this metric
                 logger.info(f"Found {len(anomaly_query['results'])} related anomalies")
                 anomaly_results = anomaly_query
-            else:
+            elif bundle is None:
                 logger.info("No related anomalies found in database")
         except Exception as e:
             logger.error(f"Error querying anomalies database: {str(e)}")
@@ -805,6 +818,35 @@ def truncate_messages(messages):
     
     return recent_messages
 
+def tool_outcome_message(outcome, sender):
+    """The stream message for one tool call Swarm ran (an agent_runtime outcome)."""
+    function_name = outcome["tool_name"]
+    if outcome["error"]:
+        logger.error(f"""
+=== Tool Error ===
+Function: {function_name}
+Error: {outcome['error']}
+""")
+        return json.dumps({
+            "type": "error",
+            "sender": sender,
+            "function_name": function_name,
+            "error": outcome["error"]
+        }) + "\n"
+    result = outcome["raw"]
+    logger.info(f"""
+=== Tool Result ===
+Function: {function_name}
+Result: {str(result)[:500]}{'...' if len(str(result)) > 500 else ''}
+""")
+    # Format the result for display
+    return json.dumps({
+        "type": "tool_result",
+        "sender": sender,
+        "function_name": function_name,
+        "result": result if isinstance(result, dict) else str(result)
+    }, default=str) + "\n"
+
 async def generate_response(user_input, session_data):
     """Generate a streaming response for the anomaly analyzer agent."""
     logger.info(f"""
@@ -816,8 +858,13 @@ Timestamp: {datetime.datetime.now().isoformat()}
     
     messages = session_data["messages"]
     agent = session_data["agent"]
-    context_variables = session_data.get("context_variables") or {}
+    context_variables = session_data.get("context_variables")
+    if context_variables is None:
+        context_variables = session_data["context_variables"] = {}
+    session_id = context_variables.get("session_id")
     current_function_name = None  # Initialize at the top level
+    # Drop outcomes left by an earlier response that ended early
+    take_tool_outcomes(session_id)
 
     # Append user message
     messages.append({"role": "user", "content": user_input})
@@ -840,6 +887,17 @@ Timestamp: {datetime.datetime.now().isoformat()}
         incomplete_tool_call = None
 
         for chunk in response_generator:
+            # Swarm runs a turn's tool calls (concurrently, see tools.agent_runtime) between chunks
+            for outcome in take_tool_outcomes(session_id):
+                yield tool_outcome_message(outcome, assistant_message["sender"])
+
+            # The run's final state: Swarm worked on a copy of the context
+            if "response" in chunk:
+                context_variables.update(chunk["response"].context_variables)
+                if chunk["response"].agent:
+                    session_data["agent"] = chunk["response"].agent
+                continue
+
             # Handle tool calls first
             if "tool_calls" in chunk and chunk["tool_calls"] is not None:
                 for tool_call in chunk["tool_calls"]:
@@ -878,51 +936,6 @@ Arguments: {json.dumps(arguments_json, indent=2)}
                         message = json.dumps(incomplete_tool_call) + "\n"
                         yield message
 
-                        # Process the function call
-                        function_to_call = function_mapping.get(current_function_name)
-                        if function_to_call:
-                            try:
-                                # Call the function with the context variables and arguments
-                                logger.info(f"Executing tool: {current_function_name}")
-                                result = function_to_call(context_variables, **arguments_json)
-                                
-                                logger.info(f"""
-=== Tool Result ===
-Function: {current_function_name}
-Result: {str(result)[:500]}{'...' if len(str(result)) > 500 else ''}
-""")
-                                
-                                # Format the result for display
-                                if isinstance(result, dict):
-                                    result_message = {
-                                        "type": "tool_result",
-                                        "sender": assistant_message["sender"],
-                                        "function_name": current_function_name,
-                                        "result": result
-                                    }
-                                else:
-                                    result_message = {
-                                        "type": "tool_result",
-                                        "sender": assistant_message["sender"],
-                                        "function_name": current_function_name,
-                                        "result": str(result)
-                                    }
-                                
-                                yield json.dumps(result_message) + "\n"
-                            except Exception as e:
-                                logger.error(f"""
-=== Tool Error ===
-Function: {current_function_name}
-Error: {str(e)}
-""")
-                                error_message = {
-                                    "type": "error",
-                                    "sender": assistant_message["sender"],
-                                    "function_name": current_function_name,
-                                    "error": str(e)
-                                }
-                                yield json.dumps(error_message) + "\n"
-
                         incomplete_tool_call = None
                         current_function_name = None
                     except json.JSONDecodeError:
@@ -996,7 +1009,7 @@ async def anomaly_chat(request: Request):
             sessions[session_id] = {
                 "messages": [],
                 "agent": anomaly_explainer_agent,
-                "context_variables": context_variables.copy()
+                "context_variables": {**context_variables, "session_id": session_id}
             }
         
         session_data = sessions[session_id]
@@ -1046,7 +1059,7 @@ async def reset_anomaly_chat(request: Request):
             sessions[session_id] = {
                 "messages": [],
                 "agent": anomaly_explainer_agent,
-                "context_variables": context_variables.copy()
+                "context_variables": {**context_variables, "session_id": session_id}
             }
         
         return JSONResponse(content={"status": "success", "message": "Conversation reset successfully"})
@@ -1433,7 +1446,7 @@ async def explain_metric_change_endpoint(request: Request):
         sessions[session_id] = {
             "messages": [],
             "agent": anomaly_explainer_agent,
-            "context_variables": context_variables.copy()
+            "context_variables": {**context_variables, "session_id": session_id}
         }
         
         # Get session data
@@ -1531,6 +1544,37 @@ After running these tools, provide a clear, comprehensive explanation of why thi
 - Whether this is part of a longer trend
 
 IMPORTANT: You MUST use the tools in the order specified before providing your explanation.
+"""
+        
+        # With the bundle prebuilt by the metric generation run, the agent starts with the
+        # metric values, top groups, docs and columns instead of fetching them tool by tool
+        bundle = await asyncio.to_thread(get_explanation_bundle, metric_id, data.get("district", "0"), period_type)
+        if bundle:
+            logger.info(f"Using explanation bundle for metric {metric_id}, district {district_number}, {period_type}")
+            system_message["content"] = """CRITICAL INSTRUCTION: The user message includes PREFETCHED CONTEXT with the metric's latest values, the groups that contributed most to the change (from stored anomalies), documentation snippets and the dataset's columns.
+
+1. Base your explanation on that context; do not call query_docs, get_dashboard_metric or query_anomalies_db to fetch it again.
+2. Use get_anomaly_details, get_dataset_columns, set_dataset or explain_anomaly only to go deeper than the context allows.
+3. The user cannot see your tool calls, only your final response, so you need to include your analysis and findings."""
+            prompt = f"""I need you to explain a significant change in the metric '{metric_name}' (ID: {metric_id}) for {district}.
+
+METRIC DETAILS:
+- Name: {metric_name}
+- ID: {metric_id}
+- District: {district} (district_number={district_number})
+- Period Type: {period_type}
+- Previous Period: {previous_period} - Value: {previous_value}
+- Recent Period: {recent_period} - Value: {recent_value}
+- Change: {direction} by {delta} ({percent_change_str})
+
+PREFETCHED CONTEXT (JSON):
+{bundle_prompt_context(bundle)}
+
+Provide a clear, comprehensive explanation of why this change occurred, focusing on:
+- Historical context and trends
+- Which groups contributed most to the change
+- Possible contributing factors
+- Whether this is part of a longer trend
 """
         
         logger.info(f"Generated prompt for agent: {prompt}")
@@ -1562,9 +1606,20 @@ IMPORTANT: You MUST use the tools in the order specified before providing your e
         
         try:
             logger.info("Processing agent response stream")
+            session_id = session_data["context_variables"].get("session_id")
+            take_tool_outcomes(session_id)
             for chunk in response_generator:
                 logger.debug(f"Received chunk: {str(chunk)[:200]}...")
                 
+                # Swarm runs a turn's tool calls (concurrently, see tools.agent_runtime) between chunks
+                for outcome in take_tool_outcomes(session_id):
+                    tool_calls_made.append({"name": outcome["tool_name"], "arguments": outcome["arguments"]})
+                    yield tool_outcome_message(outcome, "System")
+                
+                if "response" in chunk:
+                    session_data["context_variables"].update(chunk["response"].context_variables)
+                    continue
+                
                 # Handle tool calls
                 if "tool_calls" in chunk and chunk["tool_calls"] is not None:
                     for tool_call in chunk["tool_calls"]:
@@ -1608,51 +1663,6 @@ Arguments: {json.dumps(arguments_json, indent=2)}
                             message = json.dumps(incomplete_tool_call) + "\n"
                             yield message
 
-                            # Process the function call
-                            function_to_call = function_mapping.get(current_function_name)
-                            if function_to_call:
-                                try:
-                                    # Call the function with the context variables and arguments
-                                    logger.info(f"Executing tool: {current_function_name}")
-                                    result = function_to_call(session_data["context_variables"], **arguments_json)
-                                    
-                                    logger.info(f"""
-=== Tool Result ===
-Function: {current_function_name}
-Result: {str(result)[:500]}{'...' if len(str(result)) > 500 else ''}
-""")
-                                    
-                                    # Format the result for display
-                                    if isinstance(result, dict):
-                                        result_message = {
-                                            "type": "tool_result",
-                                            "sender": "System",
-                                            "function_name": current_function_name,
-                                            "result": result
-                                        }
-                                    else:
-                                        result_message = {
-                                            "type": "tool_result",
-                                            "sender": "System",
-                                            "function_name": current_function_name,
-                                            "result": str(result)
-                                        }
-                                    
-                                    yield json.dumps(result_message) + "\n"
-                                except Exception as e:
-                                    logger.error(f"""
-=== Tool Error ===
-Function: {current_function_name}
-Error: {str(e)}
-""")
-                                    error_message = {
-                                        "type": "error",
-                                        "sender": "System",
-                                        "function_name": current_function_name,
-                                        "error": str(e)
-                                    }
-                                    yield json.dumps(error_message) + "\n"
-
                             incomplete_tool_call = None
                             current_function_name = None
                         except json.JSONDecodeError:
@@ -1823,78 +1833,23 @@ async def query_anomalies_endpoint(
                     "message": "Failed to connect to database"
                 }
             
-            # Create cursor
-            cursor = connection.cursor(cursor_factory=RealDictCursor)
-            
-            # Build query with standard filters
-            query = """
-                SELECT * FROM anomalies WHERE 1=1 
-            """
-            params = []
-            
-            # Apply standard filters from get_anomalies logic
-            if only_anomalies:
-                query += "AND out_of_bounds = true "
-                
-            # Filter for active anomalies if requested
-            if only_active:
-                query += "AND is_active = true "
-                
-            if group_filter:
-                query += "AND group_value ILIKE %s "
-                params.append(f"%{group_filter}%")
-                
-            if date_start:
-                query += "AND created_at >= %s "
-                params.append(date_start)
-                
-            if date_end:
-                query += "AND created_at <= %s "
-                params.append(date_end)
-                
-            if metric_name:
-                # Filter by metric name in the metadata JSON
-                query += "AND metadata->>'object_name' ILIKE %s "
-                params.append(f"%{metric_name}%")
-            
-            if district:
-                # Filter by district
-                query += "AND district = %s "
-                params.append(district)
-                
-            # Add object_id filter - this is our key addition
-            if object_id:
-                query += "AND object_id = %s "
-                params.append(str(object_id))
-                
-            # Add period_type filter if provided
-            if period_type:
-                query += "AND period_type = %s "
-                params.append(period_type)
-            
-            # Order based on query_type
-            if query_type == 'recent':
-                query += "ORDER BY created_at DESC "
-            elif query_type == 'by_group':
-                query += "ORDER BY group_value ASC, created_at DESC "
-            elif query_type == 'by_date':
-                query += "ORDER BY created_at ASC "
-            elif query_type == 'by_anomaly_severity':
-                query += "ORDER BY ABS(difference) DESC "
-            elif query_type == 'by_district':
-                query += "ORDER BY district ASC, created_at DESC "
-            
-            # Add limit
-            query += "LIMIT %s"
-            params.append(limit)
-            
-            # Log the final query for debugging
-            logging.info(f"Executing SQL query: {query}")
-            logging.info(f"With parameters: {params}")
-            
-            # Execute query
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+            # Same indexed search as get_anomalies, with every column for the chart data
+            results = search_anomalies(
+                connection,
+                cursor_factory=RealDictCursor,
+                columns="*",
+                query_type=query_type,
+                limit=limit,
+                group_filter=group_filter,
+                date_start=date_start,
+                date_end=date_end,
+                only_anomalies=only_anomalies,
+                metric_name=metric_name,
+                district=district or None,
+                object_id=object_id or None,
+                period_type=period_type,
+                only_active=only_active
+            )
             
             # Convert to list of dictionaries and handle datetime objects
             result_list = []
@@ -1905,7 +1860,6 @@ async def query_anomalies_endpoint(
                     row_dict['created_at'] = row_dict['created_at'].isoformat()
                 result_list.append(row_dict)
             
-            cursor.close()
             connection.close()
             
             anomalies_result = {
@@ -2041,6 +1995,21 @@ async def get_anomaly_details_endpoint(anomaly_id: int):
             }
         )
 
+@router.get("/api/explanation-bundle/{metric_id}")
+async def get_explanation_bundle_endpoint(metric_id: str, district: str = "0", period_type: str = "month"):
+    """
+    API endpoint to get the explanation context prebuilt for a metric by the
+    metric generation run: latest values, top contributing groups, doc
+    snippets and dataset columns.
+    """
+    bundle = await asyncio.to_thread(get_explanation_bundle, metric_id, district, period_type)
+    if bundle is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "error", "message": f"No explanation bundle for metric {metric_id}"}
+        )
+    return JSONResponse(content=bundle)
+
 @router.get("/anomaly-chart")
 async def anomaly_chart_page(request: Request):
     """
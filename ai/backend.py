@@ -1,5 +1,5 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from fastapi.staticfiles import StaticFiles
@@ -9,7 +9,7 @@ from fastapi.security import HTTPBasic, HTTPBasicCredentials # Added for basic a
 
 import os
 import json
-from datetime import datetime, date
+from datetime import datetime
 import pytz
 import subprocess  # ADDED
 import glob
@@ -33,6 +33,22 @@ import asyncio
 # Import the new function
 from tools.genGhostPost import publish_newsletter_to_ghost
 from monthly_report import expand_chart_references, generate_email_compatible_report
+from tools.llm_cache import get_llm_cache_stats
+from tools.log_utils import tail_log, rotated_from
+from tools.pg_stream import (
+    is_read_query, stream_query, fetch_capped, explain_query, bounded, max_bytes_limit,
+    PG_QUERY_MAX_ROWS, PG_STATEMENT_TIMEOUT_MS, PG_STATEMENT_TIMEOUT_MAX_MS
+)
+from tools.db_retention import retention_report
+from tools.db_utils import get_postgres_connection
+from tools.dashboard_snapshot import get_snapshot, refresh_snapshot, vectordb_size, system_status, qdrant_collections_count
+from tools.disk_usage import register_default_roots, all_usage, tracked_files, remove_files, prune_empty_dirs
+from tools.chart_cache import (
+    cached_chart_response, invalidate_chart_cache,
+    FRONTEND_PERIOD_TYPE_MAP, DB_PERIOD_TYPE_MAP
+)
+from tools.store_anomalies import get_anomaly_details
+from tools.generateAnomalyCharts import anomaly_chart_inputs, render_anomaly_chart_page
 
 # Use the root logger configured elsewhere (e.g., in monthly_report.py)
 logger = logging.getLogger(__name__)
@@ -44,6 +60,10 @@ security = HTTPBasic() # Added for basic auth
 # Define the absolute path to the output directory
 script_dir = os.path.dirname(os.path.abspath(__file__))  # Gets the /ai directory
 output_dir = os.path.join(script_dir, 'output')  # /ai/output
+LOG_TAIL_LINES = int(os.getenv("LOG_TAIL_LINES", "2000"))  # Lines shown by the log viewer
+
+# output/ and logs/ are indexed in the background (see main.py) and served from tools/disk_usage.py
+register_default_roots(script_dir)
 
 logger.info(f"Script directory: {script_dir}")
 logger.info(f"Output directory: {output_dir}")
@@ -677,31 +697,53 @@ async def get_aggregated_summary():
         return JSONResponse({"status": "error", "message": str(e)})
 
 
+def list_log_files(logs_dir: str):
+    """Log files and their rotated (.gz) segments, from the disk usage index."""
+    entries = {os.path.basename(path): (size, mtime) for path, size, mtime in tracked_files("logs")
+               if os.path.dirname(path) == logs_dir}
+    segments = {}
+    for name in entries:
+        base = rotated_from(name)
+        if base in entries:
+            segments.setdefault(base, []).append(name)
+    
+    log_files = []
+    for name, (size, mtime) in entries.items():
+        if not (name.endswith('.log') or name.endswith('.txt')):
+            continue
+        rotated = segments.get(name, [])
+        log_files.append({
+            "name": name,
+            "size": size,
+            "modified": datetime.fromtimestamp(mtime).isoformat(),
+            "rotated_segments": len(rotated),
+            "rotated_size": sum(entries[segment][0] for segment in rotated)
+        })
+        for segment in rotated:
+            segment_size, segment_mtime = entries[segment]
+            log_files.append({
+                "name": segment,
+                "size": segment_size,
+                "modified": datetime.fromtimestamp(segment_mtime).isoformat(),
+                "rotated_from": name
+            })
+    
+    # Sort by modification time, most recent first
+    log_files.sort(key=lambda x: x["modified"], reverse=True)
+    return log_files
+
+
 @router.get("/get-log-files")
 async def get_log_files():
-    """Get a list of all log files in the logs directory."""
+    """Get a list of all log files in the logs directory, with their rotated (.gz) segments."""
     try:
         script_dir = os.path.dirname(os.path.abspath(__file__))
         logs_dir = os.path.join(script_dir, 'logs')
         
         if not os.path.exists(logs_dir):
             return JSONResponse({"files": []})
-            
-        log_files = []
-        for file in os.listdir(logs_dir):
-            if file.endswith('.log') or file.endswith('.txt'):
-                file_path = os.path.join(logs_dir, file)
-                # Get file stats
-                stats = os.stat(file_path)
-                log_files.append({
-                    "name": file,
-                    "size": stats.st_size,
-                    "modified": datetime.fromtimestamp(stats.st_mtime).isoformat()
-                })
-                
-        # Sort by modification time, most recent first
-        log_files.sort(key=lambda x: x["modified"], reverse=True)
         
+        log_files = await asyncio.to_thread(list_log_files, logs_dir)
         return JSONResponse({"files": log_files})
     except Exception as e:
         logger.exception(f"Error getting log files: {str(e)}")
@@ -710,7 +752,10 @@ async def get_log_files():
 
 @router.get("/disk-space")
 async def get_disk_space():
-    """Get disk space information for the current drive."""
+    """
+    Get disk space information for the current drive, plus byte and file counts
+    of the output, logs and vector DB directories from the disk usage index.
+    """
     try:
         # Get disk usage for the current directory's drive
         total, used, free = shutil.disk_usage(os.path.abspath(os.sep))
@@ -718,7 +763,8 @@ async def get_disk_space():
         return JSONResponse({
             "total": total,
             "available": free,
-            "used": used
+            "used": used,
+            "directories": all_usage()
         })
     except Exception as e:
         logger.exception(f"Error getting disk space: {str(e)}")
@@ -733,23 +779,11 @@ async def clear_html_files():
     """Delete all HTML files from the output directory and its subdirectories."""
     logger.debug("Clear HTML files called")
     try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        output_dir = os.path.join(script_dir, 'output')
+        def clear():
+            html_files = tracked_files("output", lambda path: path.endswith('.html'), rescan=True)
+            return remove_files(path for path, _, _ in html_files)[0]
         
-        # Count of deleted files
-        deleted_count = 0
-        
-        # Walk through all subdirectories
-        for root, _, files in os.walk(output_dir):
-            for file in files:
-                if file.endswith('.html'):
-                    file_path = os.path.join(root, file)
-                    try:
-                        os.remove(file_path)
-                        deleted_count += 1
-                        logger.debug(f"Deleted file: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Error deleting file {file_path}: {str(e)}")
+        deleted_count = await asyncio.to_thread(clear)
         
         logger.info(f"Successfully deleted {deleted_count} HTML files")
         return JSONResponse({
@@ -798,30 +832,13 @@ async def clear_period_files(period_type: str):
                 "message": f"No {period_folder} files to delete"
             })
         
-        # Count of deleted files
-        deleted_count = 0
+        def clear():
+            # Delete all files, then the directories left empty
+            deleted = remove_files(path for path, _, _ in tracked_files("output", under=output_dir, rescan=True))[0]
+            prune_empty_dirs(output_dir)
+            return deleted
         
-        # Delete all files and subdirectories
-        for root, dirs, files in os.walk(output_dir, topdown=False):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    os.remove(file_path)
-                    deleted_count += 1
-                    logger.debug(f"Deleted file: {file_path}")
-                except Exception as e:
-                    logger.error(f"Error deleting file {file_path}: {str(e)}")
-            
-            # Delete empty directories
-            for dir in dirs:
-                dir_path = os.path.join(root, dir)
-                try:
-                    # Only remove if empty
-                    if not os.listdir(dir_path):
-                        os.rmdir(dir_path)
-                        logger.debug(f"Deleted directory: {dir_path}")
-                except Exception as e:
-                    logger.error(f"Error deleting directory {dir_path}: {str(e)}")
+        deleted_count = await asyncio.to_thread(clear)
         
         logger.info(f"Successfully deleted {deleted_count} files from {period_folder} folder")
         return JSONResponse({
@@ -1227,9 +1244,13 @@ async def execute_query(request: Request):
 
 
 @router.get("/logs/{filename}")
-async def get_log_file(filename: str):
+async def get_log_file(filename: str, lines: int = None, rotated: bool = False):
     """
     Serve a log file directly.
+
+    With ?lines=N, return only the last N lines, read backwards from the end of
+    the file; with &rotated=true the tail continues into the gzipped rotated
+    segments. Rotated segments (name.log.1.gz) are always served as a tail.
     """
     logger.info(f"Request for log file: {filename}")
     
@@ -1281,6 +1302,9 @@ async def get_log_file(filename: str):
         
         # Check if the file exists
         if os.path.exists(file_path):
+            if lines or filename.endswith('.gz'):
+                tail = tail_log(file_path, lines=lines or LOG_TAIL_LINES, include_rotated=rotated)
+                return PlainTextResponse("\n".join(tail["lines"]) + "\n")
             logger.info(f"Serving log file: {file_path}")
             return FileResponse(file_path)
         else:
@@ -2100,17 +2124,33 @@ async def enhance_queries():
 
 @router.post("/execute-postgres-query")
 async def execute_postgres_query(request: Request):
-    """Execute a PostgreSQL query and return results."""
+    """
+    Execute a PostgreSQL query and return results.
+
+    Read queries (SELECT/WITH/VALUES/TABLE) run on a server-side cursor under
+    a statement timeout and never load the whole result:
+        mode "json" (default): up to max_rows rows (PG_QUERY_JSON_MAX_ROWS) plus a truncated flag
+        mode "ndjson" / "csv": streamed in chunks, capped by max_rows/max_mb, with a truncation marker
+        mode "explain": the EXPLAIN plan and row estimate, without running the query
+    Other statements are executed and committed as before.
+    """
     try:
         data = await request.json()
-        query = data.get('query', '').strip()
+        query = data.get('query', '').strip().rstrip(';')
         parameters = data.get('parameters', {})
+        mode = (data.get('mode') or 'json').lower()
+        timeout_ms = data.get('timeout_ms')
         
         if not query:
             return JSONResponse({
                 'status': 'error',
                 'message': 'Query is required'
             })
+        if mode not in ('json', 'ndjson', 'csv', 'explain'):
+            return JSONResponse({
+                'status': 'error',
+                'message': f"Unsupported mode '{mode}'. Use json, ndjson, csv or explain"
+            }, status_code=400)
         
         # Connect to PostgreSQL
         conn = get_db_connection()
@@ -2119,47 +2159,71 @@ async def execute_postgres_query(request: Request):
                 status_code=500,
                 content={"detail": "Failed to connect to database"}
             )
+
+        if is_read_query(query) and mode in ('ndjson', 'csv'):
+            # Checked before streaming starts, so a bad limit is a 400 and not a truncated body
+            max_mb = data.get('max_mb')
+            try:
+                max_rows = bounded(data.get('max_rows'), PG_QUERY_MAX_ROWS, PG_QUERY_MAX_ROWS, "max_rows")
+                max_bytes = bounded(int(float(max_mb) * 1024 * 1024) if max_mb not in (None, "") else None,
+                                    max_bytes_limit(), max_bytes_limit(), "max_mb")
+                timeout_ms = bounded(timeout_ms or None, PG_STATEMENT_TIMEOUT_MS, PG_STATEMENT_TIMEOUT_MAX_MS, "timeout_ms")
+            except ValueError as e:
+                conn.close()
+                return JSONResponse({'status': 'error', 'message': str(e)}, status_code=400)
+            stream = stream_query(
+                conn, query, parameters, fmt=mode,
+                max_rows=max_rows,
+                max_bytes=max_bytes,
+                timeout_ms=timeout_ms
+            )
+            media_type = "application/x-ndjson" if mode == 'ndjson' else "text/csv"
+            headers = {"Content-Disposition": "attachment; filename=query_results.csv"} if mode == 'csv' else None
+            # The generator owns the connection and closes it when the response ends
+            return StreamingResponse(stream, media_type=media_type, headers=headers)
         
         try:
-            # Create a cursor with dictionary-like results
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            
-            # Execute the query with parameters
-            cursor.execute(query, parameters)
-            
-            # For non-SELECT queries, commit the transaction
-            if not query.strip().upper().startswith('SELECT'):
+            if mode == 'explain':
+                if not is_read_query(query):
+                    return JSONResponse({
+                        'status': 'error',
+                        'message': 'EXPLAIN preview is only available for read queries'
+                    }, status_code=400)
+                explained = await asyncio.to_thread(explain_query, conn, query, parameters, timeout_ms)
+                return JSONResponse({'status': 'success', 'query': query, **explained})
+
+            if is_read_query(query):
+                fetched = await asyncio.to_thread(fetch_capped, conn, query, parameters, data.get('max_rows'), timeout_ms)
+                return JSONResponse({
+                    'status': 'success',
+                    'rowCount': fetched['rowCount'],
+                    'truncated': fetched['truncated'],
+                    'query': query,
+                    'results': fetched['results']
+                })
+
+            # Non-read statements run as before and are committed
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, parameters)
                 conn.commit()
                 return JSONResponse({
                     'status': 'success',
                     'message': 'Query executed successfully',
                     'rowCount': cursor.rowcount
                 })
-            
-            # For SELECT queries, fetch and return results
-            results = cursor.fetchall()
-            
-            # Convert results to list of dictionaries and handle datetime serialization
-            results_list = []
-            for row in results:
-                row_dict = dict(row)
-                # Convert datetime objects to ISO format strings
-                for key, value in row_dict.items():
-                    if isinstance(value, (datetime, date)):
-                        row_dict[key] = value.isoformat()
-                results_list.append(row_dict)
-            
-            return JSONResponse({
-                'status': 'success',
-                'rowCount': len(results_list),
-                'query': query,
-                'results': results_list
-            })
+            finally:
+                cursor.close()
             
         finally:
-            cursor.close()
             conn.close()
             
+    except ValueError as e:
+        # Negative or malformed max_rows / timeout_ms
+        return JSONResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status_code=400)
     except Exception as e:
         logger.exception(f"Error executing PostgreSQL query: {str(e)}")
         return JSONResponse({
@@ -2232,6 +2296,7 @@ async def clear_postgres_data():
             
             # Commit the transaction
             conn.commit()
+            invalidate_chart_cache()
             
         finally:
             cursor.close()
@@ -2258,30 +2323,13 @@ async def clear_all_output():
         script_dir = os.path.dirname(os.path.abspath(__file__))
         output_dir = os.path.join(script_dir, 'output')
         
-        # Count of deleted files
-        deleted_count = 0
+        def clear():
+            # Delete all files, then the directories left empty
+            deleted = remove_files(path for path, _, _ in tracked_files("output", under=output_dir, rescan=True))[0]
+            prune_empty_dirs(output_dir)
+            return deleted
         
-        # Delete all files and subdirectories
-        for root, dirs, files in os.walk(output_dir, topdown=False):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    os.remove(file_path)
-                    deleted_count += 1
-                    logger.debug(f"Deleted file: {file_path}")
-                except Exception as e:
-                    logger.error(f"Error deleting file {file_path}: {str(e)}")
-            
-            # Delete empty directories
-            for dir in dirs:
-                dir_path = os.path.join(root, dir)
-                try:
-                    # Only remove if empty
-                    if not os.listdir(dir_path):
-                        os.rmdir(dir_path)
-                        logger.debug(f"Deleted directory: {dir_path}")
-                except Exception as e:
-                    logger.error(f"Error deleting directory {dir_path}: {str(e)}")
+        deleted_count = await asyncio.to_thread(clear)
         
         # Recreate output directory structure
         os.makedirs(os.path.join(output_dir, 'annual'), exist_ok=True)
@@ -2381,6 +2429,12 @@ async def get_notes_file():
 
 # Import evals functionality
 from evals import run_and_get_tool_calls, agent as analyst_agent
+from tools.eval_runner import run_suite, list_runs, load_run, compare_runs, resolve_agent, EVAL_RESULTS_DIR
+
+# Suite runs started from the evals interface, by run label, while they are in flight
+_eval_runs_in_flight = set()
+# The event loop only keeps weak references to tasks; these keep eval runs alive until they finish
+_eval_tasks = set()
 
 @router.get("/run-evals")
 async def run_evals_endpoint(query: str):
@@ -2388,8 +2442,8 @@ async def run_evals_endpoint(query: str):
     logger.info(f"Running evals with query: {query}")
     
     try:
-        # Run the query through the evals system
-        tool_calls = run_and_get_tool_calls(analyst_agent, query)
+        # Run the query through the evals system, off the event loop
+        tool_calls = await asyncio.to_thread(run_and_get_tool_calls, analyst_agent, query)
         
         # Get the log filename that was used
         from evals import log_filename
@@ -2419,6 +2473,87 @@ async def run_evals_endpoint(query: str):
             "message": str(e)
         }, status_code=500)
 
+@router.post("/eval-runs")
+async def start_eval_run(request: Request):
+    """
+    Start a concurrent eval suite run in the background. Body (all optional):
+    {"agent": "analyst", "model": "gpt-4o-mini", "instructions": "...",
+     "suite": [{"id", "query", "expect_tools", "forbid_tools"}], "workers": 4, "label": "..."}
+    """
+    body = await request.json() if await request.body() else {}
+    try:
+        agent = resolve_agent(body.get("agent", "analyst"), body.get("instructions"))
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    try:
+        workers = int(body.get("workers") or 4)
+    except (TypeError, ValueError):
+        workers = 0
+    if workers < 1:
+        return JSONResponse({"status": "error", "message": "workers must be a positive integer"}, status_code=400)
+    label = body.get("label") or datetime.now().strftime('%Y%m%d_%H%M%S')
+    if label in _eval_runs_in_flight:
+        return JSONResponse({"status": "error", "message": f"Eval run {label} is already running"}, status_code=409)
+
+    async def run():
+        try:
+            import webChat
+            await asyncio.to_thread(run_suite, agent, body.get("suite"), model=body.get("model"),
+                                    workers=workers, label=label,
+                                    context={"dataset": webChat.combined_df, "notes": webChat.combined_notes})
+        except Exception as e:
+            logger.exception(f"Eval run {label} failed: {str(e)}")
+        finally:
+            _eval_runs_in_flight.discard(label)
+
+    # Claimed before the task starts, so a second request for the label gets the 409
+    _eval_runs_in_flight.add(label)
+    task = asyncio.create_task(run())
+    _eval_tasks.add(task)
+    task.add_done_callback(_eval_tasks.discard)
+    return JSONResponse({"status": "started", "label": label})
+
+@router.get("/eval-runs")
+async def get_eval_runs():
+    """Summaries of recorded eval runs, most recent first, and the labels still running."""
+    runs = await asyncio.to_thread(list_runs)
+    # Parquet run headers can hold numpy scalars
+    runs = json.loads(json.dumps(runs, default=str))
+    return JSONResponse({"status": "success", "runs": runs, "running": sorted(_eval_runs_in_flight)})
+
+@router.get("/eval-runs/compare")
+async def compare_eval_runs(baseline: str, candidate: str):
+    """Compare two eval run files (names in the runs directory) and list regressions."""
+    paths = []
+    for name in (baseline, candidate):
+        path = os.path.join(EVAL_RESULTS_DIR, os.path.basename(name))
+        if not os.path.exists(path):
+            return JSONResponse({"status": "error", "message": f"Eval run {name} not found"}, status_code=404)
+        paths.append(path)
+    baseline_rows = (await asyncio.to_thread(load_run, paths[0]))[1]
+    candidate_rows = (await asyncio.to_thread(load_run, paths[1]))[1]
+    return JSONResponse({"status": "success", **compare_runs(baseline_rows, candidate_rows)})
+
+@router.post("/anomaly-scan")
+async def anomaly_scan(request: Request):
+    """
+    Re-score every stored time series for anomalies and write the results.
+    Body (all optional): {"period_type": "month", "detector": "stddev",
+    "params": {"min_diff": 2.5}, "dry_run": false, "refresh": false}
+    """
+    from tools.anomaly_scan import run_anomaly_scan
+    body = await request.json() if await request.body() else {}
+    try:
+        summary = await asyncio.to_thread(run_anomaly_scan, body.get("period_type", "month"),
+                                          body.get("detector", "stddev"), body.get("params") or {},
+                                          write=not body.get("dry_run", False), refresh=bool(body.get("refresh")))
+    except (ValueError, TypeError) as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception(f"Anomaly scan failed: {str(e)}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+    return JSONResponse({"status": "success", **summary})
+
 @router.get("/evals-interface")
 async def evals_interface(request: Request):
     """Serve the evals interface."""
@@ -2703,12 +2838,21 @@ async def get_postgres_size():
             size_mb = float(result[0]) if result else 0.0
             
             cursor.close()
-            conn.close()
+            
+            # Live vs archived size of the versioned tables and space reclaimed by retention
+            try:
+                retention = retention_report(conn)
+            except Exception as report_err:
+                logger.error(f"Error building retention report: {str(report_err)}")
+                retention = None
+            finally:
+                conn.close()
             
         except Exception as db_err:
             logger.error(f"Database error: {str(db_err)}")
             # If can't connect to DB, return estimated size
             size_mb = 0.0
+            retention = None
         
         # Mock change value for now
         # In a real implementation, this would be calculated from historical data
@@ -2716,146 +2860,29 @@ async def get_postgres_size():
         
         return JSONResponse(content={
             "size_mb": size_mb,
-            "change": change
+            "change": change,
+            "retention": retention
         })
     except Exception as e:
         logger.error(f"Error getting PostgreSQL size: {str(e)}")
         raise HTTPException(status_code=500, detail="Error getting PostgreSQL size")
 
+@router.get("/api/llm-cache-stats")
+async def get_llm_cache_status():
+    """Get hit rate, savings and size of the LLM response cache."""
+    try:
+        return JSONResponse(content=get_llm_cache_stats())
+    except Exception as e:
+        logger.error(f"Error getting LLM cache stats: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error getting LLM cache stats")
+
 @router.get("/api/vectordb-size")
 async def get_vectordb_size():
     """Get the size of the Vector DB in MB using metrics API and filesystem fallback."""
     try:
-        # Method 1: Try to get size from Qdrant metrics API
-        try:
-            import requests
-            logger.info("Attempting to get Qdrant size from metrics API")
-            response = requests.get("http://localhost:6333/metrics", timeout=5)
-            
-            if response.ok:
-                metrics = response.text
-                # Look for disk usage metrics in the response
-                disk_metrics = {}
-                
-                # Parse metrics for disk usage
-                for line in metrics.splitlines():
-                    if line.startswith("qdrant_storage_total_") and not line.startswith("#"):
-                        try:
-                            parts = line.split()
-                            if len(parts) >= 2:
-                                key = parts[0].split("{")[0]  # Get metric name without labels
-                                value = float(parts[1])
-                                disk_metrics[key] = value
-                        except Exception as parse_err:
-                            logger.warning(f"Error parsing metric line '{line}': {str(parse_err)}")
-                
-                # Look for total bytes metric
-                if "qdrant_storage_total_bytes" in disk_metrics:
-                    storage_bytes = disk_metrics["qdrant_storage_total_bytes"]
-                    storage_mb = storage_bytes / (1024 * 1024)  # Convert bytes to MB
-                    logger.info(f"Got Qdrant size from metrics API: {storage_mb:.2f} MB")
-                    return JSONResponse(content={
-                        "size_mb": float(storage_mb),
-                        "change": 0.0,
-                        "source": "metrics_api"
-                    })
-                else:
-                    logger.warning("Storage metrics not found in Qdrant metrics API response")
-            else:
-                logger.warning(f"Metrics API request failed with status {response.status_code}")
-        
-        except Exception as metrics_err:
-            logger.warning(f"Error getting size from metrics API: {str(metrics_err)}")
-        
-        # Method 2: Try filesystem measurement
-        try:
-            # Get Qdrant storage path - default is './storage' in Qdrant's working directory
-            # This needs to be adjusted based on your Qdrant configuration
-            logger.info("Attempting to measure Qdrant size from filesystem")
-            
-            # Try to get storage path from environment variable or use default
-            qdrant_storage_path = os.environ.get("QDRANT_STORAGE_PATH", "/var/lib/qdrant")
-            
-            if not os.path.exists(qdrant_storage_path):
-                # Try alternate paths
-                alternate_paths = [
-                    "./storage",  # Default in local development
-                    "/var/lib/qdrant/storage",
-                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage"),
-                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "storage")
-                ]
-                
-                for path in alternate_paths:
-                    if os.path.exists(path):
-                        qdrant_storage_path = path
-                        break
-            
-            if os.path.exists(qdrant_storage_path):
-                total_size = 0
-                for dirpath, _, filenames in os.walk(qdrant_storage_path):
-                    for f in filenames:
-                        fp = os.path.join(dirpath, f)
-                        try:
-                            total_size += os.path.getsize(fp)
-                        except (FileNotFoundError, PermissionError) as e:
-                            logger.warning(f"Error getting size of {fp}: {str(e)}")
-                
-                storage_mb = total_size / (1024 * 1024)  # Convert bytes to MB
-                logger.info(f"Got Qdrant size from filesystem: {storage_mb:.2f} MB")
-                return JSONResponse(content={
-                    "size_mb": float(storage_mb),
-                    "change": 0.0,
-                    "source": "filesystem"
-                })
-            else:
-                logger.warning(f"Qdrant storage path not found at {qdrant_storage_path}")
-        except Exception as fs_err:
-            logger.warning(f"Error measuring size from filesystem: {str(fs_err)}")
-        
-        # Method 3: Fallback to collection-based estimation if both methods above fail
-        total_points = 0
-        collections_count = 0
-        
-        try:
-            # Initialize Qdrant client
-            logger.info("Falling back to collection-based size estimation")
-            qdrant_client = QdrantClient(os.environ.get("QDRANT_URL", "localhost"), port=6333)
-            
-            # Get list of collections
-            collections_response = qdrant_client.get_collections()
-            collections_count = len(collections_response.collections)
-            
-            # Iterate through each collection to get statistics
-            for collection_info in collections_response.collections:
-                collection_name = collection_info.name
-                
-                try:
-                    # Get collection info with points count
-                    collection_detail = qdrant_client.get_collection(collection_name=collection_name)
-                    points_count = collection_detail.points_count
-                    
-                    if points_count is not None:
-                        total_points += points_count
-                except Exception as coll_err:
-                    logger.error(f"Error getting details for collection {collection_name}: {str(coll_err)}")
-                    continue
-                    
-        except Exception as qdrant_err:
-            logger.error(f"Error querying Qdrant: {str(qdrant_err)}")
-        
-        # Estimate size based on points (more realistic estimate: ~2KB per vector on average)
-        estimated_size_mb = (total_points * 2.0) / 1024
-        
-        # If it's a very small number, set a minimum
-        if estimated_size_mb < 0.1 and total_points > 0:
-            estimated_size_mb = 0.1
-            
-        logger.info(f"Estimated size from collections: {estimated_size_mb:.2f} MB")
-        return JSONResponse(content={
-            "size_mb": float(estimated_size_mb),
-            "change": 0.0,
-            "source": "estimate"
-        })
+        size = await asyncio.to_thread(vectordb_size)
+        size.pop("collections", None)
+        return JSONResponse(content=size)
     except Exception as e:
         logger.error(f"Error getting Vector DB size: {str(e)}")
         # Return a default value in case of error
@@ -2869,122 +2896,35 @@ async def get_vectordb_size():
 async def get_system_status():
     """Get system status for various components."""
     try:
-        status_items = []
-        
-        # Check PostgreSQL status
-        postgres_status = "error"
-        postgres_value = "Offline"
-        try:
-            conn = psycopg2.connect(
-                host=os.environ.get("POSTGRES_HOST", "localhost"),
-                database=os.environ.get("POSTGRES_DB", "transparentsf"),
-                user=os.environ.get("POSTGRES_USER", "postgres"),
-                password=os.environ.get("POSTGRES_PASSWORD", "postgres"),
-                connect_timeout=3
-            )
-            cursor = conn.cursor()
-            cursor.execute("SELECT version()")
-            version = cursor.fetchone()[0]
-            cursor.close()
-            conn.close()
-            
-            postgres_status = "healthy"
-            postgres_value = "Online"
-        except Exception as db_err:
-            logger.error(f"PostgreSQL status check failed: {str(db_err)}")
-        
-        status_items.append({
-            "name": "PostgreSQL Database",
-            "status": postgres_status,
-            "value": postgres_value
-        })
-        
-        # Check Vector DB (Qdrant) status
-        vectordb_status = "error"
-        vectordb_value = "Offline"
-        try:
-            qdrant_client = QdrantClient(os.environ.get("QDRANT_URL", "localhost"), port=6333)
-            collections = qdrant_client.get_collections()
-            vectordb_status = "healthy"
-            vectordb_value = f"{len(collections.collections)} collections"
-        except Exception as vdb_err:
-            logger.error(f"Vector DB status check failed: {str(vdb_err)}")
-        
-        status_items.append({
-            "name": "Vector Database",
-            "status": vectordb_status,
-            "value": vectordb_value
-        })
-        
-        # Check disk space
-        disk_status = "healthy"
-        disk_value = ""
-        try:
-            total, used, free = shutil.disk_usage("/")
-            percent_used = (used / total) * 100
-            
-            if percent_used > 90:
-                disk_status = "error"
-            elif percent_used > 70:
-                disk_status = "warning"
-            
-            disk_value = f"{round(percent_used, 1)}% used"
-        except Exception as disk_err:
-            logger.error(f"Disk status check failed: {str(disk_err)}")
-            disk_status = "error"
-            disk_value = "Unknown"
-        
-        status_items.append({
-            "name": "Disk Space",
-            "status": disk_status,
-            "value": disk_value
-        })
-        
-        # Add server uptime
-        uptime_status = "healthy"
-        uptime_value = ""
-        try:
-            if os.name == 'posix':  # Linux or MacOS
-                try:
-                    # Try using uptime command (works on both Linux and MacOS)
-                    uptime_output = subprocess.check_output(['uptime']).decode('utf-8')
-                    # Extract the uptime information
-                    if 'day' in uptime_output:
-                        # Format with days
-                        days_part = uptime_output.split('up ')[1].split(' day')[0].strip()
-                        days = int(days_part)
-                        uptime_value = f"{days} days"
-                    else:
-                        # Less than a day
-                        uptime_value = "Less than a day"
-                except:
-                    # Fallback for Linux only
-                    if os.path.exists('/proc/uptime'):
-                        with open('/proc/uptime', 'r') as f:
-                            uptime_seconds = float(f.readline().split()[0])
-                            uptime_days = uptime_seconds / 86400  # Convert to days
-                            uptime_value = f"{round(uptime_days, 1)} days"
-                    else:
-                        uptime_value = "Unknown"
-            else:
-                # Default value for non-posix systems
-                uptime_value = "Unknown"
-        except Exception as uptime_err:
-            logger.error(f"Uptime check failed: {str(uptime_err)}")
-            uptime_status = "warning"
-            uptime_value = "Unknown"
-        
-        status_items.append({
-            "name": "Server Uptime",
-            "status": uptime_status,
-            "value": uptime_value
-        })
+        def check():
+            postgres_online = False
+            conn = get_postgres_connection()
+            if conn is not None:
+                postgres_online = True
+                conn.close()
+            return system_status(postgres_online, qdrant_collections_count())
         
-        return JSONResponse(content=status_items)
+        return JSONResponse(content=await asyncio.to_thread(check))
     except Exception as e:
         logger.error(f"Error getting system status: {str(e)}")
         raise HTTPException(status_code=500, detail="Error getting system status")
 
+@router.get("/api/dashboard-snapshot")
+async def get_dashboard_snapshot(refresh: bool = False):
+    """
+    All dashboard statistics in one response, from the snapshot kept current by
+    the background refresher. refresh=true recomputes it unless it is only a few
+    seconds old. The response carries computed_at and age_seconds.
+    """
+    try:
+        snapshot = get_snapshot()
+        if snapshot is None or refresh:
+            snapshot = await asyncio.to_thread(refresh_snapshot, refresh)
+        return JSONResponse(content=snapshot)
+    except Exception as e:
+        logger.error(f"Error getting dashboard snapshot: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error getting dashboard snapshot")
+
 @router.get("/api/time-series-data-count")
 async def get_time_series_data_count():
     """
@@ -3043,25 +2983,17 @@ async def get_time_series_data_count():
         logger.exception(f"Error getting time series data count: {str(e)}")
         return {"count": "Error", "change": 0}
 
-@router.get("/api/chart/{chart_id}")
-@router.get("/backend/api/chart/{chart_id}")  # Add an extra route
-async def get_chart_data(chart_id: int):
-    """
-    Get chart data for a specific chart_id.
-    Accessible via both /api/chart/{chart_id} and /backend/api/chart/{chart_id}
+def _build_chart_payload(chart_id: int):
+    """Load chart metadata and data points for a chart_id from PostgreSQL."""
+    # Connect to PostgreSQL
+    conn = psycopg2.connect(
+        host=os.environ.get("POSTGRES_HOST", "localhost"),
+        database=os.environ.get("POSTGRES_DB", "transparentsf"),
+        user=os.environ.get("POSTGRES_USER", "postgres"),
+        password=os.environ.get("POSTGRES_PASSWORD", "postgres")
+    )
     
-    Returns:
-        ChartResponse with metadata and data points
-    """
     try:
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(
-            host=os.environ.get("POSTGRES_HOST", "localhost"),
-            database=os.environ.get("POSTGRES_DB", "transparentsf"),
-            user=os.environ.get("POSTGRES_USER", "postgres"),
-            password=os.environ.get("POSTGRES_PASSWORD", "postgres")
-        )
-        
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         
         # Query to get chart metadata
@@ -3084,8 +3016,6 @@ async def get_chart_data(chart_id: int):
         metadata_result = cursor.fetchone()
         
         if not metadata_result:
-            cursor.close()
-            conn.close()
             raise HTTPException(status_code=404, detail=f"Chart with ID {chart_id} not found")
         
         # Query to get chart data points
@@ -3100,53 +3030,71 @@ async def get_chart_data(chart_id: int):
         """, (chart_id,))
         
         data_results = cursor.fetchall()
-        
         cursor.close()
+    finally:
         conn.close()
-        
-        # Map database period type to frontend period type for the response
-        frontend_period_type_map = {
-            'year': 'annual',
-            'month': 'monthly',
-            'week': 'weekly',
-            'day': 'daily'
+    
+    # Format the response according to the requested structure
+    response = {
+        "metadata": {
+            "chart_id": metadata_result["chart_id"],
+            "chart_title": metadata_result["chart_title"],
+            "y_axis_label": metadata_result["y_axis_label"],
+            "period_type": FRONTEND_PERIOD_TYPE_MAP.get(metadata_result["period_type"], metadata_result["period_type"]),
+            "object_type": metadata_result["object_type"],
+            "object_id": metadata_result["object_id"],
+            "object_name": metadata_result["object_name"],
+            "field_name": metadata_result["field_name"],
+            "district": metadata_result["district"]
         }
-        
-        # Format the response according to the requested structure
-        response = {
-            "metadata": {
-                "chart_id": metadata_result["chart_id"],
-                "chart_title": metadata_result["chart_title"],
-                "y_axis_label": metadata_result["y_axis_label"],
-                "period_type": frontend_period_type_map.get(metadata_result["period_type"], metadata_result["period_type"]),
-                "object_type": metadata_result["object_type"],
-                "object_id": metadata_result["object_id"],
-                "object_name": metadata_result["object_name"],
-                "field_name": metadata_result["field_name"],
-                "district": metadata_result["district"]
-            }
+    }
+    
+    # Add group_field if it exists
+    if metadata_result["group_field"]:
+        response["metadata"]["group_field"] = metadata_result["group_field"]
+    
+    response["data"] = _format_chart_points(data_results)
+    
+    logger.info(f"Retrieved chart data for chart_id: {chart_id}")
+    return response
+
+def _format_chart_points(data_results):
+    """Convert time_series_data rows to the chart API point format."""
+    points = []
+    for time_period, group_value, numeric_value in data_results:
+        data_point = {
+            "time_period": time_period.isoformat(),
+            "numeric_value": float(numeric_value)
         }
         
-        # Add group_field if it exists
-        if metadata_result["group_field"]:
-            response["metadata"]["group_field"] = metadata_result["group_field"]
-        
-        # Format the data points
-        response["data"] = []
-        for row in data_results:
-            data_point = {
-                "time_period": row["time_period"].isoformat(),
-                "numeric_value": float(row["numeric_value"])
-            }
+        # Add group_value if it exists
+        if group_value:
+            data_point["group_value"] = group_value
             
-            # Add group_value if it exists
-            if row["group_value"]:
-                data_point["group_value"] = row["group_value"]
-                
-            response["data"].append(data_point)
-        
-        logger.info(f"Retrieved chart data for chart_id: {chart_id}")
-        return JSONResponse(content=response)
+        points.append(data_point)
+    return points
+
+@router.get("/api/chart/{chart_id}")
+@router.get("/backend/api/chart/{chart_id}")  # Add an extra route
+async def get_chart_data(chart_id: int, request: Request = None, format: str = 'json'):
+    """
+    Get chart data for a specific chart_id.
+    Accessible via both /api/chart/{chart_id} and /backend/api/chart/{chart_id}
+    
+    Responses are served from the chart cache with a strong ETag (If-None-Match
+    returns 304) and gzip/brotli compression when the client accepts it.
+    Pass format=columnar for the compact columnar layout.
+    
+    Returns:
+        ChartResponse with metadata and data points
+    """
+    try:
+        return cached_chart_response(
+            request,
+            ("chart", chart_id),
+            lambda: _build_chart_payload(chart_id),
+            fmt="columnar" if format == "columnar" else "json"
+        )
         
     except HTTPException:
         raise
@@ -3154,81 +3102,67 @@ async def get_chart_data(chart_id: int):
         logger.error(f"Error getting chart data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving chart data: {str(e)}")
 
-@router.get("/api/chart-by-metric")
-@router.get("/backend/api/chart-by-metric")  # Add an extra route
-async def get_chart_by_metric(
-    metric_id: str,
-    district: int = 0,
-    period_type: str = 'year',
-    group_field: str = None,
-    groups: str = None
-):
+def _build_anomaly_chart_payload(anomaly_id):
+    """Render the chart page of one stored anomaly from its comparison/recent data."""
+    details = get_anomaly_details(anomaly_id)
+    if details.get("status") != "success":
+        message = details.get("message", "Error retrieving anomaly")
+        status_code = 404 if message.startswith("No anomaly found") else 500
+        return JSONResponse({"status": "error", "message": message}, status_code=status_code)
+    anomaly = details["anomaly"]
+    item, metadata = anomaly_chart_inputs(anomaly)
+    return {
+        "metadata": {
+            "object_id": anomaly.get("object_id"),
+            "district": anomaly.get("district"),
+            "period_type": anomaly.get("period_type")
+        },
+        "html": render_anomaly_chart_page(item, metadata)
+    }
+
+@router.get("/api/anomaly-chart/{anomaly_id}")
+async def get_anomaly_chart(anomaly_id: int, request: Request = None):
     """
-    Get chart data for a specific metric, district, and period type.
-    Accessible via both /api/chart-by-metric and /backend/api/chart-by-metric
-    
-    Parameters:
-        metric_id: The ID of the metric (matches object_id in the database)
-        district: The district ID (default: 0)
-        period_type: The period type (default: 'year')
-        group_field: Optional group field (default: null)
-        groups: Comma-separated list of group values to include (default: null)
-    
-    Returns:
-        ChartResponse with metadata and data points
+    Chart page for one stored anomaly, rendered on first request and then
+    served from the chart cache (ETag, gzip/brotli). Analysis runs only render
+    the charts of out-of-bounds groups; every other group is charted here.
     """
     try:
-        # Map frontend period types to database period types if needed
-        period_type_map = {
-            'annual': 'year',
-            'monthly': 'month',
-            'weekly': 'week',
-            'daily': 'day'
-        }
-        
-        # Convert period type if it's one of the frontend values
-        db_period_type = period_type_map.get(period_type, period_type)
-        
-        # Parse groups parameter if provided
-        group_values = None
-        if groups:
-            group_values = [g.strip() for g in groups.split(',')]
-            logger.info(f"Using specified group values: {group_values}")
-        
-        logger.info(f"Looking for chart with object_id={metric_id}, district={district}, period_type={db_period_type}, group_field={group_field}, groups={groups}")
-        
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(
-            host=os.environ.get("POSTGRES_HOST", "localhost"),
-            database=os.environ.get("POSTGRES_DB", "transparentsf"),
-            user=os.environ.get("POSTGRES_USER", "postgres"),
-            password=os.environ.get("POSTGRES_PASSWORD", "postgres")
+        return await asyncio.to_thread(
+            cached_chart_response,
+            request,
+            ("anomaly_chart", anomaly_id),
+            lambda: _build_anomaly_chart_payload(anomaly_id),
+            "html"
         )
-        
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=422)
+    except Exception as e:
+        logger.error(f"Error rendering anomaly chart {anomaly_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error rendering anomaly chart: {str(e)}")
+
+def _build_chart_by_metric_payload(metric_id, district, period_type, db_period_type, group_field, group_values):
+    """
+    Load the latest chart for a metric/district/period from PostgreSQL.
+    
+    Returns the response dict, or a 404 JSONResponse when no chart matches.
+    """
+    # Connect to PostgreSQL
+    conn = psycopg2.connect(
+        host=os.environ.get("POSTGRES_HOST", "localhost"),
+        database=os.environ.get("POSTGRES_DB", "transparentsf"),
+        user=os.environ.get("POSTGRES_USER", "postgres"),
+        password=os.environ.get("POSTGRES_PASSWORD", "postgres")
+    )
+    
+    try:
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         
-        # DEBUGGING: Check for available metrics
-        cursor.execute("SELECT DISTINCT object_id FROM time_series_metadata")
-        available_metrics = [row[0] for row in cursor.fetchall()]
-        logger.info(f"Available metrics in database: {available_metrics}")
-        
-        # DEBUGGING: Check for available period types
-        cursor.execute("SELECT DISTINCT period_type FROM time_series_metadata")
-        available_period_types = [row[0] for row in cursor.fetchall()]
-        logger.info(f"Available period types in database: {available_period_types}")
-        
-        # DEBUGGING: Check if specific metric exists
-        cursor.execute("SELECT COUNT(*) FROM time_series_metadata WHERE object_id = %s", (metric_id,))
-        metric_count = cursor.fetchone()[0]
-        logger.info(f"Found {metric_count} entries with object_id={metric_id}")
-        
         # Build the query with proper handling of group_field NULL vs value
         if group_field is None:
             group_field_condition = "AND group_field IS NULL"
-            params = (metric_id, district, db_period_type)
         else:
             group_field_condition = "AND group_field = %s"
-            params = (metric_id, district, db_period_type, group_field)
         
         # Special handling for 'month' period type - try both 'month' directly and with LOWER comparison
         if db_period_type == 'month':
@@ -3311,9 +3245,13 @@ async def get_chart_by_metric(
             metadata_result = cursor.fetchone()
             
             if not metadata_result:
+                # Only list what is available when the lookup actually failed
+                cursor.execute("SELECT DISTINCT object_id FROM time_series_metadata")
+                available_metrics = [row[0] for row in cursor.fetchall()]
+                cursor.execute("SELECT DISTINCT period_type FROM time_series_metadata")
+                available_period_types = [row[0] for row in cursor.fetchall()]
+                
                 # Return 404 with detailed error message
-                cursor.close()
-                conn.close()
                 return JSONResponse(
                     status_code=404,
                     content={
@@ -3372,74 +3310,93 @@ async def get_chart_by_metric(
             """, (chart_id,))
         
         data_results = cursor.fetchall()
-        
-        # DEBUGGING: Check data count
-        logger.info(f"Found {len(data_results)} data points for chart_id {chart_id}")
-        
-        # If no data found, try debugging
-        if not data_results:
-            cursor.execute("SELECT COUNT(*) FROM time_series_data")
-            total_data = cursor.fetchone()[0]
-            logger.info(f"Total data points in time_series_data: {total_data}")
-        
         cursor.close()
+    finally:
         conn.close()
-        
-        # Map database period type back to frontend period type for the response
-        frontend_period_type_map = {
-            'year': 'annual',
-            'month': 'monthly',
-            'week': 'weekly',
-            'day': 'daily'
-        }
-        
-        # Get the JSON metadata field or initialize as empty dict if missing
-        json_metadata = metadata_result.get("metadata", {}) or {}
-        if isinstance(json_metadata, str):
-            try:
-                json_metadata = json.loads(json_metadata)
-            except:
-                json_metadata = {}
-        
-        # Format the response according to the requested structure
-        # Prioritize fields from the metadata JSON for the three specified fields
-        response = {
-            "metadata": {
-                "chart_id": metadata_result["chart_id"],
-                "chart_title": json_metadata.get("chart_title", metadata_result.get("chart_title", "")),
-                "y_axis_label": json_metadata.get("y_axis_label", metadata_result.get("y_axis_label", "")),
-                "period_type": frontend_period_type_map.get(metadata_result["period_type"], metadata_result["period_type"]),
-                "object_type": metadata_result["object_type"],
-                "object_id": metadata_result["object_id"],
-                "object_name": metadata_result["object_name"],
-                "field_name": metadata_result["field_name"],
-                "district": metadata_result["district"],
-                "executed_query_url": metadata_result["executed_query_url"],
-                "caption": metadata_result["caption"],
-                "filter_conditions": json_metadata.get("filter_conditions", metadata_result.get("filter_conditions", ""))
-            }
+    
+    logger.info(f"Found {len(data_results)} data points for chart_id {chart_id}")
+    
+    # Get the JSON metadata field or initialize as empty dict if missing
+    json_metadata = metadata_result.get("metadata", {}) or {}
+    if isinstance(json_metadata, str):
+        try:
+            json_metadata = json.loads(json_metadata)
+        except:
+            json_metadata = {}
+    
+    # Format the response according to the requested structure
+    # Prioritize fields from the metadata JSON for the three specified fields
+    response = {
+        "metadata": {
+            "chart_id": metadata_result["chart_id"],
+            "chart_title": json_metadata.get("chart_title", metadata_result.get("chart_title", "")),
+            "y_axis_label": json_metadata.get("y_axis_label", metadata_result.get("y_axis_label", "")),
+            "period_type": FRONTEND_PERIOD_TYPE_MAP.get(metadata_result["period_type"], metadata_result["period_type"]),
+            "object_type": metadata_result["object_type"],
+            "object_id": metadata_result["object_id"],
+            "object_name": metadata_result["object_name"],
+            "field_name": metadata_result["field_name"],
+            "district": metadata_result["district"],
+            "executed_query_url": metadata_result["executed_query_url"],
+            "caption": metadata_result["caption"],
+            "filter_conditions": json_metadata.get("filter_conditions", metadata_result.get("filter_conditions", ""))
         }
+    }
+    
+    # Add group_field if it exists
+    if metadata_result["group_field"]:
+        response["metadata"]["group_field"] = metadata_result["group_field"]
+    
+    response["data"] = _format_chart_points(data_results)
+    
+    logger.info(f"Retrieved chart data for object_id: {metric_id}, district: {district}, period_type: {period_type}, group_field: {group_field}")
+    return response
+
+@router.get("/api/chart-by-metric")
+@router.get("/backend/api/chart-by-metric")  # Add an extra route
+async def get_chart_by_metric(
+    metric_id: str,
+    district: int = 0,
+    period_type: str = 'year',
+    group_field: str = None,
+    groups: str = None,
+    request: Request = None,
+    format: str = 'json'
+):
+    """
+    Get chart data for a specific metric, district, and period type.
+    Accessible via both /api/chart-by-metric and /backend/api/chart-by-metric
+    
+    Responses are cached until store_time_series_in_db writes a new chart for the
+    same metric, district and period, and served with ETag/304 and compression.
+    
+    Parameters:
+        metric_id: The ID of the metric (matches object_id in the database)
+        district: The district ID (default: 0)
+        period_type: The period type (default: 'year')
+        group_field: Optional group field (default: null)
+        groups: Comma-separated list of group values to include (default: null)
+        format: 'json' (default) or 'columnar' for one value array per group
+    
+    Returns:
+        ChartResponse with metadata and data points
+    """
+    try:
+        # Convert period type if it's one of the frontend values
+        db_period_type = DB_PERIOD_TYPE_MAP.get(period_type, period_type)
         
-        # Add group_field if it exists
-        if metadata_result["group_field"]:
-            response["metadata"]["group_field"] = metadata_result["group_field"]
-        
-        # Format the data points
-        response["data"] = []
-        for row in data_results:
-            data_point = {
-                "time_period": row["time_period"].isoformat(),
-                "numeric_value": float(row["numeric_value"])
-            }
-            
-            # Add group_value if it exists
-            if row["group_value"]:
-                data_point["group_value"] = row["group_value"]
-                
-            response["data"].append(data_point)
+        # Parse groups parameter if provided
+        group_values = None
+        if groups:
+            group_values = [g.strip() for g in groups.split(',')]
         
-        logger.info(f"Retrieved chart data for object_id: {metric_id}, district: {district}, period_type: {period_type}, group_field: {group_field}")
-        return JSONResponse(content=response)
+        cache_key = ("metric", str(metric_id), district, db_period_type, group_field, tuple(group_values or ()))
+        return cached_chart_response(
+            request,
+            cache_key,
+            lambda: _build_chart_by_metric_payload(metric_id, district, period_type, db_period_type, group_field, group_values),
+            fmt="columnar" if format == "columnar" else "json"
+        )
         
     except Exception as e:
         logger.error(f"Error retrieving chart data: {str(e)}")
@@ -4030,6 +3987,7 @@ async def rerun_monthly_report_generation(request: Request):
         period_type = data.get("period_type", "month")
         max_report_items = data.get("max_report_items", 10)
         only_generate = data.get("only_generate", False)
+        bypass_cache = data.get("bypass_cache", False)
         
         logger.info(f"Re-running monthly report generation for district {district}, period_type {period_type}, only_generate={only_generate}")
         
@@ -4040,7 +3998,7 @@ async def rerun_monthly_report_generation(request: Request):
             # Only run the generate_monthly_report function
             result = await loop.run_in_executor(
                 None,
-                lambda: generate_monthly_report(district=district)
+                lambda: generate_monthly_report(district=district, bypass_cache=bypass_cache)
             )
         else:
             # Run the full monthly report process
@@ -4049,7 +4007,8 @@ async def rerun_monthly_report_generation(request: Request):
                 lambda: run_monthly_report_process(
                     district=district,
                     period_type=period_type,
-                    max_report_items=max_report_items
+                    max_report_items=max_report_items,
+                    bypass_cache=bypass_cache
                 )
             )
         
@@ -4094,6 +4053,7 @@ async def rerun_monthly_report_proofreading(request: Request):
         # Get request data
         data = await request.json()
         report_path = data.get("report_path")
+        bypass_cache = data.get("bypass_cache", False)
         
         if not report_path:
             return JSONResponse(
@@ -4110,7 +4070,7 @@ async def rerun_monthly_report_proofreading(request: Request):
         loop = asyncio.get_event_loop()
         result = await loop.run_in_executor(
             None,
-            lambda: proofread_and_revise_report(report_path)
+            lambda: proofread_and_revise_report(report_path, bypass_cache=bypass_cache)
         )
         
         if result.get("status") == "success":
@@ -4298,6 +4258,11 @@ async def update_chart_groups(chart_id: int, request: Request):
             
             # Commit the transaction
             conn.commit()
+            invalidate_chart_cache(
+                object_id=metadata_result["object_id"],
+                district=metadata_result["district"],
+                period_type=metadata_result["period_type"]
+            )
             
             logger.info(f"Updated {updated_count} rows and inserted {inserted_count} rows")
             
@@ -4379,23 +4344,14 @@ async def clear_chart_files():
     """Delete all chart image files (chart*.png) from the output directory and its subdirectories."""
     logger.debug("Clear chart files called")
     try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        output_dir = os.path.join(script_dir, 'output')
+        def is_chart(path):
+            file = os.path.basename(path)
+            return file.startswith('chart') and file.endswith('.png')
         
-        # Count of deleted files
-        deleted_count = 0
+        def clear():
+            return remove_files(path for path, _, _ in tracked_files("output", is_chart, rescan=True))[0]
         
-        # Walk through all subdirectories
-        for root, _, files in os.walk(output_dir):
-            for file in files:
-                if file.startswith('chart') and file.endswith('.png'):
-                    file_path = os.path.join(root, file)
-                    try:
-                        os.remove(file_path)
-                        deleted_count += 1
-                        logger.debug(f"Deleted chart file: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Error deleting chart file {file_path}: {str(e)}")
+        deleted_count = await asyncio.to_thread(clear)
         
         logger.info(f"Successfully deleted {deleted_count} chart image files")
         return JSONResponse({
@@ -1,3 +1,9 @@
+"""
+Browser-driven discovery of the portal's dataset URLs, kept as a fallback:
+fetch_metadata.py discovers them through the Socrata catalog API without a
+browser and refreshes data/dataset_urls.json itself.
+"""
+
 import os
 import json
 import time
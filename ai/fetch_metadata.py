@@ -1,8 +1,61 @@
+"""
+Dataset metadata for data/datasets/<id>.json.
+
+refresh_metadata() is the common path: it lists the portal's datasets with
+the Socrata catalog JSON API (no browser), fetches every /api/views/<id>.json
+concurrently over one pooled session, politely (a cap on requests in flight
+and a request rate per host), and revalidates each view with the ETag /
+Last-Modified it returned last time, so unchanged views cost a 304. Only
+files whose content changed are rewritten.
+
+fetch_dataset_urls.py (Selenium) remains for when the catalog API is not
+an option.
+
+    python fetch_metadata.py                 # refresh everything
+    python fetch_metadata.py --force         # ignore cached validators
+"""
+
 import json
 import os
 import re
-import requests
+import sys
+import logging
+import argparse
+import threading
 from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+
+from tools.concurrency import run_concurrently
+from tools.dw_registry import RateLimiter
+
+SOCRATA_BASE_URL = os.getenv("SOCRATA_BASE_URL", "https://data.sfgov.org").rstrip("/")
+METADATA_MAX_WORKERS = int(os.getenv("METADATA_MAX_WORKERS", "8"))
+# Politeness per host: requests in flight and requests per second
+METADATA_MAX_PER_HOST = int(os.getenv("METADATA_MAX_PER_HOST", "4"))
+METADATA_REQUESTS_PER_SECOND = float(os.getenv("METADATA_REQUESTS_PER_SECOND", "8"))
+METADATA_TIMEOUT_SECONDS = float(os.getenv("METADATA_TIMEOUT_SECONDS", "30"))
+CATALOG_PAGE_SIZE = 100
+
+DATASETS_DIR = os.path.join(AI_DIR, "data", "datasets")
+# The URL list and the validators of the last response per URL are kept
+# beside (not inside) the directory they describe: everything in
+# data/datasets is read as a dataset
+DATASET_URLS_FILE = "dataset_urls.json"
+HTTP_CACHE_FILE = ".metadata_http_cache"
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+_host_limits_lock = threading.Lock()
 
 def sanitize_filename(filename):
     """Sanitize the filename by removing or replacing invalid characters."""
@@ -10,94 +63,262 @@ def sanitize_filename(filename):
     sanitized = sanitized.strip()
     return sanitized
 
+def dataset_id_from_url(dataset_url):
+    match = re.search(r'/([a-z0-9]{4}-[a-z0-9]{4})(?:/|$)', dataset_url)
+    return match.group(1) if match else None
+
 def scrape_dataset_metadata(dataset_url):
     """Retrieve dataset metadata including columns and descriptions via the Socrata API."""
     # Extract the dataset identifier from the URL
-    match = re.search(r'/([a-z0-9]{4}-[a-z0-9]{4})(?:/|$)', dataset_url)
-    if not match:
+    dataset_id = dataset_id_from_url(dataset_url)
+    if not dataset_id:
         print(f"Could not extract dataset ID from URL: {dataset_url}")
         return None
-    dataset_id = match.group(1)
 
-    metadata_url = f'https://data.sfgov.org/api/views/{dataset_id}.json'
+    metadata_url = f'{SOCRATA_BASE_URL}/api/views/{dataset_id}.json'
 
-    response = requests.get(metadata_url)
+    response = requests.get(metadata_url, timeout=METADATA_TIMEOUT_SECONDS)
 
     if response.status_code == 200:
-        data = response.json()
-        # Get the title and description
-        title = data.get('name', 'Untitled')
-        category = data.get('category', '')
-        description = data.get('description', '')
-        # Get the columns
-        columns_info = []
-        columns = data.get('columns', [])
-        for column in columns:
-            column_info = {
-                'name': column.get('name'),
-                'fieldName': column.get('fieldName'),
-                'dataTypeName': column.get('dataTypeName'),
-                'description': column.get('description'),
-                'position': column.get('position'),
-                'renderTypeName': column.get('renderTypeName'),
-                'tableColumnId': column.get('id'),
-            }
-            columns_info.append(column_info)
-        
-        # Get publishing department
-        publishing_department = data.get('metadata', {}).get('custom_fields', {}).get('Department Metrics', {}).get('Publishing Department', '')
-        # Get most recent update date
-        rows_updated_at = data.get('rowsUpdatedAt')
-        if rows_updated_at:
-            rows_updated_at = datetime.utcfromtimestamp(rows_updated_at).isoformat() + 'Z'
-        else:
-            rows_updated_at = ''
-
-        dataset_info = {
-            'category': category,
-            'endpoint': dataset_id,
-            'url': dataset_url,
-            'title': title,
-            'description': description,
-            'columns': columns_info,
-            'publishing_department': publishing_department,
-            'rows_updated_at': rows_updated_at
-        }
-        return dataset_info
+        return dataset_info_from_view(response.json(), dataset_url)
     else:
         print(f"Failed to retrieve metadata: {response.status_code}")
         return None
 
-def main():
-    # Load all dataset URLs from the dataset_urls.json file
-    data_folder = 'data'
-    output_folder = 'datasets'
-
-    # Ensure the output directory exists
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Load the dataset URLs
-    dataset_urls_file = os.path.join(data_folder, 'dataset_urls.json')
-    with open(dataset_urls_file, 'r', encoding='utf-8') as f:
-        dataset_urls = json.load(f)
-
-    # Process each URL
-    for dataset_url in dataset_urls:
-        try:
-            print(f"Processing URL: {dataset_url}")
-            dataset_info = scrape_dataset_metadata(dataset_url)
-            if dataset_info:
-                # Use the endpoint (dataset ID) as the filename instead of the title
-                endpoint = dataset_info.get('endpoint')
-                filename = f"{endpoint}.json"
-                output_path = os.path.join(output_folder, filename)
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump(dataset_info, f, ensure_ascii=False, indent=4)
-                print(f"Saved dataset info to {output_path}")
+def dataset_info_from_view(data, dataset_url):
+    """The data/datasets/<id>.json content for a Socrata view's metadata."""
+    dataset_id = dataset_id_from_url(dataset_url) or data.get('id')
+    # Get the title and description
+    title = data.get('name', 'Untitled')
+    category = data.get('category', '')
+    description = data.get('description', '')
+    # Get the columns
+    columns_info = []
+    columns = data.get('columns', [])
+    for column in columns:
+        column_info = {
+            'name': column.get('name'),
+            'fieldName': column.get('fieldName'),
+            'dataTypeName': column.get('dataTypeName'),
+            'description': column.get('description'),
+            'position': column.get('position'),
+            'renderTypeName': column.get('renderTypeName'),
+            'tableColumnId': column.get('id'),
+        }
+        columns_info.append(column_info)
+    
+    # Get publishing department
+    publishing_department = data.get('metadata', {}).get('custom_fields', {}).get('Department Metrics', {}).get('Publishing Department', '')
+    # Get most recent update date
+    rows_updated_at = data.get('rowsUpdatedAt')
+    if rows_updated_at:
+        rows_updated_at = datetime.utcfromtimestamp(rows_updated_at).isoformat() + 'Z'
+    else:
+        rows_updated_at = ''
+
+    dataset_info = {
+        'category': category,
+        'endpoint': dataset_id,
+        'url': dataset_url,
+        'title': title,
+        'description': description,
+        'columns': columns_info,
+        'publishing_department': publishing_department,
+        'rows_updated_at': rows_updated_at
+    }
+    return dataset_info
+
+def _get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(METADATA_MAX_WORKERS, 4))
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+def _limits_for(url):
+    host = urlsplit(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = (threading.BoundedSemaphore(METADATA_MAX_PER_HOST),
+                                  RateLimiter(METADATA_REQUESTS_PER_SECOND))
+        return _host_limits[host]
+
+def polite_get(url, headers=None, params=None):
+    """GET over the pooled session, within the per-host concurrency and rate limits."""
+    slots, limiter = _limits_for(url)
+    with slots:
+        limiter.acquire()
+        return _get_session().get(url, headers=headers, params=params, timeout=METADATA_TIMEOUT_SECONDS)
+
+class HttpCache:
+    """ETag / Last-Modified of the last successful response per URL, persisted as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable HTTP cache {path}: {e}")
+
+    def conditional_headers(self, url):
+        with self.lock:
+            entry = self.entries.get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, url, response):
+        entry = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        entry = {key: value for key, value in entry.items() if value}
+        with self.lock:
+            if entry:
+                self.entries[url] = entry
             else:
-                print(f"Failed to process dataset at {dataset_url}")
-        except Exception as e:
-            print(f"Error processing {dataset_url}: {e}")
+                self.entries.pop(url, None)
+
+    def save(self, keep=None):
+        """Write the cache atomically; with keep, drop URLs not in it."""
+        with self.lock:
+            if keep is not None:
+                keep = set(keep)
+                self.entries = {url: entry for url, entry in self.entries.items() if url in keep}
+            text = json.dumps(self.entries, indent=2, sort_keys=True)
+        write_if_changed(self.path, text)
+
+def http_cache_path(output_dir):
+    """Where the HTTP cache for output_dir lives: data/datasets -> data/.metadata_http_cache."""
+    return os.path.join(os.path.dirname(os.path.abspath(output_dir)), HTTP_CACHE_FILE)
+
+def dataset_urls_path(output_dir):
+    """Where the dataset URL list for output_dir lives: data/datasets -> data/dataset_urls.json."""
+    return os.path.join(os.path.dirname(os.path.abspath(output_dir)), DATASET_URLS_FILE)
+
+def write_if_changed(path, text):
+    """Atomically replace path with text unless it already holds exactly that. True if written."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return False
+    except FileNotFoundError:
+        pass
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+def render_dataset_info(dataset_info):
+    # Byte-for-byte what json.dump(..., ensure_ascii=False, indent=4) has always written
+    return json.dumps(dataset_info, ensure_ascii=False, indent=4)
+
+def discover_dataset_urls(base_url=None, page_size=CATALOG_PAGE_SIZE):
+    """Dataset page URLs of the portal, from the Socrata catalog API, in name order."""
+    base_url = (base_url or SOCRATA_BASE_URL).rstrip('/')
+    domain = urlsplit(base_url).hostname
+    dataset_urls, offset = [], 0
+    while True:
+        # A stable order keeps offset paging consistent and dataset_urls.json diffable
+        params = {'domains': domain, 'only': 'datasets', 'order': 'name', 'limit': page_size, 'offset': offset}
+        response = polite_get(f"{base_url}/api/catalog/v1", params=params)
+        response.raise_for_status()
+        results = response.json().get('results', [])
+        for result in results:
+            link = result.get('link') or result.get('permalink')
+            if link and dataset_id_from_url(link):
+                dataset_urls.append(link)
+        if len(results) < page_size:
+            break
+        offset += page_size
+    return list(dict.fromkeys(dataset_urls))
+
+def refresh_dataset(dataset_url, output_dir, cache, base_url=None, force=False):
+    """
+    Fetch one view's metadata and rewrite its file if the content changed.
+
+    Returns "written", "unchanged" or "not_modified" (304, nothing downloaded).
+    """
+    base_url = (base_url or SOCRATA_BASE_URL).rstrip('/')
+    dataset_id = dataset_id_from_url(dataset_url)
+    if not dataset_id:
+        raise ValueError(f"Could not extract dataset ID from URL: {dataset_url}")
+    view_url = f"{base_url}/api/views/{dataset_id}.json"
+    output_path = os.path.join(output_dir, f"{dataset_id}.json")
+
+    # A 304 is only useful while the file it validates is still there
+    revalidate = not force and os.path.exists(output_path)
+    response = polite_get(view_url, headers=cache.conditional_headers(view_url) if revalidate else None)
+    if response.status_code == 304:
+        return "not_modified"
+    response.raise_for_status()
+
+    dataset_info = dataset_info_from_view(response.json(), dataset_url)
+    written = write_if_changed(output_path, render_dataset_info(dataset_info))
+    # Only remember validators once the file matches the response they describe
+    cache.update(view_url, response)
+    return "written" if written else "unchanged"
+
+def refresh_metadata(dataset_urls=None, output_dir=DATASETS_DIR, urls_file=None,
+                     base_url=None, force=False, max_workers=METADATA_MAX_WORKERS):
+    """
+    Refresh data/datasets/<id>.json for every dataset, concurrently.
+
+    Without dataset_urls the datasets are discovered from the catalog API and
+    urls_file (by default dataset_urls_path(output_dir)) is rewritten if the
+    list changed. Returns counts per outcome and the URLs that failed.
+    """
+    base_url = (base_url or SOCRATA_BASE_URL).rstrip('/')
+    os.makedirs(output_dir, exist_ok=True)
+    discovered = dataset_urls is None
+    if discovered:
+        dataset_urls = discover_dataset_urls(base_url)
+        logger.info(f"Catalog lists {len(dataset_urls)} datasets")
+        write_if_changed(urls_file or dataset_urls_path(output_dir), json.dumps(dataset_urls, indent=4))
+
+    cache = HttpCache(http_cache_path(output_dir))
+    results = run_concurrently(lambda url: refresh_dataset(url, output_dir, cache, base_url, force),
+                               dataset_urls, max_workers=max_workers, name="dataset metadata")
+
+    summary = {"datasets": len(dataset_urls), "written": 0, "unchanged": 0, "not_modified": 0, "failed": []}
+    for result in results:
+        if result.ok:
+            summary[result.result] += 1
+        else:
+            logger.warning(f"Failed to refresh {result.item}: {result.error}")
+            summary["failed"].append(result.item)
+    # A full catalog pass also forgets datasets that are no longer published
+    keep = [f"{base_url}/api/views/{dataset_id_from_url(url)}.json" for url in dataset_urls] if discovered else None
+    cache.save(keep)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh data/datasets/*.json from the Socrata API")
+    parser.add_argument('--from-file', action='store_true',
+                        help="Use the URLs in dataset_urls.json beside the output directory instead of the catalog API")
+    parser.add_argument('--force', action='store_true', help="Refetch every view, ignoring cached validators")
+    parser.add_argument('--workers', type=int, default=METADATA_MAX_WORKERS)
+    parser.add_argument('--output-dir', default=DATASETS_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    dataset_urls = None
+    if args.from_file:
+        with open(dataset_urls_path(args.output_dir), 'r', encoding='utf-8') as f:
+            dataset_urls = json.load(f)
+    summary = refresh_metadata(dataset_urls, output_dir=args.output_dir, force=args.force, max_workers=args.workers)
+    print(f"{summary['datasets']} datasets: {summary['written']} written, {summary['unchanged']} unchanged, "
+          f"{summary['not_modified']} not modified, {len(summary['failed'])} failed")
+    for dataset_url in summary['failed']:
+        print(f"Failed to process dataset at {dataset_url}")
 
 if __name__ == '__main__':
     main()
@@ -4,6 +4,14 @@ import logging
 import traceback
 from datetime import datetime, date, timedelta
 from tools.data_fetcher import set_dataset  # Fixed import path
+from tools.db_utils import get_postgres_connection
+from tools.log_utils import configure_logging, remove_handlers, rotating_file_handler
+from tools.explanation_bundle import build_explanation_bundles
+from tools.dashboard_store import notify_write as notify_dashboard_write
+from tools.metric_cube import (
+    DISTRICT_FIELD, build_cube_query, build_cube_slices, cube_dimensions, cube_groupings, get_cube_state,
+    load_cube, refresh_metric_cube, trend_series, ytd_results
+)
 import pandas as pd
 import re
 import uuid
@@ -17,29 +25,18 @@ import time
 import argparse
 import sys
 
+# Read YTD daily series from the metric cube (falls back to a single in-memory fetch)
+METRIC_CUBE_ENABLED = os.getenv("METRIC_CUBE_ENABLED", "true").lower() in ("1", "true", "yes")
+
 # Create logs directory if it doesn't exist
 script_dir = os.path.dirname(os.path.abspath(__file__))
 logs_dir = os.path.join(script_dir, 'logs')
 os.makedirs(logs_dir, exist_ok=True)
 
-# Configure logging with a single handler for both file and console
+# Handlers are attached by setup_logging() when run as a script; imported
+# (by main.py and backend.py) this logger propagates to the app's handlers
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-# Remove any existing handlers
-for handler in logger.handlers[:]:
-    logger.removeHandler(handler)
-
-# Add file handler
-file_handler = logging.FileHandler(os.path.join(logs_dir, 'dashboard_metrics.log'))
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-# Add console handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
 
 def load_json_file(file_path):
     """Load a JSON file and return its contents."""
@@ -585,6 +582,189 @@ def process_ytd_trend_query(query, endpoint, date_ranges=None, target_date=None,
     
     return None
 
+def load_daily_series(query_data, endpoint, as_of, query_name=None, refresh=True):
+    """
+    Get the metric's daily series (citywide and per district) from Jan 1 of the
+    previous year through as_of with at most one portal query.
+
+    Reads the daily metric cube, refreshing it first when asked; without the
+    cube (or if it has no rows for the window) the same daily query is run
+    once and kept in memory.
+
+    Returns:
+        tuple: (cube DataFrame, aggregation, executed query) or None
+    """
+    metric_id = query_data.get('id')
+    window_start = date(as_of.year - 1, 1, 1)
+
+    if METRIC_CUBE_ENABLED and isinstance(metric_id, int):
+        connection = get_postgres_connection()
+        if connection is not None:
+            try:
+                result = {'status': 'success'}
+                if refresh:
+                    result = refresh_metric_cube(metric_id, query_data, endpoint, as_of=as_of, connection=connection)
+                state = get_cube_state(connection, metric_id) if result.get('status') == 'success' else None
+                if state and state['start_date'] <= window_start:
+                    cube = load_cube(connection, metric_id, start=window_start, end=as_of, field_name='')
+                    if not cube.empty:
+                        executed_query = result.get('query') or build_cube_query(
+                            query_data['ytd_query'], cube_groupings(cube_dimensions(query_data))[0],
+                            window_start.isoformat(), as_of.isoformat()
+                        )['query']
+                        return cube, state['aggregation'], executed_query
+                elif result.get('status') != 'success':
+                    logger.warning(f"Cube refresh failed for {query_name}: {result.get('message')}")
+            except Exception as e:
+                logger.warning(f"Could not read metric cube for {query_name}: {e}")
+            finally:
+                connection.close()
+
+    dimensions = [DISTRICT_FIELD] if DISTRICT_FIELD in cube_dimensions(query_data) else []
+    cube_query = build_cube_query(query_data['ytd_query'], dimensions, window_start.isoformat(), as_of.isoformat())
+    if not cube_query:
+        return None
+
+    context_variables = {}
+    result = set_dataset(context_variables, endpoint=endpoint, query=cube_query['query'])
+    if result.get('status') != 'success' or 'dataset' not in context_variables:
+        logger.error(f"Daily series query failed for {query_name}: {result.get('error')}")
+        return None
+    cube = build_cube_slices(context_variables['dataset'], metric_id, dimensions)
+    return cube, cube_query['aggregation'], cube_query['query']
+
+def process_ytd_metric(query_data, endpoint, target_date=None, query_name=None):
+    """
+    Compute YTD totals, district splits and the trend line from one daily series.
+
+    The series is fetched once over the widest range needed (Jan 1 of last
+    year to the target date); this-year/last-year totals, means for AVG
+    metrics, district splits and the trend are all cut locally at the last
+    day with data. Passing an earlier target_date re-cuts YTD from the cube
+    without fetching.
+
+    Returns:
+        tuple: (query_results, trend_data) in the shapes of process_query_for_district
+               and process_ytd_trend_query, or None to use the query-based path
+    """
+    yesterday = date.today() - timedelta(days=1)
+    as_of = datetime.strptime(target_date, '%Y-%m-%d').date() if isinstance(target_date, str) else (target_date or yesterday)
+    as_of = min(as_of, yesterday)
+
+    series = load_daily_series(query_data, endpoint, as_of, query_name=query_name, refresh=as_of >= yesterday)
+    if not series:
+        return None
+    cube, aggregation, executed_query = series
+
+    results = ytd_results(cube, as_of, aggregation)
+    if '0' not in results:
+        logger.warning(f"No daily data up to {as_of} for {query_name}")
+        return None
+
+    cutoff = results['0']['lastDataDate']
+    trend = trend_series(cube, date(as_of.year - 1, 1, 1), cutoff, aggregation=aggregation)
+    logger.info(f"YTD for {query_name} as of {cutoff}: thisYear={results['0']['thisYear']}, lastYear={results['0']['lastYear']}, {len(results) - 1} districts, {len(trend)} trend points")
+
+    query_results = {
+        'results': results,
+        'queries': {
+            'original_query': query_data.get('metric_query', ''),
+            'executed_query': executed_query
+        }
+    }
+    trend_data = {
+        'trend_data': trend,
+        'last_updated': cutoff,
+        'original_query': query_data.get('ytd_query'),
+        'executed_query': executed_query
+    }
+    return query_results, trend_data
+
+def process_ytd_metric_with_queries(metric_query, ytd_query, query_endpoint, target_date=None, query_name=None):
+    """
+    Compute YTD results by running the metric query to find the last data date,
+    then re-running the metric and trend queries with the adjusted date ranges.
+
+    Used when the metric has no daily ytd_query the single-fetch engine can use.
+
+    Returns:
+        tuple: (query_results, trend_data), either of which may be None
+    """
+    # Get initial date ranges using yesterday as target
+    initial_date_ranges = get_date_ranges(target_date=target_date, query=metric_query)
+
+    # Create a copy of initial date ranges for this metric
+    date_ranges = initial_date_ranges.copy()
+    trend_data = None
+
+    # Process metric query first to get max date
+    query_results = process_query_for_district(metric_query, query_endpoint, date_ranges=date_ranges, query_name=query_name)
+    if query_results and 'results' in query_results and '0' in query_results['results']:
+        max_date = query_results['results']['0'].get('lastDataDate')
+        if max_date:
+            logger.info(f"Found max date from metric query: {max_date}")
+
+            # Convert max_date to datetime for manipulation
+            max_date_dt = datetime.strptime(max_date, '%Y-%m-%d')
+            today = datetime.now()
+            yesterday = today - timedelta(days=1)
+            yesterday_str = yesterday.strftime('%Y-%m-%d')
+
+            # Cap max_date to yesterday
+            if max_date > yesterday_str:
+                logger.info(f"Capping max date to yesterday: {max_date} -> {yesterday_str}")
+                max_date = yesterday_str
+                max_date_dt = yesterday
+
+            # If max_date is in the future, set it to last day of previous month
+            if max_date_dt > today:
+                logger.info(f"Max date {max_date} is in the future, adjusting to last day of previous month")
+                if today.month == 1:
+                    # If we're in January, use December of previous year
+                    end_year = today.year - 1
+                    end_month = 12
+                else:
+                    end_year = today.year
+                    end_month = today.month - 1
+
+                # Calculate last day of the month
+                if end_month == 12:
+                    last_day = 31
+                elif end_month in [4, 6, 9, 11]:
+                    last_day = 30
+                elif end_month == 2:
+                    # Handle leap years
+                    if end_year % 4 == 0 and (end_year % 100 != 0 or end_year % 400 == 0):
+                        last_day = 29
+                    else:
+                        last_day = 28
+                else:
+                    last_day = 31
+
+                max_date = f"{end_year}-{end_month:02d}-{last_day}"
+                logger.info(f"Adjusted max date to last day of previous month: {max_date}")
+
+            # Update date ranges with the max date
+            date_ranges['this_year_end'] = max_date
+            max_date_dt = datetime.strptime(max_date, '%Y-%m-%d')
+
+            # For last year's end date, use the same day-of-month but in previous year
+            last_year_end = max_date_dt.replace(year=max_date_dt.year-1)
+            date_ranges['last_year_end'] = last_year_end.strftime('%Y-%m-%d')
+
+            date_ranges['last_data_date'] = max_date
+            # Ensure last_year_start is always January 1st of the previous year
+            date_ranges['last_year_start'] = f"{max_date_dt.year-1}-01-01"
+            logger.info(f"Updated date ranges with max date: {date_ranges}")
+
+    # Now process trend data with the updated date ranges
+    if ytd_query:
+        trend_data = process_ytd_trend_query(ytd_query, query_endpoint, date_ranges=date_ranges, query_name=query_name)
+
+    # Process metric query with the adjusted date ranges
+    query_results = process_query_for_district(metric_query, query_endpoint, date_ranges, query_name=query_name)
+    return query_results, trend_data
+
 def generate_ytd_metrics(queries_data, output_dir, target_date=None):
     """Generate YTD metrics files for each district."""
     
@@ -662,79 +842,16 @@ def generate_ytd_metrics(queries_data, output_dir, target_date=None):
                         logger.warning(f"Skipping query {query_name} because no endpoint is defined")
                         continue
                     
-                    # Get initial date ranges using yesterday as target
-                    initial_date_ranges = get_date_ranges(target_date=target_date, query=metric_query)
-                    
-                    # Create a copy of initial date ranges for this metric
-                    date_ranges = initial_date_ranges.copy()
-                    trend_data = None
-                    
-                    # Process metric query first to get max date
-                    query_results = process_query_for_district(metric_query, query_endpoint, date_ranges=date_ranges, query_name=query_name)
-                    if query_results and 'results' in query_results and '0' in query_results['results']:
-                        max_date = query_results['results']['0'].get('lastDataDate')
-                        if max_date:
-                            logger.info(f"Found max date from metric query: {max_date}")
-                            
-                            # Convert max_date to datetime for manipulation
-                            max_date_dt = datetime.strptime(max_date, '%Y-%m-%d')
-                            today = datetime.now()
-                            yesterday = today - timedelta(days=1)
-                            yesterday_str = yesterday.strftime('%Y-%m-%d')
-                            
-                            # Cap max_date to yesterday
-                            if max_date > yesterday_str:
-                                logger.info(f"Capping max date to yesterday: {max_date} -> {yesterday_str}")
-                                max_date = yesterday_str
-                                max_date_dt = yesterday
-                            
-                            # If max_date is in the future, set it to last day of previous month
-                            if max_date_dt > today:
-                                logger.info(f"Max date {max_date} is in the future, adjusting to last day of previous month")
-                                if today.month == 1:
-                                    # If we're in January, use December of previous year
-                                    end_year = today.year - 1
-                                    end_month = 12
-                                else:
-                                    end_year = today.year
-                                    end_month = today.month - 1
-                                    
-                                # Calculate last day of the month
-                                if end_month == 12:
-                                    last_day = 31
-                                elif end_month in [4, 6, 9, 11]:
-                                    last_day = 30
-                                elif end_month == 2:
-                                    # Handle leap years
-                                    if end_year % 4 == 0 and (end_year % 100 != 0 or end_year % 400 == 0):
-                                        last_day = 29
-                                    else:
-                                        last_day = 28
-                                else:
-                                    last_day = 31
-                                    
-                                max_date = f"{end_year}-{end_month:02d}-{last_day}"
-                                logger.info(f"Adjusted max date to last day of previous month: {max_date}")
-                            
-                            # Update date ranges with the max date
-                            date_ranges['this_year_end'] = max_date
-                            max_date_dt = datetime.strptime(max_date, '%Y-%m-%d')
-                            
-                            # For last year's end date, use the same day-of-month but in previous year
-                            last_year_end = max_date_dt.replace(year=max_date_dt.year-1)
-                            date_ranges['last_year_end'] = last_year_end.strftime('%Y-%m-%d')
-                            
-                            date_ranges['last_data_date'] = max_date
-                            # Ensure last_year_start is always January 1st of the previous year
-                            date_ranges['last_year_start'] = f"{max_date_dt.year-1}-01-01"
-                            logger.info(f"Updated date ranges with max date: {date_ranges}")
-                    
-                    # Now process trend data with the updated date ranges
-                    if ytd_query:
-                        trend_data = process_ytd_trend_query(ytd_query, query_endpoint, date_ranges=date_ranges, query_name=query_name)
-                    
-                    # Process metric query with the adjusted date ranges
-                    query_results = process_query_for_district(metric_query, query_endpoint, date_ranges, query_name=query_name)
+                    ytd = None
+                    if isinstance(query_data, dict) and ytd_query:
+                        ytd = process_ytd_metric(query_data, query_endpoint, target_date=target_date, query_name=query_name)
+                    if ytd:
+                        query_results, trend_data = ytd
+                    else:
+                        query_results, trend_data = process_ytd_metric_with_queries(
+                            metric_query, ytd_query, query_endpoint, target_date=target_date, query_name=query_name
+                        )
+
                     if query_results:
                         results = query_results['results']
                         queries = query_results['queries']
@@ -951,6 +1068,7 @@ def generate_ytd_metrics(queries_data, output_dir, target_date=None):
 
                     with open(metric_file, 'w', encoding='utf-8') as f:
                         json.dump(metric_data, f, indent=2)
+                    notify_dashboard_write(metric_file)
                     logger.info(f"Metric {file_id} (original id: {metric['id']}) saved to {metric_file}")
                 
                 district_data['categories'].append(category_copy)
@@ -959,6 +1077,7 @@ def generate_ytd_metrics(queries_data, output_dir, target_date=None):
             top_level_file = os.path.join(district_dir, 'top_level.json')
             with open(top_level_file, 'w', encoding='utf-8') as f:
                 json.dump(district_data, f, indent=2)
+            notify_dashboard_write(top_level_file)
             logger.info(f"District {district_str} top_level metrics saved to {top_level_file}")
             
             # Save to history directory with timestamp
@@ -1202,12 +1321,11 @@ def setup_logging():
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
     
-    # Remove any existing handlers
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
+    # Remove (and close) any existing handlers
+    remove_handlers(logger)
     
     # Add file handler
-    file_handler = logging.FileHandler(os.path.join(logs_dir, 'dashboard_metrics.log'))
+    file_handler = rotating_file_handler(os.path.join(logs_dir, 'dashboard_metrics.log'))
     file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logger.addHandler(file_handler)
     
@@ -1216,6 +1334,9 @@ def setup_logging():
     console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logger.addHandler(console_handler)
     
+    # Per-module levels (LOG_LEVELS) and JSON lines (LOG_FORMAT=json)
+    configure_logging(logger=logger)
+    
     return logger
 
 def process_single_metric(metric_id, period_type='ytd'):
@@ -1398,6 +1519,7 @@ def process_single_metric(metric_id, period_type='ytd'):
         top_level_file = os.path.join(district_dir, 'top_level.json')
         with open(top_level_file, 'w', encoding='utf-8') as f:
             json.dump(district_data, f, indent=2)
+        notify_dashboard_write(top_level_file)
         logging.info(f"Created new top_level.json for district {district_str}")
         
         # Save to history directory with timestamp
@@ -1412,9 +1534,6 @@ def process_single_metric(metric_id, period_type='ytd'):
 
 def main():
     """Main function to generate dashboard metrics."""
-    # Set up logging
-    setup_logging()
-    
     # Define output directory
     output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output", "dashboard")
     os.makedirs(output_dir, exist_ok=True)
@@ -1448,8 +1567,15 @@ def main():
         
         # Generate all metrics
         generate_ytd_metrics(dashboard_queries, output_dir, args.target_date)
+        
+        # Prebuild the context the metric-change explainer starts from
+        try:
+            build_explanation_bundles(dashboard_queries, output_dir)
+        except Exception as e:
+            logging.error(f"Error building explanation bundles: {str(e)}")
     
     logging.info("Dashboard metrics generation complete")
 
 if __name__ == '__main__':
+    setup_logging()
     main() 
\ No newline at end of file
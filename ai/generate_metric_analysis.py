@@ -12,6 +12,8 @@ import copy
 from tools.data_fetcher import set_dataset
 from tools.genChart import generate_time_series_chart
 from tools.anomaly_detection import anomaly_detection
+from tools.log_utils import configure_logging, remove_handlers, rotating_file_handler
+from tools.disk_usage import record_write
 
 # Configure logging
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -33,12 +35,11 @@ root_logger = logging.getLogger()
 root_logger.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# Remove any existing handlers from root logger
-for handler in root_logger.handlers[:]:
-    root_logger.removeHandler(handler)
+# Remove (and close) any existing handlers from root logger
+remove_handlers(root_logger)
 
 # Add file handler to root logger
-root_file_handler = logging.FileHandler(os.path.join(logs_dir, 'metric_analysis.log'))
+root_file_handler = rotating_file_handler(os.path.join(logs_dir, 'metric_analysis.log'))
 root_file_handler.setFormatter(formatter)
 root_logger.addHandler(root_file_handler)
 
@@ -47,6 +48,9 @@ root_console_handler = logging.StreamHandler()
 root_console_handler.setFormatter(formatter)
 root_logger.addHandler(root_console_handler)
 
+# Per-module levels (LOG_LEVELS) and JSON lines (LOG_FORMAT=json)
+configure_logging()
+
 # Now configure the module logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -1235,6 +1239,7 @@ def save_analysis_files(result, metric_id, period_type, output_dir=None, distric
     # Write markdown file
     with open(md_path, 'w') as f:
         f.write(markdown_content)
+    record_write(md_path)
     
     # Get district description based on district value
     if district == 0 or district is None:
@@ -14,6 +14,7 @@ import time
 from tools.data_fetcher import set_dataset
 from tools.genChart import generate_time_series_chart
 from tools.anomaly_detection import anomaly_detection
+from tools.disk_usage import record_write
 
 # Get script directory and ensure logs directory exists
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -1181,6 +1182,7 @@ def save_weekly_analysis(result, metric_id, district=None):
         # Write markdown file
         with open(md_path, 'w') as f:
             f.write(markdown_content)
+        record_write(md_path)
         logger.info(f"Successfully wrote markdown file ({len(markdown_content)} chars) to {md_path}")
     except Exception as e:
         logger.error(f"Error writing markdown file to {md_path}: {str(e)}")
@@ -1198,6 +1200,7 @@ def save_weekly_analysis(result, metric_id, district=None):
         
         with open(json_path, 'w') as f:
             json.dump(json_data, f, indent=2)
+        record_write(json_path)
         logger.info(f"Successfully wrote JSON file to {json_path}")
     except Exception as e:
         logger.error(f"Error writing JSON file to {json_path}: {str(e)}")
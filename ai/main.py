@@ -1,17 +1,20 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import json
 import logging
 import asyncio
 from datetime import datetime, timedelta
 from generate_dashboard_metrics import main as generate_metrics
+from tools.log_utils import parse_module_levels, rotate_oversized_logs, remove_expired_logs
+from tools.db_retention import run_retention
+from tools.db_utils import get_postgres_connection
+from tools.dashboard_snapshot import refresh_snapshot, DASHBOARD_SNAPSHOT_INTERVAL_SECONDS
+from tools.disk_usage import register_default_roots, maintain as maintain_disk_usage, DISK_USAGE_POLL_SECONDS
+from tools.dashboard_store import get_dashboard_store, MAPPING_FILE, ENHANCED_QUERIES_FILE, DASHBOARD_STORE_CHECK_SECONDS
 from dotenv import load_dotenv
-import re
-import glob
 
 # --- Logging Configuration Moved Up ---
 # Get the absolute path to the current directory
@@ -72,17 +75,17 @@ LOGGING_CONFIG = {
              "class": "logging.StreamHandler",
              "stream": "ext://sys.stdout", # Log access messages to stdout
         },
-         # Optional: Define a file handler if you want Uvicorn to manage file logging
-         # "file": {
-         #     "formatter": "default",
-         #     "class": "logging.FileHandler",
-         #     "filename": os.path.join(logs_dir, 'app.log'), # Make sure logs_dir is defined if used
-         # },
+        # Application log, rotated by size and age with gzipped segments (see tools/log_utils.py)
+        "file": {
+            "formatter": "default",
+            "()": "tools.log_utils.rotating_file_handler",
+            "filename": os.path.join(current_dir, "logs", "webchat.log"),
+        },
     },
     "loggers": {
         # Root logger configuration
         "": {
-            "handlers": ["default"], # Use handlers defined above (e.g., "default", "file")
+            "handlers": ["default", "file"], # Use handlers defined above (e.g., "default", "file")
             "level": log_level_str, # Use uppercase level
             "propagate": True, # Allow propagation if needed
         },
@@ -101,6 +104,12 @@ LOGGING_CONFIG = {
         "httpx": {"level": log_level_str, "propagate": True}, 
     },
 }
+
+# Per-module levels (LOG_LEVELS=tools.data_fetcher=WARNING,...) and JSON lines (LOG_FORMAT=json)
+for module_name, module_level in parse_module_levels(os.getenv("LOG_LEVELS")).items():
+    LOGGING_CONFIG["loggers"][module_name] = {"level": module_level, "propagate": True}
+if os.getenv("LOG_FORMAT", "text").lower() == "json":
+    LOGGING_CONFIG["formatters"]["default"] = {"()": "tools.log_utils.JsonFormatter"}
 # --- End Logging Configuration ---
 
 # Get the main logger for use within main.py itself
@@ -193,6 +202,15 @@ logger.debug(f"Logs directory: {logs_dir}")
 metrics_dir = os.path.join(current_dir, "data/dashboard")
 logger.debug(f"Metrics directory: {metrics_dir}")
 
+def _json_file_response(entry, description: str):
+    """Serve a dashboard store entry as-is, or raise the 404/500 the file-based routes used to."""
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"{description} not found")
+    if entry.error is not None:
+        logger.error(f"Invalid JSON in {description}: {entry.path}")
+        raise HTTPException(status_code=500, detail=f"Invalid JSON in {description}")
+    return Response(content=entry.raw, media_type="application/json")
+
 @app.get("/api/metrics/{filename}")
 async def get_metrics(filename: str):
     """Serve metrics data from JSON files."""
@@ -200,46 +218,25 @@ async def get_metrics(filename: str):
     if not filename.endswith('.json'):
         filename = f"{filename}.json"
     
-    # Check if this is a district file request (district_X.json)
+    store = get_dashboard_store()
+    # Check if this is a district file request (district_X.json): serve the district's top_level.json
     if filename.startswith('district_') and '_' in filename:
-        # Extract district number
         district_str = filename.split('_')[1].split('.')[0]
-        
-        # Try to serve top_level.json from the district subfolder
-        new_file_path = os.path.join(output_dir, 'dashboard', district_str, 'top_level.json')
-        logger.debug(f"Attempting to read metrics from: {new_file_path}")
-        try:
-            with open(new_file_path, 'r') as f:
-                data = json.load(f)
-                return JSONResponse(content=data)
-        except FileNotFoundError:
-            logger.error(f"Metrics file not found: {new_file_path}")
+        entry = store.top_level_entry(district_str)
+        if entry is None:
+            logger.error(f"Metrics file not found: {filename}")
             raise HTTPException(status_code=404, detail=f"Metrics file '{filename}' not found")
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON in metrics file: {new_file_path}")
-            raise HTTPException(status_code=500, detail=f"Invalid JSON in metrics file '{filename}'")
-        except Exception as e:
-            logger.error(f"Error reading metrics file {new_file_path}: {str(e)}")
-            raise HTTPException(status_code=500, detail="Internal server error")
+        return _json_file_response(entry, f"metrics file '{filename}'")
     
     # Check if this is a metric ID request (metric_id.json)
     # Format could be something like "crime_incidents_ytd.json"
     elif '_' in filename and not filename.startswith('district_'):
-        # This is likely a metric file request
-        # We need to determine which district it belongs to
-        # First, try to find it in each district folder
+        # Serve it from the first district folder (0-11) that has it
         for district_num in range(12):  # 0-11 for citywide and districts 1-11
-            district_str = str(district_num)
-            metric_file_path = os.path.join(output_dir, 'dashboard', district_str, filename)
-            if os.path.exists(metric_file_path):
-                logger.debug(f"Found metric file in district {district_str}: {metric_file_path}")
-                try:
-                    with open(metric_file_path, 'r') as f:
-                        data = json.load(f)
-                        return JSONResponse(content=data)
-                except Exception as e:
-                    logger.error(f"Error reading metric file {metric_file_path}: {str(e)}")
-                    # Continue to try other districts
+            entry = store.entry(district_num, filename)
+            if entry is not None and entry.error is None:
+                logger.debug(f"Found metric file in district {district_num}: {filename}")
+                return Response(content=entry.raw, media_type="application/json")
         
         # If we get here, the metric file wasn't found in any district folder
         logger.error(f"Metric file not found in any district folder: {filename}")
@@ -248,195 +245,71 @@ async def get_metrics(filename: str):
 @app.get("/api/enhanced-queries")
 async def get_enhanced_queries():
     """Serve the enhanced dashboard queries file."""
-    file_path = os.path.join(current_dir, "data", "dashboard", "dashboard_queries_enhanced.json")
-    logger.debug(f"Attempting to read enhanced queries from: {file_path}")
-    
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            return JSONResponse(content=data)
-    except FileNotFoundError:
-        logger.error(f"Enhanced queries file not found: {file_path}")
-        raise HTTPException(status_code=404, detail="Enhanced queries file not found")
-    except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in enhanced queries file: {file_path}")
-        raise HTTPException(status_code=500, detail="Invalid JSON in enhanced queries file")
-    except Exception as e:
-        logger.error(f"Error reading enhanced queries file {file_path}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    return _json_file_response(get_dashboard_store().file_entry(ENHANCED_QUERIES_FILE), "Enhanced queries file")
 
 @app.get("/api/metric-id-mapping")
 async def get_metric_id_mapping():
     """Serve the metric ID mapping file."""
-    file_path = os.path.join(current_dir, "data", "dashboard", "metric_id_mapping.json")
-    logger.debug(f"Attempting to read metric ID mapping from: {file_path}")
-    
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            return JSONResponse(content=data)
-    except FileNotFoundError:
-        logger.error(f"Metric ID mapping file not found: {file_path}")
-        raise HTTPException(status_code=404, detail="Metric ID mapping file not found")
-    except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in metric ID mapping file: {file_path}")
-        raise HTTPException(status_code=500, detail="Invalid JSON in metric ID mapping file")
-    except Exception as e:
-        logger.error(f"Error reading metric ID mapping file {file_path}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    return _json_file_response(get_dashboard_store().file_entry(MAPPING_FILE), "Metric ID mapping file")
 
 @app.get("/api/metric/{metric_id}")
 async def get_metric_by_id(metric_id: int):
     """Get metric details by its numeric ID."""
-    # First, load the metric ID mapping
-    mapping_file = os.path.join(current_dir, "data", "dashboard", "metric_id_mapping.json")
-    enhanced_queries_file = os.path.join(current_dir, "data", "dashboard", "dashboard_queries_enhanced.json")
-    
-    try:
-        # Load the mapping file
-        with open(mapping_file, 'r') as f:
-            mapping = json.load(f)
-        
-        # Check if the metric ID exists in the mapping
-        metric_id_str = str(metric_id)
-        if metric_id_str not in mapping:
-            logger.error(f"Metric ID {metric_id} not found in mapping")
-            raise HTTPException(status_code=404, detail=f"Metric ID {metric_id} not found")
-        
-        # Get the metric details from the mapping
-        metric_info = mapping[metric_id_str]
-        category = metric_info["category"]
-        subcategory = metric_info["subcategory"]
-        metric_name = metric_info["name"]
-        
-        # Load the enhanced queries file
-        with open(enhanced_queries_file, 'r') as f:
-            queries = json.load(f)
-        
-        # Get the metric details from the enhanced queries
-        if category in queries and subcategory in queries[category] and "queries" in queries[category][subcategory] and metric_name in queries[category][subcategory]["queries"]:
-            metric_data = queries[category][subcategory]["queries"][metric_name]
-            return JSONResponse(content=metric_data)
-        else:
-            logger.error(f"Metric {metric_name} not found in enhanced queries")
-            raise HTTPException(status_code=404, detail=f"Metric {metric_name} not found in enhanced queries")
-    
-    except FileNotFoundError as e:
-        logger.error(f"File not found: {str(e)}")
+    store = get_dashboard_store()
+    mapping = store.mapping()
+    queries = store.enhanced_queries()
+    if mapping is None or queries is None:
+        logger.error("Metric ID mapping or enhanced queries file not found")
         raise HTTPException(status_code=404, detail="Required files not found")
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON: {str(e)}")
-        raise HTTPException(status_code=500, detail="Invalid JSON in required files")
-    except Exception as e:
-        logger.error(f"Error getting metric by ID: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+
+    # Check if the metric ID exists in the mapping
+    metric_info = mapping.get(str(metric_id))
+    if metric_info is None:
+        logger.error(f"Metric ID {metric_id} not found in mapping")
+        raise HTTPException(status_code=404, detail=f"Metric ID {metric_id} not found")
+
+    category = metric_info["category"]
+    subcategory = metric_info["subcategory"]
+    metric_name = metric_info["name"]
+
+    # Get the metric details from the enhanced queries
+    metric_data = queries.get(category, {}).get(subcategory, {}).get("queries", {}).get(metric_name)
+    if metric_data is None:
+        logger.error(f"Metric {metric_name} not found in enhanced queries")
+        raise HTTPException(status_code=404, detail=f"Metric {metric_name} not found in enhanced queries")
+    return JSONResponse(content=metric_data)
 
 @app.get("/api/district/{district_id}/metric/{metric_id}")
 async def get_district_metric(district_id: str, metric_id: str):
     """Serve a specific metric for a specific district."""
-    # Ensure metric_id ends with .json
-    if not metric_id.endswith('.json'):
-        metric_id = f"{metric_id}.json"
-    
-    # Construct the file path
-    file_path = os.path.join(output_dir, 'dashboard', district_id, metric_id)
-    logger.debug(f"Attempting to read district metric from: {file_path}")
-    
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            return JSONResponse(content=data)
-    except FileNotFoundError:
-        logger.error(f"District metric file not found: {file_path}")
+    entry = get_dashboard_store().entry(district_id, metric_id)
+    if entry is None:
+        logger.error(f"District metric not found: {district_id}/{metric_id}")
         raise HTTPException(status_code=404, detail=f"Metric '{metric_id}' for district '{district_id}' not found")
-    except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in district metric file: {file_path}")
-        raise HTTPException(status_code=500, detail=f"Invalid JSON in metric file '{metric_id}' for district '{district_id}'")
-    except Exception as e:
-        logger.error(f"Error reading district metric file {file_path}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    return _json_file_response(entry, f"metric file '{metric_id}' for district '{district_id}'")
 
 @app.get("/api/district/{district_id}")
 async def get_district_top_level(district_id: str):
     """Serve the top-level metrics for a specific district."""
-    # Construct the file path
-    file_path = os.path.join(output_dir, 'dashboard', district_id, 'top_level.json')
-    logger.debug(f"Attempting to read district top-level metrics from: {file_path}")
-    
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            return JSONResponse(content=data)
-    except FileNotFoundError:
-        logger.error(f"District top-level file not found: {file_path}")
+    entry = get_dashboard_store().top_level_entry(district_id)
+    if entry is None:
+        logger.error(f"District top-level metrics not found: {district_id}")
         raise HTTPException(status_code=404, detail=f"Top-level metrics for district '{district_id}' not found")
-    except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in district top-level file: {file_path}")
-        raise HTTPException(status_code=500, detail=f"Invalid JSON in top-level file for district '{district_id}'")
-    except Exception as e:
-        logger.error(f"Error reading district top-level file {file_path}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    return _json_file_response(entry, f"top-level file for district '{district_id}'")
 
 @app.get("/api/district/{district_id}/metrics")
 async def list_district_metrics(district_id: str):
     """List all available metrics for a specific district."""
-    # Construct the directory path
-    dir_path = os.path.join(output_dir, 'dashboard', district_id)
-    logger.debug(f"Attempting to list metrics in directory: {dir_path}")
-    
-    try:
-        if not os.path.exists(dir_path):
-            logger.error(f"District directory not found: {dir_path}")
-            raise HTTPException(status_code=404, detail=f"District '{district_id}' not found")
-        
-        # Get all JSON files in the directory except top_level.json
-        metric_files = [f for f in os.listdir(dir_path) if f.endswith('.json') and f != 'top_level.json']
-        
-        # Extract metric IDs (remove .json extension)
-        metric_ids = [f[:-5] for f in metric_files]
-        
-        # Return the list of metric IDs
-        return JSONResponse(content={"metrics": metric_ids})
-    except Exception as e:
-        logger.error(f"Error listing district metrics: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    metric_ids = get_dashboard_store().metric_ids(district_id)
+    if metric_ids is None:
+        logger.error(f"District not found: {district_id}")
+        raise HTTPException(status_code=404, detail=f"District '{district_id}' not found")
+    return JSONResponse(content={"metrics": metric_ids})
 
 @app.get("/api/districts")
 async def list_districts():
     """List all available districts."""
-    try:
-        districts = []
-        dashboard_dir = os.path.join(output_dir, 'dashboard')
-        
-        # Look for numbered directories (0-11) representing districts
-        for item in os.listdir(dashboard_dir):
-            item_path = os.path.join(dashboard_dir, item)
-            # Check if it's a directory and represents a district number
-            if os.path.isdir(item_path) and item.isdigit() and 0 <= int(item) <= 11:
-                district_id = item
-                # Load the district's top-level data for its name
-                top_level_path = os.path.join(item_path, 'top_level.json')
-                try:
-                    with open(top_level_path, 'r') as f:
-                        top_level_data = json.load(f)
-                        district_name = top_level_data.get('name', f"District {district_id}")
-                        districts.append({
-                            'id': district_id,
-                            'name': district_name
-                        })
-                except:
-                    # If we can't read top_level.json, just use the district number
-                    districts.append({
-                        'id': district_id,
-                        'name': f"District {district_id}"
-                    })
-        
-        # Sort districts by ID, ensuring numeric sorting (district 0 is first, then 1-11)
-        districts.sort(key=lambda d: int(d['id']))
-        return JSONResponse(content=districts)
-    except Exception as e:
-        logger.error(f"Error listing districts: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    return JSONResponse(content=get_dashboard_store().districts())
 
 # Root route to serve index.html
 @app.get("/")
@@ -484,21 +357,23 @@ async def api_add_subscriber(request: Request):
 
 @app.get("/api/chart-by-metric")
 async def forward_chart_by_metric(
+    request: Request,
     metric_id: str,
     district: int = 0,
-    period_type: str = 'year'
+    period_type: str = 'year',
+    format: str = 'json'
 ):
     """
     Forward requests from /api/chart-by-metric to /backend/api/chart-by-metric
     """
-    return await get_chart_by_metric(metric_id, district, period_type)
+    return await get_chart_by_metric(metric_id, district, period_type, request=request, format=format)
 
 @app.get("/api/chart/{chart_id}")
-async def forward_chart_data(chart_id: int):
+async def forward_chart_data(request: Request, chart_id: int, format: str = 'json'):
     """
     Forward requests from /api/chart/{chart_id} to /backend/api/chart/{chart_id}
     """
-    return await get_chart_data(chart_id)
+    return await get_chart_data(chart_id, request=request, format=format)
 
 async def schedule_metrics_generation():
     """Schedule metrics generation to run daily at 5 AM and 11 AM."""
@@ -538,7 +413,12 @@ async def schedule_metrics_generation():
             await asyncio.sleep(300)  # Wait 5 minutes before retrying if there's an error
 
 async def cleanup_logs():
-    """Trim log files to keep only the last 7 days of logs. Runs daily."""
+    """
+    Rotate oversized log files daily. Files written through rotating handlers
+    rotate themselves; this catches logs written directly or by processes
+    that have exited, using the same gzip and retention scheme. Logs and
+    segments older than LOG_RETENTION_DAYS (7 by default) are deleted.
+    """
     while True:
         try:
             # Schedule to run daily at 11:30 AM
@@ -551,58 +431,90 @@ async def cleanup_logs():
             
             # Wait until the scheduled time
             wait_seconds = (target_run - now).total_seconds()
-            logger.info(f"Next log cleanup scheduled for {target_run} (in {wait_seconds/3600:.2f} hours)")
+            logger.info(f"Next log rotation check scheduled for {target_run} (in {wait_seconds/3600:.2f} hours)")
             await asyncio.sleep(wait_seconds)
             
-            # Trim log files
-            logger.info("Starting scheduled log cleanup...")
-            try:
-                # Get all log files
-                log_files = glob.glob(os.path.join(logs_dir, "*.log"))
-                trimmed_count = 0
-                
-                # Calculate the cutoff date (7 days ago)
-                cutoff_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
-                
-                for log_file in log_files:
-                    try:
-                        # Create a temporary file to store recent logs
-                        temp_file = log_file + ".temp"
-                        with open(log_file, 'r') as original, open(temp_file, 'w') as temp:
-                            # For each line, check if it's newer than the cutoff date
-                            kept_lines = 0
-                            for line in original:
-                                # Try to extract the date from the line (assuming standard log format)
-                                date_match = re.search(r'(\d{4}-\d{2}-\d{2})', line)
-                                if date_match and date_match.group(1) >= cutoff_date:
-                                    # Keep lines newer than or equal to the cutoff date
-                                    temp.write(line)
-                                    kept_lines += 1
-                            
-                        # If we kept any lines or the original file is empty, replace the original with the temp file
-                        if kept_lines > 0 or os.path.getsize(log_file) == 0:
-                            os.replace(temp_file, log_file)
-                            trimmed_count += 1
-                            logger.debug(f"Trimmed log file: {log_file}, kept {kept_lines} lines")
-                        else:
-                            # If we didn't keep any lines, don't replace the file (it might be a special case)
-                            os.remove(temp_file)
-                            logger.debug(f"No recent logs found in {log_file}, file not modified")
-                            
-                    except Exception as e:
-                        logger.error(f"Error trimming log file {log_file}: {str(e)}")
-                        # Clean up temp file if it exists
-                        if os.path.exists(temp_file):
-                            os.remove(temp_file)
-                
-                logger.info(f"Log cleanup completed. Trimmed {trimmed_count} log files to keep entries from the last 7 days.")
-            except Exception as e:
-                logger.error(f"Error during log cleanup: {str(e)}")
+            rotated = await asyncio.to_thread(rotate_oversized_logs, logs_dir)
+            removed = await asyncio.to_thread(remove_expired_logs, logs_dir)
+            logger.info(f"Log rotation check completed. Rotated {len(rotated)} and removed {len(removed)} expired log files.")
                 
         except Exception as e:
             logger.error(f"Error in log cleanup scheduler: {str(e)}")
             await asyncio.sleep(300)  # Wait 5 minutes before retrying if there's an error
 
+def compact_versioned_tables():
+    """Run one retention pass over the anomaly and time series tables."""
+    connection = get_postgres_connection()
+    if connection is None:
+        logger.warning("Skipping retention: no database connection")
+        return None
+    try:
+        return run_retention(connection)
+    finally:
+        connection.close()
+
+async def schedule_retention():
+    """Compact old inactive anomaly and time series versions daily at 3:30 AM, before metrics generation."""
+    while True:
+        try:
+            now = datetime.now()
+            target_run = now.replace(hour=3, minute=30, second=0, microsecond=0)
+            if now >= target_run:
+                target_run += timedelta(days=1)
+            
+            wait_seconds = (target_run - now).total_seconds()
+            logger.info(f"Next retention run scheduled for {target_run} (in {wait_seconds/3600:.2f} hours)")
+            await asyncio.sleep(wait_seconds)
+            
+            result = await asyncio.to_thread(compact_versioned_tables)
+            if result:
+                logger.info(f"Retention completed. Archived {result['bytes_archived'] / 1024 / 1024:.1f} MB, "
+                            f"freed {result['bytes_freed'] / 1024 / 1024:.1f} MB")
+                
+        except Exception as e:
+            logger.error(f"Error in retention scheduler: {str(e)}")
+            await asyncio.sleep(300)  # Wait 5 minutes before retrying if there's an error
+
+async def refresh_dashboard_snapshot():
+    """Recompute the backend dashboard statistics every DASHBOARD_SNAPSHOT_INTERVAL_SECONDS."""
+    while True:
+        try:
+            await asyncio.to_thread(refresh_snapshot)
+        except Exception as e:
+            logger.error(f"Error refreshing dashboard snapshot: {str(e)}")
+        await asyncio.sleep(DASHBOARD_SNAPSHOT_INTERVAL_SECONDS)
+
+async def watch_disk_usage():
+    """
+    Index output/, logs/ and the vector DB storage, then every DISK_USAGE_POLL_SECONDS
+    pick up files written by other processes and enforce the directory quotas.
+    """
+    register_default_roots(current_dir)
+    while True:
+        try:
+            results = await asyncio.to_thread(maintain_disk_usage)
+            for name, result in results.items():
+                if result["deleted"]:
+                    logger.info(f"Quota cleanup of {name} freed {result['bytes_freed'] / 1024 / 1024:.1f} MB")
+        except Exception as e:
+            logger.error(f"Error updating disk usage: {str(e)}")
+        await asyncio.sleep(DISK_USAGE_POLL_SECONDS)
+
+async def watch_dashboard_store():
+    """
+    Load the dashboard files into memory, then every DASHBOARD_STORE_CHECK_SECONDS
+    reload the ones changed by other processes, so requests never wait on a refresh.
+    """
+    store = get_dashboard_store()
+    while True:
+        try:
+            changed = await asyncio.to_thread(store.refresh)
+            if changed:
+                logger.info(f"Dashboard store reloaded {changed} changed files")
+        except Exception as e:
+            logger.error(f"Error refreshing dashboard store: {str(e)}")
+        await asyncio.sleep(DASHBOARD_STORE_CHECK_SECONDS)
+
 @app.on_event("startup")
 async def startup_event():
     # Existing startup code
@@ -624,6 +536,23 @@ async def startup_event():
     # Start the log cleanup scheduler
     asyncio.create_task(cleanup_logs())
     logger.info("Started log cleanup scheduler")
+    
+    # Start the dashboard statistics refresher
+    asyncio.create_task(refresh_dashboard_snapshot())
+    logger.info("Started dashboard snapshot refresher")
+    
+    # Start the dashboard store refresher
+    asyncio.create_task(watch_dashboard_store())
+    logger.info("Started dashboard store refresher")
+    
+    # Start the disk usage watcher
+    asyncio.create_task(watch_disk_usage())
+    logger.info("Started disk usage watcher")
+    
+    # Start the database retention scheduler
+    if os.getenv("RETENTION_ENABLED", "true").lower() == "true":
+        asyncio.create_task(schedule_retention())
+        logger.info("Started retention scheduler")
 
 if __name__ == "__main__":
     import uvicorn
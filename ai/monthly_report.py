@@ -9,22 +9,30 @@ import requests
 from datetime import datetime
 from dotenv import load_dotenv
 from pathlib import Path
-import traceback
 import base64
 from io import BytesIO
 from PIL import Image
 import time
 import re
-from dateutil.relativedelta import relativedelta
+from functools import partial
 import plotly.graph_objects as go
 import plotly.io as pio
 from plotly.subplots import make_subplots
 from tools.generate_report_text import generate_report_text
+from tools.dw_registry import publish_many
+from tools.report_explainer import explain_report_items
+from tools.concurrency import run_concurrently
+from tools.log_utils import configure_logging, remove_handlers, rotating_file_handler
+from tools.llm_cache import cached_chat_completion
 
 # Set up paths to look for .env file
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(script_dir)
 
+# Reports, charts and the dashboard files updated with the report link;
+# tools.benchmark points this at a temporary directory
+OUTPUT_DIR = Path(script_dir) / 'output'
+
 # Add the project root and script directory to the Python path
 sys.path.insert(0, project_root)
 sys.path.insert(0, script_dir)
@@ -55,7 +63,7 @@ os.makedirs(logs_dir, exist_ok=True)
 
 # Configure file handler with absolute path
 log_file = os.path.join(logs_dir, 'monthly_report.log')
-file_handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
+file_handler = rotating_file_handler(log_file)
 file_handler.setLevel(log_level)  # Set handler level to match log_level
 
 # Configure console handler
@@ -71,14 +79,16 @@ console_handler.setFormatter(formatter)
 root_logger = logging.getLogger()
 root_logger.setLevel(log_level)  # Set root logger level to match log_level
 
-# Remove any existing handlers from the root logger to avoid duplicate logs
-for handler in root_logger.handlers[:]:
-    root_logger.removeHandler(handler)
+# Remove (and close) any existing handlers from the root logger to avoid duplicate logs
+remove_handlers(root_logger)
 
 # Add handlers to root logger
 root_logger.addHandler(file_handler)
 root_logger.addHandler(console_handler)
 
+# Per-module levels (LOG_LEVELS) and JSON lines (LOG_FORMAT=json)
+configure_logging()
+
 # Create a module-specific logger that will use the root logger's configuration
 logger = logging.getLogger(__name__)
 
@@ -188,6 +198,10 @@ if PERPLEXITY_API_KEY:
 else:
     logger.warning("No Perplexity API key found. Perplexity API features will not be available.")
 
+# Context enrichment calls are independent per item and run concurrently
+PERPLEXITY_CONCURRENCY = int(os.getenv("PERPLEXITY_CONCURRENCY", "4"))
+PERPLEXITY_TIMEOUT = float(os.getenv("PERPLEXITY_TIMEOUT", "120"))
+
 # Global variable to store prompts
 _PROMPTS = None
 
@@ -615,7 +629,7 @@ def select_deltas_to_discuss(period_type='month', top_n=20, bottom_n=20, distric
         logger.error(error_msg, exc_info=True)
         return {"status": "error", "message": error_msg}
 
-def prioritize_deltas(deltas, max_items=10):
+def prioritize_deltas(deltas, max_items=10, bypass_cache=False):
     """
     Step 2: Prioritize the deltas for discussion based on their importance.
     This uses the explainer agent to determine which changes are most significant.
@@ -623,6 +637,7 @@ def prioritize_deltas(deltas, max_items=10):
     Args:
         deltas: Dictionary with top and bottom changes from select_deltas_to_discuss
         max_items: Maximum number of items to prioritize
+        bypass_cache: Call the model even if an identical request is cached
         
     Returns:
         List of prioritized items with explanations
@@ -684,7 +699,9 @@ def prioritize_deltas(deltas, max_items=10):
         )
 
         # Make API call to get prioritized list
-        response = client.chat.completions.create(
+        response = cached_chat_completion(
+            client,
+            bypass=bypass_cache,
             model=AGENT_MODEL,
             messages=[{"role": "system", "content": system_message},
                      {"role": "user", "content": prompt}],
@@ -948,334 +965,77 @@ def store_prioritized_items(prioritized_items, period_type='month', district="0"
     else:
         return {"status": "error", "message": result["message"]}
 
-def generate_explanations(report_ids):
+def generate_explanations(report_ids, llm_client=None, max_concurrency=None, timeout=None):
     """
     Step 3: Generate detailed explanations for each prioritized item using the explainer agent.
     Updates the monthly_reporting table with the explanations.
     
+    All report rows are fetched in one query, the explainer agent runs for the
+    items concurrently (bounded, with a per-call timeout) and the results are
+    written back in one batched UPDATE.
+    
     Args:
         report_ids: List of report IDs to explain
+        llm_client: Swarm-compatible client (defaults to the shared swarm_client)
+        max_concurrency: Maximum agent runs in flight (default EXPLANATION_CONCURRENCY)
+        timeout: Per-item timeout in seconds (default EXPLANATION_TIMEOUT)
         
     Returns:
         Status dictionary
     """
     logger.info(f"Generating explanations for {len(report_ids)} items")
+    llm_client = llm_client or swarm_client
     
     def generate_explanations_operation(connection):
         cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        successful_explanations = 0
         
+        # Prefetch every report item in one round-trip
+        cursor.execute("""
+            SELECT * FROM monthly_reporting WHERE id = ANY(%s)
+        """, (list(report_ids),))
+        rows_by_id = {row["id"]: row for row in cursor.fetchall()}
+        
+        items = []
         for report_id in report_ids:
-            # Get the report item
-            cursor.execute("""
-                SELECT * FROM monthly_reporting WHERE id = %s
-            """, (report_id,))
-            
-            item = cursor.fetchone()
-            if not item:
-                logger.warning(f"Report item with ID {report_id} not found")
-                continue
-            
-            # Format the data for the explainer agent
-            metric_name = item["metric_name"]
-            metric_id = item["metric_id"]  # Get the metric_id from the item
-            group_value = item["group_value"]
-            recent_mean = item["recent_mean"]
-            comparison_mean = item["comparison_mean"]
-            difference = item["difference"]
-            percent_change = item["percent_change"]
-            district = item["district"]
-            period_type = item["period_type"]
-            
-            # Calculate time periods for context - check the report date
-            report_date = item.get("report_date") or datetime.now().date()
-            if isinstance(report_date, str):
-                report_date = datetime.strptime(report_date, "%Y-%m-%d").date()
-            
-            # Get the previous month's date (the more recent month in the comparison)
-            # Using a safer approach to handle edge cases with month days
-            previous_month_date = report_date - relativedelta(months=1)
-            
-            # Get the month before the previous month (the earlier month in the comparison)
-            # Using a safer approach to handle edge cases with month days
-            comparison_month_date = previous_month_date - relativedelta(months=1)
-            
-            # Format the month names
-            recent_month = previous_month_date.strftime("%B %Y")
-            previous_month = comparison_month_date.strftime("%B %Y")
-            
-            logger.info(f"Comparing data between {previous_month} and {recent_month}")
-            
-            # Calculate delta if not already in the item
-            delta = item.get("difference", recent_mean - comparison_mean)
-            
-            # Add detailed context about the item for logging
-            logger.info(f"Generating explanation for report_id={report_id}, metric={metric_name} (ID: {metric_id}), group={group_value}")
-            logger.info(f"  Values: recent={recent_mean}, comparison={comparison_mean}, diff={difference}, percent_change={percent_change}")
-            logger.info(f"  Period: {period_type}, District: {district}")
-            
-            # Create a simple session for the anomaly explainer agent
-            session_id = f"report_{report_id}"
-            session_context = context_variables.copy()
-            
-            # Create a session for the agent
-            sessions = {}
-            sessions[session_id] = {
-                "messages": [],
-                "agent": anomaly_explainer_agent,
-                "context_variables": session_context
-            }
-            
-            # Create a simple, direct prompt for the agent
-            direction = "increased" if delta > 0 else "decreased"
-            percent_change_str = f"{abs(percent_change):.2f}%" if percent_change is not None else "unknown percentage"
-            
-            prompt = f"""Please explain why the metric '{metric_name}' (ID: {metric_id})  {direction} from {comparison_mean} to {recent_mean} ({percent_change_str}) between {previous_month} and {recent_month} for district {district}.
-
-Use the available tools to research this change and provide a comprehensive explanation that can be included in a monthly newsletter for city residents.
-You should first look to supervisor district and see if there are localized trends in a particular neighborhood.  If so, you should include that in your explanation. 
-Other than that, prefer to share anomalies or data-points that explain a large portion of the difference in the metric.  
-
-Your response MUST be returned as a properly formatted JSON object with the following fields:
-- "explanation": A clear and thorough explanation of what happened (at least 3 paragraphs)
-- "trend_analysis": A discussion of how this change fits into longer-term trends
-- "charts": A list of chart references to include (if any)
-
-DO NOT include any additional content, headers, or formatting outside of this JSON structure. The data will be extracted directly for use in a report."""
-            
-            logger.info(f"Prompt for explainer agent: {prompt[:200]}...")
-            
-            # Add prompt to the session
-            session_data = sessions[session_id]
-            session_data["messages"].append({"role": "user", "content": prompt})
-            
-            # Process with the agent
-            try:
-                logger.info(f"Running explainer agent for metric: {metric_id}")
-                # Run the agent in a non-streaming mode to get the complete response
-                response = swarm_client.run(
-                    agent=anomaly_explainer_agent,
-                    messages=session_data["messages"],
-                    context_variables=session_data["context_variables"],
-                    stream=False
-                )
-                
-                # Log information about the response type and attributes
-                logger.info(f"Explainer agent response type: {type(response)}")
-                if hasattr(response, '__dict__'):
-                    logger.info(f"Response attributes: {list(response.__dict__.keys())}")
-                elif isinstance(response, dict):
-                    logger.info(f"Response keys: {list(response.keys())}")
-                
-                # Log the raw response for debugging
-                try:
-                    if hasattr(response, 'model_dump'):
-                        logger.info(f"Response model_dump: {safe_json_serialize(response.model_dump())[:500]}...")
-                    elif isinstance(response, dict):
-                        logger.info(f"Response dict: {safe_json_serialize(response)[:500]}...")
-                    elif hasattr(response, '__dict__'):
-                        logger.info(f"Response __dict__: {safe_json_serialize(response.__dict__)[:500]}...")
-                    else:
-                        logger.info(f"Response string: {str(response)[:500]}...")
-                except Exception as dump_error:
-                    logger.error(f"Error dumping response for logging: {str(dump_error)}")
-                    logger.error(f"Response type: {type(response)}")
-                    if callable(response):
-                        logger.error("Response is a callable function, cannot serialize")
-                    else:
-                        logger.error(f"Response repr: {repr(response)[:200]}...")
-                
-                explanation = ""
-                chart_data = None
-                explainer_metadata = {}
-                
-                # Check if response contains content
-                if response:
-                    # Try to extract JSON data from the response messages
-                    try:
-                        # Extract the response content
-                        response_content = None
-                        
-                        # Check if response has a 'messages' attribute
-                        if hasattr(response, 'messages') and response.messages:
-                            logger.info(f"Response has messages attribute with {len(response.messages)} messages")
-                            # Get the last message
-                            last_message = response.messages[-1]
-                            logger.info(f"Last message type: {type(last_message)}")
-                            
-                            # Check if the message has content
-                            if hasattr(last_message, 'content') and last_message.content:
-                                response_content = str(last_message.content)
-                                logger.info(f"Found response content in last message content: {response_content[:100]}...")
-                            # Check if the message has text
-                            elif hasattr(last_message, 'text') and last_message.text:
-                                response_content = str(last_message.text)
-                                logger.info(f"Found response content in last message text: {response_content[:100]}...")
-                            # Check if the message is a dict with content
-                            elif isinstance(last_message, dict) and 'content' in last_message:
-                                response_content = str(last_message['content'])
-                                logger.info(f"Found response content in last message dict content: {response_content[:100]}...")
-                            # Check if the message is a dict with text
-                            elif isinstance(last_message, dict) and 'text' in last_message:
-                                response_content = str(last_message['text'])
-                                logger.info(f"Found response content in last message dict text: {response_content[:100]}...")
-                        
-                        # If no response_content found in messages, try to extract from the response itself
-                        if not response_content:
-                            # Handle other response types as previously implemented
-                            # ... existing code for parsing response ...
-                            if isinstance(response, str):
-                                response_content = response
-                            # Add other extraction methods as needed
-                        
-                        # Now try to parse the JSON from the response_content
-                        if response_content:
-                            try:
-                                # Extract JSON content from the response_content
-                                # First look for JSON content between ```json and ``` markers
-                                json_pattern = r'```json\s*([\s\S]*?)\s*```'
-                                json_match = re.search(json_pattern, response_content)
-                                
-                                if json_match:
-                                    json_str = json_match.group(1)
-                                    logger.info(f"Found JSON content in code block: {json_str[:200]}...")
-                                    explainer_data = json.loads(json_str)
-                                else:
-                                    # Try to parse the entire response as JSON
-                                    logger.info("Attempting to parse entire response as JSON")
-                                    explainer_data = json.loads(response_content)
-                                
-                                logger.info(f"Successfully parsed JSON data: {json.dumps(explainer_data)[:200]}...")
-                                
-                                # Extract the specific fields we're looking for
-                                if "explanation" in explainer_data:
-                                    explanation = explainer_data["explanation"]
-                                    logger.info(f"Extracted explanation from JSON: {explanation[:100]}...")
-                                    
-                                # Store all fields in metadata
-                                explainer_metadata = explainer_data
-                                
-                                # Keep chart data separate
-                                if "chart_data" in explainer_data:
-                                    chart_data = explainer_data["chart_data"]
-                                elif "charts" in explainer_data:
-                                    chart_data = explainer_data["charts"]
-                                    
-                            except json.JSONDecodeError as json_err:
-                                logger.warning(f"Failed to parse JSON from response: {json_err}")
-                                logger.warning(f"Response content: {response_content[:500]}...")
-                                # If JSON parsing fails, attempt to extract explanation using existing methods
-                                explanation_pattern = r'EXPLANATION:\s*([\s\S]*?)(?:\Z|(?:TREND_ANALYSIS:|CHARTS:))'
-                                explanation_match = re.search(explanation_pattern, response_content)
-                                if explanation_match:
-                                    explanation = explanation_match.group(1).strip()
-                                    logger.info(f"Extracted explanation using regex: {explanation[:100]}...")
-                                    
-                                # Also try to extract trend analysis
-                                trend_pattern = r'TREND_ANALYSIS:\s*([\s\S]*?)(?:\Z|CHARTS:)'
-                                trend_match = re.search(trend_pattern, response_content)
-                                if trend_match:
-                                    explainer_metadata["trend_analysis"] = trend_match.group(1).strip()
-                                    logger.info(f"Extracted trend analysis using regex: {explainer_metadata['trend_analysis'][:100]}...")
-                                    
-                        else:
-                            logger.warning("Could not extract response content")
-                            
-                    except Exception as e:
-                        logger.error(f"Error extracting data from response: {e}")
-                        logger.error(traceback.format_exc())
-                
-                # Validate the explanation
-                if explanation:
-                    if len(explanation) < 10:  # If explanation is too short
-                        logger.warning(f"Extracted explanation is too short: {explanation}")
-                        explanation = ""
-                    elif len(explanation) > 5000:  # If explanation is too long
-                        logger.warning(f"Extracted explanation is too long ({len(explanation)} chars), truncating")
-                        explanation = explanation[:5000] + "..."
-                
-                # If explanation is still empty after all attempts, use a fallback
-                if not explanation:
-                    logger.warning(f"No explanation returned from agent for {metric_name}")
-                    
-                    # First try to use the explanation already in the database
-                    if item.get("explanation"):
-                        explanation = item.get("explanation")
-                        logger.info(f"Using existing explanation from prioritization step: {explanation[:100]}...")
-                    else:
-                        # If there's no explanation at all, create a generic one
-                        explanation = f"Unable to generate an automated explanation for the change in {metric_name} ({percent_change_str}) between {previous_month} and {recent_month}."
-                
-            except Exception as e:
-                logger.error(f"Error running explainer agent: {str(e)}", exc_info=True)
-                logger.error(f"Traceback: {traceback.format_exc()}")
-                explanation = f"Error generating explanation for {metric_name}: {str(e)}"
-                
-            # Log the final explanation that will be stored
-            logger.info(f"Final explanation to be stored for {metric_name} (length: {len(explanation)}): {explanation[:200]}...")
-            
-            # Prepare chart_html for storage in the database
-            chart_html = None
-            if chart_data:
-                try:
-                    # Extract chart HTML if it exists
-                    if hasattr(chart_data, 'content'):
-                        chart_html = chart_data.content
-                    elif isinstance(chart_data, dict) and 'content' in chart_data:
-                        chart_html = chart_data['content']
-                    elif isinstance(chart_data, str) and ('<div' in chart_data or '<svg' in chart_data):
-                        chart_html = chart_data
-                    
-                    if chart_html:
-                        logger.info(f"Extracted chart HTML (first 100 chars): {str(chart_html)[:100]}...")
-                except Exception as e:
-                    logger.error(f"Error extracting chart HTML: {e}")
-            
-            # Get existing metadata from the database and update it
-            existing_metadata = item.get("metadata", {}) or {}
-            if isinstance(existing_metadata, str):
-                try:
-                    existing_metadata = json.loads(existing_metadata)
-                except:
-                    existing_metadata = {}
-                    
-            # Merge the explainer_metadata into existing_metadata
-            if explainer_metadata:
-                for key, value in explainer_metadata.items():
-                    existing_metadata[key] = value
-                logger.info(f"Updated metadata with explainer data: {json.dumps(list(explainer_metadata.keys()))}")
-            
-            # Update the database with the detailed explanation, chart data, and updated metadata
-            if explanation:  # Only update if we have a valid explanation
-                try:
-                    if chart_html:
-                        cursor.execute("""
-                            UPDATE monthly_reporting
-                            SET explanation = %s,
-                                chart_data = %s,
-                                metadata = %s
-                            WHERE id = %s
-                        """, (explanation, json.dumps({"html": str(chart_html)}), json.dumps(existing_metadata), report_id))
-                        logger.info(f"Updated explanation, chart data, and metadata for report ID {report_id}")
-                    else:
-                        cursor.execute("""
-                            UPDATE monthly_reporting
-                            SET explanation = %s,
-                                metadata = %s
-                            WHERE id = %s
-                        """, (explanation, json.dumps(existing_metadata), report_id))
-                        logger.info(f"Updated explanation, and metadata for report ID {report_id}")
-                    successful_explanations += 1
-                except Exception as db_error:
-                    logger.error(f"Database error while updating explanation: {str(db_error)}")
-                    logger.error(traceback.format_exc())
+            if report_id in rows_by_id:
+                items.append(rows_by_id[report_id])
             else:
-                logger.warning(f"No valid explanation to store for report ID {report_id}")
+                logger.warning(f"Report item with ID {report_id} not found")
+        
+        explanations = explain_report_items(
+            items,
+            llm_client=llm_client,
+            agent=anomaly_explainer_agent,
+            context_variables=context_variables,
+            max_concurrency=max_concurrency,
+            timeout=timeout
+        )
+        
+        rows = [
+            (
+                result["id"],
+                result["explanation"],
+                json.dumps({"html": str(result["chart_html"])}) if result["chart_html"] else None,
+                json.dumps(result["metadata"])
+            )
+            for result in explanations if result["explanation"]
+        ]
+        
+        # Write all explanations back in a single statement
+        if rows:
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE monthly_reporting AS m
+                SET explanation = v.explanation,
+                    chart_data = COALESCE(v.chart_data::jsonb, m.chart_data),
+                    metadata = v.metadata::jsonb
+                FROM (VALUES %s) AS v(id, explanation, chart_data, metadata)
+                WHERE m.id = v.id
+            """, rows)
         
         connection.commit()
         cursor.close()
         
-        return successful_explanations
+        return len(rows)
     
     # Execute the operation with proper connection handling
     result = execute_with_connection(
@@ -1293,13 +1053,14 @@ DO NOT include any additional content, headers, or formatting outside of this JS
     else:
         return {"status": "error", "message": result["message"]}
 
-def generate_monthly_report(report_date=None, district="0"):
+def generate_monthly_report(report_date=None, district="0", bypass_cache=False):
     """
     Step 4: Generate the final monthly report with charts and annotations
     
     Args:
         report_date: The date for the report (defaults to current month)
         district: District number
+        bypass_cache: Call the model even if an identical request is cached
         
     Returns:
         Path to the generated report file
@@ -1662,7 +1423,9 @@ def generate_monthly_report(report_date=None, district="0"):
 
         # Make API call to generate the report
         logger.info("Making API call to generate report content")
-        response = client.chat.completions.create(
+        response = cached_chat_completion(
+            client,
+            bypass=bypass_cache,
             model=AGENT_MODEL,
             messages=[{"role": "system", "content": system_message},
                      {"role": "user", "content": prompt}],
@@ -1795,7 +1558,7 @@ def generate_monthly_report(report_date=None, district="0"):
                     logger.info(f"Appended chart HTML for '{item['metric']}' at the end of the report.")
         
         # Create directory for reports if it doesn't exist
-        reports_dir = Path(__file__).parent / 'output' / 'reports'
+        reports_dir = OUTPUT_DIR / 'reports'
         reports_dir.mkdir(parents=True, exist_ok=True)
         
         # Save the report to a file as HTML
@@ -1826,12 +1589,13 @@ def generate_monthly_report(report_date=None, district="0"):
     else:
         return {"status": "error", "message": result["message"]}
 
-def proofread_and_revise_report(report_path):
+def proofread_and_revise_report(report_path, bypass_cache=False):
     """
     Step 5: Proofread and revise the monthly newsletter
     
     Args:
         report_path: Path to the newsletter file to proofread
+        bypass_cache: Call the model even if an identical request is cached
         
     Returns:
         Path to the revised newsletter file
@@ -1862,7 +1626,9 @@ def proofread_and_revise_report(report_path):
 
         # Use the AGENT_MODEL directly with higher max_tokens
         logger.info("Using AGENT_MODEL for proofreading with increased token limit")
-        response = client.chat.completions.create(
+        response = cached_chat_completion(
+            client,
+            bypass=bypass_cache,
             model=AGENT_MODEL,
             messages=[
                 {"role": "system", "content": system_message},
@@ -1998,8 +1764,8 @@ def get_perplexity_context(report_items):
         prompt_template = prompts['monthly_report']['context_enrichment']['prompt']
         system_message = prompts['monthly_report']['context_enrichment']['system']
         
-        # Process each item individually
-        for item in report_items:
+        # Enrich a single item; items are independent, so they run concurrently
+        def enrich_item(item):
             metric_name = item.get("metric")
             group_value = item.get("group")
             recent_mean = item.get("recent_mean")
@@ -2050,7 +1816,7 @@ Detailed Analysis: {report_text}
             
             # Make the API request
             logger.info(f"Sending request to Perplexity API for {metric_name}")
-            response = requests.post(url, json=payload, headers=headers)
+            response = requests.post(url, json=payload, headers=headers, timeout=PERPLEXITY_TIMEOUT)
             
             # Check if the request was successful
             if response.status_code == 200:
@@ -2065,7 +1831,7 @@ Detailed Analysis: {report_text}
                 
                 if not context_content:
                     logger.warning(f"Received empty content from Perplexity API for {metric_name}")
-                    continue
+                    return
                 
                 # Initialize metadata if it doesn't exist
                 if not item.get("metadata"):
@@ -2113,6 +1879,14 @@ Detailed Analysis: {report_text}
             else:
                 logger.error(f"Perplexity API error for {metric_name}: {response.status_code} - {response.text}")
         
+        run_concurrently(
+            enrich_item,
+            report_items,
+            max_workers=PERPLEXITY_CONCURRENCY,
+            timeout=PERPLEXITY_TIMEOUT,
+            name="Perplexity context"
+        )
+        
         logger.info("Successfully retrieved additional context from Perplexity API for all items")
         return {
             "status": "success", 
@@ -2124,7 +1898,7 @@ Detailed Analysis: {report_text}
         logger.error(error_msg, exc_info=True)
         return {"status": "error", "message": error_msg}
 
-def run_monthly_report_process(district="0", period_type="month", max_report_items=10):
+def run_monthly_report_process(district="0", period_type="month", max_report_items=10, bypass_cache=False):
     """
     Run the complete monthly newsletter generation process
     
@@ -2132,6 +1906,7 @@ def run_monthly_report_process(district="0", period_type="month", max_report_ite
         district: District number (0 for citywide)
         period_type: Time period type (month, quarter, year)
         max_report_items: Maximum number of items to include in the newsletter
+        bypass_cache: Call the model even if identical requests are cached
         
     Returns:
         Status dictionary with newsletter path
@@ -2153,7 +1928,7 @@ def run_monthly_report_process(district="0", period_type="month", max_report_ite
             
         # Step 2: Prioritize deltas and get explanations
         logger.info("Step 2: Prioritizing deltas")
-        prioritized = prioritize_deltas(deltas, max_items=max_report_items)
+        prioritized = prioritize_deltas(deltas, max_items=max_report_items, bypass_cache=bypass_cache)
         if prioritized.get("status") != "success":
             return prioritized
         
@@ -2400,20 +2175,21 @@ def run_monthly_report_process(district="0", period_type="month", max_report_ite
                 load_prompts,
                 AGENT_MODEL,
                 client,
-                logger
+                logger,
+                bypass_cache=bypass_cache
             )
             if report_text_result.get("status") != "success":
                 logger.warning(f"Failed to generate report_text: {report_text_result.get('message')}")
 
         # Step 7: Generate the monthly newsletter (with enriched context already in the database)
         logger.info("Step 7: Generating monthly newsletter")
-        newsletter_result = generate_monthly_report(district=district)
+        newsletter_result = generate_monthly_report(district=district, bypass_cache=bypass_cache)
         if newsletter_result.get("status") != "success":
             return newsletter_result
             
         # Step 8: Proofreading and revising the newsletter
         logger.info("Step 8: Proofreading and revising newsletter")
-        revised_result = proofread_and_revise_report(newsletter_result.get("report_path"))
+        revised_result = proofread_and_revise_report(newsletter_result.get("report_path"), bypass_cache=bypass_cache)
         if revised_result.get("status") != "success":
             return revised_result
         
@@ -2438,8 +2214,7 @@ def run_monthly_report_process(district="0", period_type="month", max_report_ite
         # Update the district's top_level.json with the revised report filename
         try:
             # Get the district directory path
-            script_dir = Path(__file__).parent
-            dashboard_dir = script_dir / 'output' / 'dashboard'
+            dashboard_dir = OUTPUT_DIR / 'dashboard'
             district_dir = dashboard_dir / district
             
             # Read the current top_level.json
@@ -2630,7 +2405,7 @@ def delete_monthly_report(report_id):
     # Now delete the files
     try:
         report = result["result"]
-        reports_dir = Path(__file__).parent / 'output' / 'reports'
+        reports_dir = OUTPUT_DIR / 'reports'
         
         # Check if the directory exists
         if not reports_dir.exists():
@@ -2673,7 +2448,7 @@ def generate_chart_image(chart_type, params, output_dir=None):
     try:
         # Create output directory if not provided
         if not output_dir:
-            output_dir = Path(__file__).parent / 'output' / 'charts'
+            output_dir = OUTPUT_DIR / 'charts'
             output_dir.mkdir(parents=True, exist_ok=True)
         else:
             output_dir = Path(output_dir)
@@ -2942,7 +2717,7 @@ def generate_time_series_chart_image(metric_id, district, period_type, output_di
     try:
         # Create output directory if not provided
         if not output_dir:
-            output_dir = Path(__file__).parent / 'output' / 'charts'
+            output_dir = OUTPUT_DIR / 'charts'
             output_dir.mkdir(parents=True, exist_ok=True)
         else:
             output_dir = Path(output_dir)
@@ -3065,19 +2840,38 @@ def expand_chart_references(report_path):
         image_pattern_with_alt = r'<img[^>]*src="([^"]+)"[^>]*alt="([^"]+)"[^>]*>'
         image_pattern_without_alt = r'<img[^>]*src="([^"]+)"[^>]*>'
         
+        # Publish every referenced chart up front and concurrently, instead of
+        # one blocking Datawrapper round-trip sequence per reference. The chart
+        # registry reuses charts that have not changed since the last run.
+        chart_tasks = {}
+        for metric_id, district, period_type in re.findall(time_series_pattern, report_html):
+            chart_tasks[("time_series", metric_id, district, period_type)] = partial(
+                create_datawrapper_chart,
+                metric_id=metric_id,
+                district=district,
+                period_type=period_type
+            )
+        
+        anomaly_ids = set(re.findall(anomaly_pattern, report_html))
+        for img_src in re.findall(image_pattern_without_alt, report_html):
+            parts = img_src.split("_")
+            if img_src.startswith("anomaly_") and len(parts) >= 2:
+                anomaly_ids.add(parts[1].split(".")[0])
+        if anomaly_ids:
+            from tools.gen_anomaly_chart_dw import generate_anomaly_chart_from_id
+            for anomaly_id in anomaly_ids:
+                chart_tasks[("anomaly", anomaly_id)] = partial(generate_anomaly_chart_from_id, anomaly_id)
+        
+        logger.info(f"Publishing {len(chart_tasks)} Datawrapper charts for report: {report_path}")
+        chart_urls = publish_many(chart_tasks)
+        
         # Replace time series chart references
         def replace_time_series(match):
             metric_id = match.group(1)
             district = match.group(2)
             period_type = match.group(3)
             
-            logger.info(f"Attempting to generate Datawrapper chart for metric_id: {metric_id}, district: {district}, period: {period_type}")
-            
-            dw_chart_url = create_datawrapper_chart(
-                metric_id=metric_id,
-                district=district,
-                period_type=period_type
-            )
+            dw_chart_url = chart_urls.get(("time_series", metric_id, district, period_type))
             
             if dw_chart_url:
                 logger.info(f"Successfully generated Datawrapper chart: {dw_chart_url}")
@@ -3105,11 +2899,7 @@ def expand_chart_references(report_path):
             anomaly_id = match.group(1)
             
             try:
-                # Use the new helper function to generate a chart directly from the anomaly ID
-                from tools.gen_anomaly_chart_dw import generate_anomaly_chart_from_id
-                logger.info(f"Generating chart for anomaly ID: {anomaly_id} using direct ID function")
-                
-                chart_url = generate_anomaly_chart_from_id(anomaly_id)
+                chart_url = chart_urls.get(("anomaly", anomaly_id))
                 
                 if chart_url:
                     logger.info(f"Successfully generated Datawrapper chart for anomaly {anomaly_id}: {chart_url}")
@@ -3161,11 +2951,7 @@ def expand_chart_references(report_path):
                     
                     # Try to use Datawrapper for this anomaly image
                     try:
-                        # Use the new helper function to generate a chart directly from the anomaly ID
-                        from tools.gen_anomaly_chart_dw import generate_anomaly_chart_from_id
-                        logger.info(f"Generating chart for anomaly image ID: {anomaly_id} using direct ID function")
-                        
-                        chart_url = generate_anomaly_chart_from_id(anomaly_id)
+                        chart_url = chart_urls.get(("anomaly", anomaly_id))
                         
                         if chart_url:
                             logger.info(f"Successfully generated Datawrapper chart for anomaly image {anomaly_id}: {chart_url}")
@@ -3218,11 +3004,7 @@ def expand_chart_references(report_path):
                     
                     # Try to use Datawrapper for this anomaly image
                     try:
-                        # Use the new helper function to generate a chart directly from the anomaly ID
-                        from tools.gen_anomaly_chart_dw import generate_anomaly_chart_from_id
-                        logger.info(f"Generating chart for anomaly image ID (no alt): {anomaly_id} using direct ID function")
-                        
-                        chart_url = generate_anomaly_chart_from_id(anomaly_id)
+                        chart_url = chart_urls.get(("anomaly", anomaly_id))
                         
                         if chart_url:
                             logger.info(f"Successfully generated Datawrapper chart for anomaly image {anomaly_id}: {chart_url}")
@@ -3,6 +3,8 @@ import json
 from tools.data_fetcher import set_dataset
 from tools.genChart import generate_time_series_chart
 from tools.anomaly_detection import anomaly_detection
+from tools.anomaly_scan import time_ranges
+from tools.disk_usage import record_write
 import datetime
 from swarm import Swarm
 from pathlib import Path
@@ -88,61 +90,8 @@ def get_time_ranges(period_type):
     Returns:
         tuple: (recent_period, comparison_period) each containing start and end dates
     """
-    today = datetime.date.today()
-    
-    if period_type == 'ytd':
-        # Current year from Jan 1 to yesterday
-        recent_period = {
-            'start': datetime.date(today.year, 1, 1),
-            'end': today - datetime.timedelta(days=1)
-        }
-        # Same days last year
-        comparison_period = {
-            'start': datetime.date(today.year - 1, 1, 1),
-            'end': datetime.date(today.year - 1, today.month, today.day) - datetime.timedelta(days=1)
-        }
-    elif period_type == 'year':
-        # Last complete year
-        last_year = today.year - 1 
-        recent_period = {
-            'start': datetime.date(last_year, 1, 1),
-            'end': datetime.date(last_year, 12, 31)
-        }
-        comparison_period = {
-            'start': datetime.date(last_year - 10, 1, 1),
-            'end': datetime.date(last_year - 1, 12, 31)
-        }
-    elif period_type == 'month':
-        # For monthly analysis, always use the previous month as it's complete
-        last_complete_month = today.replace(day=1) - datetime.timedelta(days=1)
-        last_complete_month = last_complete_month.replace(day=1)  # First day of the month
-        
-        recent_period = {
-            'start': last_complete_month,
-            'end': (last_complete_month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
-        }
-        
-        # Calculate start of comparison (24 months before)
-        comparison_start = last_complete_month - datetime.timedelta(days=730)  # Roughly 24 months
-        comparison_start = comparison_start.replace(day=1)  # First day of that month
-        
-        comparison_period = {
-            'start': comparison_start,
-            'end': last_complete_month - datetime.timedelta(days=1)
-        }
-    else:  # day
-        # Last complete day
-        yesterday = today - datetime.timedelta(days=1)
-        recent_period = {
-            'start': yesterday,
-            'end': yesterday
-        }
-        comparison_period = {
-            'start': yesterday - datetime.timedelta(days=28),
-            'end': yesterday - datetime.timedelta(days=1)
-        }
-    
-    return recent_period, comparison_period
+    # Shared with the fleet-wide scan so both score the same windows
+    return time_ranges(period_type)
 
 def log_analysis(analysis_info):
     """
@@ -513,6 +462,7 @@ def process_entry(index, data_entry, output_folder, log_file, script_dir, period
                 os.remove(markdown_filename)
             with open(markdown_filename, 'w', encoding='utf-8') as f:
                 f.write(full_markdown_content)
+            record_write(markdown_filename)
 
             # Clear the contents for the next iteration
             all_markdown_contents.clear()
@@ -0,0 +1,229 @@
+"""
+Concurrent tool-call execution for the Swarm agents.
+
+Swarm's run() executes the tool calls of one assistant turn one at a time,
+and each is a blocking database, HTTP or Qdrant call, so an explanation turn
+that fans out to get_dashboard_metric, query_docs and query_anomalies_db takes
+the sum of their latencies. parallel_tool_calls(client) replaces the client's
+handle_tool_calls with one that runs the calls of a turn in a thread pool, so
+the turn takes as long as its slowest call:
+
+- Tool messages are appended in the order the model issued the calls, and
+  agent handoffs and context updates are merged in that order, so the
+  conversation is the same as with sequential execution.
+- Tools marked @context_writer store into context_variables (set_dataset,
+  for example) and run alone: the calls before them finish first and the
+  calls after them start afterwards.
+- Each call is limited to AGENT_TOOL_TIMEOUT_SECONDS, overridable per tool
+  with AGENT_TOOL_TIMEOUTS=query_docs=20,get_dashboard_metric=30. A call that
+  times out or raises is reported to the model as an error tool message.
+  A thread cannot be cancelled, so a timed-out call keeps running with its
+  result discarded; context writers are therefore never timed out.
+- Every call is logged as an agent_tool_call event with its latency and the
+  session_id from context_variables; the last AGENT_TOOL_LOG_SIZE calls of
+  each session are kept for tool_call_log().
+- Swarm does not stream tool results. The outcomes of each turn are queued
+  per session_id until the streaming loop collects them with
+  take_tool_outcomes() to show them (charts, tables, agent transfers);
+  the loops no longer run the tools themselves.
+"""
+
+import os
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from tools.concurrency import run_concurrently, run_with_timeout
+from tools.log_utils import log_event
+
+logger = logging.getLogger(__name__)
+
+AGENT_TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "4"))
+AGENT_TOOL_TIMEOUT_SECONDS = float(os.getenv("AGENT_TOOL_TIMEOUT_SECONDS", "60"))
+AGENT_TOOL_LOG_SIZE = int(os.getenv("AGENT_TOOL_LOG_SIZE", "200"))
+# Name of the argument Swarm fills with the context variables
+CONTEXT_VARIABLES_ARG = "context_variables"
+
+_session_logs: Dict[str, deque] = {}
+_pending_outcomes: Dict[str, deque] = {}
+_session_logs_lock = threading.Lock()
+
+
+def parse_tool_timeouts(spec: Optional[str]) -> Dict[str, float]:
+    """Parse "tool=seconds,tool=seconds" into {tool: seconds}; bad entries are ignored."""
+    timeouts = {}
+    for part in (spec or "").split(","):
+        name, _, seconds = part.partition("=")
+        try:
+            timeouts[name.strip()] = float(seconds)
+        except ValueError:
+            continue
+    timeouts.pop("", None)
+    return timeouts
+
+
+AGENT_TOOL_TIMEOUTS = parse_tool_timeouts(os.getenv("AGENT_TOOL_TIMEOUTS"))
+
+
+def context_writer(func: Callable) -> Callable:
+    """Mark an agent tool that stores into context_variables, so it never runs alongside other tools."""
+    func.context_writer = True
+    return func
+
+
+def tool_timeout(func: Callable) -> Optional[float]:
+    """Time limit of a tool, None for context writers: abandoned, they would still write the context later."""
+    if getattr(func, "context_writer", False):
+        return None
+    timeout = AGENT_TOOL_TIMEOUTS.get(func.__name__, AGENT_TOOL_TIMEOUT_SECONDS)
+    return timeout if timeout > 0 else None
+
+
+def _unpack_arguments(args: Dict[str, Any]) -> Dict[str, Any]:
+    # Models sometimes wrap the arguments as {"args": ..., "kwargs": "<JSON object>"}
+    if set(args) == {"args", "kwargs"} and isinstance(args["kwargs"], str):
+        try:
+            kwargs = json.loads(args["kwargs"])
+        except json.JSONDecodeError:
+            return args
+        if isinstance(kwargs, dict):
+            return kwargs
+    return args
+
+
+def plan_batches(calls: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Split calls, in order, into batches that can run concurrently; each context writer is a batch of its own."""
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    for call in calls:
+        if getattr(call["func"], "context_writer", False):
+            if current:
+                batches.append(current)
+            batches.append([call])
+            current = []
+        else:
+            current.append(call)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _record(session_id: Optional[str], entry: Dict[str, Any]):
+    log_event(logger, logging.INFO, "agent_tool_call", session=session_id, **entry)
+    with _session_logs_lock:
+        log = _session_logs.setdefault(session_id or "default", deque(maxlen=AGENT_TOOL_LOG_SIZE))
+        log.append(entry)
+
+
+def tool_call_log(session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """The most recent tool calls of a session, oldest first: tool, status, latency_ms, batch size."""
+    with _session_logs_lock:
+        return list(_session_logs.get(session_id or "default", ()))
+
+
+def take_tool_outcomes(session_id: Optional[str]) -> List[Dict[str, Any]]:
+    """The run_tool_calls outcomes of a session's turns since the last call, oldest first, and forget them."""
+    with _session_logs_lock:
+        return list(_pending_outcomes.pop(session_id, ())) if session_id else []
+
+
+def run_tool_calls(tool_calls, functions, context_variables: Dict[str, Any], handle_result: Callable,
+                   max_workers: int = AGENT_TOOL_WORKERS) -> List[Dict[str, Any]]:
+    """
+    Execute the tool calls of one turn and return, in call order, one outcome per
+    call: {"tool_call_id", "tool_name", "arguments", "content", "raw", "result",
+    "error"} where raw is what the tool returned, result its handle_result()
+    value and error the failure message (raw and result are None for calls
+    that failed).
+
+    Args:
+        tool_calls: Swarm/OpenAI tool call objects (id, function.name, function.arguments)
+        functions: The active agent's functions
+        context_variables: Passed to tools that take a context_variables argument
+        handle_result: Converts a raw tool return value to a Swarm Result
+        max_workers: Maximum number of calls in flight
+    """
+    function_map = {f.__name__: f for f in functions}
+    session_id = context_variables.get("session_id")
+    outcomes: List[Optional[Dict[str, Any]]] = [None] * len(tool_calls)
+    calls = []
+    for index, tool_call in enumerate(tool_calls):
+        name = tool_call.function.name
+        base = {"tool_call_id": tool_call.id, "tool_name": name, "arguments": None, "raw": None, "result": None,
+                "error": None}
+        if name not in function_map:
+            error = f"Tool {name} not found."
+            outcomes[index] = {**base, "content": f"Error: {error}", "error": error}
+            continue
+        try:
+            args = _unpack_arguments(json.loads(tool_call.function.arguments or "{}"))
+        except json.JSONDecodeError as e:
+            error = f"Invalid arguments for {name}: {e}"
+            outcomes[index] = {**base, "content": f"Error: {error}", "error": error}
+            continue
+        base["arguments"] = dict(args)
+        func = function_map[name]
+        if CONTEXT_VARIABLES_ARG in func.__code__.co_varnames:
+            args[CONTEXT_VARIABLES_ARG] = context_variables
+        calls.append({"index": index, "name": name, "func": func, "args": args, "base": base})
+
+    def execute(call):
+        raw = run_with_timeout(lambda: call["func"](**call["args"]), tool_timeout(call["func"]))
+        return raw, handle_result(raw)
+
+    for batch in plan_batches(calls):
+        if len(batch) == 1:
+            # Nothing to overlap with: run inline, still timed and bounded
+            results = run_concurrently(execute, batch, max_workers=1, name=batch[0]["name"])
+        else:
+            results = run_concurrently(execute, batch, max_workers=max_workers, name="agent tool")
+        for task in results:
+            call = task.item
+            if task.ok:
+                raw, result = task.result
+                outcome = {**call["base"], "content": result.value, "raw": raw, "result": result}
+                status = "ok"
+            else:
+                error = f"{call['name']} failed: {task.error}"
+                outcome = {**call["base"], "content": f"Error: {error}", "error": error}
+                status = "timeout" if isinstance(task.error, TimeoutError) else "error"
+            outcomes[call["index"]] = outcome
+            _record(session_id, {"tool": call["name"], "status": status,
+                                 "latency_ms": round(task.elapsed * 1000), "batch": len(batch)})
+    return outcomes
+
+
+def parallel_tool_calls(client, max_workers: int = AGENT_TOOL_WORKERS):
+    """
+    Make a Swarm client run the tool calls of each turn concurrently. Returns
+    the same client, whose run() (streaming or not) is otherwise unchanged.
+    """
+    sequential = client.handle_tool_calls
+
+    def handle_tool_calls(tool_calls, functions, context_variables, debug):
+        # An empty call list gives back an empty Response of the installed Swarm version
+        partial_response = sequential([], functions, context_variables, debug)
+        outcomes = run_tool_calls(tool_calls, functions, context_variables,
+                                  lambda raw: client.handle_function_result(raw, debug), max_workers)
+        session_id = context_variables.get("session_id")
+        if session_id:
+            with _session_logs_lock:
+                _pending_outcomes.setdefault(session_id, deque(maxlen=AGENT_TOOL_LOG_SIZE)).extend(outcomes)
+        for outcome in outcomes:
+            partial_response.messages.append({
+                "role": "tool",
+                "tool_call_id": outcome["tool_call_id"],
+                "tool_name": outcome["tool_name"],
+                "content": outcome["content"],
+            })
+            result = outcome["result"]
+            if result is not None:
+                partial_response.context_variables.update(result.context_variables)
+                if result.agent:
+                    partial_response.agent = result.agent
+        return partial_response
+
+    client.handle_tool_calls = handle_tool_calls
+    return client
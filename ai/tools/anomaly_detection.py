@@ -11,8 +11,11 @@ import json
 import numpy as np
 from .store_anomalies import store_anomaly_data, CustomJSONEncoder  # Import the store_anomalies module
 
+from .log_utils import IssueCounter, log_event, summarize
+
 # set logging level to INFO
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 def find_key(item, field_name):
     if field_name is None:
@@ -127,14 +130,13 @@ def generate_anomalies_summary(results):
     return {"anomalies": html_summary}
 
 def group_data_by_field_and_date(data_array, group_field, numeric_field, date_field, period_type='month', agg_function='sum'):
-    logging.info("=== Starting Data Grouping ===")
-    logging.info(f"First 5 records of raw data:")
-    for i, item in enumerate(data_array[:5]):
-        logging.info(f"Record {i + 1}:")
-        logging.info(f"  {group_field}: {item.get(group_field)}")
-        logging.info(f"  {date_field}: {item.get(date_field)} (type: {type(item.get(date_field))})")
-        logging.info(f"  {numeric_field}: {item.get(numeric_field)}")
-        logging.info("---")
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, item in enumerate(data_array[:5]):
+            logger.debug("Record %d: %s=%r, %s=%r (%s), %s=%r", i + 1, group_field, item.get(group_field),
+                         date_field, item.get(date_field), type(item.get(date_field)).__name__,
+                         numeric_field, item.get(numeric_field))
+
+    issues = IssueCounter(logger, "group_data_by_field_and_date")
 
     # Create a set to track all unique dates we see
     all_dates = set()
@@ -147,21 +149,21 @@ def group_data_by_field_and_date(data_array, group_field, numeric_field, date_fi
         date_obj = item.get(date_field)
         
         if not date_obj:
-            logging.warning(f"Missing date for record: {item}")
+            issues.add("missing_date", item)
             continue
 
         # Convert string dates to datetime objects
         if isinstance(date_obj, str):
             date_obj = custom_parse_date(date_obj, period_type)
             if not date_obj:
-                logging.warning(f"Could not parse date for record: {item}")
+                issues.add("unparseable_date", item)
                 continue
         elif isinstance(date_obj, pd.Timestamp):
             date_obj = date_obj.to_pydatetime().date()
         elif isinstance(date_obj, datetime.datetime):
             date_obj = date_obj.date()
         elif not isinstance(date_obj, datetime.date):
-            logging.warning(f"Unrecognized date type for record: {item}")
+            issues.add("unrecognized_date_type", item)
             continue
 
         # Use appropriate date format based on period_type
@@ -187,7 +189,7 @@ def group_data_by_field_and_date(data_array, group_field, numeric_field, date_fi
             numeric_str = str(item.get(numeric_field, '0')).replace(',', '')  # Remove any commas
             numeric_value = float(numeric_str)
         except (ValueError, TypeError):
-            logging.warning(f"Invalid numeric value for record: {item}")
+            issues.add("invalid_numeric_value", item)
             numeric_value = 0.0
             
         # Update the sum and count
@@ -208,12 +210,13 @@ def group_data_by_field_and_date(data_array, group_field, numeric_field, date_fi
             else:  # Default to sum
                 grouped[group_value][date_key] = values['sum']
 
-    logging.info(f"Using aggregation function: {agg_function}")
-    logging.info("=== Grouping Complete ===")
-    logging.info(f"Total groups found: {len(grouped)}")
-    logging.info(f"All unique dates found in data: {sorted(list(all_dates))}")
-    for key in list(grouped.keys())[:3]:  # Show first 3 groups
-        logging.info(f"Sample group '{key}' dates: {list(grouped[key].keys())}")
+    issues.flush(group_field=group_field, date_field=date_field, numeric_field=numeric_field)
+    log_event(logger, logging.INFO, "group_data_by_field_and_date", records=len(data_array), groups=len(grouped),
+              dates=len(all_dates), period_type=period_type, agg_function=agg_function)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("All unique dates found in data: %s", sorted(all_dates))
+        for key in list(grouped.keys())[:3]:  # Show first 3 groups
+            logger.debug("Sample group '%s' dates: %s", key, list(grouped[key].keys()))
 
     return grouped
 
@@ -316,13 +319,8 @@ def filter_data_by_date_and_conditions(data, filter_conditions, start_date=None,
         else:
             condition['is_date'] = False
 
-    # Add logging for date range parameters
-    logging.info(f"Date filtering parameters:")
-    logging.info(f"  start_date: {start_date} ({type(start_date)})")
-    logging.info(f"  end_date: {end_date} ({type(end_date)})")
-    logging.info(f"  date_field: {date_field}")
-    logging.info(f"  period_type: {period_type}")
-    logging.info(f"  filter_conditions: {filter_conditions}")
+    logger.debug("Date filtering parameters: start_date=%r end_date=%r date_field=%s period_type=%s filter_conditions=%s",
+                 start_date, end_date, date_field, period_type, summarize(filter_conditions))
 
     filtered_data = []
     for idx, item in enumerate(data):
@@ -548,33 +546,14 @@ def filter_data_by_date_and_conditions(data, filter_conditions, start_date=None,
         if meets_conditions:
             filtered_data.append(item)
 
-    # Add summary of date filtering
-    if date_field and start_date and end_date:
-        logging.info(f"Date filtering summary:")
-        logging.info(f"  Total records before date filtering: {len(data)}")
-        logging.info(f"  Records passing date filter: {len(filtered_data)}")
-        logging.info(f"  Records filtered out by date: {len(data) - len(filtered_data)}")
-
-    # Log error summary
-    total_records = len(data)
-    filtered_records = len(filtered_data)
-    invalid_records = total_records - filtered_records
-    logging.info(f"Total records processed: {total_records}")
-    logging.info(f"Total records after filtering: {filtered_records}")
-    logging.info(f"Total invalid records: {invalid_records}")
-    
-    # Log error counts
-    if sum(error_counts.values()) > 0:
-        logging.info("Error count summary:")
-        for error_type, count in error_counts.items():
-            if count > 0:
-                logging.info(f"  {error_type}: {count}")
-        
-        # Log sample errors if there are any
-        if error_counts['non_numeric_comparison'] > 0:
-            logging.info("Sample non-numeric comparison errors may be caused by:")
-            for condition in filter_conditions:
-                logging.info(f"  Condition: {condition['field']} {condition['operator']} {condition['value']}")
+    # One summary line instead of a line per counter
+    error_counts = {error_type: count for error_type, count in error_counts.items() if count}
+    log_event(logger, logging.INFO, "filter_data_by_date_and_conditions", records=len(data),
+              kept=len(filtered_data), dropped=len(data) - len(filtered_data), date_field=date_field,
+              date_filtered=bool(date_field and start_date and end_date), errors=error_counts)
+    if error_counts.get('non_numeric_comparison') and logger.isEnabledFor(logging.INFO):
+        logger.info("Non-numeric comparisons may be caused by conditions: %s",
+                    [f"{c['field']} {c['operator']} {c['value']}" for c in filter_conditions])
 
     return filtered_data
 
@@ -586,7 +565,7 @@ def get_month_range(start_date, end_date):
         # Only use YYYY-MM format consistently
         months.append(current_date.strftime("%Y-%m"))
         current_date += relativedelta(months=1)
-    logging.info(f"Generated month range: {months}")
+    logger.info(f"Generated month range: {months}")
     return months
 
 def parse_period_date(date_val):
@@ -681,7 +660,7 @@ def anomaly_detection(
     
     data = context_variables.get("dataset")
     if data is None:
-        logging.error("Dataset is not available.")
+        logger.error("Dataset is not available.")
         return {"error": "Dataset is not available."}
 
     data_records = data.to_dict('records')
@@ -939,6 +918,6 @@ def anomaly_detection(
                 db_password=db_password
             )
         except Exception as e:
-            logging.error(f"Error storing anomalies in database: {e}")
+            logger.error(f"Error storing anomalies in database: {e}")
     
     return {"anomalies":html_content, "anomalies_markdown":markdown_content}
\ No newline at end of file
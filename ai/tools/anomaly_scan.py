@@ -0,0 +1,519 @@
+"""
+Fleet-wide anomaly scan over the stored time series.
+
+Anomaly detection used to run only inline, one chart at a time, while a
+dataset was being fetched (periodic_analysis, generate_dashboard_metrics).
+Re-scoring the stored history after a threshold change meant fetching every
+dataset again.
+
+Here every active grouped series in time_series_data is loaded with one
+aggregate query into a NaN-padded matrix (series x periods) covering the
+comparison and recent windows. The rule of tools.anomaly_detection is then
+applied to all series at once:
+
+- a series is zero-filled from its first data point on (points before the
+  window count as a start), and is missing (NaN) before it
+- comparison/recent means and the comparison population std dev come from
+  the filled values in each window
+- a series is scored when both windows have values and the comparison std
+  dev is positive; the detector decides which scored series are out of bounds
+
+The loaded matrix is kept per period type and reused until the time series
+tables change, so re-scoring with another threshold or detector only redoes
+the array math and the write. Results are written in bulk to the anomalies
+table through tools.store_anomalies.write_anomaly_rows, which leaves
+unchanged rows alone. Each chart is mapped onto the series identity the
+inline detector uses (anomaly_identity), so a scan replaces the inline rows
+of a series rather than adding a second active set.
+
+    python -m tools.anomaly_scan --period-type month --min-diff 2.5
+"""
+
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+import datetime
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+
+from tools.db_utils import get_postgres_connection
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_SCAN_MIN_DIFF = float(os.getenv("ANOMALY_SCAN_MIN_DIFF", "2"))
+# Both means must exceed this for a series to be out of bounds, as inline
+ANOMALY_SCAN_MIN_MEAN = float(os.getenv("ANOMALY_SCAN_MIN_MEAN", "2"))
+
+PERIOD_TYPES = ("month", "year", "day")
+
+
+def time_ranges(period_type: str, today: Optional[datetime.date] = None) -> Tuple[Dict, Dict]:
+    """
+    Calculate recent and comparison periods based on period type.
+
+    Args:
+        period_type (str): One of 'year', 'month', 'day', or 'ytd'
+        today: Reference date (defaults to today)
+
+    Returns:
+        tuple: (recent_period, comparison_period) each containing start and end dates
+    """
+    today = today or datetime.date.today()
+
+    if period_type == 'ytd':
+        # Current year from Jan 1 to yesterday
+        recent_period = {
+            'start': datetime.date(today.year, 1, 1),
+            'end': today - datetime.timedelta(days=1)
+        }
+        # Same days last year
+        comparison_period = {
+            'start': datetime.date(today.year - 1, 1, 1),
+            'end': datetime.date(today.year - 1, today.month, today.day) - datetime.timedelta(days=1)
+        }
+    elif period_type == 'year':
+        # Last complete year
+        last_year = today.year - 1
+        recent_period = {
+            'start': datetime.date(last_year, 1, 1),
+            'end': datetime.date(last_year, 12, 31)
+        }
+        comparison_period = {
+            'start': datetime.date(last_year - 10, 1, 1),
+            'end': datetime.date(last_year - 1, 12, 31)
+        }
+    elif period_type == 'month':
+        # For monthly analysis, always use the previous month as it's complete
+        last_complete_month = today.replace(day=1) - datetime.timedelta(days=1)
+        last_complete_month = last_complete_month.replace(day=1)  # First day of the month
+
+        recent_period = {
+            'start': last_complete_month,
+            'end': (last_complete_month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+        }
+
+        # Calculate start of comparison (24 months before)
+        comparison_start = last_complete_month - datetime.timedelta(days=730)  # Roughly 24 months
+        comparison_start = comparison_start.replace(day=1)  # First day of that month
+
+        comparison_period = {
+            'start': comparison_start,
+            'end': last_complete_month - datetime.timedelta(days=1)
+        }
+    else:  # day
+        # Last complete day
+        yesterday = today - datetime.timedelta(days=1)
+        recent_period = {
+            'start': yesterday,
+            'end': yesterday
+        }
+        comparison_period = {
+            'start': yesterday - datetime.timedelta(days=28),
+            'end': yesterday - datetime.timedelta(days=1)
+        }
+
+    return recent_period, comparison_period
+
+
+def period_starts(start: datetime.date, end: datetime.date, period_type: str) -> List[datetime.date]:
+    """First day of every period from the one containing start to the one containing end."""
+    if period_type == 'year':
+        return [datetime.date(year, 1, 1) for year in range(start.year, end.year + 1)]
+    if period_type == 'month':
+        starts, current = [], start.replace(day=1)
+        while current <= end:
+            starts.append(current)
+            current = (current + datetime.timedelta(days=32)).replace(day=1)
+        return starts
+    return [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def period_label(period: datetime.date, period_type: str) -> str:
+    """The date string anomaly results use: YYYY, YYYY-MM or YYYY-MM-DD."""
+    if period_type == 'year':
+        return str(period.year)
+    if period_type == 'month':
+        return period.strftime("%Y-%m")
+    return period.isoformat()
+
+
+class SeriesMatrix:
+    """
+    Stored time series of one period type as a (series x periods) matrix.
+
+    Attributes:
+        values: float matrix, NaN where a series has no data point
+        started_before: per series, True if it has data before the first period
+        series: (chart_id, group_value) per row
+        charts: chart_id -> anomaly metadata of the chart
+        periods: first day of each column
+        recent, comparison: boolean column masks of the two windows
+        version: state of the time series tables when loaded
+    """
+
+    def __init__(self, period_type: str, periods: List[datetime.date], recent_period: Dict, comparison_period: Dict,
+                 series: List[Tuple[int, str]], values: np.ndarray, started_before: np.ndarray,
+                 charts: Dict[int, Dict[str, Any]], version: Any = None):
+        self.period_type = period_type
+        self.periods = periods
+        self.recent_period = recent_period
+        self.comparison_period = comparison_period
+        self.series = series
+        self.values = values
+        self.started_before = started_before
+        self.charts = charts
+        self.version = version
+        self.loaded_at = time.time()
+        columns = np.array(periods, dtype="datetime64[D]")
+        self.recent = ((columns >= np.datetime64(recent_period['start']))
+                       & (columns <= np.datetime64(recent_period['end'])))
+        self.comparison = ((columns >= np.datetime64(comparison_period['start']))
+                           & (columns <= np.datetime64(comparison_period['end'])))
+
+    @classmethod
+    def from_rows(cls, period_type: str, rows, recent_period: Dict, comparison_period: Dict,
+                  charts: Dict[int, Dict[str, Any]], started_before=(), version: Any = None) -> "SeriesMatrix":
+        """
+        Build the matrix from (chart_id, group_value, period start, value) rows;
+        rows outside the windows are ignored.
+        """
+        periods = period_starts(comparison_period['start'], recent_period['end'], period_type)
+        column_of = {period: index for index, period in enumerate(periods)}
+        row_of: Dict[Tuple[int, str], int] = {}
+        rows_index, columns_index, points = [], [], []
+        for chart_id, group_value, period, value in rows:
+            column = column_of.get(period)
+            if column is None or value is None:
+                continue
+            rows_index.append(row_of.setdefault((chart_id, str(group_value)), len(row_of)))
+            columns_index.append(column)
+            points.append(value)
+        values = np.full((len(row_of), len(periods)), np.nan)
+        index = (np.array(rows_index, dtype=int), np.array(columns_index, dtype=int))
+        # Duplicate (series, period) rows add up, like the SUM of the load query
+        values[index] = 0
+        np.add.at(values, index, np.array(points, dtype=float))
+        series = list(row_of)
+        started = set((chart_id, str(group_value)) for chart_id, group_value in started_before)
+        return cls(period_type, periods, recent_period, comparison_period, series, values,
+                   np.array([key in started for key in series], dtype=bool), charts, version)
+
+    def filled(self) -> np.ndarray:
+        """Values zero-filled from each series' first data point on, NaN before it."""
+        present = ~np.isnan(self.values)
+        started = np.logical_or.accumulate(present, axis=1) | self.started_before[:, None]
+        return np.where(started, np.nan_to_num(self.values), np.nan)
+
+
+def window_stats(filled: np.ndarray, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per series count, mean and population std dev of the filled values in the masked columns."""
+    window = filled[:, mask]
+    counts = (~np.isnan(window)).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.nansum(window, axis=1) / counts
+        stds = np.sqrt(np.nansum((window - means[:, None]) ** 2, axis=1) / counts)
+    return counts, means, stds
+
+
+# name -> function(scores, **params) returning the out-of-bounds mask
+DETECTORS: Dict[str, Callable[..., np.ndarray]] = {}
+
+
+def register_detector(name: str):
+    """Register a detector: a function of the score arrays (and keyword parameters) returning a boolean mask."""
+    def decorator(func):
+        DETECTORS[name] = func
+        return func
+    return decorator
+
+
+@register_detector("stddev")
+def stddev_detector(scores: Dict[str, np.ndarray], min_diff: float = ANOMALY_SCAN_MIN_DIFF,
+                    min_mean: float = ANOMALY_SCAN_MIN_MEAN) -> np.ndarray:
+    """The inline rule: more than min_diff comparison std devs away, with both means above min_mean."""
+    return ((np.abs(scores["difference"]) > scores["std_dev"] * float(min_diff))
+            & (scores["comparison_mean"] > float(min_mean))
+            & (scores["recent_mean"] > float(min_mean)))
+
+
+def score(matrix: SeriesMatrix, detector: str = "stddev", **params) -> Dict[str, np.ndarray]:
+    """
+    Score every series of the matrix.
+
+    Returns:
+        dict of per-series arrays: comparison_mean, recent_mean, difference,
+        std_dev, scored (both windows present and std dev > 0) and out_of_bounds
+    """
+    if detector not in DETECTORS:
+        raise ValueError(f"Unknown detector {detector!r}; available: {', '.join(sorted(DETECTORS))}")
+    filled = matrix.filled()
+    comparison_count, comparison_mean, std_dev = window_stats(filled, matrix.comparison)
+    recent_count, recent_mean, _ = window_stats(filled, matrix.recent)
+    scores = {
+        "comparison_mean": comparison_mean,
+        "recent_mean": recent_mean,
+        "difference": recent_mean - comparison_mean,
+        "std_dev": std_dev,
+        "scored": (comparison_count > 0) & (recent_count > 0) & (np.nan_to_num(std_dev) > 0),
+    }
+    with np.errstate(invalid="ignore"):
+        scores["out_of_bounds"] = DETECTORS[detector](scores, **params) & scores["scored"]
+    return scores
+
+
+def chart_results(matrix: SeriesMatrix, scores: Dict[str, np.ndarray]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Anomaly results per chart, shaped like tools.anomaly_detection's (largest
+    |difference| first). Every chart of the matrix is present, possibly with
+    no scored groups.
+    """
+    filled = matrix.filled()
+    labels = [period_label(period, matrix.period_type) for period in matrix.periods]
+    results: Dict[int, List[Dict[str, Any]]] = {chart_id: [] for chart_id in matrix.charts}
+    for row in np.flatnonzero(scores["scored"]):
+        chart_id, group_value = matrix.series[row]
+        present = ~np.isnan(filled[row])
+        results.setdefault(chart_id, []).append({
+            'group_value': group_value,
+            'comparison_mean': float(scores["comparison_mean"][row]),
+            'recent_mean': float(scores["recent_mean"][row]),
+            'difference': float(scores["difference"][row]),
+            'stdDev': float(scores["std_dev"][row]),
+            'dates': [label for label, keep in zip(labels, present) if keep],
+            'counts': [float(value) for value in filled[row][present]],
+            'out_of_bounds': bool(scores["out_of_bounds"][row]),
+        })
+    for chart_results_list in results.values():
+        chart_results_list.sort(key=lambda result: abs(result['difference']), reverse=True)
+    return results
+
+
+# --- Loading -----------------------------------------------------------------
+
+# Active grouped charts of a period type, the latest per anomaly series. store_time_series
+# fills only some columns; the rest of what the scan needs is in the metadata JSON.
+CHARTS_SQL = """
+    SELECT DISTINCT ON (object_type, object_id, object_name, group_field, district)
+        chart_id, object_type, object_id, object_name,
+        COALESCE(NULLIF(field_name, 'unknown'),
+                 CASE jsonb_typeof(metadata->'numeric_fields')
+                     WHEN 'array' THEN metadata->'numeric_fields'->>0
+                     WHEN 'string' THEN metadata->>'numeric_fields' END,
+                 field_name),
+        COALESCE(y_axis_label, metadata->>'y_axis_label'),
+        COALESCE(chart_title, metadata->>'chart_title'),
+        group_field, COALESCE(filter_conditions, metadata->'filter_conditions'), district, executed_query_url
+    FROM time_series_metadata
+    WHERE is_active = TRUE AND period_type = %(period_type)s
+      AND group_field IS NOT NULL AND group_field <> ''
+    ORDER BY object_type, object_id, object_name, group_field, district, chart_id DESC
+"""
+
+# Stored chart object_type -> object_type the inline detector stores anomalies of that series under
+ANOMALY_OBJECT_TYPES = {'dashboard_metric_category': 'dashboard_metric'}
+
+
+def anomaly_identity(object_type, object_name, chart_title) -> Tuple[str, str]:
+    """
+    The (object_type, object_name) inline anomalies of a chart's series are
+    stored under, so scan results replace those rows instead of adding a
+    parallel set. generate_metric_analysis names category charts
+    "<base name> by <field>" and anomalies after the query, which leads the
+    chart title ("<query> <br> <value> by <period> by <field>").
+    """
+    if object_type not in ANOMALY_OBJECT_TYPES:
+        return object_type, object_name
+    query_name = (chart_title or '').split('<br>')[0].strip()
+    return ANOMALY_OBJECT_TYPES[object_type], query_name or object_name
+
+
+def _chart_metadata(row, period_type, recent_period, comparison_period) -> Dict[str, Any]:
+    (chart_id, object_type, object_id, object_name, field_name, y_axis_label, chart_title, group_field,
+     filter_conditions, district, executed_query_url) = row
+    if isinstance(filter_conditions, str):
+        try:
+            filter_conditions = json.loads(filter_conditions)
+        except ValueError:
+            filter_conditions = []
+    object_name = object_name or chart_title or f"{field_name} by {group_field}"
+    anomaly_object_type, anomaly_object_name = anomaly_identity(object_type, object_name, chart_title)
+    metadata = {
+        'recent_period': recent_period,
+        'comparison_period': comparison_period,
+        'group_field': group_field,
+        'y_axis_label': y_axis_label or field_name or 'Value',
+        'title': chart_title or object_name,
+        'filter_conditions': filter_conditions if isinstance(filter_conditions, list) else [],
+        'numeric_field': field_name,
+        'period_type': period_type,
+        'object_type': anomaly_object_type,
+        'object_id': object_id,
+        'object_name': anomaly_object_name,
+        'district': district,
+        'chart_id': chart_id,
+    }
+    if executed_query_url:
+        metadata['executed_query_url'] = executed_query_url
+    return metadata
+
+
+def series_version(connection) -> Tuple:
+    """Changes to this value mean the stored time series changed and a loaded matrix is stale."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*), max(chart_id) FROM time_series_metadata WHERE is_active = TRUE")
+        charts = tuple(cursor.fetchone())
+        cursor.execute("SELECT to_regclass('time_series_changes') IS NOT NULL")
+        changes = None
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT max(id) FROM time_series_changes")
+            changes = cursor.fetchone()[0]
+    return charts + (changes,)
+
+
+def load_series_matrix(connection, period_type: str = "month", today: Optional[datetime.date] = None) -> SeriesMatrix:
+    """Load every active grouped series of a period type over its comparison and recent windows."""
+    if period_type not in PERIOD_TYPES:
+        raise ValueError(f"period_type must be one of {', '.join(PERIOD_TYPES)}")
+    recent_period, comparison_period = time_ranges(period_type, today)
+    version = series_version(connection)
+    params = {"period_type": period_type, "start": comparison_period['start'], "end": recent_period['end']}
+    with connection.cursor() as cursor:
+        cursor.execute(CHARTS_SQL, params)
+        charts = {row[0]: _chart_metadata(row, period_type, recent_period, comparison_period)
+                  for row in cursor.fetchall()}
+        params["chart_ids"] = list(charts)
+        cursor.execute("""
+            SELECT chart_id, group_value, date_trunc(%(period_type)s, time_period)::date, SUM(numeric_value)
+            FROM time_series_data
+            WHERE chart_id = ANY(%(chart_ids)s) AND group_value IS NOT NULL
+              AND time_period BETWEEN %(start)s AND %(end)s
+            GROUP BY 1, 2, 3
+        """, params)
+        rows = cursor.fetchall()
+        # Series with history before the window are zero-filled from its first period
+        cursor.execute("""
+            SELECT DISTINCT chart_id, group_value FROM time_series_data
+            WHERE chart_id = ANY(%(chart_ids)s) AND group_value IS NOT NULL AND time_period < %(start)s
+        """, params)
+        started_before = cursor.fetchall()
+    return SeriesMatrix.from_rows(period_type, rows, recent_period, comparison_period, charts,
+                                  started_before=started_before, version=version)
+
+
+_matrices: Dict[str, SeriesMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def get_series_matrix(connection, period_type: str = "month", refresh: bool = False,
+                      today: Optional[datetime.date] = None) -> Tuple[SeriesMatrix, bool]:
+    """
+    The loaded matrix of a period type, reloaded only when the time series
+    tables or the windows changed. Returns (matrix, reloaded).
+    """
+    with _matrices_lock:
+        matrix = _matrices.get(period_type)
+        windows = time_ranges(period_type, today)
+        if (not refresh and matrix is not None
+                and (matrix.recent_period, matrix.comparison_period) == windows
+                and matrix.version == series_version(connection)):
+            return matrix, False
+        matrix = load_series_matrix(connection, period_type, today)
+        _matrices[period_type] = matrix
+        return matrix, True
+
+
+# --- Scan --------------------------------------------------------------------
+
+def run_anomaly_scan(period_type: str = "month", detector: str = "stddev", params: Optional[Dict[str, Any]] = None,
+                     write: bool = True, refresh: bool = False, connection=None,
+                     today: Optional[datetime.date] = None) -> Dict[str, Any]:
+    """
+    Score every stored series of a period type and (unless write is False)
+    store the results in the anomalies table.
+
+    Args:
+        period_type: 'month', 'year' or 'day'
+        detector: Name of a registered detector
+        params: Keyword parameters of the detector (e.g. {"min_diff": 2.5})
+        write: Write the results to the anomalies table
+        refresh: Reload the series even if the loaded matrix is current
+        connection: PostgreSQL connection (one is opened and closed otherwise)
+
+    Returns:
+        dict: counts and timings of the scan, with the write counts if written
+    """
+    from tools.store_anomalies import create_anomalies_table, anomaly_series, anomaly_rows, write_anomaly_rows
+
+    own_connection = connection is None
+    connection = connection or get_postgres_connection()
+    if connection is None:
+        raise RuntimeError("PostgreSQL is not reachable")
+    try:
+        started = time.perf_counter()
+        matrix, reloaded = get_series_matrix(connection, period_type, refresh=refresh, today=today)
+        loaded = time.perf_counter()
+        scores = score(matrix, detector, **(params or {}))
+        results = chart_results(matrix, scores)
+        scored = time.perf_counter()
+        summary = {
+            "period_type": period_type,
+            "detector": detector,
+            "params": params or {},
+            "charts": len(matrix.charts),
+            "series": len(matrix.series),
+            "periods": len(matrix.periods),
+            "scored": int(scores["scored"].sum()),
+            "out_of_bounds": int(scores["out_of_bounds"].sum()),
+            "reloaded": reloaded,
+            "load_seconds": round(loaded - started, 3),
+            "score_seconds": round(scored - loaded, 3),
+        }
+        if write:
+            if not create_anomalies_table(connection):
+                raise RuntimeError("Cannot store anomalies - table does not exist")
+            batches = []
+            for chart_id, chart_results_list in results.items():
+                metadata = matrix.charts[chart_id]
+                series = anomaly_series(metadata)
+                batches.append((series, anomaly_rows(chart_results_list, metadata, series)))
+            try:
+                summary.update(write_anomaly_rows(connection, batches))
+            except Exception:
+                connection.rollback()
+                raise
+            summary["write_seconds"] = round(time.perf_counter() - scored, 3)
+        logger.info(f"Anomaly scan: {summary}")
+        return summary
+    finally:
+        if own_connection:
+            connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score every stored time series for anomalies")
+    parser.add_argument("--period-type", default="month", choices=PERIOD_TYPES)
+    parser.add_argument("--detector", default="stddev")
+    parser.add_argument("--min-diff", type=float, default=None, help="Std devs a recent mean must move (stddev detector)")
+    parser.add_argument("--min-mean", type=float, default=None, help="Smallest mean that can be out of bounds")
+    parser.add_argument("--dry-run", action="store_true", help="Score without writing to the anomalies table")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    params = {name: value for name, value in (("min_diff", args.min_diff), ("min_mean", args.min_mean))
+              if value is not None}
+    summary = run_anomaly_scan(args.period_type, args.detector, params, write=not args.dry_run)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Index-backed anomaly search.
+
+The anomaly searches (store_anomalies.get_anomalies, the chat tool
+query_anomalies_db and the analyzer's object_id search) filter by substring
+on group_value and the metric name, by district and object_id, and almost
+always by is_active AND out_of_bounds. This module builds those queries so
+the planner can use indexes as history grows:
+
+- group_value and object_name substring filters use ILIKE on plain columns
+  backed by pg_trgm GIN indexes (the metric name used to be read out of the
+  metadata JSON, which no index covers; object_name is now the source and
+  is backfilled from metadata for older rows).
+- district and object_id are compared without casts, with the value bound
+  in the column's actual type (district is INTEGER in tables created by
+  store_anomalies and TEXT in ones created by init_postgres_db), so their
+  B-tree indexes apply.
+- A partial index on created_at WHERE is_active AND out_of_bounds serves
+  the default "recent active anomalies" search.
+
+ensure_anomaly_search_indexes() is a migration run from init_postgres_db:
+it backfills object_name in batches and builds the indexes concurrently, so
+writers are not blocked. Searches never run DDL; until the migration has
+run (see migrated()) the metric name is matched as before, on
+metadata->>'object_name' where object_name is not set.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEARCH_COLUMNS = (
+    "id, group_field_name, group_value, comparison_mean, recent_mean, difference, std_dev, "
+    "out_of_bounds, created_at, metadata, district, object_id, period_type, is_active"
+)
+
+ORDER_BY = {
+    "recent": "created_at DESC",
+    "by_group": "group_value ASC, created_at DESC",
+    "by_date": "created_at ASC",
+    "by_anomaly_severity": "ABS(difference) DESC",
+    "by_district": "district ASC, created_at DESC",
+}
+
+INTEGER_TYPES = ("integer", "bigint", "smallint")
+BACKFILL_BATCH_ROWS = 10000
+# Built last by the migration, so its presence means object_name is backfilled
+MIGRATION_MARKER_INDEX = "anomalies_active_oob_created_idx"
+
+_migrated = False
+_column_types: Dict[str, str] = {}
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def ensure_anomaly_search_indexes(connection) -> Dict[str, Any]:
+    """
+    Backfill object_name and create the search indexes. Idempotent; meant for
+    init_postgres_db or a migration run, not the request path.
+
+    Returns:
+        dict: {"trigram": bool, "backfilled": int}
+    """
+    global _migrated
+    autocommit = connection.autocommit
+    connection.autocommit = True
+    cursor = connection.cursor()
+    try:
+        trigram = True
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except Exception as e:
+            # Needs CREATE privilege on the database; searches still work, just without trigram indexes
+            trigram = False
+            logger.warning(f"pg_trgm unavailable, substring searches will not be indexed: {e}")
+
+        # In short batches, each its own transaction, so rows are never locked for long.
+        # A JSON null name would stay NULL after the update and be picked again forever.
+        backfilled = 0
+        while True:
+            cursor.execute("""
+                UPDATE anomalies SET object_name = metadata->>'object_name'
+                WHERE id IN (
+                    SELECT id FROM anomalies
+                    WHERE object_name IS NULL AND metadata ? 'object_name'
+                      AND metadata->>'object_name' IS NOT NULL
+                    LIMIT %s
+                )
+            """, (BACKFILL_BATCH_ROWS,))
+            backfilled += cursor.rowcount
+            if cursor.rowcount < BACKFILL_BATCH_ROWS:
+                break
+
+        indexes = [
+            ("anomalies_object_id_period_idx", "ON anomalies (object_id, period_type)"),
+            ("anomalies_district_idx", "ON anomalies (district)"),
+        ]
+        if trigram:
+            indexes += [
+                ("anomalies_group_value_trgm_idx", "ON anomalies USING gin (group_value gin_trgm_ops)"),
+                ("anomalies_object_name_trgm_idx", "ON anomalies USING gin (object_name gin_trgm_ops)"),
+            ]
+        indexes.append((MIGRATION_MARKER_INDEX, "ON anomalies (created_at DESC) WHERE is_active AND out_of_bounds"))
+        for name, definition in indexes:
+            if _index_valid(cursor, name) is False:
+                # Left behind by an interrupted concurrent build
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+    finally:
+        cursor.close()
+        connection.autocommit = autocommit
+
+    _column_types.clear()
+    _migrated = True
+    if backfilled:
+        logger.info(f"Backfilled object_name on {backfilled} anomalies")
+    return {"trigram": trigram, "backfilled": backfilled}
+
+
+def _index_valid(cursor, name: str) -> Optional[bool]:
+    """True or False for an existing index (False while a concurrent build is unfinished), None if missing."""
+    cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    row = cursor.fetchone()
+    return None if row is None else bool(row[0])
+
+
+def migrated(connection) -> bool:
+    """Whether ensure_anomaly_search_indexes has run on this database (a catalog lookup until it has)."""
+    global _migrated
+    if not _migrated:
+        cursor = connection.cursor()
+        _migrated = bool(_index_valid(cursor, MIGRATION_MARKER_INDEX))
+        cursor.close()
+    return _migrated
+
+
+def anomaly_column_types(connection) -> Dict[str, str]:
+    """Data types of the anomalies columns that are compared by value (cached per process)."""
+    if not _column_types:
+        cursor = connection.cursor()
+        # The table the unqualified name resolves to, whichever schema that is
+        cursor.execute("""
+            SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = to_regclass('anomalies') AND attname IN ('district', 'object_id')
+        """)
+        _column_types.update({name: data_type for name, data_type in cursor.fetchall()})
+        cursor.close()
+    return dict(_column_types)
+
+
+def typed_value(data_type: Optional[str], value):
+    """
+    The value in the column's type so the comparison needs no cast. Returns
+    None if it cannot match (e.g. district 'citywide' on an INTEGER column).
+    """
+    if data_type in INTEGER_TYPES:
+        try:
+            return int(str(value).strip())
+        except ValueError:
+            return None
+    return str(value)
+
+
+def build_anomaly_search(query_type: str = "recent", limit: int = 30, group_filter=None, date_start=None,
+                         date_end=None, only_anomalies: bool = True, metric_name=None, district=None,
+                         object_id=None, period_type=None, only_active: bool = True,
+                         column_types: Optional[Dict[str, str]] = None,
+                         columns: str = SEARCH_COLUMNS, backfilled: bool = True) -> Tuple[str, List[Any]]:
+    """
+    Build the anomaly search query. With backfilled False, rows without
+    object_name are matched on the metric name in their metadata.
+
+    Returns:
+        tuple: (sql, params)
+    """
+    column_types = column_types or {}
+    conditions = []
+    params: List[Any] = []
+
+    if only_active:
+        conditions.append("is_active")
+    if only_anomalies:
+        conditions.append("out_of_bounds")
+    if group_filter:
+        conditions.append("group_value ILIKE %s")
+        params.append(f"%{_escape_like(str(group_filter))}%")
+    if date_start:
+        conditions.append("created_at >= %s")
+        params.append(date_start)
+    if date_end:
+        conditions.append("created_at <= %s")
+        params.append(date_end)
+    if metric_name:
+        conditions.append("object_name ILIKE %s" if backfilled
+                          else "COALESCE(object_name, metadata->>'object_name') ILIKE %s")
+        params.append(f"%{_escape_like(str(metric_name))}%")
+    for column, value in (("district", district), ("object_id", object_id)):
+        if value is None or value == "":
+            continue
+        bound = typed_value(column_types.get(column), value)
+        if bound is None:
+            conditions.append("FALSE")
+        else:
+            conditions.append(f"{column} = %s")
+            params.append(bound)
+    if period_type:
+        conditions.append("period_type = %s")
+        params.append(period_type)
+
+    sql = f"SELECT {columns} FROM anomalies"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if query_type in ORDER_BY:
+        sql += f" ORDER BY {ORDER_BY[query_type]}"
+    sql += " LIMIT %s"
+    params.append(limit)
+    return sql, params
+
+
+def search_anomalies(connection, cursor_factory=None, **filters) -> List[Dict[str, Any]]:
+    """Run build_anomaly_search with the column types of this database."""
+    sql, params = build_anomaly_search(column_types=anomaly_column_types(connection),
+                                       backfilled=migrated(connection), **filters)
+    cursor = connection.cursor(cursor_factory=cursor_factory) if cursor_factory else connection.cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
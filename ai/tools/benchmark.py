@@ -0,0 +1,313 @@
+"""
+End-to-end benchmarks of the data pipelines, offline.
+
+Each pipeline runs in a fresh spawned process inside a tools.replay cassette,
+so data.sfgov.org, OpenAI/Swarm, Qdrant and Datawrapper are answered from
+recordings (PostgreSQL is the local database). Per run it reports:
+
+- wall time, CPU time (user + system, all threads) and peak RSS of the
+  process, with the RSS after imports for reference
+- a per-stage breakdown: inclusive wall time and call count of the main
+  functions of the pipeline, timed by wrapping them for the run
+- per-host HTTP counts and time (replayed, recorded or missed)
+
+Record the cassettes once with network access, then benchmark anywhere:
+
+    python -m tools.benchmark ytd periodic monthly --mode record
+    python -m tools.benchmark ytd --repeat 3 --latency recorded --output ytd.json
+
+Pipelines write their files to a temporary output directory, never to
+output/. The monthly pipeline still writes its rows to the reports and
+monthly_reporting tables of the local database and its prompt log to logs/,
+so benchmark it against a scratch database.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import importlib
+import statistics
+import multiprocessing
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+
+from tools.replay import use_cassette
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """Inclusive wall time and call counts of wrapped functions, across threads."""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+        self._lock = threading.Lock()
+        self._patched: List[Tuple[Any, str, Any]] = []
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name]["calls"] += 1
+            self.stages[name]["seconds"] += seconds
+
+    def wrap(self, module_name: str, attr: str, name: Optional[str] = None):
+        """Time module.attr under name until restore(); callers must look it up through the module."""
+        module = importlib.import_module(module_name)
+        original = getattr(module, attr)
+        stage = name or attr
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+
+        timed.__wrapped__ = original
+        setattr(module, attr, timed)
+        self._patched.append((module, attr, original))
+
+    def restore(self):
+        while self._patched:
+            module, attr, original = self._patched.pop()
+            setattr(module, attr, original)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: {"calls": int(v["calls"]), "seconds": round(v["seconds"], 3)}
+                    for name, v in sorted(self.stages.items(), key=lambda item: -item[1]["seconds"])}
+
+
+class Pipeline:
+    """
+    A benchmarkable pipeline.
+
+    Args:
+        name: Also the cassette name
+        run: Function (options, output_dir) performing one run
+        stages: (module, function) pairs to time
+    """
+
+    def __init__(self, name: str, run: Callable[[Dict[str, Any], str], Any], stages: List[Tuple[str, str]]):
+        self.name = name
+        self.run = run
+        self.stages = stages
+
+
+def _load_queries(limit: Optional[int]) -> Dict[str, Any]:
+    with open(os.path.join(AI_DIR, "data", "dashboard", "dashboard_queries_enhanced.json"), encoding="utf-8") as f:
+        queries = json.load(f)
+    if not limit:
+        return queries
+    # Keep the first `limit` metrics, in file order, with their category structure
+    limited, remaining = {}, limit
+    for category, subcategories in queries.items():
+        for subcategory, data in subcategories.items():
+            if remaining <= 0 or not isinstance(data, dict) or "queries" not in data:
+                continue
+            picked = dict(list(data["queries"].items())[:remaining])
+            remaining -= len(picked)
+            limited.setdefault(category, {})[subcategory] = {**data, "queries": picked}
+    return limited
+
+
+def _run_ytd(options, output_dir):
+    from generate_dashboard_metrics import generate_ytd_metrics
+    return generate_ytd_metrics(_load_queries(options.get("limit")), output_dir)
+
+
+def _run_periodic(options, output_dir):
+    from periodic_analysis import export_for_endpoint
+    return export_for_endpoint(options.get("endpoint") or "wg3w-h783", period_type=options.get("period_type", "month"),
+                               output_folder=output_dir,
+                               log_file_path=os.path.join(output_dir, "processing_log.txt"))
+
+
+def _run_monthly(options, output_dir):
+    from pathlib import Path
+    import monthly_report
+    # Each run is a spawned process of its own, so the redirect does not outlive it
+    monthly_report.OUTPUT_DIR = Path(output_dir)
+    return monthly_report.run_monthly_report_process(district=options.get("district", "0"),
+                                                     period_type=options.get("period_type", "month"),
+                                                     max_report_items=options.get("limit") or 10)
+
+
+PIPELINES: Dict[str, Pipeline] = {
+    "ytd": Pipeline("ytd", _run_ytd, [
+        ("generate_dashboard_metrics", "process_ytd_metric"),
+        ("generate_dashboard_metrics", "load_daily_series"),
+        ("generate_dashboard_metrics", "refresh_metric_cube"),
+        ("tools.data_fetcher", "fetch_data_from_api"),
+    ]),
+    "periodic": Pipeline("periodic", _run_periodic, [
+        ("periodic_analysis", "process_entry"),
+        ("periodic_analysis", "set_dataset"),
+        ("periodic_analysis", "generate_time_series_chart"),
+        ("periodic_analysis", "anomaly_detection"),
+        ("tools.data_fetcher", "fetch_data_from_api"),
+    ]),
+    "monthly": Pipeline("monthly", _run_monthly, [
+        ("monthly_report", "initialize_monthly_reporting_table"),
+        ("monthly_report", "select_deltas_to_discuss"),
+        ("monthly_report", "prioritize_deltas"),
+        ("monthly_report", "store_prioritized_items"),
+        ("monthly_report", "generate_explanations"),
+        ("monthly_report", "generate_monthly_report"),
+        ("monthly_report", "proofread_and_revise_report"),
+        ("monthly_report", "publish_many"),
+    ]),
+}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_pipeline(name: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    One run of a pipeline in this process: wall/CPU time, peak RSS, stage and
+    HTTP breakdowns. Use measure() to get a fresh process per run.
+    """
+    options = options or {}
+    pipeline = PIPELINES[name]
+    if options.get("mode", "replay") != "record":
+        # Modules that check for keys at import only need them to be set
+        os.environ.setdefault("OPENAI_API_KEY", "replay")
+        os.environ.setdefault("DATAWRAPPER_API_KEY", "replay")
+    if not options.get("llm_cache"):
+        os.environ["LLM_CACHE_DISABLED"] = "true"
+    output_dir = tempfile.mkdtemp(prefix=f"benchmark_{name}_")
+    timer = StageTimer()
+    cassette = use_cassette(name, mode=options.get("mode"), cassette_dir=options.get("cassette_dir"),
+                            latency=options.get("latency"))
+    error = None
+    try:
+        with cassette:
+            # Imports happen inside the cassette: some clients talk to their service on construction
+            for module_name, attr in pipeline.stages:
+                try:
+                    timer.wrap(module_name, attr)
+                except (ImportError, AttributeError) as e:
+                    logger.warning(f"Not timing {module_name}.{attr}: {e}")
+            rss_after_imports = _peak_rss_mb()
+            cpu_started, started = _cpu_seconds(), time.perf_counter()
+            try:
+                pipeline.run(options, output_dir)
+            except Exception as e:
+                logger.error(f"Pipeline {name} failed: {e}", exc_info=True)
+                error = f"{type(e).__name__}: {e}"
+            wall = time.perf_counter() - started
+            cpu = _cpu_seconds() - cpu_started
+    finally:
+        timer.restore()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    http = cassette.stats()
+    return {
+        "pipeline": name,
+        "mode": cassette.mode,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_after_imports_mb": rss_after_imports,
+        "stages": timer.report(),
+        "http": http,
+        "http_seconds": round(sum(host["seconds"] for host in http.values()), 3),
+        "error": error,
+    }
+
+
+def _child(name, options, queue):
+    logging.basicConfig(level=options.get("log_level", logging.WARNING))
+    try:
+        queue.put(run_pipeline(name, options))
+    except Exception as e:
+        queue.put({"pipeline": name, "error": f"{type(e).__name__}: {e}"})
+
+
+def measure(name: str, options: Optional[Dict[str, Any]] = None, repeat: int = 1) -> Dict[str, Any]:
+    """Run a pipeline `repeat` times, each in a fresh process, and summarize wall/CPU/RSS."""
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_child, args=(name, options or {}, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        runs.append(result)
+    ok = [run for run in runs if "wall_seconds" in run]
+    summary = {"pipeline": name, "runs": runs}
+    if ok:
+        for metric in ("wall_seconds", "cpu_seconds", "peak_rss_mb"):
+            values = [run[metric] for run in ok]
+            summary[metric] = {"min": min(values), "median": round(statistics.median(values), 3), "max": max(values)}
+    return summary
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    lines = [f"== {summary['pipeline']} =="]
+    for metric in ("wall_seconds", "cpu_seconds", "peak_rss_mb"):
+        if metric in summary:
+            values = summary[metric]
+            lines.append(f"{metric:>16}: median {values['median']}  (min {values['min']}, max {values['max']})")
+    last = summary["runs"][-1]
+    if last.get("error"):
+        lines.append(f"{'error':>16}: {last['error']}")
+    for stage, values in last.get("stages", {}).items():
+        lines.append(f"{'stage':>16}: {stage:<40} {values['seconds']:>9.3f}s  x{values['calls']}")
+    for host, values in last.get("http", {}).items():
+        lines.append(f"{'http':>16}: {host:<40} {values['seconds']:>9.3f}s  x{values['requests']}"
+                     f"  (misses {values['misses']})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data pipelines against recorded HTTP traffic")
+    parser.add_argument("pipelines", nargs="+", choices=sorted(PIPELINES))
+    parser.add_argument("--mode", default="replay", choices=["record", "replay", "auto"])
+    parser.add_argument("--latency", default="", help='Injected replay latency: seconds, "recorded" or "recorded:<scale>"')
+    parser.add_argument("--cassette-dir", default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=None, help="Metrics (ytd) or report items (monthly) to process")
+    parser.add_argument("--endpoint", default=None, help="Dataset endpoint for the periodic pipeline")
+    parser.add_argument("--period-type", default="month")
+    parser.add_argument("--district", default="0")
+    parser.add_argument("--llm-cache", action="store_true", help="Let the LLM response cache answer")
+    parser.add_argument("--output", default=None, help="Write the full JSON report here")
+    args = parser.parse_args(argv)
+
+    options = {"mode": args.mode, "latency": args.latency, "cassette_dir": args.cassette_dir, "limit": args.limit,
+               "endpoint": args.endpoint, "period_type": args.period_type, "district": args.district,
+               "llm_cache": args.llm_cache}
+    report = []
+    for name in args.pipelines:
+        # A recording pass is a single run; the cassette would be rewritten by each repeat
+        summary = measure(name, options, repeat=1 if args.mode == "record" else args.repeat)
+        report.append(summary)
+        print(format_summary(summary))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+In-process response cache for the time series chart API.
+
+The dashboard, monthly reports and the email renderer request the same charts
+over and over. Chart payloads are built once from time_series_metadata /
+time_series_data, serialized once per format and content-encoding, and served
+with strong ETags so repeat requests cost no database work at all.
+
+Entries are tagged with the (object_id, district, period_type) they were built
+from. store_time_series_in_db calls invalidate_chart_cache() whenever it
+deactivates or writes a chart for that combination, and a TTL bounds staleness
+for writes made from other processes.
+
+Anomaly charts are rendered to HTML only when first requested and cached
+here too, as entries whose payload carries the page under "html".
+"""
+
+import os
+import json
+import gzip
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+CHART_CACHE_TTL = int(os.getenv("CHART_CACHE_TTL", "3600"))
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", "512"))
+CHART_CACHE_MAX_AGE = int(os.getenv("CHART_CACHE_MAX_AGE", "60"))
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+# Database period types -> frontend period types, as returned by the chart API
+FRONTEND_PERIOD_TYPE_MAP = {
+    'year': 'annual',
+    'month': 'monthly',
+    'week': 'weekly',
+    'day': 'daily'
+}
+DB_PERIOD_TYPE_MAP = {v: k for k, v in FRONTEND_PERIOD_TYPE_MAP.items()}
+
+
+class ChartCacheEntry:
+    """A cached chart payload plus its lazily built serialized variants."""
+
+    __slots__ = ("payload", "tags", "created_at", "_bodies", "_etags", "_lock")
+
+    def __init__(self, payload: Dict[str, Any], tags: Tuple[str, str, str]):
+        self.payload = payload
+        self.tags = tags
+        self.created_at = time.time()
+        self._bodies = {}
+        self._etags = {}
+        self._lock = threading.RLock()
+
+    def body(self, fmt: str = "json", encoding: str = "identity") -> bytes:
+        """Return the serialized body for a format and content-encoding."""
+        key = (fmt, encoding)
+        body = self._bodies.get(key)
+        if body is not None:
+            return body
+
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                return body
+
+            if encoding == "identity":
+                if fmt == "html":
+                    body = self.payload["html"].encode("utf-8")
+                else:
+                    content = self.payload if fmt == "json" else to_columnar(self.payload)
+                    body = json.dumps(content, separators=(",", ":")).encode("utf-8")
+                self._etags[fmt] = hashlib.sha256(body).hexdigest()[:32]
+            elif encoding == "br":
+                body = brotli.compress(self.body(fmt), quality=5)
+            else:
+                body = gzip.compress(self.body(fmt), compresslevel=6)
+
+            self._bodies[key] = body
+            return body
+
+    def etag(self, fmt: str = "json", encoding: str = "identity") -> str:
+        """Strong ETag for a representation; compressed variants get a suffix."""
+        if fmt not in self._etags:
+            self.body(fmt)
+        base = self._etags[fmt]
+        return f'"{base}"' if encoding == "identity" else f'"{base}-{encoding}"'
+
+    def matches(self, if_none_match: Optional[str], fmt: str = "json") -> bool:
+        """Check an If-None-Match header against any encoding of this representation."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        if fmt not in self._etags:
+            self.body(fmt)
+        base = self._etags[fmt]
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate.startswith("W/"):
+                candidate = candidate[2:]
+            candidate = candidate.strip('"')
+            if candidate == base or candidate.startswith(f"{base}-"):
+                return True
+        return False
+
+
+_cache: "OrderedDict[tuple, ChartCacheEntry]" = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0, "not_modified": 0}
+
+
+def _normalize_tags(object_id, district, period_type) -> Tuple[str, str, str]:
+    period_type = DB_PERIOD_TYPE_MAP.get(period_type, period_type)
+    return (str(object_id), str(district), str(period_type).lower())
+
+
+def get_cached_chart(key: tuple) -> Optional[ChartCacheEntry]:
+    """Return a live cache entry for key, or None if missing or expired."""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        if CHART_CACHE_TTL and time.time() - entry.created_at > CHART_CACHE_TTL:
+            del _cache[key]
+            _stats["misses"] += 1
+            return None
+        _cache.move_to_end(key)
+        _stats["hits"] += 1
+        return entry
+
+
+def store_cached_chart(key: tuple, payload: Dict[str, Any]) -> ChartCacheEntry:
+    """
+    Cache a chart payload built by the chart API.
+
+    Args:
+        key: Cache key, e.g. ("chart", chart_id) or ("metric", metric_id, district, ...)
+        payload: The response dict with "metadata" and "data"
+
+    Returns:
+        ChartCacheEntry: The stored entry
+    """
+    metadata = payload.get("metadata", {})
+    tags = _normalize_tags(
+        metadata.get("object_id"),
+        metadata.get("district"),
+        metadata.get("period_type")
+    )
+    entry = ChartCacheEntry(payload, tags)
+    with _cache_lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > CHART_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return entry
+
+
+def invalidate_chart_cache(object_id=None, district=None, period_type=None) -> int:
+    """
+    Drop cached charts built from a given metric/district/period.
+
+    Any argument left as None matches everything, so calling with no arguments
+    clears the whole cache.
+
+    Returns:
+        int: Number of entries removed
+    """
+    wanted = _normalize_tags(object_id, district, period_type)
+    check = [i for i, value in enumerate((object_id, district, period_type)) if value is not None]
+
+    with _cache_lock:
+        stale = [
+            key for key, entry in _cache.items()
+            if all(entry.tags[i] == wanted[i] for i in check)
+        ]
+        for key in stale:
+            del _cache[key]
+        _stats["invalidations"] += len(stale)
+
+    if stale:
+        logger.debug(f"Invalidated {len(stale)} cached charts for object_id={object_id}, district={district}, period_type={period_type}")
+    return len(stale)
+
+
+def get_chart_cache_stats() -> Dict[str, Any]:
+    """Return hit/miss counters and the current cache size."""
+    with _cache_lock:
+        return dict(_stats, entries=len(_cache), brotli=brotli is not None)
+
+
+def to_columnar(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a chart payload to a compact columnar layout.
+
+    Time periods are listed once and each group becomes one array of values
+    aligned with them (null where a group has no point), which is far smaller
+    than one dict per point for large multi-group charts.
+    """
+    periods = []
+    period_index = {}
+    series = {}
+    for point in payload.get("data", []):
+        period = point["time_period"]
+        if period not in period_index:
+            period_index[period] = len(periods)
+            periods.append(period)
+        series.setdefault(point.get("group_value"), {})[period_index[period]] = point["numeric_value"]
+
+    columns = {}
+    for group, values in series.items():
+        columns["" if group is None else group] = [values.get(i) for i in range(len(periods))]
+
+    return {
+        "metadata": payload.get("metadata", {}),
+        "format": "columnar",
+        "time_periods": periods,
+        "series": columns
+    }
+
+
+def _choose_encoding(accept_encoding: str) -> str:
+    accept_encoding = (accept_encoding or "").lower()
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return "identity"
+
+
+def chart_response(request, entry: ChartCacheEntry, fmt: str = "json") -> Response:
+    """
+    Build the HTTP response for a cached chart, honouring If-None-Match and Accept-Encoding.
+
+    Args:
+        request: The incoming request (may be None for internal callers)
+        entry: Cache entry to serve
+        fmt: "json" (the default point list), "columnar", or "html" for
+            entries whose payload holds a rendered page under "html"
+
+    Returns:
+        Response: 304 Not Modified or the (possibly compressed) body
+    """
+    headers = request.headers if request is not None else {}
+    encoding = _choose_encoding(headers.get("accept-encoding"))
+    if encoding != "identity" and len(entry.body(fmt)) < MIN_COMPRESS_BYTES:
+        encoding = "identity"
+
+    response_headers = {
+        "ETag": entry.etag(fmt, encoding),
+        "Cache-Control": f"public, max-age={CHART_CACHE_MAX_AGE}, must-revalidate",
+        "Vary": "Accept-Encoding"
+    }
+
+    if entry.matches(headers.get("if-none-match"), fmt):
+        with _cache_lock:
+            _stats["not_modified"] += 1
+        return Response(status_code=304, headers=response_headers)
+
+    if encoding != "identity":
+        response_headers["Content-Encoding"] = encoding
+    return Response(
+        content=entry.body(fmt, encoding),
+        media_type="text/html; charset=utf-8" if fmt == "html" else "application/json",
+        headers=response_headers
+    )
+
+
+def cached_chart_response(request, key: tuple, builder: Callable[[], Any], fmt: str = "json") -> Response:
+    """
+    Serve a chart from the cache, building and caching it on a miss.
+
+    builder() returns either the payload dict to cache, or a Response
+    (e.g. a 404) which is passed through uncached.
+    """
+    entry = get_cached_chart(key)
+    if entry is None:
+        result = builder()
+        if isinstance(result, Response):
+            return result
+        entry = store_cached_chart(key, result)
+    return chart_response(request, entry, fmt)
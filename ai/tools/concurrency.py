@@ -0,0 +1,125 @@
+"""
+Helpers for running blocking calls (LLM requests, HTTP calls, tool functions)
+concurrently with a bounded number of workers and per-call timeouts.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CallTimeoutError(TimeoutError):
+    """Raised when a call does not finish within its timeout."""
+
+
+def run_with_timeout(func: Callable[[], Any], timeout: Optional[float],
+                     slot: Optional[threading.Semaphore] = None) -> Any:
+    """
+    Run func() and return its result, raising CallTimeoutError after timeout seconds.
+
+    The call runs in a daemon thread. A timed-out call cannot be interrupted, so
+    it is left to finish in the background and its result is discarded. A slot
+    the caller acquired is released when func() actually returns, not at the
+    timeout, so abandoned calls still count against the caller's limit.
+    """
+    if not timeout:
+        try:
+            return func()
+        finally:
+            if slot is not None:
+                slot.release()
+
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = func()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            if slot is not None:
+                slot.release()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise CallTimeoutError(f"Call did not finish within {timeout}s")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
+
+
+class TaskResult:
+    """Outcome of one item processed by run_concurrently."""
+
+    __slots__ = ("item", "result", "error", "elapsed")
+
+    def __init__(self, item, result=None, error=None, elapsed=0.0):
+        self.item = item
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def run_concurrently(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = 5,
+    timeout: Optional[float] = None,
+    name: str = "task"
+) -> List[TaskResult]:
+    """
+    Apply func to every item concurrently.
+
+    At most max_workers calls run at once and each call is limited to timeout
+    seconds. A call that times out keeps its slot until it really finishes,
+    so the next item waits for it rather than exceeding max_workers; its
+    timeout starts once it has a slot. Exceptions and timeouts are captured
+    per item rather than raised.
+
+    Args:
+        func: Function called as func(item)
+        items: Items to process
+        max_workers: Maximum number of calls in flight
+        timeout: Per-call timeout in seconds (None for no limit)
+        name: Label used in log messages
+
+    Returns:
+        list: One TaskResult per item, in the same order as items
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    workers = max(1, min(max_workers, len(items)))
+    slots = threading.Semaphore(workers)
+
+    def run(item):
+        slots.acquire()
+        started = time.perf_counter()
+        try:
+            result = run_with_timeout(lambda: func(item), timeout, slot=slots)
+            return TaskResult(item, result=result, elapsed=time.perf_counter() - started)
+        except Exception as e:
+            logger.error(f"{name} failed after {time.perf_counter() - started:.1f}s: {e}")
+            return TaskResult(item, error=e, elapsed=time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run, items))
+
+    failed = sum(1 for r in results if not r.ok)
+    logger.info(
+        f"Ran {len(items)} {name} calls in {time.perf_counter() - started:.1f}s "
+        f"(slowest {max(r.elapsed for r in results):.1f}s, {failed} failed)"
+    )
+    return results
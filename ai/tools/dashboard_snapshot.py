@@ -0,0 +1,334 @@
+"""
+Cached statistics for the backend dashboard.
+
+The dashboard used to fan out to nine endpoints on every load, each opening
+its own PostgreSQL or Qdrant connection, with several COUNT(*) scans, a
+filesystem walk and an HTTP call to the Qdrant metrics API. Here everything
+is computed together by a background refresher every
+DASHBOARD_SNAPSHOT_INTERVAL_SECONDS over one database connection, and
+/api/dashboard-snapshot serves the cached result with its age.
+
+Row counts come from pg_class.reltuples (kept current by autovacuum/ANALYZE)
+and the anomaly out_of_bounds split from pg_stats; a table that has never
+been analyzed falls back to an exact count.
+"""
+
+import os
+import json
+import glob
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import requests
+from qdrant_client import QdrantClient
+
+from tools.db_utils import get_postgres_connection
+from tools.db_retention import retention_report
+from tools.disk_usage import register_root, ensure_scanned, all_usage
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("DASHBOARD_SNAPSHOT_INTERVAL_SECONDS", "300"))
+# A forced refresh within this many seconds of the last one returns the cached snapshot
+DASHBOARD_SNAPSHOT_MIN_REFRESH_SECONDS = int(os.getenv("DASHBOARD_SNAPSHOT_MIN_REFRESH_SECONDS", "30"))
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COUNTED_TABLES = ("anomalies", "time_series_metadata", "time_series_data")
+
+_snapshot: Dict[str, Any] = {"data": None, "computed_at": None}
+_refresh_lock = threading.Lock()
+
+
+def datasets_count(ai_dir: str = AI_DIR) -> int:
+    """Dataset JSON files in data/datasets (excluding analysis_map.json) and data/datasets/fixed."""
+    datasets_dir = os.path.join(ai_dir, 'data', 'datasets')
+    regular = [f for f in glob.glob(os.path.join(datasets_dir, '*.json')) if os.path.basename(f) != 'analysis_map.json']
+    fixed = glob.glob(os.path.join(datasets_dir, 'fixed', '*.json'))
+    return len(regular) + len(fixed)
+
+
+def total_metrics_count(ai_dir: str = AI_DIR) -> Optional[int]:
+    """Queries across all categories of dashboard_queries_enhanced.json, or None if it is missing."""
+    queries_file = os.path.join(ai_dir, "data", "dashboard", "dashboard_queries_enhanced.json")
+    if not os.path.exists(queries_file):
+        return None
+    with open(queries_file, 'r') as f:
+        queries_data = json.load(f)
+    return sum(
+        len(subcategory["queries"])
+        for category in queries_data.values()
+        for subcategory in category.values()
+        if "queries" in subcategory
+    )
+
+
+def estimated_row_counts(cursor, tables=COUNTED_TABLES) -> Dict[str, Dict[str, Any]]:
+    """
+    Row counts from the planner statistics.
+
+    Returns:
+        dict: {table: {"count": int, "estimated": bool}}; tables that have never
+              been analyzed (reltuples < 0) are counted exactly.
+    """
+    cursor.execute("""
+        SELECT c.relname, c.reltuples::bigint FROM pg_class c
+        WHERE c.oid = ANY (ARRAY(SELECT to_regclass(t) FROM unnest(%s::text[]) AS t))
+    """, (list(tables),))
+    counts = {}
+    for table, reltuples in cursor.fetchall():
+        if reltuples is not None and reltuples >= 0:
+            counts[table] = {"count": int(reltuples), "estimated": True}
+        else:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = {"count": int(cursor.fetchone()[0]), "estimated": False}
+    return counts
+
+
+def anomaly_status_split(cursor, total: int) -> Dict[str, Any]:
+    """out_of_bounds / in_bounds anomaly counts, scaled from pg_stats frequencies when available."""
+    cursor.execute("""
+        SELECT most_common_vals::text, most_common_freqs, null_frac FROM pg_stats
+        WHERE tablename = 'anomalies' AND attname = 'out_of_bounds'
+        AND schemaname = ANY (current_schemas(false))
+    """)
+    row = cursor.fetchone()
+    if row and row[0] and row[1]:
+        values = [v.strip() for v in row[0].strip("{}").split(",")]
+        frequencies = dict(zip(values, row[1]))
+        out_of_bounds = int(round(total * frequencies.get("t", 0.0)))
+        in_bounds = int(round(total * frequencies.get("f", 0.0)))
+        return {"out_of_bounds": out_of_bounds, "in_bounds": in_bounds, "total": out_of_bounds + in_bounds,
+                "estimated": True}
+
+    cursor.execute("SELECT out_of_bounds, COUNT(*) FROM anomalies GROUP BY out_of_bounds")
+    split = {"out_of_bounds": 0, "in_bounds": 0}
+    for flag, count in cursor.fetchall():
+        split["out_of_bounds" if flag else "in_bounds"] += int(count)
+    return {**split, "total": split["out_of_bounds"] + split["in_bounds"], "estimated": False}
+
+
+def postgres_stats() -> Dict[str, Any]:
+    """Database size, table row estimates, anomaly split and retention report over one connection."""
+    connection = get_postgres_connection()
+    if connection is None:
+        return {"online": False}
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_database_size(current_database()) / 1024.0 / 1024.0")
+        size_mb = float(cursor.fetchone()[0])
+        counts = estimated_row_counts(cursor)
+        anomalies = anomaly_status_split(cursor, counts.get("anomalies", {}).get("count", 0)) \
+            if "anomalies" in counts else {"out_of_bounds": 0, "in_bounds": 0, "total": 0, "estimated": False}
+        cursor.close()
+        try:
+            retention = retention_report(connection)
+        except Exception as e:
+            logger.warning(f"Retention report unavailable: {e}")
+            connection.rollback()
+            retention = None
+        return {"online": True, "size_mb": size_mb, "counts": counts, "anomalies": anomalies, "retention": retention}
+    finally:
+        connection.close()
+
+
+def _qdrant_storage_path() -> Optional[str]:
+    path = os.environ.get("QDRANT_STORAGE_PATH", "/var/lib/qdrant")
+    if os.path.exists(path):
+        return path
+    for candidate in ["./storage", "/var/lib/qdrant/storage", os.path.join(AI_DIR, "storage"),
+                      os.path.join(AI_DIR, "..", "storage")]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def vectordb_size() -> Dict[str, Any]:
+    """
+    Size of the vector DB in MB: from the Qdrant metrics API, else the storage
+    directory on disk, else estimated at ~2KB per point.
+
+    Returns:
+        dict: {"size_mb", "change", "source", "collections"}; collections is None
+              when Qdrant could not be reached.
+    """
+    collections = None
+    try:
+        response = requests.get("http://localhost:6333/metrics", timeout=5)
+        if response.ok:
+            for line in response.text.splitlines():
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].split("{")[0] == "qdrant_storage_total_bytes":
+                    storage_mb = float(parts[1]) / (1024 * 1024)
+                    return {"size_mb": storage_mb, "change": 0.0, "source": "metrics_api", "collections": collections}
+            logger.warning("Storage metrics not found in Qdrant metrics API response")
+        else:
+            logger.warning(f"Metrics API request failed with status {response.status_code}")
+    except Exception as e:
+        logger.warning(f"Error getting size from metrics API: {e}")
+
+    try:
+        storage_path = _qdrant_storage_path()
+        if storage_path:
+            # Indexed once, then kept current by the disk usage watcher
+            register_root("vectordb", storage_path)
+            total_size = ensure_scanned("vectordb")["bytes"]
+            return {"size_mb": total_size / (1024 * 1024), "change": 0.0, "source": "filesystem",
+                    "collections": collections}
+        logger.warning("Qdrant storage path not found")
+    except Exception as e:
+        logger.warning(f"Error measuring size from filesystem: {e}")
+
+    total_points = 0
+    try:
+        qdrant_client = QdrantClient(os.environ.get("QDRANT_URL", "localhost"), port=6333)
+        names = [c.name for c in qdrant_client.get_collections().collections]
+        collections = len(names)
+        for name in names:
+            try:
+                total_points += qdrant_client.get_collection(collection_name=name).points_count or 0
+            except Exception as e:
+                logger.error(f"Error getting details for collection {name}: {e}")
+    except Exception as e:
+        logger.error(f"Error querying Qdrant: {e}")
+        return {"size_mb": 0.0, "change": 0.0, "source": "error", "collections": None}
+
+    estimated_size_mb = (total_points * 2.0) / 1024
+    if 0 < total_points and estimated_size_mb < 0.1:
+        estimated_size_mb = 0.1
+    return {"size_mb": estimated_size_mb, "change": 0.0, "source": "estimate", "collections": collections}
+
+
+def qdrant_collections_count() -> Optional[int]:
+    try:
+        qdrant_client = QdrantClient(os.environ.get("QDRANT_URL", "localhost"), port=6333)
+        return len(qdrant_client.get_collections().collections)
+    except Exception as e:
+        logger.error(f"Vector DB status check failed: {e}")
+        return None
+
+
+def server_uptime() -> str:
+    if os.path.exists('/proc/uptime'):
+        with open('/proc/uptime', 'r') as f:
+            return f"{round(float(f.readline().split()[0]) / 86400, 1)} days"
+    if os.name == 'posix':
+        try:
+            output = subprocess.check_output(['uptime']).decode('utf-8')
+            if 'day' in output:
+                return f"{int(output.split('up ')[1].split(' day')[0].strip())} days"
+            return "Less than a day"
+        except Exception:
+            pass
+    return "Unknown"
+
+
+def system_status(postgres_online: bool, collections: Optional[int]) -> List[Dict[str, str]]:
+    """Status items for PostgreSQL, the vector DB, disk space and uptime."""
+    items = [
+        {"name": "PostgreSQL Database", "status": "healthy" if postgres_online else "error",
+         "value": "Online" if postgres_online else "Offline"},
+        {"name": "Vector Database", "status": "healthy" if collections is not None else "error",
+         "value": f"{collections} collections" if collections is not None else "Offline"},
+    ]
+    try:
+        total, used, _ = shutil.disk_usage("/")
+        percent_used = (used / total) * 100
+        disk_status = "error" if percent_used > 90 else "warning" if percent_used > 70 else "healthy"
+        items.append({"name": "Disk Space", "status": disk_status, "value": f"{round(percent_used, 1)}% used"})
+    except Exception as e:
+        logger.error(f"Disk status check failed: {e}")
+        items.append({"name": "Disk Space", "status": "error", "value": "Unknown"})
+    try:
+        items.append({"name": "Server Uptime", "status": "healthy", "value": server_uptime()})
+    except Exception as e:
+        logger.error(f"Uptime check failed: {e}")
+        items.append({"name": "Server Uptime", "status": "warning", "value": "Unknown"})
+    return items
+
+
+def compute_snapshot(ai_dir: str = AI_DIR) -> Dict[str, Any]:
+    """Every dashboard statistic, in the shapes the individual endpoints return."""
+    started = time.perf_counter()
+    try:
+        postgres = postgres_stats()
+    except Exception as e:
+        logger.error(f"PostgreSQL statistics failed: {e}")
+        postgres = {"online": False}
+    counts = postgres.get("counts", {})
+
+    def count_of(table):
+        return counts.get(table, {}).get("count", 0)
+
+    vectordb = vectordb_size()
+    collections = vectordb.pop("collections")
+    if collections is None and vectordb["source"] != "error":
+        collections = qdrant_collections_count()
+
+    try:
+        total, used, free = shutil.disk_usage(os.path.abspath(os.sep))
+        disk = {"total": total, "available": free, "used": used, "directories": all_usage()}
+    except Exception as e:
+        logger.error(f"Error getting disk space: {e}")
+        disk = {"error": str(e)}
+
+    try:
+        metrics = total_metrics_count(ai_dir)
+    except Exception as e:
+        logger.error(f"Error counting metrics: {e}")
+        metrics = None
+
+    snapshot = {
+        "datasets": {"count": datasets_count(ai_dir), "change": 0.0},
+        "total_metrics": {"count": metrics if metrics is not None else "Error", "change": 0},
+        "time_series": {"count": count_of("time_series_metadata"), "change": 0},
+        "time_series_data": {"count": count_of("time_series_data"), "change": 0},
+        "anomalies": postgres.get("anomalies", {"out_of_bounds": 0, "in_bounds": 0, "total": 0}),
+        "postgres": {"size_mb": postgres.get("size_mb", 0.0), "change": 0, "retention": postgres.get("retention")},
+        "vectordb": vectordb,
+        "disk": disk,
+        "system_status": system_status(postgres.get("online", False), collections),
+        "estimated": sorted(table for table, count in counts.items() if count["estimated"]),
+    }
+    logger.info(f"Dashboard snapshot computed in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return snapshot
+
+
+def refresh_snapshot(force: bool = True, ai_dir: str = AI_DIR) -> Dict[str, Any]:
+    """
+    Recompute the snapshot. Concurrent callers wait for the refresh in flight
+    instead of starting another; a non-forced call, or a forced one within
+    DASHBOARD_SNAPSHOT_MIN_REFRESH_SECONDS of the last, reuses the cache.
+    """
+    with _refresh_lock:
+        age = snapshot_age()
+        if _snapshot["data"] is not None and age is not None:
+            if not force or age < DASHBOARD_SNAPSHOT_MIN_REFRESH_SECONDS:
+                return get_snapshot()
+        data = compute_snapshot(ai_dir)
+        _snapshot["data"] = data
+        _snapshot["computed_at"] = time.time()
+    return get_snapshot()
+
+
+def snapshot_age() -> Optional[float]:
+    computed_at = _snapshot["computed_at"]
+    return None if computed_at is None else time.time() - computed_at
+
+
+def get_snapshot() -> Optional[Dict[str, Any]]:
+    """The cached snapshot with computed_at and age_seconds, or None before the first refresh."""
+    data, computed_at = _snapshot["data"], _snapshot["computed_at"]
+    if data is None:
+        return None
+    age = time.time() - computed_at
+    return {
+        **data,
+        "computed_at": datetime.fromtimestamp(computed_at).isoformat(),
+        "age_seconds": round(age, 1),
+        "stale": age > 2 * DASHBOARD_SNAPSHOT_INTERVAL_SECONDS,
+    }
@@ -0,0 +1,342 @@
+"""
+In-memory store for the dashboard metric files.
+
+The public dashboard routes (/api/district/..., /api/metric/...) and the chat
+tools (get_dashboard_metric, the combined notes) used to open and json.load
+files under output/dashboard/<district>/ and data/dashboard/ on every
+request. Here the files are loaded once and indexed by district, metric id
+and category; each entry keeps both the parsed data and the raw bytes, so a
+route can return the file as-is without re-serializing it.
+
+The store stays current in two ways:
+
+- notify_write() is called by generate_ytd_metrics and process_single_metric
+  right after they write a file, and reloads just that file.
+- Writers in other processes are picked up by refresh(), which stats every
+  file and reloads only those whose mtime or size changed. In the web app,
+  main.py's watch_dashboard_store task calls it every
+  DASHBOARD_STORE_CHECK_SECONDS in a worker thread, so requests normally
+  find the store already current. As a fallback for processes without that
+  task (scripts, the chat tools run standalone), a read that finds the data
+  older than DASHBOARD_STORE_CHECK_SECONDS refreshes in the calling thread;
+  only the first load makes readers wait, later ones are done by one reader
+  while the others keep answering from the current data.
+
+Returned dicts are shared between callers and must be treated as read-only.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_STORE_CHECK_SECONDS = float(os.getenv("DASHBOARD_STORE_CHECK_SECONDS", "5"))
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOP_LEVEL = "top_level"
+MAPPING_FILE = "metric_id_mapping.json"
+ENHANCED_QUERIES_FILE = "dashboard_queries_enhanced.json"
+
+
+class StoreEntry:
+    """One JSON file: its raw bytes, parsed data, or the error that kept it from loading."""
+
+    __slots__ = ("path", "mtime_ns", "size", "raw", "data", "error")
+
+    def __init__(self, path: str, mtime_ns: int, size: int):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.raw: Optional[bytes] = None
+        self.data: Any = None
+        self.error: Optional[str] = None
+
+    @classmethod
+    def load(cls, path: str, stat: Optional[os.stat_result] = None) -> Optional["StoreEntry"]:
+        """Read and parse path; None if it no longer exists."""
+        try:
+            stat = stat or os.stat(path)
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        entry = cls(path, stat.st_mtime_ns, stat.st_size)
+        try:
+            entry.data = json.loads(raw)
+            entry.raw = raw
+        except ValueError as e:
+            # Usually a file caught mid-write; the next refresh sees a new mtime/size
+            entry.error = str(e)
+            logger.warning(f"Invalid JSON in dashboard file {path}: {e}")
+        return entry
+
+    def is_current(self, stat: os.stat_result) -> bool:
+        return self.mtime_ns == stat.st_mtime_ns and self.size == stat.st_size
+
+
+def district_key(district) -> str:
+    """"3", 3 and " 03 " all name district "3"; anything non-numeric is used as given."""
+    text = str(district).strip()
+    return str(int(text)) if text.isdigit() else text
+
+
+def metric_key(metric_id) -> str:
+    text = str(metric_id).strip()
+    return text[:-5] if text.endswith(".json") else text
+
+
+class DashboardStore:
+    """
+    Indexed, mtime-validated view of output/dashboard/<district>/*.json plus
+    the metric id mapping and enhanced queries files in data/dashboard.
+    """
+
+    def __init__(self, ai_dir: str = AI_DIR, check_seconds: float = DASHBOARD_STORE_CHECK_SECONDS):
+        self.dashboard_dir = os.path.join(ai_dir, "output", "dashboard")
+        self.data_dir = os.path.join(ai_dir, "data", "dashboard")
+        self.check_seconds = check_seconds
+        # district -> metric id (or "top_level") -> entry
+        self._districts: Dict[str, Dict[str, StoreEntry]] = {}
+        # metric id -> district -> entry, and category -> [(district, metric id)]
+        self._by_metric: Dict[str, Dict[str, StoreEntry]] = {}
+        self._by_category: Dict[str, List[tuple]] = {}
+        # Single files in data/dashboard, keyed by file name
+        self._files: Dict[str, StoreEntry] = {}
+        self._checked_at: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.reloads = 0
+
+    # --- Loading -------------------------------------------------------------
+
+    def _district_dirs(self) -> Dict[str, str]:
+        try:
+            with os.scandir(self.dashboard_dir) as entries:
+                return {e.name: e.path for e in entries if e.is_dir() and e.name.isdigit()}
+        except FileNotFoundError:
+            return {}
+
+    def refresh(self) -> int:
+        """Reload the files that changed since the last refresh; returns the number of files added, changed or removed."""
+        with self._write_lock:
+            changed = 0
+            seen_districts = set()
+            for district, path in self._district_dirs().items():
+                district = district_key(district)
+                seen_districts.add(district)
+                current = self._districts.get(district, {})
+                updated = {}
+                try:
+                    with os.scandir(path) as entries:
+                        for item in entries:
+                            if not item.name.endswith(".json") or not item.is_file():
+                                continue
+                            key = metric_key(item.name)
+                            stat = item.stat()
+                            entry = current.get(key)
+                            if entry is None or not entry.is_current(stat):
+                                entry = StoreEntry.load(item.path, stat)
+                                if entry is None:
+                                    continue
+                                changed += 1
+                            updated[key] = entry
+                except FileNotFoundError:
+                    updated = {}
+                changed += len(set(current) - set(updated))
+                self._districts[district] = updated
+            for district in set(self._districts) - seen_districts:
+                changed += len(self._districts.pop(district))
+
+            for name in (MAPPING_FILE, ENHANCED_QUERIES_FILE):
+                changed += self._refresh_file(name)
+
+            if changed or self._checked_at is None:
+                self._reindex()
+                self.reloads += changed
+            self._checked_at = time.monotonic()
+            return changed
+
+    def _refresh_file(self, name: str) -> int:
+        path = os.path.join(self.data_dir, name)
+        entry = self._files.get(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 1 if self._files.pop(name, None) else 0
+        if entry is not None and entry.is_current(stat):
+            return 0
+        entry = StoreEntry.load(path, stat)
+        if entry is None:
+            return 1 if self._files.pop(name, None) else 0
+        self._files[name] = entry
+        return 1
+
+    def _reindex(self):
+        by_metric: Dict[str, Dict[str, StoreEntry]] = {}
+        by_category: Dict[str, List[tuple]] = {}
+        for district in sorted(self._districts, key=int):
+            for key, entry in self._districts[district].items():
+                if key == TOP_LEVEL:
+                    continue
+                by_metric.setdefault(key, {})[district] = entry
+                if isinstance(entry.data, dict) and entry.data.get("category"):
+                    by_category.setdefault(entry.data["category"], []).append((district, key))
+        # Swapped in whole so readers never see a half-built index
+        self._by_metric = by_metric
+        self._by_category = by_category
+
+    def notify_write(self, path: str) -> bool:
+        """Reload one file just written by this process; returns False for files the store does not hold."""
+        path = os.path.abspath(path)
+        if not path.endswith(".json"):
+            return False
+        directory, name = os.path.split(path)
+        if directory == self.data_dir and name in (MAPPING_FILE, ENHANCED_QUERIES_FILE):
+            with self._write_lock:
+                self._refresh_file(name)
+            return True
+        district_dir, district = os.path.split(directory)
+        if district_dir != self.dashboard_dir or not district.isdigit():
+            return False
+        with self._write_lock:
+            district = district_key(district)
+            entries = dict(self._districts.get(district, {}))
+            entry = StoreEntry.load(path)
+            if entry is None:
+                entries.pop(metric_key(name), None)
+            else:
+                entries[metric_key(name)] = entry
+            self._districts[district] = entries
+            self._reindex()
+            self.reloads += 1
+        return True
+
+    def _ensure_current(self):
+        if self._checked_at is None:
+            # First read: everyone waits for the initial load
+            with self._refresh_lock:
+                if self._checked_at is None:
+                    self.refresh()
+            return
+        if time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        # Only one reader re-validates; the others serve the current data
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self._checked_at >= self.check_seconds:
+                    self.refresh()
+            finally:
+                self._refresh_lock.release()
+
+    # --- Lookups -------------------------------------------------------------
+
+    def entry(self, district, metric_id) -> Optional[StoreEntry]:
+        """The entry for output/dashboard/<district>/<metric_id>.json, or None."""
+        self._ensure_current()
+        return self._districts.get(district_key(district), {}).get(metric_key(metric_id))
+
+    def metric(self, district, metric_id) -> Optional[Dict[str, Any]]:
+        entry = self.entry(district, metric_id)
+        return entry.data if entry is not None else None
+
+    def top_level_entry(self, district) -> Optional[StoreEntry]:
+        return self.entry(district, TOP_LEVEL)
+
+    def top_level(self, district) -> Optional[Dict[str, Any]]:
+        return self.metric(district, TOP_LEVEL)
+
+    def has_district(self, district) -> bool:
+        self._ensure_current()
+        return district_key(district) in self._districts
+
+    def metric_ids(self, district) -> Optional[List[str]]:
+        """Metric ids available for a district (numeric ones first, in order), or None if the district is missing."""
+        self._ensure_current()
+        entries = self._districts.get(district_key(district))
+        if entries is None:
+            return None
+        ids = [key for key in entries if key != TOP_LEVEL]
+        return sorted(ids, key=lambda key: (0, int(key), "") if key.isdigit() else (1, 0, key))
+
+    def districts(self) -> List[Dict[str, str]]:
+        """[{"id", "name"}] for districts 0-11, citywide first; the name comes from top_level.json."""
+        self._ensure_current()
+        result = []
+        for district in sorted(self._districts, key=int):
+            if not 0 <= int(district) <= 11:
+                continue
+            top_level = self._districts[district].get(TOP_LEVEL)
+            name = None
+            if top_level is not None and isinstance(top_level.data, dict):
+                name = top_level.data.get("name")
+            result.append({"id": district, "name": name or f"District {district}"})
+        return result
+
+    def metric_by_district(self, metric_id) -> Dict[str, Dict[str, Any]]:
+        """{district: data} for one metric across every district that has it."""
+        self._ensure_current()
+        return {district: entry.data for district, entry in self._by_metric.get(metric_key(metric_id), {}).items()
+                if entry.error is None}
+
+    def category_metrics(self, category: str, district=None) -> List[Dict[str, Any]]:
+        """The metric files of a category, for one district or all of them."""
+        self._ensure_current()
+        wanted = district_key(district) if district is not None else None
+        results = []
+        for metric_district, key in self._by_category.get(category, []):
+            if wanted is not None and metric_district != wanted:
+                continue
+            entry = self._districts.get(metric_district, {}).get(key)
+            if entry is not None and entry.error is None:
+                results.append(entry.data)
+        return results
+
+    def categories(self) -> List[str]:
+        self._ensure_current()
+        return sorted(self._by_category)
+
+    def file_entry(self, name: str) -> Optional[StoreEntry]:
+        """A file in data/dashboard held by the store (metric_id_mapping.json, dashboard_queries_enhanced.json)."""
+        self._ensure_current()
+        return self._files.get(name)
+
+    def mapping(self) -> Optional[Dict[str, Any]]:
+        entry = self.file_entry(MAPPING_FILE)
+        return entry.data if entry is not None else None
+
+    def enhanced_queries(self) -> Optional[Dict[str, Any]]:
+        entry = self.file_entry(ENHANCED_QUERIES_FILE)
+        return entry.data if entry is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "districts": len(self._districts),
+            "files": sum(len(entries) for entries in self._districts.values()) + len(self._files),
+            "bytes": sum(entry.size for entries in self._districts.values() for entry in entries.values()),
+            "categories": len(self._by_category),
+            "reloads": self.reloads,
+            "checked_seconds_ago": None if self._checked_at is None else round(time.monotonic() - self._checked_at, 1),
+        }
+
+
+_store: Optional[DashboardStore] = None
+_store_lock = threading.Lock()
+
+
+def get_dashboard_store() -> DashboardStore:
+    """Return the process-wide dashboard store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DashboardStore()
+        return _store
+
+
+def notify_write(path: str):
+    """Tell the dashboard store (if this process has one) that path was just written."""
+    if _store is not None:
+        _store.notify_write(path)
@@ -6,6 +6,8 @@ from urllib.parse import urljoin
 import pandas as pd
 import logging
 import json
+from tools.log_utils import log_event, summarize
+from tools.agent_runtime import context_writer
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
@@ -30,7 +32,7 @@ def clean_query_string(query):
     return cleaned
 
 def fetch_data_from_api(query_object):
-    logger.info("Starting fetch_data_from_api with query_object: %s", json.dumps(query_object, indent=2))
+    logger.debug("Starting fetch_data_from_api with query_object: %s", summarize(query_object))
     base_url = "https://data.sfgov.org/resource/"
     all_data = []
     limit = 5000
@@ -46,34 +48,24 @@ def fetch_data_from_api(query_object):
         logger.error("Missing query in query_object")
         return {'error': 'Query is required'}
 
-    logger.info(f"Processing endpoint: {endpoint}")
-    logger.info(f"Initial query string: {query}")
-    
     cleaned_query = clean_query_string(query)
-    logger.info(f"After clean_query_string: {cleaned_query}")
     
     # Remove any $query= prefix if it exists
     if cleaned_query.startswith('$query='):
         cleaned_query = cleaned_query[7:]
-        logger.info("Removed $query= prefix")
     if cleaned_query.startswith('query='):
         cleaned_query = cleaned_query[6:]
-        logger.info("Removed query= prefix")
-    
-    logger.info(f"Final cleaned query: {cleaned_query}")
 
     has_limit = "limit" in cleaned_query.lower()
     url = urljoin(base_url, f"{endpoint if endpoint.endswith('.json') else endpoint + '.json'}")
-    logger.info(f"Full API URL: {url}")
+    log_event(logger, logging.INFO, "soda.fetch.start", url=url, query=cleaned_query)
     
     # Don't wrap the query in $query= here, just pass it directly
     params = {"$query": cleaned_query}
-    logger.info(f"Request parameters: {json.dumps(params, indent=2)}")
 
     headers = {
         'Accept': 'application/json'
     }
-    logger.info(f"Request headers: {json.dumps(headers, indent=2)}")
 
     has_more_data = True
     while has_more_data:
@@ -95,12 +87,11 @@ def fetch_data_from_api(query_object):
                 )
                 return {'error': 'Failed to decode JSON response from the API.', 'queryURL': response.url}
             all_data.extend(data)
-            logger.info("Fetched %d records in current batch.", len(data))
+            logger.debug("Fetched %d records in current batch.", len(data))
 
             if has_limit or len(data) < limit:
                 has_more_data = False
                 logger.debug("No more data to fetch; ending pagination.")
-                logger.info("url: %s", url)
             else:
                 offset += limit
                 logger.debug("Proceeding to next offset: %d", offset)
@@ -123,7 +114,7 @@ def fetch_data_from_api(query_object):
             logger.exception("An error occurred: %s", err)
             return {'error': str(err), 'queryURL': response.url if response else None}
 
-    logger.debug("Finished fetching data. Total records retrieved: %d", len(all_data))
+    log_event(logger, logging.INFO, "soda.fetch.done", url=url, records=len(all_data), pages=offset // limit + 1)
     return {
         'data': all_data,
         'queryURL': response.url if response else None
@@ -199,6 +190,8 @@ def _map_result_to_dataset(context_variables, result):
         if data:
             df = pd.DataFrame(data)
             context_variables['dataset'] = df
+            # Table views of the previous dataset are keyed on this
+            context_variables.pop('dataset_key', None)
             logger.info(f"Dataset successfully created with shape: {df.shape}")
             return {'status': 'success', 'queryURL': result.get('queryURL')}
         else:
@@ -313,6 +306,7 @@ def fetch_facebook_ads_library_paged(params):
         "queryURL": response.url if "response" in locals() else None,
     }
 
+@context_writer
 def set_dataset(context_variables, *args, **kwargs):
     """
     Fetches data from the API and sets it in the context variables.
@@ -333,10 +327,7 @@ def set_dataset(context_variables, *args, **kwargs):
     Returns:
         Dictionary with status and optional error message
     """
-    logger.info("=== Starting set_dataset ===")
-    logger.info(f"Args received: {args}")
-    logger.info(f"Kwargs received: {json.dumps(kwargs, indent=2)}")
-    logger.info(f"Context variables keys: {list(context_variables.keys())}")
+    logger.debug("set_dataset args=%s kwargs=%s context keys=%s", summarize(args), summarize(kwargs), summarize(list(context_variables.keys())))
 
     try:
         # Handle nested kwargs structure (agent style)
@@ -360,13 +351,11 @@ def set_dataset(context_variables, *args, **kwargs):
         # Clean up endpoint - ensure it ends with .json
         if not endpoint.endswith('.json'):
             endpoint = f"{endpoint}.json"
-            logger.info(f"Added .json to endpoint: {endpoint}")
 
-        logger.info(f"Final parameters - Endpoint: {endpoint}, Query: {query}")
         query_object = {'endpoint': endpoint, 'query': query}
 
         result = fetch_data_from_api(query_object)
-        logger.info(f"API result status: {'success' if 'data' in result else 'error'}")
+        logger.debug("API result status: %s", 'success' if 'data' in result else 'error')
 
         return _map_result_to_dataset(context_variables, result)
 
@@ -0,0 +1,507 @@
+"""
+Retention and compaction for the versioned analysis tables.
+
+Every anomaly and time series run flips the previous rows to
+is_active = FALSE and inserts a fresh copy, so anomalies,
+time_series_metadata and time_series_data only ever grow. This module
+keeps the live tables small:
+
+- Compaction keeps the active row plus the newest RETENTION_GENERATIONS
+  inactive versions of each series (same key as the deactivation UPDATE in
+  store_anomalies / store_time_series). Versions are ranked once per run and
+  the older ones are moved out in batches of RETENTION_BATCH_SIZE.
+- In "archive" mode (the default) moved rows go to <table>_archive, which is
+  range-partitioned by created_at month. Old history is removed by dropping
+  whole partitions past ARCHIVE_RETENTION_MONTHS (0 keeps them forever),
+  which frees space at once and never needs a vacuum. "delete" mode drops
+  old versions outright.
+- Archived rows keep a metadata_hash instead of the metadata JSONB; every
+  distinct blob is stored once in metadata_blobs.
+- Each run is recorded in retention_runs, and retention_report() summarizes
+  live and archive sizes for /api/postgres-size. Space actually freed
+  (deleted rows, dropped partitions) is reported apart from space archived,
+  which only moved from a live table to its archive.
+
+The live tables are not partitioned themselves: their primary keys and the
+time_series_data -> time_series_metadata foreign key would have to change,
+and once compacted they stay small enough for their indexes and autovacuum.
+"""
+
+import os
+import logging
+import datetime
+from typing import Any, Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+RETENTION_GENERATIONS = int(os.getenv("RETENTION_GENERATIONS", "3"))
+RETENTION_MODE = os.getenv("RETENTION_MODE", "archive")
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", "24"))
+
+MODES = ("archive", "delete")
+
+# Versioned tables: primary key, the columns identifying one series (as in the
+# deactivation UPDATE), the JSONB column deduplicated on archive, and child
+# tables whose rows go with the parent row.
+RETENTION_TABLES = [
+    {
+        "table": "anomalies",
+        "id": "id",
+        "key": ["object_type", "object_id", "object_name", "group_field_name", "period_type", "district", "group_value"],
+        "blob": "metadata",
+        "children": [],
+    },
+    {
+        "table": "time_series_metadata",
+        "id": "chart_id",
+        "key": ["object_type", "object_id", "object_name", "field_name", "group_field", "period_type", "district"],
+        "blob": "metadata",
+        "children": [("time_series_data", "chart_id")],
+    },
+]
+
+ARCHIVE_EXTRA_COLUMNS = ("metadata_hash", "archived_at")
+
+
+def _archive_name(table: str) -> str:
+    return f"{table}_archive"
+
+
+def _partition_name(archive: str, month: datetime.date) -> str:
+    return f"{archive}_p{month.year:04d}{month.month:02d}"
+
+
+def _next_month(month: datetime.date) -> datetime.date:
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _table_exists(cursor, table: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    return bool(cursor.fetchone()[0])
+
+
+def _columns(cursor, table: str) -> List[str]:
+    cursor.execute("""
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_retention_tables(connection) -> None:
+    """Create metadata_blobs, retention_runs and the partitioned archive tables if missing."""
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS metadata_blobs (
+            hash TEXT PRIMARY KEY,
+            body JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS retention_runs (
+            id SERIAL PRIMARY KEY,
+            run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            mode TEXT,
+            table_name TEXT,
+            rows_moved INTEGER,
+            bytes_freed BIGINT,
+            partitions_dropped INTEGER
+        )
+    """)
+    cursor.execute("ALTER TABLE retention_runs ADD COLUMN IF NOT EXISTS bytes_archived BIGINT DEFAULT 0")
+
+    tables = [config["table"] for config in RETENTION_TABLES]
+    tables += [child for config in RETENTION_TABLES for child, _ in config["children"]]
+    for table in tables:
+        if not _table_exists(cursor, table):
+            continue
+        archive = _archive_name(table)
+        if _table_exists(cursor, archive):
+            continue
+        # Same columns as the live table, no defaults or constraints, partitioned by month
+        cursor.execute(f"""
+            CREATE TABLE {archive} (
+                LIKE {table},
+                metadata_hash TEXT,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) PARTITION BY RANGE (created_at)
+        """)
+        if "metadata" in _columns(cursor, table):
+            cursor.execute(f"ALTER TABLE {archive} DROP COLUMN metadata")
+            cursor.execute(f"CREATE INDEX {archive}_metadata_hash_idx ON {archive} (metadata_hash)")
+        else:
+            cursor.execute(f"ALTER TABLE {archive} DROP COLUMN metadata_hash")
+        id_column = next((c["id"] for c in RETENTION_TABLES if c["table"] == table), "id")
+        cursor.execute(f"CREATE INDEX {archive}_{id_column}_idx ON {archive} ({id_column})")
+        # Rows without created_at can't be routed to a month
+        cursor.execute(f"CREATE TABLE {archive}_default PARTITION OF {archive} DEFAULT")
+        logger.info(f"Created partitioned archive table {archive}")
+    connection.commit()
+    cursor.close()
+
+
+def ensure_month_partitions(cursor, archive: str, months) -> List[str]:
+    """Create the monthly partitions of an archive table for the given month starts."""
+    created = []
+    for month in sorted(set(months)):
+        month = datetime.date(month.year, month.month, 1)
+        name = _partition_name(archive, month)
+        if _table_exists(cursor, name):
+            continue
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {archive} FOR VALUES FROM (%s) TO (%s)",
+            (month, _next_month(month))
+        )
+        created.append(name)
+    return created
+
+
+def build_doomed_query(config: Dict[str, Any]) -> str:
+    """Primary keys of all inactive versions older than the kept generations (one ranking pass)."""
+    key = ", ".join(config["key"])
+    return f"""
+        SELECT {config['id']} AS id FROM (
+            SELECT {config['id']},
+                   row_number() OVER (PARTITION BY {key} ORDER BY created_at DESC, {config['id']} DESC) AS generation
+            FROM {config['table']}
+            WHERE is_active IS FALSE AND created_at IS NOT NULL
+        ) ranked
+        WHERE generation > %s
+    """
+
+
+# Takes the next batch of ids off retention_candidates into retention_doomed
+NEXT_BATCH_QUERY = """
+    WITH batch AS (
+        DELETE FROM retention_candidates
+        WHERE id IN (SELECT id FROM retention_candidates ORDER BY id LIMIT %s)
+        RETURNING id
+    )
+    INSERT INTO retention_doomed SELECT id FROM batch
+"""
+
+
+def build_move_query(table: str, match_column: str, mode: str, columns: Optional[List[str]] = None,
+                     blob: Optional[str] = None) -> str:
+    """
+    Delete the rows of table whose match_column is in retention_doomed and,
+    in archive mode, insert them into the archive table with the blob column
+    replaced by its hash. Returns one row: (rows moved, bytes moved).
+    """
+    steps = [f"moved AS (DELETE FROM {table} t USING retention_doomed d WHERE t.{match_column} = d.id RETURNING t.*)"]
+    if mode == "archive":
+        column_list = ", ".join(columns)
+        if blob:
+            steps.append(f"""blobs AS (
+                INSERT INTO metadata_blobs (hash, body)
+                SELECT DISTINCT ON (md5({blob}::text)) md5({blob}::text), {blob} FROM moved WHERE {blob} IS NOT NULL
+                ON CONFLICT (hash) DO NOTHING
+            )""")
+            steps.append(f"""archived AS (
+                INSERT INTO {_archive_name(table)} ({column_list}, metadata_hash)
+                SELECT {column_list}, md5({blob}::text) FROM moved
+            )""")
+        else:
+            steps.append(f"""archived AS (
+                INSERT INTO {_archive_name(table)} ({column_list}) SELECT {column_list} FROM moved
+            )""")
+    return "WITH " + ",\n".join(steps) + "\nSELECT count(*), COALESCE(sum(pg_column_size(moved.*)), 0) FROM moved"
+
+
+def _archive_columns(cursor, table: str, blob: Optional[str]) -> List[str]:
+    live = _columns(cursor, table)
+    archive = set(_columns(cursor, _archive_name(table)))
+    return [c for c in live if c in archive and c != blob and c not in ARCHIVE_EXTRA_COLUMNS]
+
+
+def _move(cursor, table: str, match_column: str, mode: str, blob: Optional[str]) -> Dict[str, int]:
+    columns = None
+    if mode == "archive":
+        columns = _archive_columns(cursor, table, blob)
+        cursor.execute(f"""
+            SELECT DISTINCT date_trunc('month', t.created_at)::date FROM {table} t
+            JOIN retention_doomed d ON t.{match_column} = d.id WHERE t.created_at IS NOT NULL
+        """)
+        ensure_month_partitions(cursor, _archive_name(table), [row[0] for row in cursor.fetchall()])
+    cursor.execute(build_move_query(table, match_column, mode, columns, blob))
+    rows, size = cursor.fetchone()
+    return {"rows": int(rows), "bytes": int(size)}
+
+
+def compact_table(connection, config: Dict[str, Any], generations: int, mode: str,
+                  batch_size: int) -> Dict[str, Dict[str, int]]:
+    """
+    Move old inactive versions of one table (and their child rows) out in
+    batches, committing after each batch so locks stay short. The versions
+    are ranked once into a session temp table; each batch takes the next
+    batch_size ids from it.
+
+    Returns:
+        dict: {table: {"rows", "bytes_archived", "bytes_deleted"}} for the
+        table and each child table; moved bytes count as archived in archive
+        mode and as deleted in delete mode
+    """
+    bytes_key = "bytes_archived" if mode == "archive" else "bytes_deleted"
+    totals = {table: {"rows": 0, "bytes_archived": 0, "bytes_deleted": 0}
+              for table in [config["table"]] + [child for child, _ in config["children"]]}
+
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE IF EXISTS retention_candidates")
+    cursor.execute("CREATE TEMP TABLE retention_candidates (id BIGINT PRIMARY KEY)")
+    cursor.execute("INSERT INTO retention_candidates " + build_doomed_query(config), (generations,))
+    connection.commit()
+    try:
+        while True:
+            cursor.execute("CREATE TEMP TABLE retention_doomed (id BIGINT PRIMARY KEY) ON COMMIT DROP")
+            cursor.execute(NEXT_BATCH_QUERY, (batch_size,))
+            if cursor.rowcount <= 0:
+                connection.rollback()
+                break
+            # Children first so the foreign key is never left dangling
+            for child, column in config["children"]:
+                moved = _move(cursor, child, column, mode, None)
+                totals[child]["rows"] += moved["rows"]
+                totals[child][bytes_key] += moved["bytes"]
+            moved = _move(cursor, config["table"], config["id"], mode, config["blob"])
+            totals[config["table"]]["rows"] += moved["rows"]
+            totals[config["table"]][bytes_key] += moved["bytes"]
+            connection.commit()
+    finally:
+        connection.rollback()
+        cursor.execute("DROP TABLE IF EXISTS retention_candidates")
+        connection.commit()
+        cursor.close()
+    return totals
+
+
+def drop_expired_partitions(connection, archive: str, months: int,
+                            today: Optional[datetime.date] = None) -> Dict[str, int]:
+    """Drop the monthly partitions of an archive table that end more than `months` months ago."""
+    if months <= 0:
+        return {"partitions": 0, "bytes": 0}
+    today = today or datetime.date.today()
+    cutoff = datetime.date(today.year, today.month, 1)
+    for _ in range(months):
+        cutoff = datetime.date(cutoff.year - (cutoff.month == 1), (cutoff.month - 2) % 12 + 1, 1)
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT c.relname, pg_total_relation_size(c.oid) FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (archive,))
+    dropped = {"partitions": 0, "bytes": 0}
+    prefix = f"{archive}_p"
+    for name, size in cursor.fetchall():
+        suffix = name[len(prefix):] if name.startswith(prefix) else ""
+        if len(suffix) != 6 or not suffix.isdigit():
+            continue
+        month = datetime.date(int(suffix[:4]), int(suffix[4:]), 1)
+        if _next_month(month) <= cutoff:
+            cursor.execute(f"DROP TABLE {name}")
+            dropped["partitions"] += 1
+            dropped["bytes"] += int(size)
+            logger.info(f"Dropped archive partition {name}")
+    connection.commit()
+    cursor.close()
+    return dropped
+
+
+def _collect_orphan_blobs(connection) -> int:
+    """Delete metadata blobs no archive row refers to any more."""
+    cursor = connection.cursor()
+    references = [
+        f"NOT EXISTS (SELECT 1 FROM {_archive_name(c['table'])} a WHERE a.metadata_hash = b.hash)"
+        for c in RETENTION_TABLES if c["blob"] and _table_exists(cursor, _archive_name(c["table"]))
+    ]
+    if not references:
+        cursor.close()
+        return 0
+    cursor.execute("DELETE FROM metadata_blobs b WHERE " + " AND ".join(references))
+    deleted = cursor.rowcount
+    connection.commit()
+    cursor.close()
+    return deleted
+
+
+def _vacuum(connection, tables: List[str]) -> None:
+    # VACUUM can't run inside a transaction block
+    autocommit = connection.autocommit
+    connection.autocommit = True
+    try:
+        cursor = connection.cursor()
+        for table in tables:
+            cursor.execute(f"VACUUM (ANALYZE) {table}")
+        cursor.close()
+    finally:
+        connection.autocommit = autocommit
+
+
+def run_retention(connection, generations: Optional[int] = None, mode: Optional[str] = None,
+                  batch_size: Optional[int] = None, archive_months: Optional[int] = None,
+                  vacuum: bool = True) -> Dict[str, Any]:
+    """
+    Compact every versioned table, drop expired archive partitions, vacuum
+    the touched tables and record the run in retention_runs.
+
+    Returns:
+        dict: {"mode", "generations",
+               "tables": {table: {"rows", "bytes_archived", "bytes_deleted", "partitions_dropped", "bytes_dropped"}},
+               "bytes_freed", "bytes_archived"} where bytes_freed counts deleted rows and dropped
+               partitions only, and bytes_archived the rows moved into archive tables
+    """
+    generations = RETENTION_GENERATIONS if generations is None else int(generations)
+    mode = mode or RETENTION_MODE
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    archive_months = ARCHIVE_RETENTION_MONTHS if archive_months is None else int(archive_months)
+    if mode not in MODES:
+        raise ValueError(f"Unsupported retention mode '{mode}'. Use one of: {', '.join(MODES)}")
+
+    ensure_retention_tables(connection)
+    cursor = connection.cursor()
+    configs = [c for c in RETENTION_TABLES if _table_exists(cursor, c["table"])]
+    cursor.close()
+
+    tables: Dict[str, Dict[str, int]] = {}
+    for config in configs:
+        for table, moved in compact_table(connection, config, generations, mode, batch_size).items():
+            tables[table] = {**moved, "partitions_dropped": 0, "bytes_dropped": 0}
+
+    dropped_any = False
+    for table, stats in tables.items():
+        dropped = drop_expired_partitions(connection, _archive_name(table), archive_months)
+        stats["partitions_dropped"] = dropped["partitions"]
+        stats["bytes_dropped"] = dropped["bytes"]
+        dropped_any = dropped_any or dropped["partitions"] > 0
+    if dropped_any:
+        _collect_orphan_blobs(connection)
+
+    touched = [table for table, stats in tables.items() if stats["rows"]]
+    if vacuum and touched:
+        _vacuum(connection, touched)
+
+    cursor = connection.cursor()
+    for table, stats in tables.items():
+        cursor.execute("""
+            INSERT INTO retention_runs (mode, table_name, rows_moved, bytes_freed, bytes_archived, partitions_dropped)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (mode, table, stats["rows"], stats["bytes_deleted"] + stats["bytes_dropped"], stats["bytes_archived"],
+              stats["partitions_dropped"]))
+    connection.commit()
+    cursor.close()
+
+    bytes_freed = sum(stats["bytes_deleted"] + stats["bytes_dropped"] for stats in tables.values())
+    bytes_archived = sum(stats["bytes_archived"] for stats in tables.values())
+    moved = ", ".join(f"{table}={stats['rows']}" for table, stats in tables.items())
+    logger.info(f"Retention ({mode}, keep {generations}): moved {moved}; archived {bytes_archived / 1024 / 1024:.1f} MB, "
+                f"freed {bytes_freed / 1024 / 1024:.1f} MB")
+    return {"mode": mode, "generations": generations, "tables": tables, "bytes_freed": bytes_freed,
+            "bytes_archived": bytes_archived}
+
+
+def retention_report(connection) -> Dict[str, Any]:
+    """
+    Live and archive sizes of the versioned tables, the space reclaimed by
+    retention (deleted rows and dropped partitions) and, separately, the
+    space it moved into the archive tables.
+
+    Returns:
+        dict: {"last_run", "reclaimed_mb_last_run", "reclaimed_mb_total", "archived_mb_last_run",
+               "archived_mb_total", "blobs_mb", "tables": {table: {"live_mb", "archive_mb", "dead_rows"}}}
+    """
+    mb = 1024.0 * 1024.0
+    cursor = connection.cursor(cursor_factory=RealDictCursor)
+    report: Dict[str, Any] = {"last_run": None, "reclaimed_mb_last_run": 0.0, "reclaimed_mb_total": 0.0,
+                              "archived_mb_last_run": 0.0, "archived_mb_total": 0.0, "blobs_mb": 0.0, "tables": {}}
+
+    tables = [c["table"] for c in RETENTION_TABLES] + [t for c in RETENTION_TABLES for t, _ in c["children"]]
+    for table in tables:
+        cursor.execute("""
+            SELECT COALESCE(pg_total_relation_size(to_regclass(%s)), 0) AS live,
+                   (SELECT COALESCE(sum(pg_total_relation_size(inhrelid)), 0) FROM pg_inherits
+                    WHERE inhparent = to_regclass(%s)) AS archive,
+                   (SELECT n_dead_tup FROM pg_stat_user_tables WHERE relid = to_regclass(%s)) AS dead
+        """, (table, _archive_name(table), table))
+        row = cursor.fetchone()
+        report["tables"][table] = {
+            "live_mb": round(float(row["live"]) / mb, 2),
+            "archive_mb": round(float(row["archive"]) / mb, 2),
+            "dead_rows": int(row["dead"] or 0),
+        }
+
+    cursor.execute("SELECT to_regclass('retention_runs') IS NOT NULL AS runs, "
+                   "COALESCE(pg_total_relation_size(to_regclass('metadata_blobs')), 0) AS blobs")
+    row = cursor.fetchone()
+    report["blobs_mb"] = round(float(row["blobs"]) / mb, 2)
+    if row["runs"]:
+        # retention_runs from before bytes_archived was recorded has no such column until the next run
+        cursor.execute("SELECT count(*) > 0 AS present FROM pg_attribute WHERE attrelid = to_regclass('retention_runs') "
+                       "AND attname = 'bytes_archived' AND NOT attisdropped")
+        archived = "bytes_archived" if cursor.fetchone()["present"] else "0"
+        cursor.execute(f"""
+            WITH latest AS (SELECT max(run_at) AS run_at FROM retention_runs)
+            SELECT (SELECT run_at FROM latest) AS last_run,
+                   COALESCE(sum(bytes_freed), 0) AS freed_total,
+                   COALESCE(sum(bytes_freed) FILTER (WHERE run_at = (SELECT run_at FROM latest)), 0) AS freed_last,
+                   COALESCE(sum({archived}), 0) AS archived_total,
+                   COALESCE(sum({archived}) FILTER (WHERE run_at = (SELECT run_at FROM latest)), 0) AS archived_last
+            FROM retention_runs
+        """)
+        runs = cursor.fetchone()
+        report["last_run"] = runs["last_run"].isoformat() if runs["last_run"] else None
+        report["reclaimed_mb_total"] = round(float(runs["freed_total"]) / mb, 2)
+        report["reclaimed_mb_last_run"] = round(float(runs["freed_last"]) / mb, 2)
+        report["archived_mb_total"] = round(float(runs["archived_total"]) / mb, 2)
+        report["archived_mb_last_run"] = round(float(runs["archived_last"]) / mb, 2)
+    cursor.close()
+    return report
+
+
+def get_archived_row(connection, table: str, row_id) -> Optional[Dict[str, Any]]:
+    """An archived row with its metadata blob restored, or None."""
+    config = next(c for c in RETENTION_TABLES if c["table"] == table)
+    archive = _archive_name(table)
+    cursor = connection.cursor(cursor_factory=RealDictCursor)
+    if not _table_exists(cursor, archive):
+        cursor.close()
+        return None
+    cursor.execute(f"""
+        SELECT a.*, b.body AS metadata FROM {archive} a
+        LEFT JOIN metadata_blobs b ON b.hash = a.metadata_hash
+        WHERE a.{config['id']} = %s
+    """, (row_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    if not row:
+        return None
+    row = dict(row)
+    row.pop("metadata_hash", None)
+    return row
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from tools.db_utils import get_postgres_connection
+
+    parser = argparse.ArgumentParser(description="Compact old inactive anomaly and time series versions")
+    parser.add_argument("--generations", type=int, default=None, help="inactive versions to keep per series")
+    parser.add_argument("--mode", choices=MODES, default=None)
+    parser.add_argument("--archive-months", type=int, default=None, help="months of archive partitions to keep (0 = all)")
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    conn = get_postgres_connection()
+    try:
+        result = run_retention(conn, args.generations, args.mode, archive_months=args.archive_months,
+                               vacuum=not args.no_vacuum)
+        print(json.dumps(result, indent=2))
+        print(json.dumps(retention_report(conn), indent=2))
+    finally:
+        conn.close()
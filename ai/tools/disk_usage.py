@@ -0,0 +1,406 @@
+"""
+Cached disk usage accounting for the output, logs and vector DB directories.
+
+output/ holds thousands of per-metric HTML, MD, JSON and PNG artifacts across
+periods and districts, and the admin endpoints used to os.walk it (and logs/
+and the Qdrant storage directory) on every request. Here each directory tree
+is registered once as a named root and indexed by a background scan; after
+that its byte and file counts, overall and per top-level subdirectory, are
+kept current incrementally:
+
+- record_write() / record_delete() are called from the artifact write paths
+  and the clear endpoints of this process.
+- poll_root() is the file watcher for writers in other processes (the
+  analysis scripts run as subprocesses): it only re-lists directories whose
+  mtime changed since the last poll. A full rescan every
+  DISK_USAGE_FULL_SCAN_SECONDS catches in-place overwrites.
+
+usage() then answers from the index in O(1). A root can have a quota
+(OUTPUT_QUOTA_MB, LOGS_QUOTA_MB); when it is exceeded, enforce_quota() deletes
+the oldest cleanup-eligible files until usage is back under
+DISK_QUOTA_TARGET_RATIO of the quota. Live log files and output/dashboard
+are never cleaned up.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DISK_USAGE_POLL_SECONDS = int(os.getenv("DISK_USAGE_POLL_SECONDS", "60"))
+DISK_USAGE_FULL_SCAN_SECONDS = int(os.getenv("DISK_USAGE_FULL_SCAN_SECONDS", "3600"))
+# 0 disables the quota for that root
+OUTPUT_QUOTA_MB = float(os.getenv("OUTPUT_QUOTA_MB", "0"))
+LOGS_QUOTA_MB = float(os.getenv("LOGS_QUOTA_MB", "0"))
+# Quota cleanup deletes down to this fraction of the quota so it does not run on every write
+DISK_QUOTA_TARGET_RATIO = float(os.getenv("DISK_QUOTA_TARGET_RATIO", "0.9"))
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_ARTIFACT_SUFFIXES = (".html", ".md", ".json", ".png", ".txt")
+OUTPUT_PROTECTED_DIRS = tuple(
+    d.strip() for d in os.getenv("DISK_QUOTA_PROTECTED_DIRS", "dashboard").split(",") if d.strip()
+)
+
+
+class TrackedRoot:
+    """Index of one directory tree: per-file size and mtime, per-directory and per-subdirectory totals."""
+
+    def __init__(self, name: str, path: str, quota_bytes: int = 0,
+                 cleanup_filter: Optional[Callable[[str], bool]] = None):
+        self.name = name
+        self.path = os.path.abspath(path)
+        self.quota_bytes = quota_bytes
+        self.cleanup_filter = cleanup_filter
+        self.files: Dict[str, Tuple[int, float]] = {}
+        self.dir_mtimes: Dict[str, float] = {}
+        self.children: Dict[str, List[int]] = {}
+        self.bytes = 0
+        self.file_count = 0
+        self.scanned_at: Optional[float] = None
+        self.updated_at: Optional[float] = None
+
+    def child_of(self, path: str) -> str:
+        """Top-level subdirectory of the root that path is in; "." for files directly in the root."""
+        relative = os.path.relpath(path, self.path)
+        head = relative.split(os.sep, 1)
+        return head[0] if len(head) > 1 else "."
+
+    def add(self, path: str, size: int, mtime: float):
+        previous = self.files.get(path)
+        child = self.children.setdefault(self.child_of(path), [0, 0])
+        if previous is None:
+            self.file_count += 1
+            child[1] += 1
+            delta = size
+        else:
+            delta = size - previous[0]
+        self.files[path] = (size, mtime)
+        self.bytes += delta
+        child[0] += delta
+        self.updated_at = time.time()
+
+    def discard(self, path: str) -> int:
+        previous = self.files.pop(path, None)
+        if previous is None:
+            return 0
+        child = self.children[self.child_of(path)]
+        self.bytes -= previous[0]
+        self.file_count -= 1
+        child[0] -= previous[0]
+        child[1] -= 1
+        self.updated_at = time.time()
+        return previous[0]
+
+
+_roots: Dict[str, TrackedRoot] = {}
+_lock = threading.RLock()
+# One scan per root at a time; a second caller waits for it and reuses the result
+_scan_locks: Dict[str, threading.Lock] = {}
+
+
+def register_root(name: str, path: str, quota_mb: float = 0,
+                  cleanup_filter: Optional[Callable[[str], bool]] = None) -> TrackedRoot:
+    """Register (or re-register with new settings) a directory tree to account for. Does not scan it."""
+    path = os.path.abspath(path)
+    with _lock:
+        root = _roots.get(name)
+        if root is None or root.path != path:
+            root = TrackedRoot(name, path)
+            _roots[name] = root
+            _scan_locks.setdefault(name, threading.Lock())
+        root.quota_bytes = int(quota_mb * 1024 * 1024)
+        root.cleanup_filter = cleanup_filter
+        return root
+
+
+def _is_output_artifact(path: str) -> bool:
+    return path.endswith(OUTPUT_ARTIFACT_SUFFIXES)
+
+
+def _is_rotated_log(path: str) -> bool:
+    # name.log.N.gz; the live .log files are never cleaned up
+    return path.endswith(".gz")
+
+
+def register_default_roots(ai_dir: str = AI_DIR, vectordb_path: Optional[str] = None):
+    """Register output/ and logs/ with their quotas, and the Qdrant storage directory if given."""
+    register_root("output", os.path.join(ai_dir, "output"), OUTPUT_QUOTA_MB, _is_output_artifact)
+    register_root("logs", os.path.join(ai_dir, "logs"), LOGS_QUOTA_MB, _is_rotated_log)
+    if vectordb_path:
+        register_root("vectordb", vectordb_path)
+
+
+def _root_for(path: str) -> Optional[TrackedRoot]:
+    path = os.path.abspath(path)
+    with _lock:
+        for root in _roots.values():
+            if root.scanned_at is not None and (path == root.path or path.startswith(root.path + os.sep)):
+                return root
+    return None
+
+
+def _list_directory(directory: str) -> Tuple[Dict[str, Tuple[int, float]], List[str]]:
+    """Files (path -> (size, mtime)) and subdirectories directly in directory."""
+    files, subdirs = {}, []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        files[entry.path] = (stat.st_size, stat.st_mtime)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def _scan(root: TrackedRoot):
+    started = time.perf_counter()
+    fresh = TrackedRoot(root.name, root.path)
+    pending = [root.path] if os.path.isdir(root.path) else []
+    while pending:
+        directory = pending.pop()
+        try:
+            fresh.dir_mtimes[directory] = os.stat(directory).st_mtime
+        except OSError:
+            continue
+        files, subdirs = _list_directory(directory)
+        for path, (size, mtime) in files.items():
+            fresh.add(path, size, mtime)
+        pending.extend(subdirs)
+    with _lock:
+        root.files, root.dir_mtimes, root.children = fresh.files, fresh.dir_mtimes, fresh.children
+        root.bytes, root.file_count = fresh.bytes, fresh.file_count
+        root.scanned_at = root.updated_at = time.time()
+    logger.info(f"Indexed {root.file_count} files ({root.bytes / 1024 / 1024:.1f} MB) under {root.path} "
+                f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+def scan_root(name: str) -> Dict[str, Any]:
+    """Index the whole tree of a root from scratch and swap it in."""
+    with _lock:
+        root = _roots[name]
+    with _scan_locks[name]:
+        _scan(root)
+    return usage(name)
+
+
+def ensure_scanned(name: str) -> Dict[str, Any]:
+    """usage() of a root, scanning it first if it has never been indexed."""
+    with _lock:
+        root = _roots[name]
+    if root.scanned_at is None:
+        with _scan_locks[name]:
+            # Another caller may have finished the first scan while we waited
+            if root.scanned_at is None:
+                _scan(root)
+    return usage(name)
+
+
+def poll_root(name: str) -> int:
+    """
+    Re-list only the directories whose mtime changed since the last scan or
+    poll (a file was created, deleted or renamed in them) and apply the
+    difference. Returns the number of files added, removed or resized.
+    """
+    with _lock:
+        root = _roots[name]
+        if root.scanned_at is None:
+            return 0
+        known_dirs = dict(root.dir_mtimes)
+    known_subdirs: Dict[str, List[str]] = {}
+    for directory in known_dirs:
+        if directory != root.path:
+            known_subdirs.setdefault(os.path.dirname(directory), []).append(directory)
+    changes = 0
+    pending = [root.path] if os.path.isdir(root.path) else []
+    seen_dirs = set()
+    while pending:
+        directory = pending.pop()
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            continue
+        seen_dirs.add(directory)
+        if known_dirs.get(directory) == mtime:
+            # Unchanged listing: only its subdirectories need checking
+            pending.extend(known_subdirs.get(directory, []))
+            continue
+        files, subdirs = _list_directory(directory)
+        with _lock:
+            for path in [p for p in root.files if os.path.dirname(p) == directory and p not in files]:
+                root.discard(path)
+                changes += 1
+            for path, (size, file_mtime) in files.items():
+                if root.files.get(path, (None,))[0] != size:
+                    changes += 1
+                root.add(path, size, file_mtime)
+            root.dir_mtimes[directory] = mtime
+        pending.extend(subdirs)
+    with _lock:
+        for directory in [d for d in root.dir_mtimes if d not in seen_dirs]:
+            del root.dir_mtimes[directory]
+            for path in [p for p in root.files if os.path.dirname(p) == directory]:
+                root.discard(path)
+                changes += 1
+    return changes
+
+
+def record_write(path: str):
+    """Account for a file just written (or overwritten) by this process."""
+    root = _root_for(path)
+    if root is None:
+        return
+    try:
+        stat = os.stat(path)
+    except OSError:
+        record_delete(path)
+        return
+    with _lock:
+        root.add(os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+
+def record_delete(path: str):
+    """Account for a file just deleted by this process."""
+    root = _root_for(path)
+    if root is None:
+        return
+    with _lock:
+        root.discard(os.path.abspath(path))
+
+
+def usage(name: str) -> Optional[Dict[str, Any]]:
+    """Byte and file counts of a root and of each of its top-level subdirectories, from the index."""
+    with _lock:
+        root = _roots.get(name)
+        if root is None or root.scanned_at is None:
+            return None
+        return {
+            "path": root.path,
+            "bytes": root.bytes,
+            "files": root.file_count,
+            "quota_bytes": root.quota_bytes or None,
+            "over_quota": bool(root.quota_bytes) and root.bytes > root.quota_bytes,
+            "directories": {child: {"bytes": b, "files": n} for child, (b, n) in root.children.items() if n},
+            "scanned_at": datetime.fromtimestamp(root.scanned_at).isoformat(),
+            "updated_at": datetime.fromtimestamp(root.updated_at).isoformat(),
+        }
+
+
+def all_usage() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        names = list(_roots)
+    return {name: u for name in names if (u := usage(name)) is not None}
+
+
+def tracked_files(name: str, predicate: Optional[Callable[[str], bool]] = None,
+                  under: Optional[str] = None, rescan: bool = False) -> List[Tuple[str, int, float]]:
+    """
+    (path, size, mtime) of indexed files of a root, optionally filtered by a path predicate and subdirectory.
+
+    The index can be up to DISK_USAGE_POLL_SECONDS behind writers in other
+    processes; rescan=True re-indexes the root first, for callers that must
+    see every file on disk (the clear endpoints).
+    """
+    if rescan:
+        scan_root(name)
+    else:
+        ensure_scanned(name)
+    with _lock:
+        root = _roots[name]
+        prefix = os.path.abspath(under) + os.sep if under else None
+        return [(path, size, mtime) for path, (size, mtime) in root.files.items()
+                if (prefix is None or path.startswith(prefix)) and (predicate is None or predicate(path))]
+
+
+def remove_files(paths: Iterable[str]) -> Tuple[int, int]:
+    """Delete files and account for them. Returns (deleted count, bytes freed)."""
+    deleted, freed = 0, 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            record_delete(path)
+            continue
+        except OSError as e:
+            logger.error(f"Error deleting file {path}: {str(e)}")
+            continue
+        record_delete(path)
+        deleted += 1
+        freed += size
+        logger.debug(f"Deleted file: {path}")
+    return deleted, freed
+
+
+def prune_empty_dirs(path: str) -> int:
+    """Remove empty subdirectories of path, deepest first (path itself is kept)."""
+    removed = 0
+    for root, dirs, _ in os.walk(path, topdown=False):
+        for directory in dirs:
+            dir_path = os.path.join(root, directory)
+            try:
+                if not os.listdir(dir_path):
+                    os.rmdir(dir_path)
+                    removed += 1
+                    logger.debug(f"Deleted directory: {dir_path}")
+            except OSError as e:
+                logger.error(f"Error deleting directory {dir_path}: {str(e)}")
+    with _lock:
+        for root in _roots.values():
+            for directory in [d for d in root.dir_mtimes if not os.path.isdir(d)]:
+                del root.dir_mtimes[directory]
+    return removed
+
+
+def enforce_quota(name: str) -> Dict[str, int]:
+    """
+    If a root is over its quota, delete its oldest cleanup-eligible files
+    until it is under DISK_QUOTA_TARGET_RATIO of the quota.
+    """
+    with _lock:
+        root = _roots[name]
+        if not root.quota_bytes or root.scanned_at is None or root.bytes <= root.quota_bytes:
+            return {"deleted": 0, "bytes_freed": 0}
+        target = int(root.quota_bytes * DISK_QUOTA_TARGET_RATIO)
+        protected = tuple(os.path.join(root.path, d) + os.sep for d in OUTPUT_PROTECTED_DIRS) if name == "output" else ()
+        candidates = sorted(
+            (mtime, path, size) for path, (size, mtime) in root.files.items()
+            if (root.cleanup_filter is None or root.cleanup_filter(path)) and not path.startswith(protected)
+        )
+        excess = root.bytes - target
+    doomed = []
+    for _, path, size in candidates:
+        if excess <= 0:
+            break
+        doomed.append(path)
+        excess -= size
+    deleted, freed = remove_files(doomed)
+    logger.warning(f"{name} was over its {root.quota_bytes / 1024 / 1024:.0f} MB quota; "
+                   f"deleted the {deleted} oldest files ({freed / 1024 / 1024:.1f} MB)")
+    return {"deleted": deleted, "bytes_freed": freed}
+
+
+def maintain() -> Dict[str, Any]:
+    """One watcher pass over every root: index or poll it (rescanning fully when due), then enforce its quota."""
+    with _lock:
+        names = list(_roots)
+    results = {}
+    for name in names:
+        with _lock:
+            scanned_at = _roots[name].scanned_at
+        if scanned_at is None or time.time() - scanned_at > DISK_USAGE_FULL_SCAN_SECONDS:
+            scan_root(name)
+            changes = None
+        else:
+            changes = poll_root(name)
+        results[name] = {"changes": changes, **enforce_quota(name)}
+    return results
@@ -0,0 +1,325 @@
+"""
+Local registry and batch publisher for Datawrapper charts.
+
+Every chart the reports embed is described by a logical key (for example
+"time_series:4:0:month" or "anomaly:27338"), its CSV data and its
+configuration (title, type and the metadata PATCH payload). The registry
+remembers which Datawrapper chart was published for each key together with
+hashes of the data and config, so that:
+
+- a key whose data and config are unchanged is reused without any API round-trips,
+- a chart whose data changed only gets its data re-uploaded and republished,
+- only genuinely new charts go through create, upload, update and publish.
+
+All Datawrapper calls go through dw_call(), which shares one pooled HTTP
+session and a rate limiter between threads, so publish_many() can expand the
+charts of a whole report concurrently without tripping the API rate limit.
+A chart is only recorded in the registry once every call that built it
+succeeded, so a failed upload or publish is retried on the next run.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DW_API_BASE_URL = "https://api.datawrapper.de/v3"
+DW_MAX_WORKERS = int(os.getenv("DATAWRAPPER_MAX_WORKERS", "8"))
+DW_REQUESTS_PER_SECOND = float(os.getenv("DATAWRAPPER_REQUESTS_PER_SECOND", "5"))
+
+_ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REGISTRY_PATH = os.path.join(_ai_dir, "data", "datawrapper_registry.json")
+
+
+def get_dw_api_base_url() -> str:
+    """Datawrapper API base URL; overridable so tests can point at a local fake server."""
+    return os.getenv("DATAWRAPPER_API_BASE_URL", DEFAULT_DW_API_BASE_URL).rstrip("/")
+
+
+class RateLimiter:
+    """Thread-safe token bucket limiting requests per second."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_session = None
+_session_lock = threading.Lock()
+_rate_limiter = RateLimiter(DW_REQUESTS_PER_SECOND)
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(DW_MAX_WORKERS, 4))
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def dw_call(method, endpoint, headers=None, data=None, json_payload=None) -> Tuple[bool, Any]:
+    """
+    Make a rate-limited request to the Datawrapper API over the shared session.
+
+    Returns (ok, body): ok is False for HTTP and connection errors (which are
+    logged); body is the parsed JSON, the raw text for non-JSON bodies, or None
+    for empty responses such as a 204 from a data upload.
+    """
+    api_key = os.getenv("DATAWRAPPER_API_KEY")
+    if not api_key:
+        logger.error("Datawrapper API key is not configured.")
+        return False, None
+
+    url = f"{get_dw_api_base_url()}{endpoint}"
+    request_headers = {"Authorization": f"Bearer {api_key}"}
+    if headers:
+        request_headers.update(headers)
+
+    _rate_limiter.acquire()
+    try:
+        response = _get_session().request(method, url, headers=request_headers, data=data, json=json_payload, timeout=60)
+        response.raise_for_status()
+
+        if response.content:
+            try:
+                return True, response.json()
+            except json.JSONDecodeError:
+                logger.info(f"Response from {method} {url} was not JSON, returning raw content.")
+                return True, response.text
+        return True, None
+
+    except requests.exceptions.HTTPError as e:
+        logger.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request failed: {e}")
+    return False, None
+
+
+def dw_request(method, endpoint, headers=None, data=None, json_payload=None):
+    """
+    Make a rate-limited request to the Datawrapper API over the shared session.
+
+    Returns the parsed JSON body, the raw text for non-JSON bodies, or None for
+    empty responses and errors (which are logged), matching _make_dw_request.
+    Use dw_call() where an empty success must be told apart from a failure.
+    """
+    return dw_call(method, endpoint, headers=headers, data=data, json_payload=json_payload)[1]
+
+
+def _hash(value: Any) -> str:
+    if not isinstance(value, (str, bytes)):
+        value = json.dumps(value, sort_keys=True, default=str)
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+
+class ChartRegistry:
+    """
+    JSON-file registry of published Datawrapper charts.
+
+    Layout: {"charts": {key: entry}} where an entry holds chart_id,
+    public_url, data_hash, config_hash and updated_at.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("DATAWRAPPER_REGISTRY_PATH", DEFAULT_REGISTRY_PATH)
+        self.lock = threading.RLock()
+        self.charts = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            self.charts = stored.get("charts", {})
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read Datawrapper registry {self.path}, starting empty: {e}")
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"charts": self.charts}, f, indent=2)
+            os.replace(temp_path, self.path)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.charts.get(key)
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        with self.lock:
+            self.charts[key] = entry
+            self.save()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ChartRegistry:
+    """Return the process-wide chart registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ChartRegistry()
+        return _registry
+
+
+def _extract_public_url(response) -> Optional[str]:
+    if not isinstance(response, dict):
+        return None
+    public_url = response.get("publicUrl")
+    data = response.get("data")
+    if not public_url and isinstance(data, list) and data:
+        public_url = data[0].get("publicUrl")
+    elif not public_url and isinstance(data, dict):
+        public_url = data.get("publicUrl")
+    return public_url
+
+
+def _publish(chart_id: str) -> Optional[str]:
+    ok, publish_response = dw_call("POST", f"/charts/{chart_id}/publish")
+    if not ok:
+        return None
+    public_url = _extract_public_url(publish_response)
+    if not public_url:
+        logger.info("Public URL not found directly in publish response, attempting to retrieve chart details...")
+        public_url = _extract_public_url(dw_request("GET", f"/charts/{chart_id}"))
+    return public_url
+
+
+def publish_chart(key: str, title: str, csv_data: str, customization: Dict[str, Any],
+                  chart_type: str = "d3-lines", registry: Optional[ChartRegistry] = None) -> Optional[str]:
+    """
+    Publish a chart through the registry, doing only the API calls that are needed.
+
+    Args:
+        key: Logical chart key, e.g. "time_series:4:0:month"
+        title: Chart title
+        csv_data: CSV body uploaded to /charts/{id}/data
+        customization: Payload for PATCH /charts/{id} (the "metadata" block)
+        chart_type: Datawrapper chart type
+        registry: Registry to use (defaults to the process-wide one)
+
+    Returns:
+        str: Public URL of the published chart, or None if publishing failed
+    """
+    registry = registry or get_registry()
+    config = {"title": title, "type": chart_type, "customization": customization}
+    config_hash = _hash(config)
+    data_hash = _hash(csv_data)
+
+    # 1. Same chart already published under this key
+    entry = registry.get(key)
+    if entry and entry.get("config_hash") == config_hash and entry.get("data_hash") == data_hash and entry.get("public_url"):
+        logger.info(f"Reusing published Datawrapper chart {entry['chart_id']} for {key}")
+        return entry["public_url"]
+
+    upload_headers = {"Content-Type": "text/csv"}
+    chart_id = entry.get("chart_id") if entry else None
+
+    if chart_id:
+        # 2. Existing chart: update config only if it changed, then replace the data
+        calls = []
+        if entry.get("config_hash") != config_hash:
+            logger.info(f"Updating Datawrapper chart {chart_id} configuration for {key}")
+            calls.append(("PATCH", f"/charts/{chart_id}", {"json_payload": dict(customization, title=title)}))
+        logger.info(f"Updating Datawrapper chart {chart_id} data for {key}")
+        calls.append(("PUT", f"/charts/{chart_id}/data", {"headers": upload_headers, "data": csv_data.encode("utf-8")}))
+    else:
+        # 3. New chart: create, upload, customize
+        logger.info(f"Creating new Datawrapper chart for {key}")
+        ok, created_chart_info = dw_call("POST", "/charts", json_payload={"title": title, "type": chart_type})
+        if not ok or not isinstance(created_chart_info, dict) or "id" not in created_chart_info:
+            logger.error("Failed to create Datawrapper chart.")
+            return None
+        chart_id = created_chart_info["id"]
+        calls = [
+            ("PUT", f"/charts/{chart_id}/data", {"headers": upload_headers, "data": csv_data.encode("utf-8")}),
+            ("PATCH", f"/charts/{chart_id}", {"json_payload": customization}),
+        ]
+
+    for method, endpoint, kwargs in calls:
+        ok, _ = dw_call(method, endpoint, **kwargs)
+        if not ok:
+            logger.error(f"{method} {endpoint} failed for {key}; not recording the chart.")
+            return None
+
+    public_url = _publish(chart_id)
+    if not public_url:
+        logger.error(f"Failed to retrieve public URL for chart ID: {chart_id} after publishing.")
+        return None
+
+    registry.put(key, {
+        "chart_id": chart_id,
+        "public_url": public_url,
+        "config_hash": config_hash,
+        "data_hash": data_hash,
+        "updated_at": datetime.now().isoformat()
+    })
+    logger.info(f"Chart published successfully! Public URL: {public_url}")
+    return public_url
+
+
+def publish_many(tasks: Dict[Any, Callable[[], Optional[str]]], max_workers: Optional[int] = None) -> Dict[Any, Optional[str]]:
+    """
+    Run chart-publishing callables concurrently.
+
+    Args:
+        tasks: Mapping of reference key -> zero-argument callable returning a chart URL
+        max_workers: Thread pool size (defaults to DATAWRAPPER_MAX_WORKERS)
+
+    Returns:
+        dict: reference key -> chart URL (None where the callable failed)
+    """
+    if not tasks:
+        return {}
+
+    def run(key, task):
+        try:
+            return task()
+        except Exception as e:
+            logger.error(f"Error publishing Datawrapper chart for {key}: {e}")
+            return None
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=min(max_workers or DW_MAX_WORKERS, len(tasks))) as executor:
+        futures = {key: executor.submit(run, key, task) for key, task in tasks.items()}
+        results = {key: future.result() for key, future in futures.items()}
+
+    logger.info(f"Published {sum(1 for url in results.values() if url)}/{len(tasks)} Datawrapper charts in {time.time() - started:.1f}s")
+    return results
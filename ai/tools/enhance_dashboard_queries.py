@@ -5,6 +5,11 @@ import re
 import logging
 from pathlib import Path
 
+try:
+    from tools.log_utils import rotating_file_handler
+except ImportError:  # run as a script from the tools directory
+    from log_utils import rotating_file_handler
+
 # Configure logging
 script_dir = os.path.dirname(os.path.abspath(__file__))
 logs_dir = os.path.join(script_dir, '..', 'logs')
@@ -14,7 +19,7 @@ logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(os.path.join(logs_dir, "enhance_dashboard_queries.log")),
+        rotating_file_handler(os.path.join(logs_dir, "enhance_dashboard_queries.log")),
         logging.StreamHandler()
     ]
 )
@@ -0,0 +1,478 @@
+"""
+Concurrent eval runs of the chat agents, with latency, token and cost accounting.
+
+evals.run_and_get_tool_calls runs one query at a time and only keeps a
+pretty-printed session log. run_suite() runs a whole suite of cases
+concurrently against one agent (optionally with another model or
+instructions) and records, per case:
+
+- every model call of every turn: latency, prompt and completion tokens
+  and their cost, captured by wrapping the Swarm client's
+  get_chat_completion
+- every tool call: status and latency, from the agent_runtime tool log of
+  the case's session
+- which tools were called and whether the case's expectations held
+
+Each run is written to one file in EVAL_RESULTS_DIR, JSON lines (a run
+header then one line per case) or Parquet. compare_runs() diffs two runs
+and flags regressions in latency, tokens, cost and pass rate beyond the
+EVAL_REGRESSION_* thresholds, so a prompt or instruction change that makes
+chat slower or more expensive shows up before it is deployed:
+
+    python -m tools.eval_runner run --agent analyst --model gpt-4o-mini
+    python -m tools.eval_runner compare logs/evals/runs/<baseline>.jsonl logs/evals/runs/<candidate>.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import statistics
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+
+from tools.agent_runtime import parallel_tool_calls, tool_call_log
+from tools.concurrency import run_concurrently
+from tools.llm_cache import usage_tokens
+
+logger = logging.getLogger(__name__)
+
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "4"))
+EVAL_MAX_TURNS = int(os.getenv("EVAL_MAX_TURNS", "5"))
+EVAL_CASE_TIMEOUT_SECONDS = float(os.getenv("EVAL_CASE_TIMEOUT_SECONDS", "300"))
+EVAL_RESULTS_DIR = os.getenv("EVAL_RESULTS_DIR", os.path.join(AI_DIR, "logs", "evals", "runs"))
+# Relative increases (0.2 = 20%) that count as a regression, and the allowed pass-rate drop
+EVAL_REGRESSION_LATENCY = float(os.getenv("EVAL_REGRESSION_LATENCY", "0.2"))
+EVAL_REGRESSION_TOKENS = float(os.getenv("EVAL_REGRESSION_TOKENS", "0.1"))
+EVAL_REGRESSION_COST = float(os.getenv("EVAL_REGRESSION_COST", "0.1"))
+EVAL_REGRESSION_PASS_RATE = float(os.getenv("EVAL_REGRESSION_PASS_RATE", "0.0"))
+
+# USD per million (prompt, completion) tokens; versioned model names match by prefix
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "o3-mini": (1.10, 4.40),
+    "o4-mini": (1.10, 4.40),
+}
+
+# The queries of the evals.py tests, with what each one should and should not do
+DEFAULT_SUITE = [
+    {"id": "set_dataset_police_misconduct",
+     "query": "Please search for a dataset about Police Misconduct and then set the dataset to select everything "
+              "from that endpoint for the period of Septmeber 2024 to October 2024.",
+     "expect_tools": ["set_dataset"]},
+    {"id": "set_dataset_retail_businesses",
+     "query": "What are the names of the last 5 Retail businesses locations registered in SF?",
+     "expect_tools": ["set_dataset"]},
+    {"id": "no_dataset_mayor", "query": "Hi, who is the mayor of SF?", "forbid_tools": ["set_dataset"]},
+    {"id": "no_dataset_weather", "query": "What is happening with the weather in SF?", "forbid_tools": ["set_dataset"]},
+]
+
+RUN_FORMATS = ("jsonl", "parquet")
+
+
+def parse_model_prices(spec: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    """Parse "model=prompt/completion,..." (USD per million tokens); bad entries are ignored."""
+    prices = {}
+    for part in (spec or "").split(","):
+        name, _, value = part.partition("=")
+        prompt, _, completion = value.partition("/")
+        try:
+            prices[name.strip()] = (float(prompt), float(completion))
+        except ValueError:
+            continue
+    prices.pop("", None)
+    return prices
+
+
+MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **parse_model_prices(os.getenv("EVAL_MODEL_PRICES"))}
+
+
+def model_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Cost in USD of one call, or None for a model with no known price."""
+    if not model:
+        return None
+    matches = [name for name in MODEL_PRICES if model == name or model.startswith(f"{name}-")]
+    if not matches:
+        return None
+    prompt_price, completion_price = MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+# --- Instrumentation ---------------------------------------------------------
+
+_model_calls: Dict[str, List[Dict[str, Any]]] = {}
+_model_calls_lock = threading.Lock()
+
+
+def instrument(client):
+    """
+    Make a Swarm client record the latency and token usage of each model call
+    under the session_id of its context variables; see model_calls(). Tool
+    calls run concurrently and are logged per session as well.
+    """
+    if getattr(client, "_eval_instrumented", False):
+        return client
+    client = parallel_tool_calls(client)
+    get_chat_completion = client.get_chat_completion
+
+    def timed_chat_completion(agent, history, context_variables, model_override, stream, debug):
+        started = time.perf_counter()
+        completion = get_chat_completion(agent, history, context_variables, model_override, stream, debug)
+        latency = time.perf_counter() - started
+        prompt_tokens, completion_tokens = usage_tokens(getattr(completion, "usage", None))
+        model = getattr(completion, "model", None) or model_override or getattr(agent, "model", None)
+        entry = {
+            "model": model,
+            "latency_ms": round(latency * 1000),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": model_cost(model, prompt_tokens, completion_tokens),
+        }
+        with _model_calls_lock:
+            _model_calls.setdefault((context_variables or {}).get("session_id") or "default", []).append(entry)
+        return completion
+
+    client.get_chat_completion = timed_chat_completion
+    client._eval_instrumented = True
+    return client
+
+
+def model_calls(session_id: str) -> List[Dict[str, Any]]:
+    """The model calls recorded for a session, oldest first; clears them."""
+    with _model_calls_lock:
+        return _model_calls.pop(session_id, [])
+
+
+def make_client():
+    from swarm import Swarm
+    return instrument(Swarm())
+
+
+def resolve_agent(name: str, instructions: Optional[str] = None):
+    """
+    A chat agent by name ("analyst" -> webChat.analyst_agent, "Researcher" ->
+    webChat.Researcher_agent), optionally with replacement instructions.
+    """
+    import webChat
+    agent = getattr(webChat, f"{name}_agent", None)
+    if agent is None:
+        candidates = {key[:-6].lower(): value for key, value in vars(webChat).items() if key.endswith("_agent")}
+        agent = candidates.get(name.lower())
+    if agent is None:
+        raise ValueError(f"Unknown agent {name!r}")
+    if instructions is not None:
+        agent = agent.model_copy(update={"instructions": instructions})
+    return agent
+
+
+# --- Running -----------------------------------------------------------------
+
+def _final_text(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "assistant" and message.get("content"):
+            return message["content"]
+    return ""
+
+
+def _case_passed(case: Dict[str, Any], tools: List[str]) -> bool:
+    called = set(tools)
+    return (all(tool in called for tool in case.get("expect_tools", ()))
+            and not any(tool in called for tool in case.get("forbid_tools", ())))
+
+
+def run_case(client, agent, case: Dict[str, Any], run_id: str, model: Optional[str] = None,
+             context: Optional[Dict[str, Any]] = None, max_turns: int = EVAL_MAX_TURNS) -> Dict[str, Any]:
+    """Run one eval case to completion and return its result row."""
+    session_id = f"eval-{run_id}-{case['id']}"
+    context_variables = {**(context or {}), "session_id": session_id}
+    messages = [{"role": "user", "content": case["query"]}]
+    row = {"type": "case", "run_id": run_id, "case_id": case["id"], "query": case["query"],
+           "agent": getattr(agent, "name", None), "status": "ok", "error": None}
+    started = time.perf_counter()
+    try:
+        response = client.run(agent=agent, messages=messages, context_variables=context_variables,
+                              model_override=model, max_turns=case.get("max_turns", max_turns))
+        response_messages = response.messages
+    except Exception as e:
+        logger.error(f"Eval case {case['id']} failed: {e}")
+        row.update(status="error", error=f"{type(e).__name__}: {e}")
+        response_messages = []
+    row["wall_ms"] = round((time.perf_counter() - started) * 1000)
+
+    calls = model_calls(session_id)
+    tools = tool_call_log(session_id)
+    tool_names = [call["function"]["name"] for message in response_messages
+                  for call in (message.get("tool_calls") or [])]
+    costs = [call["cost_usd"] for call in calls]
+    row.update({
+        "model": calls[-1]["model"] if calls else model or getattr(agent, "model", None),
+        "model_calls": calls,
+        "tool_calls": tools,
+        "tools": tool_names,
+        "turns": len(calls),
+        "model_ms": sum(call["latency_ms"] for call in calls),
+        "tool_ms": sum(call["latency_ms"] for call in tools),
+        "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+        "completion_tokens": sum(call["completion_tokens"] for call in calls),
+        "cost_usd": round(sum(costs), 6) if costs and None not in costs else None,
+        "passed": row["status"] == "ok" and _case_passed(case, tool_names),
+        "response": _final_text(response_messages)[:2000],
+    })
+    return row
+
+
+def write_run(path: str, header: Dict[str, Any], rows: List[Dict[str, Any]]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.endswith(".parquet"):
+        import pandas as pd
+        frame = pd.DataFrame(rows)
+        for column in ("model_calls", "tool_calls", "tools"):
+            if column in frame:
+                frame[column] = frame[column].map(json.dumps)
+        for key, value in header.items():
+            frame[f"run_{key}"] = json.dumps(value) if isinstance(value, (dict, list)) else value
+        frame.to_parquet(path, index=False)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def load_run(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """(header, case rows) of a run file written by run_suite."""
+    if path.endswith(".parquet"):
+        import pandas as pd
+        frame = pd.read_parquet(path)
+        header_columns = [c for c in frame.columns if c.startswith("run_")]
+        header = {c[4:]: frame[c].iloc[0] for c in header_columns} if len(frame) else {}
+        rows = frame.drop(columns=header_columns).to_dict(orient="records")
+        for row in rows:
+            for column in ("model_calls", "tool_calls", "tools"):
+                if isinstance(row.get(column), str):
+                    row[column] = json.loads(row[column])
+        return header, rows
+    header, rows = {}, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("type") == "run":
+                header = record
+            else:
+                rows.append(record)
+    return header, rows
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Run-level totals and percentiles."""
+    if not rows:
+        return {"cases": 0}
+    walls = sorted(row["wall_ms"] for row in rows)
+    costs = [row.get("cost_usd") for row in rows]
+    return {
+        "cases": len(rows),
+        "passed": sum(1 for row in rows if row.get("passed")),
+        "errors": sum(1 for row in rows if row.get("status") != "ok"),
+        "pass_rate": round(sum(1 for row in rows if row.get("passed")) / len(rows), 3),
+        "wall_ms_p50": round(statistics.median(walls)),
+        "wall_ms_p95": walls[min(len(walls) - 1, int(round(0.95 * (len(walls) - 1))))],
+        "model_ms": sum(row.get("model_ms", 0) for row in rows),
+        "tool_ms": sum(row.get("tool_ms", 0) for row in rows),
+        "turns": sum(row.get("turns", 0) for row in rows),
+        "prompt_tokens": sum(row.get("prompt_tokens", 0) for row in rows),
+        "completion_tokens": sum(row.get("completion_tokens", 0) for row in rows),
+        "cost_usd": round(sum(costs), 6) if None not in costs else None,
+    }
+
+
+def run_suite(agent, suite: Optional[List[Dict[str, Any]]] = None, client=None, model: Optional[str] = None,
+              workers: int = EVAL_WORKERS, context: Optional[Dict[str, Any]] = None,
+              results_dir: str = EVAL_RESULTS_DIR, run_format: str = "jsonl",
+              label: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run every case of a suite concurrently and write the run file.
+
+    Args:
+        agent: The Swarm agent under test
+        suite: Cases {"id", "query", "expect_tools"?, "forbid_tools"?, "max_turns"?}; DEFAULT_SUITE if None
+        client: A Swarm client; a new instrumented one if None
+        model: Model override for every call
+        workers: Cases in flight at once
+        context: Context variables every case starts from (copied per case)
+        results_dir: Where the run file goes
+        run_format: "jsonl" or "parquet"
+        label: Free-form note stored in the run header (a branch or prompt version)
+
+    Returns:
+        dict: {"run_id", "path", "summary", "rows"}
+    """
+    if run_format not in RUN_FORMATS:
+        raise ValueError(f"Unknown run format {run_format!r}; expected one of {RUN_FORMATS}")
+    suite = suite or DEFAULT_SUITE
+    client = instrument(client) if client is not None else make_client()
+    run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    instructions = getattr(agent, "instructions", None)
+    header = {
+        "type": "run",
+        "run_id": run_id,
+        "started_at": datetime.now().isoformat(),
+        "agent": getattr(agent, "name", None),
+        "model": model or getattr(agent, "model", None),
+        "instructions_chars": len(instructions) if isinstance(instructions, str) else None,
+        "cases": len(suite),
+        "workers": workers,
+        "label": label,
+    }
+    started = time.perf_counter()
+    results = run_concurrently(lambda case: run_case(client, agent, case, run_id, model, context),
+                               suite, max_workers=workers, timeout=EVAL_CASE_TIMEOUT_SECONDS, name="eval case")
+    rows = []
+    for task in results:
+        if task.ok:
+            rows.append(task.result)
+        else:
+            rows.append({"type": "case", "run_id": run_id, "case_id": task.item["id"], "query": task.item["query"],
+                         "status": "error", "error": f"{type(task.error).__name__}: {task.error}",
+                         "wall_ms": round(task.elapsed * 1000), "passed": False})
+    header["wall_ms"] = round((time.perf_counter() - started) * 1000)
+    header["summary"] = summarize(rows)
+    path = os.path.join(results_dir, f"{run_id}.{'parquet' if run_format == 'parquet' else 'jsonl'}")
+    write_run(path, header, rows)
+    logger.info(f"Eval run {run_id}: {header['summary']} -> {path}")
+    return {"run_id": run_id, "path": path, "summary": header["summary"], "rows": rows}
+
+
+# --- Comparing ---------------------------------------------------------------
+
+def _relative_change(baseline, candidate) -> Optional[float]:
+    if baseline is None or candidate is None:
+        return None
+    if baseline == 0:
+        return 0.0 if candidate == 0 else float("inf")
+    return (candidate - baseline) / baseline
+
+
+def compare_runs(baseline_rows: List[Dict[str, Any]], candidate_rows: List[Dict[str, Any]],
+                 latency: float = EVAL_REGRESSION_LATENCY, tokens: float = EVAL_REGRESSION_TOKENS,
+                 cost: float = EVAL_REGRESSION_COST, pass_rate: float = EVAL_REGRESSION_PASS_RATE) -> Dict[str, Any]:
+    """
+    Compare two runs over the cases they share.
+
+    Returns:
+        dict: {"baseline", "candidate" (summaries), "changes" (relative, per
+        metric), "cases" (per-case wall/token changes), "regressions" (messages)}
+    """
+    shared = sorted({row["case_id"] for row in baseline_rows} & {row["case_id"] for row in candidate_rows})
+    base_by_id = {row["case_id"]: row for row in baseline_rows if row["case_id"] in shared}
+    cand_by_id = {row["case_id"]: row for row in candidate_rows if row["case_id"] in shared}
+    base = summarize(list(base_by_id.values()))
+    cand = summarize(list(cand_by_id.values()))
+    if not shared:
+        return {"baseline": base, "candidate": cand, "changes": {}, "cases": {}, "regressions": []}
+
+    thresholds = {"wall_ms_p50": latency, "wall_ms_p95": latency, "prompt_tokens": tokens,
+                  "completion_tokens": tokens, "cost_usd": cost}
+    changes, regressions = {}, []
+    for metric, threshold in thresholds.items():
+        change = _relative_change(base.get(metric), cand.get(metric))
+        changes[metric] = None if change is None else round(change, 3)
+        if change is not None and change > threshold:
+            regressions.append(f"{metric} rose {change:+.0%} ({base[metric]} -> {cand[metric]}), "
+                               f"threshold {threshold:.0%}")
+    changes["pass_rate"] = round(cand["pass_rate"] - base["pass_rate"], 3)
+    if base["pass_rate"] - cand["pass_rate"] > pass_rate:
+        regressions.append(f"pass_rate fell from {base['pass_rate']} to {cand['pass_rate']}")
+
+    cases = {}
+    for case_id in shared:
+        before, after = base_by_id[case_id], cand_by_id[case_id]
+        tokens_before = before.get("prompt_tokens", 0) + before.get("completion_tokens", 0)
+        tokens_after = after.get("prompt_tokens", 0) + after.get("completion_tokens", 0)
+        cases[case_id] = {
+            "wall_ms": [before.get("wall_ms"), after.get("wall_ms")],
+            "tokens": [tokens_before, tokens_after],
+            "passed": [before.get("passed"), after.get("passed")],
+        }
+        if before.get("passed") and not after.get("passed"):
+            regressions.append(f"case {case_id} no longer passes")
+    return {"baseline": base, "candidate": cand, "changes": changes, "cases": cases, "regressions": regressions}
+
+
+def list_runs(results_dir: str = EVAL_RESULTS_DIR) -> List[Dict[str, Any]]:
+    """Headers of the runs in results_dir, most recent first."""
+    runs = []
+    if not os.path.isdir(results_dir):
+        return runs
+    for name in os.listdir(results_dir):
+        if not name.endswith((".jsonl", ".parquet")):
+            continue
+        path = os.path.join(results_dir, name)
+        try:
+            header, rows = load_run(path)
+        except Exception as e:
+            logger.warning(f"Skipping unreadable eval run {path}: {e}")
+            continue
+        runs.append({**header, "file": name, "summary": header.get("summary") or summarize(rows)})
+    runs.sort(key=lambda run: str(run.get("started_at", "")), reverse=True)
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run and compare chat agent evals")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run an eval suite")
+    run.add_argument("--agent", default="analyst")
+    run.add_argument("--model", default=None)
+    run.add_argument("--instructions-file", default=None, help="Replace the agent's instructions")
+    run.add_argument("--suite", default=None, help="JSON file with a list of cases")
+    run.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    run.add_argument("--format", default="jsonl", choices=RUN_FORMATS)
+    run.add_argument("--label", default=None)
+    run.add_argument("--baseline", default=None, help="Run file to compare against; exits 1 on regressions")
+    compare = commands.add_parser("compare", help="Compare two run files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        instructions = None
+        if args.instructions_file:
+            with open(args.instructions_file, encoding="utf-8") as f:
+                instructions = f.read()
+        suite = None
+        if args.suite:
+            with open(args.suite, encoding="utf-8") as f:
+                suite = json.load(f)
+        import webChat
+        result = run_suite(resolve_agent(args.agent, instructions), suite, model=args.model, workers=args.workers,
+                           context={"dataset": webChat.combined_df, "notes": webChat.combined_notes},
+                           run_format=args.format, label=args.label)
+        print(json.dumps({"run_id": result["run_id"], "path": result["path"], "summary": result["summary"]}, indent=2))
+        if not args.baseline:
+            return 0
+        baseline_path, candidate_path = args.baseline, result["path"]
+    else:
+        baseline_path, candidate_path = args.baseline, args.candidate
+
+    comparison = compare_runs(load_run(baseline_path)[1], load_run(candidate_path)[1])
+    print(json.dumps(comparison, indent=2))
+    return 1 if comparison["regressions"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
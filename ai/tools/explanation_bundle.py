@@ -0,0 +1,333 @@
+"""
+Precomputed context bundles for metric-change explanations.
+
+explain_metric_change used to gather its context after the user clicked
+"explain": the dashboard metric JSON from output/dashboard, a Qdrant search
+(with an embedding call) for documentation, then more agent round-trips for
+anomalies and dataset columns. build_explanation_bundles() runs at the end of
+dashboard metric generation and stores, per (metric_id, district,
+period_type), everything the explainer needs:
+
+- metric: the latest values (this year, last year, change, last data date,
+  district breakdown) and the tail of the trend
+- top_groups: the groups contributing most to the change, from the stored
+  anomalies, largest difference first
+- docs: a few short documentation snippets for the metric
+- columns: name, type and description of the metric's dataset columns
+
+Bundles are zlib-compressed JSON rows in one SQLite file
+(EXPLANATION_BUNDLE_PATH), so get_explanation_bundle() is a single indexed
+read.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUNDLE_PATH = os.path.join(_ai_dir, "data", "explanation_bundles.sqlite")
+DASHBOARD_DIR = os.path.join(_ai_dir, "output", "dashboard")
+DATASETS_DIR = os.path.join(_ai_dir, "data", "datasets")
+
+EXPLANATION_BUNDLE_PERIOD_TYPES = tuple(
+    p.strip() for p in os.getenv("EXPLANATION_BUNDLE_PERIOD_TYPES", "month,year").split(",") if p.strip()
+)
+BUNDLE_TOP_GROUPS = int(os.getenv("BUNDLE_TOP_GROUPS", "5"))
+BUNDLE_DOC_SNIPPETS = int(os.getenv("BUNDLE_DOC_SNIPPETS", "3"))
+BUNDLE_SNIPPET_CHARS = 400
+BUNDLE_MAX_COLUMNS = 60
+BUNDLE_TREND_POINTS = 13
+BUNDLE_ANOMALY_COLUMNS = "id, group_field_name, group_value, comparison_mean, recent_mean, difference, out_of_bounds"
+DISTRICTS = range(12)  # 0 is citywide, 1-11 the supervisor districts
+
+
+def bundle_key(metric_id, district, period_type: str) -> Tuple[str, int, str]:
+    """Normalize the ways callers name a metric and district: "12.json", "citywide", "all", "3"."""
+    metric_id = str(metric_id).replace(".json", "")
+    if district in (None, "", "all", "citywide", "all districts"):
+        district = 0
+    return metric_id, int(district), period_type or "month"
+
+
+def metric_values(metric_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The latest values of a dashboard metric file, without its queries and full trend."""
+    this_year, last_year = metric_data.get("thisYear"), metric_data.get("lastYear")
+    values = {
+        "name": metric_data.get("metric_name"),
+        "id": metric_data.get("metric_id"),
+        "category": metric_data.get("category"),
+        "this_year": this_year,
+        "last_year": last_year,
+        "last_data_date": metric_data.get("lastDataDate"),
+    }
+    try:
+        values["delta"] = this_year - last_year
+        values["percent_change"] = round((this_year - last_year) * 100.0 / last_year, 2) if last_year else None
+    except TypeError:
+        values["delta"] = values["percent_change"] = None
+
+    trend = metric_data.get("trend_data") or {}
+    if isinstance(trend, dict):
+        # {"YYYY-MM-DD": value}; keep the most recent points
+        values["trend_tail"] = dict(sorted(trend.items())[-BUNDLE_TREND_POINTS:])
+    if metric_data.get("district_breakdown"):
+        values["district_breakdown"] = metric_data["district_breakdown"]
+    return values
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return round(float(value), 4)
+    except (TypeError, ValueError):
+        return None
+
+
+def top_groups(anomalies: Iterable[Dict[str, Any]], limit: int = BUNDLE_TOP_GROUPS) -> List[Dict[str, Any]]:
+    """The groups of stored anomaly rows with the largest absolute difference from their comparison mean."""
+    groups = []
+    for row in anomalies:
+        difference = _number(row.get("difference"))
+        if difference is None:
+            continue
+        groups.append({
+            "anomaly_id": row.get("id"),
+            "group_field": row.get("group_field_name"),
+            "group_value": row.get("group_value"),
+            "comparison_mean": _number(row.get("comparison_mean")),
+            "recent_mean": _number(row.get("recent_mean")),
+            "difference": difference,
+            "out_of_bounds": row.get("out_of_bounds"),
+        })
+    groups.sort(key=lambda g: abs(g["difference"]), reverse=True)
+    return groups[:limit]
+
+
+def doc_snippets(docs: Optional[Dict[str, Any]], limit: int = BUNDLE_DOC_SNIPPETS) -> List[Dict[str, Any]]:
+    """Short snippets from a query_docs() result: (title, description, endpoint, columns, column names) tuples."""
+    snippets = []
+    for result in (docs or {}).get("results", [])[:limit]:
+        title, description, endpoint = (list(result) + [None, None, None])[:3]
+        description = " ".join(str(description or "").split())
+        if len(description) > BUNDLE_SNIPPET_CHARS:
+            description = description[:BUNDLE_SNIPPET_CHARS] + "..."
+        snippets.append({"title": title, "endpoint": endpoint, "text": description})
+    return snippets
+
+
+def column_metadata(endpoint: Optional[str], datasets_dir: str = DATASETS_DIR) -> List[Dict[str, str]]:
+    """Name, type and description of a dataset's columns, preferring the fixed metadata file."""
+    if not endpoint:
+        return []
+    for path in (os.path.join(datasets_dir, "fixed", f"{endpoint}.json"), os.path.join(datasets_dir, f"{endpoint}.json")):
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not read dataset metadata {path}: {e}")
+                continue
+            columns = metadata.get("columns", metadata.get("fields", [])) if isinstance(metadata, dict) else metadata
+            return [{
+                "name": col.get("fieldName", col.get("name", "unknown")),
+                "type": col.get("dataTypeName", col.get("type", "unknown")),
+                "description": (col.get("description") or "")[:200],
+            } for col in columns[:BUNDLE_MAX_COLUMNS] if isinstance(col, dict)]
+    return []
+
+
+def build_bundle(metric_data: Dict[str, Any], district: int, period_type: str,
+                 anomalies: Iterable[Dict[str, Any]], docs: Optional[Dict[str, Any]],
+                 columns: List[Dict[str, str]], endpoint: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "metric": metric_values(metric_data),
+        "district": district,
+        "period_type": period_type,
+        "endpoint": endpoint,
+        "top_groups": top_groups(anomalies),
+        "docs": doc_snippets(docs),
+        "columns": columns,
+        "built_at": time.time(),
+    }
+
+
+class BundleStore:
+    """SQLite table of compressed bundles keyed by (metric_id, district, period_type)."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("EXPLANATION_BUNDLE_PATH", DEFAULT_BUNDLE_PATH)
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS explanation_bundles (
+                metric_id TEXT NOT NULL,
+                district INTEGER NOT NULL,
+                period_type TEXT NOT NULL,
+                body BLOB NOT NULL,
+                built_at REAL NOT NULL,
+                PRIMARY KEY (metric_id, district, period_type)
+            )
+        """)
+        self.conn.commit()
+
+    def put_many(self, bundles: Dict[Tuple[str, int, str], Dict[str, Any]]):
+        """Replace bundles in one transaction."""
+        rows = [(*key, zlib.compress(json.dumps(bundle, default=str, separators=(",", ":")).encode("utf-8")),
+                 bundle.get("built_at", time.time())) for key, bundle in bundles.items()]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO explanation_bundles (metric_id, district, period_type, body, built_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def get(self, metric_id, district, period_type) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body FROM explanation_bundles WHERE metric_id = ? AND district = ? AND period_type = ?",
+                bundle_key(metric_id, district, period_type)
+            ).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def close(self):
+        self.conn.close()
+
+
+_store: Optional[BundleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_bundle_store() -> BundleStore:
+    """Return the process-wide bundle store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BundleStore()
+        return _store
+
+
+def get_explanation_bundle(metric_id, district=0, period_type: str = "month") -> Optional[Dict[str, Any]]:
+    """The prebuilt bundle for a metric, or None if it has not been built (or the key is malformed)."""
+    try:
+        return get_bundle_store().get(metric_id, district, period_type)
+    except (ValueError, TypeError, sqlite3.Error) as e:
+        logger.warning(f"No explanation bundle for {metric_id}/{district}/{period_type}: {e}")
+        return None
+
+
+def _dashboard_metrics(queries_data: Dict[str, Any]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """(name, id, query data) of every metric in the dashboard queries file."""
+    metrics = []
+    for category in queries_data.values():
+        for subcategory in category.values():
+            for name, query in subcategory.get("queries", {}).items():
+                if isinstance(query, dict) and "id" in query:
+                    metrics.append((name, str(query["id"]), query))
+    return metrics
+
+
+def _default_docs(metric_name: str, period_type: str) -> Dict[str, Any]:
+    from tools.vector_query import query_docs
+    return query_docs({}, collection_name="SFPublicData", query=f"metrics {metric_name} analysis explanation {period_type}")
+
+
+def _anomaly_lookup(connection) -> Callable[[str, int, str], List[Dict[str, Any]]]:
+    """Top stored anomalies of a metric, district and period type, by absolute difference."""
+    from psycopg2.extras import RealDictCursor
+    from tools.anomaly_search import search_anomalies
+
+    def lookup(metric_id, district, period_type):
+        try:
+            return search_anomalies(
+                connection, cursor_factory=RealDictCursor, query_type="by_anomaly_severity",
+                limit=BUNDLE_TOP_GROUPS, object_id=metric_id, district=district, period_type=period_type,
+                only_anomalies=False, columns=BUNDLE_ANOMALY_COLUMNS
+            )
+        except Exception as e:
+            logger.warning(f"Anomaly lookup failed for metric {metric_id}: {e}")
+            connection.rollback()
+            return []
+    return lookup
+
+
+def build_explanation_bundles(queries_data: Dict[str, Any], dashboard_dir: str = DASHBOARD_DIR,
+                              period_types: Iterable[str] = EXPLANATION_BUNDLE_PERIOD_TYPES,
+                              docs_fn: Optional[Callable[[str, str], Dict[str, Any]]] = None,
+                              anomalies_fn: Optional[Callable[[str, int, str], List[Dict[str, Any]]]] = None,
+                              store: Optional[BundleStore] = None) -> Dict[str, Any]:
+    """
+    Build and store a bundle for every metric, district and period type that has
+    a dashboard metric file. Docs and columns are looked up once per metric and
+    shared by its districts; anomalies are read over one database connection.
+
+    Args:
+        queries_data: Parsed dashboard_queries(_enhanced).json
+        dashboard_dir: output/dashboard, holding <district>/<metric id>.json
+        period_types: Anomaly period types to build bundles for
+        docs_fn: Documentation search, called as docs_fn(metric_name, period_type)
+        anomalies_fn: Stored anomaly rows, called as anomalies_fn(metric_id, district, period_type);
+            defaults to searching the anomalies table
+        store: BundleStore to write to (the process-wide one if None)
+
+    Returns:
+        dict: {"bundles", "metrics", "seconds"}
+    """
+    started = time.perf_counter()
+    docs_fn = docs_fn or _default_docs
+    period_types = list(period_types)
+    connection = None
+    if anomalies_fn is None:
+        from tools.db_utils import get_postgres_connection
+        connection = get_postgres_connection()
+        if connection is None:
+            logger.warning("Building explanation bundles without anomalies: no database connection")
+            def anomalies_fn(metric_id, district, period_type):
+                return []
+        else:
+            anomalies_fn = _anomaly_lookup(connection)
+
+    bundles = {}
+    metrics = _dashboard_metrics(queries_data)
+    try:
+        for metric_name, metric_id, query in metrics:
+            endpoint = query.get("endpoint")
+            columns = column_metadata(endpoint)
+            docs = {}
+            for period_type in period_types:
+                try:
+                    docs[period_type] = docs_fn(metric_name, period_type)
+                except Exception as e:
+                    logger.warning(f"Documentation search failed for {metric_name}: {e}")
+                    docs[period_type] = None
+
+            for district in DISTRICTS:
+                metric_file = os.path.join(dashboard_dir, str(district), f"{metric_id}.json")
+                if not os.path.exists(metric_file):
+                    continue
+                with open(metric_file, "r", encoding="utf-8") as f:
+                    metric_data = json.load(f)
+                for period_type in period_types:
+                    bundles[(metric_id, district, period_type)] = build_bundle(
+                        metric_data, district, period_type, anomalies_fn(metric_id, district, period_type),
+                        docs[period_type], columns, endpoint
+                    )
+    finally:
+        if connection is not None:
+            connection.close()
+
+    (store or get_bundle_store()).put_many(bundles)
+    seconds = time.perf_counter() - started
+    logger.info(f"Built {len(bundles)} explanation bundles for {len(metrics)} metrics in {seconds:.1f}s")
+    return {"bundles": len(bundles), "metrics": len(metrics), "seconds": round(seconds, 1)}
+
+
+def bundle_prompt_context(bundle: Dict[str, Any]) -> str:
+    """The bundle as compact JSON for the explainer prompt."""
+    return json.dumps({k: v for k, v in bundle.items() if k != "built_at"}, default=str, separators=(",", ":"))
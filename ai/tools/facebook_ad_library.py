@@ -1,13 +1,65 @@
+"""
+Facebook Ad Library API client.
+
+fetch_ads() pulls every page of one search into memory. For large pulls,
+crawl_ads() runs several search terms concurrently over one pooled session
+and streams each page to <output_dir>/<term>.ndjson as it arrives. After
+every page the cursor of the next one is checkpointed (without the access
+token), so an interrupted crawl resumes where it stopped instead of starting
+over. iter_ad_frames() / load_ads_frame() read the results back into pandas
+chunk by chunk.
+"""
+
 import os
+import re
+import sys
 import json
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+
+from tools.concurrency import run_concurrently
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 API_VERSION = "v19.0"
 BASE_URL = f"https://graph.facebook.com/{API_VERSION}/ads_archive"
 
+FACEBOOK_ADS_MAX_WORKERS = int(os.getenv("FACEBOOK_ADS_MAX_WORKERS", "4"))
+FACEBOOK_ADS_TIMEOUT_SECONDS = float(os.getenv("FACEBOOK_ADS_TIMEOUT_SECONDS", "60"))
+FACEBOOK_ADS_RETRIES = int(os.getenv("FACEBOOK_ADS_RETRIES", "3"))
+# Seconds before the first retry of a failed page; doubled for each further retry
+FACEBOOK_ADS_RETRY_BACKOFF = float(os.getenv("FACEBOOK_ADS_RETRY_BACKOFF", "2"))
+
+CHECKPOINT_FILE = "checkpoint.json"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(FACEBOOK_ADS_MAX_WORKERS, 4))
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
 
 def fetch_ads(search_terms, country="US", ad_type="POLITICAL_AND_ISSUE_ADS",
               limit=100, access_token=None, fields=None):
@@ -46,7 +98,7 @@ def fetch_ads(search_terms, country="US", ad_type="POLITICAL_AND_ISSUE_ADS",
     ads = []
     url = BASE_URL
     while True:
-        response = requests.get(url, params=params)
+        response = _get_session().get(url, params=params, timeout=FACEBOOK_ADS_TIMEOUT_SECONDS)
         response.raise_for_status()
         data = response.json()
         ads.extend(data.get("data", []))
@@ -66,17 +118,237 @@ def save_ads_to_json(ads, output_path):
         json.dump(ads, f, ensure_ascii=False, indent=2)
 
 
+def _without_token(url):
+    """The URL minus its access_token parameter, so cursors can be checkpointed to disk."""
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != "access_token"]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def term_file_name(search_terms):
+    """File-safe name for a search term's NDJSON file."""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", search_terms).strip("_")[:40] or "term"
+    return f"{slug}_{hashlib.sha1(search_terms.encode('utf-8')).hexdigest()[:8]}.ndjson"
+
+
+class AdCrawl:
+    """
+    The on-disk state of a crawl: one NDJSON file per search term and a
+    checkpoint recording, per term, the next page cursor, the pages and ads
+    written so far and the size of its file when the last page was committed.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+        self._lock = threading.Lock()
+        self.terms = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self.terms = json.load(f).get("terms", {})
+
+    def path(self, search_terms):
+        return os.path.join(self.output_dir, term_file_name(search_terms))
+
+    def state(self, search_terms):
+        with self._lock:
+            return dict(self.terms.get(search_terms) or {
+                "file": term_file_name(search_terms), "next": None, "pages": 0, "ads": 0, "bytes": 0, "done": False
+            })
+
+    def commit(self, search_terms, state):
+        """Record a term's state; written atomically so a crash leaves the previous checkpoint."""
+        with self._lock:
+            self.terms[search_terms] = dict(state)
+            os.makedirs(self.output_dir, exist_ok=True)
+            temp_path = f"{self.checkpoint_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"terms": self.terms}, f, indent=2)
+            os.replace(temp_path, self.checkpoint_path)
+
+    def reset(self, search_terms):
+        with self._lock:
+            self.terms.pop(search_terms, None)
+        if os.path.exists(self.path(search_terms)):
+            os.remove(self.path(search_terms))
+
+
+def _get_page(url, params, retries, backoff):
+    """GET one page, retrying throttling, server errors and dropped connections."""
+    for attempt in range(retries + 1):
+        try:
+            response = _get_session().get(url, params=params, timeout=FACEBOOK_ADS_TIMEOUT_SECONDS)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                response.raise_for_status()
+                return response.json()
+            reason = f"HTTP {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            reason = str(e)
+        delay = backoff * (2 ** attempt)
+        logger.warning(f"Facebook Ad Library page failed ({reason}); retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def crawl_term(crawl, search_terms, params, access_token, base_url=BASE_URL,
+               retries=FACEBOOK_ADS_RETRIES, backoff=FACEBOOK_ADS_RETRY_BACKOFF):
+    """
+    Fetch the remaining pages of one search term into its NDJSON file,
+    committing the checkpoint after each page.
+
+    Returns:
+        dict: The term's checkpoint state
+    """
+    state = crawl.state(search_terms)
+    if state["done"]:
+        return state
+
+    path = crawl.path(search_terms)
+    os.makedirs(crawl.output_dir, exist_ok=True)
+    if state["next"]:
+        url, query = state["next"], {"access_token": access_token}
+    else:
+        url, query = base_url, dict(params, search_terms=search_terms, access_token=access_token)
+
+    with open(path, "ab") as f:
+        # Drop anything written after the last committed page (an interrupted write)
+        f.truncate(state["bytes"])
+        f.seek(state["bytes"])
+        while url:
+            data = _get_page(url, query, retries, backoff)
+            ads = data.get("data", [])
+            for ad in ads:
+                f.write(json.dumps(ad, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+            next_url = data.get("paging", {}).get("next")
+            state.update(pages=state["pages"] + 1, ads=state["ads"] + len(ads), bytes=f.tell(),
+                         next=_without_token(next_url) if next_url else None, done=not next_url)
+            crawl.commit(search_terms, state)
+            # Cursor URLs carry every other parameter; only the token is re-added
+            url, query = state["next"], {"access_token": access_token}
+    logger.info(f"Fetched {state['ads']} ads in {state['pages']} pages for '{search_terms}'")
+    return state
+
+
+def crawl_ads(search_terms, output_dir, country="US", ad_type="POLITICAL_AND_ISSUE_ADS", limit=100,
+              access_token=None, fields=None, max_workers=FACEBOOK_ADS_MAX_WORKERS, restart=False,
+              base_url=BASE_URL, retries=FACEBOOK_ADS_RETRIES, backoff=FACEBOOK_ADS_RETRY_BACKOFF):
+    """Fetch ads for several search terms concurrently, streaming pages to disk.
+
+    Parameters
+    ----------
+    search_terms : list[str]
+        Searches to run; each gets its own NDJSON file in ``output_dir``.
+    output_dir : str
+        Directory of the crawl. Terms already complete there are skipped and
+        interrupted ones continue from their last checkpointed page.
+    restart : bool, optional
+        Discard earlier results of these terms and fetch them from the start.
+    Other parameters are as for :func:`fetch_ads`.
+
+    Returns
+    -------
+    dict
+        Per search term: its checkpoint state, plus ``error`` if it failed.
+    """
+    access_token = access_token or os.getenv("FACEBOOK_ACCESS_TOKEN")
+    if not access_token:
+        raise ValueError("Facebook access token is required")
+    if isinstance(search_terms, str):
+        search_terms = [search_terms]
+
+    params = {"ad_reached_countries": country, "ad_type": ad_type, "limit": limit}
+    if fields:
+        params["fields"] = ",".join(fields)
+
+    crawl = AdCrawl(output_dir)
+    if restart:
+        for term in search_terms:
+            crawl.reset(term)
+
+    results = run_concurrently(
+        lambda term: crawl_term(crawl, term, params, access_token, base_url, retries, backoff),
+        search_terms, max_workers=max_workers, name="Facebook Ad Library search"
+    )
+    summary = {}
+    for result in results:
+        summary[result.item] = crawl.state(result.item)
+        if not result.ok:
+            summary[result.item]["error"] = str(result.error)
+    return summary
+
+
+def iter_ads(output_dir, search_terms=None):
+    """Yield (search term, ad) from a crawl directory, one line at a time."""
+    crawl = AdCrawl(output_dir)
+    for term in search_terms or sorted(crawl.terms):
+        state = crawl.state(term)
+        path = crawl.path(term)
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            # Only pages whose cursor was committed
+            remaining = state["bytes"]
+            for line in f:
+                remaining -= len(line)
+                if remaining < 0:
+                    break
+                yield term, json.loads(line)
+
+
+def iter_ad_frames(output_dir, search_terms=None, chunk_rows=10000):
+    """Yield the crawl's ads as DataFrames of at most chunk_rows rows, with a search_terms column."""
+    import pandas as pd
+
+    rows = []
+    for term, ad in iter_ads(output_dir, search_terms):
+        rows.append(dict(ad, search_terms=term))
+        if len(rows) >= chunk_rows:
+            yield pd.DataFrame(rows)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+
+def load_ads_frame(output_dir, search_terms=None, columns=None, chunk_rows=10000):
+    """All ads of a crawl as one DataFrame, built chunk by chunk (optionally only some columns)."""
+    import pandas as pd
+
+    frames = [frame.reindex(columns=columns) if columns else frame
+              for frame in iter_ad_frames(output_dir, search_terms, chunk_rows)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def export_ads_json(output_dir, output_path, search_terms=None):
+    """Write a crawl's ads as one JSON array without holding them in memory."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for _, ad in iter_ads(output_dir, search_terms):
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(ad, ensure_ascii=False))
+            count += 1
+        f.write("\n]\n")
+    return count
+
+
 def main():
     import argparse
 
     parser = argparse.ArgumentParser(description="Fetch Facebook Ad Library data")
-    parser.add_argument("--search", required=True, help="Search terms")
+    parser.add_argument("--search", required=True, nargs="+", help="Search terms (fetched concurrently)")
     parser.add_argument("--country", default="US", help="Country code")
     parser.add_argument("--token", default=None, help="Access token")
     parser.add_argument("--limit", type=int, default=100,
                         help="Number of ads per request")
+    parser.add_argument("--crawl-dir", default="ai/data/facebook_ads/crawl",
+                        help="Directory for the per-term NDJSON files and the checkpoint")
     parser.add_argument("--output", default="ai/data/facebook_ads/ads.json",
-                        help="Output file for ads")
+                        help="Output file for ads (JSON array)")
     parser.add_argument("--fields",
                         default=("page_id,page_name,ad_creative_body,"
                                  "ad_snapshot_url,impressions,spend,"
@@ -84,22 +356,32 @@ def main():
                         help="Comma-separated list of fields to include")
     parser.add_argument("--ad-type", default="POLITICAL_AND_ISSUE_ADS",
                         help="Ad type filter")
+    parser.add_argument("--workers", type=int, default=FACEBOOK_ADS_MAX_WORKERS,
+                        help="Search terms fetched at once")
+    parser.add_argument("--restart", action="store_true",
+                        help="Discard earlier results of these terms instead of resuming")
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
     fields = [f.strip() for f in args.fields.split(",") if f.strip()]
 
-    ads = fetch_ads(
+    summary = crawl_ads(
         search_terms=args.search,
+        output_dir=args.crawl_dir,
         country=args.country,
         ad_type=args.ad_type,
         limit=args.limit,
         access_token=args.token,
         fields=fields,
+        max_workers=args.workers,
+        restart=args.restart,
     )
-    save_ads_to_json(ads, args.output)
-    print(f"Saved {len(ads)} ads to {args.output}")
+    for term, state in summary.items():
+        status = state.get("error") or ("complete" if state["done"] else "incomplete")
+        print(f"{term}: {state['ads']} ads in {state['pages']} pages ({status})")
+    count = export_ads_json(args.crawl_dir, args.output, args.search)
+    print(f"Saved {count} ads to {args.output}")
 
 
 if __name__ == "__main__":
     main()
-
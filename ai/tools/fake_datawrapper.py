@@ -0,0 +1,142 @@
+"""
+Local fake of the Datawrapper v3 API for tests.
+
+Implements the handful of endpoints the chart publishers use (create, data
+upload, metadata update, publish, get) in memory, and records every request so
+tests can assert how many round-trips a publish took.
+
+Usage:
+    with FakeDatawrapperServer() as server:
+        os.environ["DATAWRAPPER_API_BASE_URL"] = server.base_url
+        ...
+        server.requests  # [("POST", "/charts"), ("PUT", "/charts/abc12/data"), ...]
+        server.failures.add(("PUT", "/charts/abc12/data"))  # answer that request with a 500
+"""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _FakeDatawrapperHandler(BaseHTTPRequestHandler):
+    chart_path = re.compile(r"^/charts/([A-Za-z0-9]+)(/data|/publish)?$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _handle(self, method):
+        fake = self.server.fake
+        body = self._read_body()
+        fake.record(method, self.path)
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._send_json(401, {"message": "Unauthorized"})
+        if (method, self.path) in fake.failures:
+            return self._send_json(500, {"message": "Injected failure"})
+
+        if method == "POST" and self.path == "/charts":
+            payload = json.loads(body or b"{}")
+            chart = fake.create_chart(payload.get("title", ""), payload.get("type", "d3-lines"))
+            return self._send_json(201, chart)
+
+        match = self.chart_path.match(self.path)
+        if not match or match.group(1) not in fake.charts:
+            return self._send_json(404, {"message": "Chart not found"})
+
+        chart_id, action = match.group(1), match.group(2)
+        chart = fake.charts[chart_id]
+
+        if method == "GET" and action is None:
+            return self._send_json(200, chart)
+        if method == "PATCH" and action is None:
+            payload = json.loads(body or b"{}")
+            chart.update(payload)
+            return self._send_json(200, chart)
+        if method == "PUT" and action == "/data":
+            fake.data[chart_id] = body.decode("utf-8")
+            return self._send_json(204)
+        if method == "POST" and action == "/publish":
+            chart["publicVersion"] = chart.get("publicVersion", 0) + 1
+            chart["publicUrl"] = f"{fake.public_base}/{chart_id}/{chart['publicVersion']}/"
+            return self._send_json(200, {"data": chart})
+
+        return self._send_json(405, {"message": "Method not allowed"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+
+class FakeDatawrapperServer:
+    """In-memory Datawrapper API served on a random local port."""
+
+    public_base = "https://datawrapper.dwcdn.net"
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.charts = {}
+        self.data = {}
+        self.requests = []
+        self.failures = set()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._httpd = ThreadingHTTPServer((host, port), _FakeDatawrapperHandler)
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, method, path):
+        with self._lock:
+            self.requests.append((method, path))
+
+    def create_chart(self, title, chart_type):
+        with self._lock:
+            self._next_id += 1
+            chart_id = f"fake{self._next_id:05d}"
+            self.charts[chart_id] = {"id": chart_id, "title": title, "type": chart_type}
+            return dict(self.charts[chart_id])
+
+    def reset_requests(self):
+        with self._lock:
+            self.requests = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -9,12 +9,14 @@ from tools.genAggregate import aggregate_data
 from tools.anomaly_detection import filter_data_by_date_and_conditions
 from tools.store_time_series import store_time_series_in_db
 from tools.db_utils import execute_with_connection
+from tools.log_utils import log_event, summarize
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
 
 def store_chart_data(
     chart_data,
@@ -44,8 +46,8 @@ def store_chart_data(
         try:
             return store_time_series_in_db(connection, chart_data, metadata)
         except Exception as e:
-            logging.error(f"Failed to store time series data: {e}")
-            return 0
+            logger.error(f"Failed to store time series data: {e}")
+            return None
     
     try:
         result = execute_with_connection(
@@ -57,12 +59,15 @@ def store_chart_data(
             db_password=db_password
         )
         
-        if result["status"] == "success" and result["result"] > 0:
-            inserted_count = result["result"]
+        counts = result.get("result") if result["status"] == "success" else None
+        if counts and counts["inserted"] + counts["updated"] + counts["unchanged"] > 0:
+            stored_count = counts["inserted"] + counts["updated"] + counts["unchanged"]
+            written = counts["inserted"] + counts["updated"] + counts["deleted"]
             return {
                 "status": "success",
-                "message": f"Successfully stored {inserted_count} data points in the database",
-                "records_stored": inserted_count
+                "message": f"Stored {stored_count} data points in the database ({written} written, {counts['unchanged']} unchanged)",
+                "records_stored": stored_count,
+                "changes": counts
             }
         else:
             return {
@@ -71,7 +76,7 @@ def store_chart_data(
                 "records_stored": 0
             }
     except Exception as e:
-        logging.error(f"Error in store_chart_data: {e}")
+        logger.error(f"Error in store_chart_data: {e}")
         return {
             "status": "error",
             "message": f"Failed to store data in database: {str(e)}",
@@ -104,13 +109,11 @@ def generate_time_series_chart(
     db_password: str = None
 ) -> str:
     try:
-        logging.info("Full context_variables: %s", context_variables)
-
         if isinstance(numeric_fields, str):
             numeric_fields = [numeric_fields]
-        logging.debug("Numeric fields: %s", numeric_fields)
-
-        logging.debug("Context Variables: %s", context_variables)
+        log_event(logger, logging.INFO, "time_series_chart.start", time_series_field=time_series_field,
+                  numeric_fields=numeric_fields, group_field=group_field, aggregation_period=aggregation_period,
+                  context=summarize(context_variables))
 
         # Retrieve title and y_axis_label from context_variables
         chart_title = context_variables.get("chart_title", "Time Series Chart")
@@ -122,38 +125,38 @@ def generate_time_series_chart(
             if numeric_fields and len(numeric_fields) > 0:
                 field_name = numeric_fields[0].lower().replace('_', ' ')
                 y_axis_label = "count" if field_name == "item count" else numeric_fields[0].capitalize()
-                logging.info(f"No y_axis_label provided in context_variables, using derived label: {y_axis_label}")
+                logger.info(f"No y_axis_label provided in context_variables, using derived label: {y_axis_label}")
             else:
                 y_axis_label = "Value"
-                logging.info(f"No y_axis_label or numeric fields provided, using default: {y_axis_label}")
+                logger.info(f"No y_axis_label or numeric fields provided, using default: {y_axis_label}")
         else:
-            logging.info(f"Using provided y_axis_label from context_variables: {y_axis_label}")
+            logger.info(f"Using provided y_axis_label from context_variables: {y_axis_label}")
 
         noun = context_variables.get("noun", y_axis_label)
         # Create a copy of the dataset to avoid modifying the original data
         original_df = context_variables.get("dataset")
         if original_df is None or original_df.empty:
-            logging.error("Dataset is not available or is empty.")
+            logger.error("Dataset is not available or is empty.")
             return "**Error**: Dataset is missing or empty. Please provide a valid dataset in 'context_variables'."
 
         df = original_df.copy()
-        logging.debug("DataFrame copied to avoid in-place modifications.")
+        logger.debug("DataFrame copied to avoid in-place modifications.")
 
         # Store original column names for later reference
         original_columns = df.columns.tolist()
         column_mapping = {col.lower(): col for col in original_columns}
-        logging.debug("Original column mapping: %s", column_mapping)
+        logger.debug("Original column mapping: %s", column_mapping)
         
         # Convert columns to lowercase for case-insensitive comparison
         df.columns = df.columns.str.lower()
-        logging.debug("Standardized DataFrame columns: %s", df.columns.tolist())
+        logger.debug("Standardized DataFrame columns: %s", df.columns.tolist())
         
         # Convert input fields to lowercase for comparison
         time_series_field = time_series_field.lower()
         numeric_fields = [field.lower() for field in numeric_fields]
         if group_field:
             group_field = group_field.lower()
-            logging.debug(f"Lowercased group_field: {group_field}")
+            logger.debug(f"Lowercased group_field: {group_field}")
 
         # Check for fields using case-insensitive comparison
         required_fields = [time_series_field] + numeric_fields
@@ -162,7 +165,7 @@ def generate_time_series_chart(
         missing_fields = [field for field in required_fields if field not in df.columns]
 
         if missing_fields:
-            logging.error("Missing fields in DataFrame: %s. Available columns: %s", missing_fields, df.columns.tolist())
+            logger.error("Missing fields in DataFrame: %s. Available columns: %s", missing_fields, df.columns.tolist())
             return f"**Error**: Missing required fields in DataFrame: {missing_fields}. Please check the column names and ensure they are present."
 
         # Apply filter conditions if provided
@@ -171,7 +174,7 @@ def generate_time_series_chart(
             year_filters = [f for f in filter_conditions if f['field'].lower() == time_series_field.lower() and isinstance(f['value'], str) and f['value'].isdigit()]
             if year_filters and 'year' in time_series_field.lower():
                 df[time_series_field] = df[time_series_field].astype(str)
-                logging.info(f"Converted {time_series_field} to string type for year comparisons")
+                logger.info(f"Converted {time_series_field} to string type for year comparisons")
             
             data_records = df.to_dict('records')
             # Apply filter_data_by_date_and_conditions
@@ -184,9 +187,9 @@ def generate_time_series_chart(
             )
             # Convert back to DataFrame
             df = pd.DataFrame(filtered_data)
-            logging.info(f"Filtered data size: {len(df)} records after applying filters.")
+            logger.info(f"Filtered data size: {len(df)} records after applying filters.")
             if df.empty:
-                logging.error("No data available after applying filters.")
+                logger.error("No data available after applying filters.")
                 return "**Error**: No data available after applying filters. Please adjust your filter conditions."
 
         for field in numeric_fields:
@@ -202,17 +205,14 @@ def generate_time_series_chart(
             coerced_count = pre_conversion_count - post_conversion_count
 
             if coerced_count > 0:
-                logging.info("Field '%s': %d values were coerced to NaN during conversion to numeric.", field, coerced_count)
-                if 'id' in df.columns:
-                    coerced_values = df[df[field].isna()][['id', field]].head(20)
-                    logging.info("Sample of coerced values in field '%s' (ID and Value):\n%s", field, coerced_values)
-                else:
-                    coerced_values = df[df[field].isna()].head(20)
-                    logging.info("Sample of coerced values in field '%s' (Full Row):\n%s", field, coerced_values)
+                logger.info("Field '%s': %d values were coerced to NaN during conversion to numeric.", field, coerced_count)
+                if logger.isEnabledFor(logging.DEBUG):
+                    sample_columns = ['id', field] if 'id' in df.columns else df.columns
+                    logger.debug("Sample of coerced values in field '%s':\n%s", field, df.loc[df[field].isna(), sample_columns].head(5))
 
         # Drop rows with NaN in numeric fields
         df.dropna(subset=numeric_fields, inplace=True)
-        logging.info("Dropped NA values from DataFrame.")
+        logger.debug("Dropped NA values from DataFrame.")
         
         if group_field and null_group_label:
             df[group_field] = df[group_field].fillna(null_group_label)
@@ -223,7 +223,7 @@ def generate_time_series_chart(
                 field: 'mean' if any(field.endswith(suffix) for suffix in ['_avg', '_pct']) else 'sum'
                 for field in numeric_fields
             }
-        logging.info("Aggregation functions: %s", agg_functions)
+        logger.info("Aggregation functions: %s", agg_functions)
 
         aggregated_df = aggregate_data(
             df=df,
@@ -235,13 +235,13 @@ def generate_time_series_chart(
         )
 
         if 'time_period' not in aggregated_df.columns:
-            logging.error("'time_period' column is missing after aggregation.")
+            logger.error("'time_period' column is missing after aggregation.")
             return "**Error**: The 'time_period' column is missing after aggregation. Check the 'aggregate_data' function for proper time grouping."
 
         # Ensure 'time_period' is datetime and sort the DataFrame
         aggregated_df['time_period'] = pd.to_datetime(aggregated_df['time_period'])
         aggregated_df = aggregated_df.sort_values('time_period')
-        logging.debug("Aggregated DataFrame sorted by 'time_period'.")
+        logger.debug("Aggregated DataFrame sorted by 'time_period'.")
         
         # Compute values for the caption
         try:
@@ -263,7 +263,7 @@ def generate_time_series_chart(
             else:  # fallback for any other period
                 period_name = last_time_period.strftime('%Y-%m-%d')
 
-            logging.debug(f"Last time period: {last_time_period}, Period name: {period_name}")
+            logger.debug(f"Last time period: {last_time_period}, Period name: {period_name}")
 
             # Format numbers for caption
             def format_number(num):
@@ -272,7 +272,7 @@ def generate_time_series_chart(
                 return f"{num:.2f}"
 
             total_latest = format_number(aggregated_df[aggregated_df['time_period'] == last_time_period][numeric_fields[0]].sum())
-            logging.debug(f"Total value for last period: {total_latest}")
+            logger.debug(f"Total value for last period: {total_latest}")
 
             # Exclude the last period for calculating the average of the rest across all groups
             rest_periods = aggregated_df[aggregated_df['time_period'] < last_time_period]
@@ -286,7 +286,7 @@ def generate_time_series_chart(
                 total_periods = len(rest_periods['time_period'].unique())
 
             formatted_average = format_number(average_of_rest)
-            logging.debug(f"Average value of rest periods: {formatted_average}")
+            logger.debug(f"Average value of rest periods: {formatted_average}")
 
             percentage_diff_total = ((float(total_latest.replace(',', '')) - average_of_rest) / average_of_rest) * 100 if average_of_rest != 0 else 0
             above_below_total = 'above' if float(total_latest.replace(',', '')) > average_of_rest else 'below'
@@ -294,7 +294,7 @@ def generate_time_series_chart(
             y_axis_label_lower = y_axis_label.lower()
 
             caption_total = f"In {period_name}, {y_axis_label_lower} was {total_latest}, which is {percentage_diff_total}% {above_below_total} the {total_periods} {aggregation_period} average of {formatted_average}."
-            logging.info(f"Caption for total: {caption_total}")
+            logger.info(f"Caption for total: {caption_total}")
 
             # Caption for charts with a group_field
             caption_group = ""
@@ -302,12 +302,12 @@ def generate_time_series_chart(
                 try:
                     last_period_df = aggregated_df[aggregated_df['time_period'] == last_time_period]
                     numeric_values = last_period_df.groupby(group_field)[numeric_fields[0]].sum().to_dict()
-                    logging.debug(f"Numeric values for last period by group: {numeric_values}")
+                    logger.debug(f"Numeric values for last period by group: {numeric_values}")
 
                     # Calculate the average of the prior periods for each group
                     prior_periods = aggregated_df[aggregated_df['time_period'] < last_time_period]
                     average_of_prior = prior_periods.groupby(group_field)[numeric_fields[0]].mean().to_dict()
-                    logging.debug(f"Average values of prior periods by group: {average_of_prior}")
+                    logger.debug(f"Average values of prior periods by group: {average_of_prior}")
 
                     # Sort groups by their latest values to show most significant first
                     sorted_groups = sorted(numeric_values.items(), key=lambda x: x[1], reverse=True)
@@ -335,10 +335,10 @@ def generate_time_series_chart(
                         captions_group.append(f"... and {len(sorted_groups) - 5} more groups.")
                         
                     caption_group = "<br>".join(captions_group)
-                    logging.info(f"Generated group captions: {caption_group}")
+                    logger.info(f"Generated group captions: {caption_group}")
                     
                 except Exception as e:
-                    logging.error(f"Error generating group captions: {e}")
+                    logger.error(f"Error generating group captions: {e}")
                     caption_group = "Error generating group details."
 
             if group_field:
@@ -438,10 +438,10 @@ def generate_time_series_chart(
                     caption = f"{caption}\n\n{ytd_caption}"
 
                 except Exception as ytd_err:
-                    logging.warning(f"Failed to compute YTD comparison: {ytd_err}")
+                    logger.warning(f"Failed to compute YTD comparison: {ytd_err}")
 
         except Exception as e:
-            logging.error("Failed to compute caption values: %s", e)
+            logger.error("Failed to compute caption values: %s", e)
             caption = ""
         
         # Store chart data in the database if requested
@@ -474,16 +474,16 @@ def generate_time_series_chart(
                     db_user=db_user,
                     db_password=db_password
                 )
-                logging.info(f"Database storage result: {db_result['message']}")
+                logger.info(f"Database storage result: {db_result['message']}")
             except Exception as db_error:
-                logging.error(f"Database operation failed: {db_error}")
+                logger.error(f"Database operation failed: {db_error}")
                 return f"**Error**: Failed to store chart data: {str(db_error)}"
         
         # Limit legend to top max_legend_items
         if group_field:
             group_totals = aggregated_df.groupby(group_field)[numeric_fields].sum().sum(axis=1)
             top_groups = group_totals.sort_values(ascending=False).head(max_legend_items).index.tolist()
-            logging.info("Top groups based on total values: %s", top_groups)
+            logger.info("Top groups based on total values: %s", top_groups)
 
             # Create mask for top groups
             mask_top = aggregated_df[group_field].isin(top_groups)
@@ -513,7 +513,7 @@ def generate_time_series_chart(
         try:
             if group_field:
                 group_field_original = column_mapping.get(group_field, group_field)
-                logging.debug(f"Original group field name from mapping: {group_field_original}")
+                logger.debug(f"Original group field name from mapping: {group_field_original}")
                 fig = px.area(
                     aggregated_df,
                     x='time_period',
@@ -732,7 +732,7 @@ def generate_time_series_chart(
 
             # Generate a unique chart ID without saving an image
             chart_id = uuid.uuid4().hex[:6]
-            logging.info("Not saving chart as image, only generating chart ID")
+            logger.info("Not saving chart as image, only generating chart ID")
 
             # Prepare crosstabbed data
             if group_field:
@@ -817,7 +817,7 @@ function toggleDataTable(tableId) {{
 </style>
 '''
 
-            logging.info("Markdown content created with chart ID: %s", chart_id)
+            logger.info("Markdown content created with chart ID: %s", chart_id)
 
             if return_html:
                 return markdown_content, html_content
@@ -825,13 +825,13 @@ function toggleDataTable(tableId) {{
                 return markdown_content
 
         except Exception as e:
-            logging.error("Failed to generate or save chart: %s", e)
+            logger.error("Failed to generate or save chart: %s", e)
             return f"**Error**: An unexpected error occurred while generating the chart: {e}"
 
     except ValueError as ve:
-        logging.error("ValueError in generate_time_series_chart: %s", ve)
+        logger.error("ValueError in generate_time_series_chart: %s", ve)
         return f"**Error**: {ve}"
 
     except Exception as e:
-        logging.error("Unexpected error in generate_time_series_chart: %s", e)
+        logger.error("Unexpected error in generate_time_series_chart: %s", e)
         return f"**Error**: An unexpected error occurred: {e}"
@@ -4,6 +4,7 @@ import json
 import logging
 from dotenv import load_dotenv
 from pathlib import Path
+from tools.dw_registry import dw_request, publish_chart, get_dw_api_base_url
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -40,45 +41,15 @@ if not loaded_env:
 
 DATAWRAPPER_API_KEY = os.getenv("DATAWRAPPER_API_KEY")
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000") # Default if not set
-DW_API_BASE_URL = "https://api.datawrapper.de/v3"
+DW_API_BASE_URL = get_dw_api_base_url()
 
 if not DATAWRAPPER_API_KEY:
     logger.error("DATAWRAPPER_API_KEY not found in environment variables. Script cannot function.")
     # raise ValueError("DATAWRAPPER_API_KEY not set.") # Or handle more gracefully
 
 def _make_dw_request(method, endpoint, headers=None, data=None, json_payload=None):
-    """Helper function to make requests to Datawrapper API."""
-    if not DATAWRAPPER_API_KEY:
-        logger.error("Datawrapper API key is not configured.")
-        return None
-
-    url = f"{DW_API_BASE_URL}{endpoint}"
-    
-    default_headers = {
-        "Authorization": f"Bearer {DATAWRAPPER_API_KEY}"
-    }
-    if headers:
-        default_headers.update(headers)
-
-    try:
-        response = requests.request(method, url, headers=default_headers, data=data, json=json_payload)
-        response.raise_for_status()  # Raises HTTPError for bad responses (4XX or 5XX)
-        
-        # For POST/PATCH creating/updating resources, Datawrapper often returns 200 or 201 with JSON
-        # For PUT (data upload), it might be 204 No Content or 200 with JSON
-        if response.content:
-            try:
-                return response.json()
-            except json.JSONDecodeError:
-                logger.info(f"Response from {method} {url} was not JSON, returning raw content.")
-                return response.text # or response.content for binary
-        return None # For 204 No Content
-
-    except requests.exceptions.HTTPError as e:
-        logger.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request failed: {e}")
-    return None
+    """Helper function to make requests to Datawrapper API (pooled and rate-limited)."""
+    return dw_request(method, endpoint, headers=headers, data=data, json_payload=json_payload)
 
 def create_datawrapper_chart(metric_id: str, intro: str = "", district: str = "0", period_type: str = "month"):
     """
@@ -147,41 +118,7 @@ def create_datawrapper_chart(metric_id: str, intro: str = "", district: str = "0
     csv_data = "\n".join(csv_data_lines)
     logger.debug(f"Prepared CSV data with correct keys:\n{csv_data[:250]}...") # Log a snippet
 
-    # 3. Create a new chart in Datawrapper
-    logger.info("Creating new chart in Datawrapper...")
-    create_payload = {
-        "title": chart_title,  # Use the chart_title from the metadata
-        "type": "d3-lines", # Line chart
-        # "folderId": "YOUR_FOLDER_ID" # Optional: to organize charts
-    }
-    created_chart_info = _make_dw_request("POST", "/charts", json_payload=create_payload)
-
-    if not created_chart_info or "id" not in created_chart_info:
-        logger.error("Failed to create Datawrapper chart.")
-        return None
-    
-    chart_id = created_chart_info["id"]
-    logger.info(f"Datawrapper chart created with ID: {chart_id}")
-
-    # 4. Upload data to the chart
-    logger.info(f"Uploading data to chart ID: {chart_id}...")
-    upload_headers = {"Content-Type": "text/csv"}
-    # Datawrapper API for data upload expects raw CSV in the body, not as form data or JSON.
-    upload_response = _make_dw_request("PUT", f"/charts/{chart_id}/data", headers=upload_headers, data=csv_data.encode('utf-8'))
-
-    # A successful PUT to /data usually returns 204 No Content or 200 with chart metadata.
-    # _make_dw_request handles this. If it returns None for 204, that's fine.
-    # If it returns chart metadata (on 200), that's also fine.
-    # We mainly care that it didn't raise an error.
-    # Let's check if an error occurred by inspecting if upload_response is None AND an error was logged by _make_dw_request.
-    # For now, we assume success if no exception was raised by _make_dw_request.
-    logger.info(f"Data upload process completed for chart ID: {chart_id}. Response: {type(upload_response)}")
-
-
-    # 5. Customize chart (metadata) - Crucial for making it look like time_series_chart.html
-    logger.info(f"Customizing chart ID: {chart_id}...")
-    
-    # Mimic time_series_chart.html styling
+    # 3. Customize chart (metadata) - Crucial for making it look like time_series_chart.html
     # - X-axis: date, Y-axis: value
     # - Date format for X-axis labels
     # - Grid lines
@@ -237,55 +174,15 @@ def create_datawrapper_chart(metric_id: str, intro: str = "", district: str = "0
         }
     }
     
-    # Add specific line customization if 'value' is the recognized column
-    # Datawrapper might automatically pick up the 'value' column if it's the only one besides 'date'.
-    # The `metadata.visualize.lines` is more explicit.
-
-    update_response = _make_dw_request("PATCH", f"/charts/{chart_id}", json_payload=customization_payload)
-    if update_response is None and not logger.handlers[0].stream.getvalue().endswith("HTTP error occurred"): # A bit hacky check
-        logger.info(f"Chart metadata updated successfully for chart ID: {chart_id}.")
-    elif update_response:
-         logger.info(f"Chart metadata updated successfully for chart ID: {chart_id}. Response: {type(update_response)}")
-    else:
-        logger.warning(f"Failed to update chart metadata or update returned no content for chart ID: {chart_id}.")
-        # Continue to publish, might still work with defaults.
-
-    # 6. Publish the chart
-    logger.info(f"Publishing chart ID: {chart_id}...")
-    publish_response = _make_dw_request("POST", f"/charts/{chart_id}/publish")
-
-    if not publish_response: # This means error or 204 from POST
-        logger.error(f"Failed to publish chart ID: {chart_id} or no response content. Check logs.")
-        # Try to get chart info anyway to see if publicUrl exists
-        chart_details = _make_dw_request("GET", f"/charts/{chart_id}")
-        if chart_details and chart_details.get("publicUrl"):
-            public_url = chart_details["publicUrl"]
-            logger.warning(f"Publish command might have failed or returned no content, but found publicUrl: {public_url}")
-            return public_url
-        return None
-
-    # The publish response usually contains the updated chart metadata, including publicUrl
-    public_url = None
-    if isinstance(publish_response, dict):
-        public_url = publish_response.get("publicUrl")
-        # Datawrapper often nests the URL like: publish_response['data'][0]['publicUrl'] or similar
-        # Let's be more robust
-        if not public_url:
-            if "data" in publish_response and isinstance(publish_response["data"], list) and len(publish_response["data"]) > 0:
-                public_url = publish_response["data"][0].get("publicUrl")
-        
-    if not public_url: # Fallback if structure is different or publicUrl not directly in response
-        logger.info("Public URL not found directly in publish response, attempting to retrieve chart details...")
-        chart_details = _make_dw_request("GET", f"/charts/{chart_id}")
-        if chart_details:
-            public_url = chart_details.get("publicUrl")
-
-    if public_url:
-        logger.info(f"Chart published successfully! Public URL: {public_url}")
-        return public_url
-    else:
-        logger.error(f"Failed to retrieve public URL for chart ID: {chart_id} after publishing.")
-        return None
+    # 4. Create, update or reuse the chart through the registry. Identical
+    # charts cost no API calls; charts with new data only get a data upload
+    # and a republish.
+    return publish_chart(
+        key=f"time_series:{metric_id}:{district}:{period_type}",
+        title=chart_title,
+        csv_data=csv_data,
+        customization=customization_payload
+    )
 
 if __name__ == '__main__':
     # Example Usage:
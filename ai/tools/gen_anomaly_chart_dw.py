@@ -1,11 +1,11 @@
 import os
 import logging
-import requests
-import json
 import datetime
 import uuid
+import hashlib
 from pathlib import Path
 from dotenv import load_dotenv
+from tools.dw_registry import dw_request, publish_chart, get_dw_api_base_url
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -38,52 +38,28 @@ if not loaded_env:
     logger.warning("No .env file found in project root or home directory. Relying on environment variables being set.")
 
 DATAWRAPPER_API_KEY = os.getenv("DATAWRAPPER_API_KEY")
-DW_API_BASE_URL = "https://api.datawrapper.de/v3"
+DW_API_BASE_URL = get_dw_api_base_url()
 
 if not DATAWRAPPER_API_KEY:
     logger.error("DATAWRAPPER_API_KEY not found in environment variables. Script cannot function.")
 
 def _make_dw_request(method, endpoint, headers=None, data=None, json_payload=None):
-    """Helper function to make requests to Datawrapper API."""
-    if not DATAWRAPPER_API_KEY:
-        logger.error("Datawrapper API key is not configured.")
-        return None
+    """Helper function to make requests to Datawrapper API (pooled and rate-limited)."""
+    return dw_request(method, endpoint, headers=headers, data=data, json_payload=json_payload)
 
-    url = f"{DW_API_BASE_URL}{endpoint}"
-    
-    default_headers = {
-        "Authorization": f"Bearer {DATAWRAPPER_API_KEY}"
-    }
-    if headers:
-        default_headers.update(headers)
-
-    try:
-        response = requests.request(method, url, headers=default_headers, data=data, json=json_payload)
-        response.raise_for_status()
-        
-        if response.content:
-            try:
-                return response.json()
-            except json.JSONDecodeError:
-                logger.info(f"Response from {method} {url} was not JSON, returning raw content.")
-                return response.text
-        return None
-
-    except requests.exceptions.HTTPError as e:
-        logger.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request failed: {e}")
-    return None
-
-def generate_anomaly_chart_dw(item, chart_title, metadata, output_dir='static'):
+def generate_anomaly_chart_dw(item, chart_title, metadata, output_dir='static', chart_key=None):
     """
     Generates a Datawrapper chart for an anomaly and returns the chart URL.
     
+    Charts are published through the Datawrapper chart registry, so an
+    identical chart is reused and a changed one only gets its data updated.
+    
     Parameters:
     - item (dict): Anomaly data containing dates, counts, comparison_mean, etc.
     - chart_title (str): Title for the chart.
     - metadata (dict): Contains comparison_period, recent_period, and other metadata.
     - output_dir (str): Directory to save chart details (not used for Datawrapper but kept for API compatibility).
+    - chart_key (str, optional): Registry key for the chart, e.g. "anomaly:27338". Defaults to one derived from the title.
     
     Returns:
     - str: URL of the published Datawrapper chart or None if failed.
@@ -196,31 +172,14 @@ def generate_anomaly_chart_dw(item, chart_title, metadata, output_dir='static'):
         f"compared to the average over {comparison_period_label}."
     )
     
-    # 1. Create a new chart in Datawrapper
-    logger.info("Creating new anomaly chart in Datawrapper...")
-    create_payload = {
-        "title": chart_title,
-        "type": "d3-lines",
-    }
-    created_chart_info = _make_dw_request("POST", "/charts", json_payload=create_payload)
+    if not chart_key:
+        key_source = f"{chart_title}|{item['group_value']}|{period_type}"
+        chart_key = f"anomaly:{hashlib.sha1(key_source.encode('utf-8')).hexdigest()[:16]}"
     
-    if not created_chart_info or "id" not in created_chart_info:
-        logger.error("Failed to create Datawrapper chart.")
-        return None
-    
-    chart_id = created_chart_info["id"]
-    logger.info(f"Datawrapper chart created with ID: {chart_id}")
-    
-    # 2. Upload data to the chart
-    logger.info(f"Uploading data to chart ID: {chart_id}...")
-    upload_headers = {"Content-Type": "text/csv"}
-    upload_response = _make_dw_request("PUT", f"/charts/{chart_id}/data", headers=upload_headers, data=csv_data.encode('utf-8'))
-    
-    logger.info(f"Data upload process completed for chart ID: {chart_id}. Response: {type(upload_response)}")
-    
-    # 3. Customize chart (metadata)
-    logger.info(f"Customizing chart ID: {chart_id}...")
+    # Stable id for the area fill so an unchanged chart hashes the same in the registry
+    area_fill_id = "fill_" + hashlib.md5(chart_key.encode('utf-8')).hexdigest()
     
+    # 1. Customize chart (metadata)
     # Determine chart format based on period_type
     date_format = "%Y" if period_type == 'year' else "%b %Y"
     
@@ -256,7 +215,7 @@ def generate_anomaly_chart_dw(item, chart_title, metadata, output_dir='static'):
                 },
                 "custom-area-fills": [
                     {
-                        "id": str(uuid.uuid4()).replace("-", "_"),
+                        "id": area_fill_id,
                         "from": "upper_bound",
                         "to": "lower_bound",
                         "color": "#e0e0e0",
@@ -339,33 +298,13 @@ def generate_anomaly_chart_dw(item, chart_title, metadata, output_dir='static'):
         }
     }
     
-    update_response = _make_dw_request("PATCH", f"/charts/{chart_id}", json_payload=customization_payload)
-    if update_response:
-        logger.info(f"Chart metadata updated successfully for chart ID: {chart_id}. Response: {type(update_response)}")
-    else:
-        logger.warning(f"Failed to update chart metadata or update returned no content for chart ID: {chart_id}.")
-    
-    # 4. Publish the chart
-    logger.info(f"Publishing chart ID: {chart_id}...")
-    publish_response = _make_dw_request("POST", f"/charts/{chart_id}/publish")
-    
-    # Get the public URL
-    public_url = None
-    if isinstance(publish_response, dict):
-        public_url = publish_response.get("publicUrl")
-        
-    if not public_url:
-        logger.info("Public URL not found directly in publish response, attempting to retrieve chart details...")
-        chart_details = _make_dw_request("GET", f"/charts/{chart_id}")
-        if chart_details:
-            public_url = chart_details.get("publicUrl")
-    
-    if public_url:
-        logger.info(f"Chart published successfully! Public URL: {public_url}")
-        return public_url
-    else:
-        logger.error(f"Failed to retrieve public URL for chart ID: {chart_id} after publishing.")
-        return None
+    # 2. Create, update or reuse the chart through the registry
+    return publish_chart(
+        key=chart_key,
+        title=chart_title,
+        csv_data=csv_data,
+        customization=customization_payload
+    )
 
 def generate_anomalies_summary_with_datawrapper(results, metadata, output_dir='static'):
     """
@@ -806,7 +745,7 @@ def generate_anomaly_chart_from_id(anomaly_id, chart_title=None, output_dir='sta
             logger.info(f"Setting y_axis_label in metadata to: {object_name}")
         
         # Generate the Datawrapper chart
-        return generate_anomaly_chart_dw(item, chart_title, metadata, output_dir)
+        return generate_anomaly_chart_dw(item, chart_title, metadata, output_dir, chart_key=f"anomaly:{anomaly_id}")
         
     except Exception as e:
         logger.error(f"Error generating chart for anomaly ID {anomaly_id}: {str(e)}", exc_info=True)
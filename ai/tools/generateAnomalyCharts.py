@@ -1,4 +1,5 @@
 import os
+import html
 import logging
 from jinja2 import Environment, FileSystemLoader
 import plotly.graph_objs as go
@@ -413,7 +414,7 @@ def generate_chart_html(item, chart_title, metadata, chart_counter, output_dir):
     # Assemble the HTML snippet for the chart and its caption
     chart_html = f"""
     <div id="{chart_container_id}" class="chart-container" style="margin-bottom: 50px;">
-        {fig.to_html(full_html=False)}
+        {fig.to_html(full_html=False, include_plotlyjs=False)}
     </div>
     <div class="chart-caption" style="font-size: 12px; text-align: left; margin-bottom: 50px;">
         {caption}
@@ -423,6 +424,77 @@ def generate_chart_html(item, chart_title, metadata, chart_counter, output_dir):
     return chart_html, chart_id
 
 
+def _period_date(value):
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def anomaly_chart_inputs(anomaly):
+    """
+    Rebuild the (item, metadata) pair generate_chart_html takes from a stored
+    anomalies row, whose comparison/recent dates and counts hold the series.
+
+    Parameters:
+    - anomaly (dict): A row of the anomalies table.
+
+    Returns:
+    - tuple: (item, metadata)
+    """
+    metadata = dict(anomaly.get('metadata') or {})
+    metadata.setdefault('period_type', anomaly.get('period_type') or 'month')
+    metadata.setdefault('y_axis_label', anomaly.get('field_name') or 'Value')
+    for period in ('recent_period', 'comparison_period'):
+        if period not in metadata:
+            raise ValueError(f"Anomaly {anomaly.get('id')} has no {period} in its metadata")
+        metadata[period] = {key: _period_date(metadata[period][key]) for key in ('start', 'end')}
+
+    item = {
+        'group_value': anomaly.get('group_value'),
+        'comparison_mean': anomaly.get('comparison_mean') or 0,
+        'recent_mean': anomaly.get('recent_mean') or 0,
+        'difference': anomaly.get('difference') or 0,
+        'stdDev': anomaly.get('std_dev') or 0,
+        'dates': list(anomaly.get('comparison_dates') or []) + list(anomaly.get('recent_dates') or []),
+        'counts': list(anomaly.get('comparison_counts') or []) + list(anomaly.get('recent_counts') or []),
+        'out_of_bounds': bool(anomaly.get('out_of_bounds')),
+    }
+    return item, metadata
+
+
+def render_anomaly_chart_page(item, metadata):
+    """
+    Renders a standalone HTML page with the chart of one anomaly, for charts
+    generated on request rather than with the anomaly summary.
+
+    Parameters:
+    - item (dict): Anomaly data as generate_chart_html takes it.
+    - metadata (dict): Contains comparison_period and recent_period information.
+
+    Returns:
+    - str: The HTML page.
+    """
+    agg_function_display = 'Average' if metadata.get('agg_function', 'sum') == 'mean' else 'Total'
+    label = 'Anomaly in' if item.get('out_of_bounds') else 'Trend of'
+    chart_title = f"{label} {agg_function_display} {metadata['y_axis_label']} in {item['group_value']} "
+    chart_html, _ = generate_chart_html(item, chart_title, metadata, 0, None)
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>{html.escape(metadata.get('title') or chart_title)}</title>
+    <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+    <style>body {{ font-family: Arial, sans-serif; margin: 20px; }}</style>
+</head>
+<body>
+{chart_html}
+</body>
+</html>
+"""
+
+
 def generate_markdown_summary(table_data, metadata, output_dir):
     """
     Generates a Markdown summary of the anomalies without links to chart images.
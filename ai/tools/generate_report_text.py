@@ -12,8 +12,9 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 from ai.anomalyAnalyzer import get_anomaly_details
+from tools.llm_cache import cached_chat_completion
 
-def generate_report_text(report_ids, execute_with_connection, load_prompts, AGENT_MODEL, client, logger=None):
+def generate_report_text(report_ids, execute_with_connection, load_prompts, AGENT_MODEL, client, logger=None, bypass_cache=False):
     """
     Step 3.5: Generate the final report_text for each prioritized item using the LLM.
     Updates the monthly_reporting table with the final narrative for each item.
@@ -24,6 +25,7 @@ def generate_report_text(report_ids, execute_with_connection, load_prompts, AGEN
         AGENT_MODEL: Model name for the LLM
         client: LLM client
         logger: Optional logger
+        bypass_cache: Call the model even if an identical request is cached
     Returns:
         Status dictionary
     """
@@ -157,7 +159,9 @@ def generate_report_text(report_ids, execute_with_connection, load_prompts, AGEN
                 citations=citations_str,
                 perplexity_context=perplexity_context
             )
-            response = client.chat.completions.create(
+            response = cached_chat_completion(
+                client,
+                bypass=bypass_cache,
                 model=AGENT_MODEL,
                 messages=[{"role": "system", "content": system_message},
                          {"role": "user", "content": prompt}],
@@ -5,8 +5,17 @@ This script creates the database and necessary tables if they don't exist.
 """
 
 import os
+import sys
 import logging
 from db_utils import get_postgres_connection, execute_with_connection
+from anomaly_search import ensure_anomaly_search_indexes
+
+# store_time_series imports through the tools package
+_ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ai_dir not in sys.path:
+    sys.path.insert(0, _ai_dir)
+
+from tools.store_time_series import ensure_time_series_upsert_schema
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -240,6 +249,11 @@ def init_database():
 
         connection.commit()
         cursor.close()
+
+        # Unique point key and change log of the time series writer
+        ensure_time_series_upsert_schema(connection)
+        # Trigram and partial indexes used by anomaly search
+        ensure_anomaly_search_indexes(connection)
         logger.info("Successfully initialized database tables")
         return True    
 
@@ -0,0 +1,375 @@
+"""
+Content-addressed cache for LLM responses.
+
+Responses from OpenAI chat completions and Swarm agent runs are stored under a
+key derived from everything that determines the answer: the model, the
+messages (including the system prompt / agent instructions), the tool schema,
+the temperature and any other request parameters. Re-running a step whose
+inputs did not change (re-analyzing unchanged dataset metadata, regenerating
+or re-proofreading the same report) returns the stored answer instead of
+calling the API again.
+
+Entries live in a SQLite file so they survive restarts and are shared between
+the web server and the batch scripts. The cache is bounded by TTL, entry count
+and total size (least recently used entries are evicted first), and keeps
+hit/miss counters together with the API latency and tokens that hits saved.
+
+Configuration:
+    LLM_CACHE_PATH          SQLite file (default ai/data/llm_cache.sqlite)
+    LLM_CACHE_TTL           Seconds an entry stays valid (default 30 days, 0 = forever)
+    LLM_CACHE_MAX_ENTRIES   Maximum number of entries (default 5000)
+    LLM_CACHE_MAX_MB        Maximum total size of stored responses (default 200)
+    LLM_CACHE_DISABLED      Set to 1/true to bypass the cache everywhere
+
+Individual calls can bypass the cache with bypass=True; a bypassed call still
+refreshes the stored entry.
+"""
+
+import os
+import json
+import time
+import hashlib
+import inspect
+import logging
+import sqlite3
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(_ai_dir, "data", "llm_cache.sqlite")
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+
+
+def cache_disabled() -> bool:
+    return os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+
+
+def make_cache_key(kind: str, model: Optional[str], messages: List[Dict[str, Any]],
+                   tools: Any = None, temperature: Optional[float] = None, **params) -> str:
+    """
+    Build the content address of an LLM request.
+
+    Args:
+        kind: "chat" for chat completions, "swarm" for agent runs
+        model: Model name
+        messages: Request messages, including any system prompt
+        tools: Tool/function schema offered to the model
+        temperature: Sampling temperature
+        **params: Any other parameters that change the answer (max_tokens, response_format, ...)
+    """
+    prompt_hash = hashlib.sha256(_canonical(messages).encode("utf-8")).hexdigest()
+    tools_hash = hashlib.sha256(_canonical(tools).encode("utf-8")).hexdigest() if tools else None
+    material = {
+        "kind": kind,
+        "model": model,
+        "prompt": prompt_hash,
+        "tools": tools_hash,
+        "temperature": temperature,
+        "params": {k: v for k, v in params.items() if v is not None}
+    }
+    return hashlib.sha256(_canonical(material).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed response cache with TTL, LRU eviction and usage metrics."""
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[int] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.path = path or os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.ttl = LLM_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries or LLM_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or int(LLM_CACHE_MAX_MB * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "evictions": 0,
+            "saved_seconds": 0.0,
+            "saved_prompt_tokens": 0,
+            "saved_completion_tokens": 0
+        }
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                latency REAL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used_idx ON llm_cache (last_used)")
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the stored response for key, or None if missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens, latency, created_at FROM llm_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row and self.ttl and now - row[4] > self.ttl:
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if not row:
+                self.stats["misses"] += 1
+                return None
+
+            self.conn.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.stats["hits"] += 1
+            self.stats["saved_prompt_tokens"] += row[1] or 0
+            self.stats["saved_completion_tokens"] += row[2] or 0
+            self.stats["saved_seconds"] += row[3] or 0.0
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Any, kind: str = None, model: str = None,
+            prompt_tokens: int = 0, completion_tokens: int = 0, latency: float = 0.0):
+        """Store a JSON-serializable response and evict entries beyond the limits."""
+        body = json.dumps(response, default=str)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO llm_cache
+                    (key, kind, model, response, size, prompt_tokens, completion_tokens, latency, created_at, last_used, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, kind, model, body, len(body), prompt_tokens or 0, completion_tokens or 0, latency, now, now)
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        if self.ttl:
+            cursor = self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self.stats["evictions"] += cursor.rowcount
+
+        count, total_size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total_size <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until both limits hold
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used ASC"):
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total_size -= size
+        self.conn.executemany("DELETE FROM llm_cache WHERE key = ?", evicted)
+        self.stats["evictions"] += len(evicted)
+
+    def note_bypass(self):
+        with self.lock:
+            self.stats["bypassed"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.conn.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and savings for this process, plus the size of the store."""
+        with self.lock:
+            count, total_size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(stats["saved_seconds"], 2),
+            "entries": count,
+            "size_bytes": total_size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "path": self.path
+        })
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Return the process-wide LLM response cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def get_llm_cache_stats() -> Dict[str, Any]:
+    stats = get_llm_cache().get_stats()
+    stats["disabled"] = cache_disabled()
+    return stats
+
+
+def _to_namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _to_namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_to_namespace(v) for v in value]
+    return value
+
+
+def usage_tokens(usage) -> tuple:
+    """(prompt_tokens, completion_tokens) of a completion's usage, as an object or a dict; zeros when missing."""
+    if usage is None:
+        return 0, 0
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+def cached_chat_completion(client, bypass: bool = False, cache: Optional[LLMCache] = None, **kwargs):
+    """
+    Drop-in replacement for client.chat.completions.create(**kwargs) with caching.
+
+    Streaming requests are never cached. A cache hit returns an object with the
+    same attribute layout as a ChatCompletion (choices[0].message.content,
+    usage, model), so callers need no changes beyond the call itself.
+    """
+    if kwargs.get("stream") or cache_disabled():
+        return client.chat.completions.create(**kwargs)
+
+    cache = cache or get_llm_cache()
+    params = {k: v for k, v in kwargs.items() if k not in ("model", "messages", "tools", "functions", "temperature")}
+    key = make_cache_key(
+        "chat",
+        kwargs.get("model"),
+        kwargs.get("messages", []),
+        tools=kwargs.get("tools") or kwargs.get("functions"),
+        temperature=kwargs.get("temperature"),
+        **params
+    )
+
+    if bypass:
+        cache.note_bypass()
+    else:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM cache hit for chat completion ({kwargs.get('model')}, key {key[:12]})")
+            return _to_namespace(cached)
+
+    started = time.perf_counter()
+    response = client.chat.completions.create(**kwargs)
+    latency = time.perf_counter() - started
+
+    try:
+        payload = response.model_dump() if hasattr(response, "model_dump") else response
+        prompt_tokens, completion_tokens = usage_tokens(payload.get("usage"))
+        cache.put(key, payload, kind="chat", model=kwargs.get("model"),
+                  prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, latency=latency)
+    except Exception as e:
+        logger.warning(f"Could not cache chat completion response: {e}")
+    return response
+
+
+def agent_tool_schema(agent) -> List[Dict[str, Any]]:
+    """Describe the functions an agent offers, for use in its cache key."""
+    schema = []
+    for func in getattr(agent, "functions", None) or []:
+        try:
+            signature = str(inspect.signature(func))
+        except (TypeError, ValueError):
+            signature = None
+        schema.append({
+            "name": getattr(func, "__name__", str(func)),
+            "signature": signature,
+            "doc": inspect.getdoc(func)
+        })
+    return schema
+
+
+def _agent_instructions(agent, context_variables):
+    instructions = getattr(agent, "instructions", None)
+    if callable(instructions):
+        return instructions(context_variables or {})
+    return instructions
+
+
+def _response_message(message):
+    if isinstance(message, dict):
+        return message
+    if hasattr(message, "model_dump"):
+        return message.model_dump()
+    return {"role": getattr(message, "role", "assistant"), "content": getattr(message, "content", None)}
+
+
+def cached_swarm_run(client, agent, messages, context_variables=None, bypass: bool = False,
+                     cache: Optional[LLMCache] = None, **kwargs):
+    """
+    Drop-in replacement for client.run(agent=..., messages=...) with caching.
+
+    The key covers the agent's model, instructions, tool schema and the
+    conversation. On a hit, tools are not re-executed: the cached messages and
+    final context variables are returned in a response with the same shape as
+    a Swarm Response. Streaming runs are never cached.
+    """
+    run_kwargs = dict(kwargs)
+    if context_variables is not None:
+        run_kwargs["context_variables"] = context_variables
+    if kwargs.get("stream") or cache_disabled():
+        return client.run(agent=agent, messages=messages, **run_kwargs)
+
+    cache = cache or get_llm_cache()
+    key = make_cache_key(
+        "swarm",
+        getattr(agent, "model", None),
+        [{"role": "system", "content": _agent_instructions(agent, context_variables)}] + list(messages),
+        tools=agent_tool_schema(agent),
+        temperature=getattr(agent, "temperature", None),
+        tool_choice=getattr(agent, "tool_choice", None),
+        context_variables=context_variables or None,
+        max_turns=kwargs.get("max_turns")
+    )
+
+    if bypass:
+        cache.note_bypass()
+    else:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM cache hit for agent {getattr(agent, 'name', None)} (key {key[:12]})")
+            return SimpleNamespace(
+                messages=cached["messages"],
+                agent=agent,
+                context_variables=cached.get("context_variables") or {}
+            )
+
+    started = time.perf_counter()
+    response = client.run(agent=agent, messages=messages, **run_kwargs)
+    latency = time.perf_counter() - started
+
+    try:
+        cache.put(key, {
+            "messages": [_response_message(m) for m in response.messages],
+            "context_variables": getattr(response, "context_variables", None) or {}
+        }, kind="swarm", model=getattr(agent, "model", None), latency=latency)
+    except Exception as e:
+        logger.warning(f"Could not cache agent response: {e}")
+    return response
@@ -0,0 +1,615 @@
+"""
+Logging helpers for the data hot paths.
+
+The fetch, filter, group and chart functions run once per metric, district
+and period, often over tens of thousands of records, so their logging has a
+budget:
+
+- summarize() wraps a value for a log argument and only renders a short
+  description (shape and columns for a DataFrame, sizes for containers) if
+  the record is actually emitted. Logging a DataFrame never reprs it.
+- log_event() emits one structured event (name plus fields) and does nothing,
+  not even building the message, when the level is disabled.
+- IssueCounter replaces one warning per bad record with counts: a few sampled
+  records per issue kind (rate-limited across calls) and one summary line.
+- JsonFormatter and configure_logging() give JSON-lines output and per-module
+  levels from the environment:
+
+    LOG_FORMAT=json
+    LOG_LEVELS=tools.data_fetcher=WARNING,tools.anomaly_detection=WARNING
+
+Log files rotate by size (LOG_MAX_MB) and age (LOG_ROTATE_HOURS) through
+rotating_file_handler(); rotated segments are gzipped as name.log.1.gz,
+name.log.2.gz, ... and only LOG_BACKUP_COUNT of them are kept. Several
+processes may write the same file (the web app runs the metric scripts both
+in-process and as subprocesses): rollovers take an exclusive lock on
+name.log.lock, and a handler whose file was rotated by another process
+reopens it. Plain writes take no lock. remove_expired_logs() deletes logs and segments older
+than LOG_RETENTION_DAYS. tail_log() reads the last lines across the live
+file and its segments without loading whole files.
+"""
+
+import os
+import re
+import gzip
+import json
+import mmap
+import time
+import shutil
+import struct
+import logging
+import logging.handlers
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation is only coordinated within one process
+    fcntl = None
+
+LOG_SAMPLE_LIMIT = int(os.getenv("LOG_SAMPLE_LIMIT", "3"))
+LOG_SAMPLE_WINDOW_SECONDS = float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", "60"))
+LOG_MAX_MB = float(os.getenv("LOG_MAX_MB", "20"))
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "7"))
+# How often a rotating handler re-checks its file on disk (see GzipRotatingFileHandler)
+LOG_CHECK_SECONDS = float(os.getenv("LOG_CHECK_SECONDS", "1"))
+LOG_FORMAT_TEXT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+TAIL_BLOCK_SIZE = 64 * 1024
+MAX_SUMMARY_ITEMS = 10
+MAX_SUMMARY_CHARS = 300
+_LEVEL_NAMES = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class summarize:
+    """
+    Lazily rendered, bounded description of a value for use as a log argument.
+
+        logger.info("Chart context: %s", summarize(context_variables))
+
+    Nothing is rendered unless a handler formats the record.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return _describe(self.value, depth=0)
+
+    __repr__ = __str__
+
+
+def _describe(value, depth: int) -> str:
+    # Checked by name so this module does not need pandas
+    kind = type(value).__name__
+    if kind == "DataFrame":
+        columns = list(value.columns[:MAX_SUMMARY_ITEMS])
+        more = f" +{len(value.columns) - len(columns)}" if len(value.columns) > len(columns) else ""
+        return f"<DataFrame {value.shape[0]}x{value.shape[1]} columns={columns}{more}>"
+    if kind == "Series":
+        return f"<Series {value.name!r} len={len(value)}>"
+    if isinstance(value, dict):
+        if depth > 0:
+            return f"<dict len={len(value)}>"
+        items = list(value.items())[:MAX_SUMMARY_ITEMS]
+        body = ", ".join(f"{k!r}: {_describe(v, depth + 1)}" for k, v in items)
+        more = f", ... +{len(value) - len(items)}" if len(value) > len(items) else ""
+        return "{" + body + more + "}"
+    if isinstance(value, (list, tuple, set)):
+        if len(value) > MAX_SUMMARY_ITEMS or depth > 0:
+            return f"<{kind} len={len(value)}>"
+        return repr(value)[:MAX_SUMMARY_CHARS]
+    text = value if isinstance(value, str) else repr(value)
+    max_chars = MAX_SUMMARY_CHARS if depth == 0 else MAX_SUMMARY_CHARS // 4
+    if len(text) > max_chars:
+        text = text[:max_chars] + "..."
+    return repr(text) if isinstance(value, str) else text
+
+
+def log_event(logger: logging.Logger, level: int, event: str, *, stacklevel: int = 2, **fields):
+    """
+    Log a structured event. The text line is "event k=v ..."; JsonFormatter
+    emits the fields as JSON. Skipped entirely when level is disabled.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    text = " ".join([event] + [f"{key}={_describe(value, depth=0)}" for key, value in fields.items()])
+    logger.log(level, text, extra={"event": event, "fields": fields}, stacklevel=stacklevel)
+
+
+_sample_lock = threading.Lock()
+_sample_windows: Dict[Any, list] = {}
+
+
+def _take_sample(key, limit: int, window: float) -> bool:
+    """Allow at most limit sampled lines per key per window seconds, across calls."""
+    now = time.monotonic()
+    with _sample_lock:
+        window_state = _sample_windows.setdefault(key, [now, 0])
+        if now - window_state[0] > window:
+            window_state[:] = [now, 0]
+        if window_state[1] >= limit:
+            return False
+        window_state[1] += 1
+        return True
+
+
+class IssueCounter:
+    """
+    Count per-record problems and log a bounded number of them.
+
+        issues = IssueCounter(logger, "group_data")
+        for item in data:
+            if not item.get(date_field):
+                issues.add("missing_date", item)
+                continue
+        issues.flush()
+
+    Each issue kind logs at most sample_limit example records per
+    LOG_SAMPLE_WINDOW_SECONDS (shared by all calls with the same context),
+    and flush() logs one summary with the counts.
+    """
+
+    def __init__(self, logger: logging.Logger, context: str, level: int = logging.WARNING,
+                 sample_limit: Optional[int] = None, window: Optional[float] = None):
+        self.logger = logger
+        self.context = context
+        self.level = level
+        self.sample_limit = LOG_SAMPLE_LIMIT if sample_limit is None else sample_limit
+        self.window = LOG_SAMPLE_WINDOW_SECONDS if window is None else window
+        self.counts = Counter()
+        self.enabled = logger.isEnabledFor(level)
+
+    def add(self, kind: str, record=None):
+        self.counts[kind] += 1
+        if self.enabled and self.sample_limit and _take_sample((self.context, kind), self.sample_limit, self.window):
+            self.logger.log(self.level, "%s: %s, e.g. %s", self.context, kind, summarize(record), stacklevel=2)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def flush(self, **fields) -> Dict[str, int]:
+        """Log the summary (if anything was counted) and return the counts."""
+        if self.counts:
+            log_event(self.logger, self.level, f"{self.context}.issues", stacklevel=3,
+                      total=self.total, counts=dict(self.counts), **fields)
+        return dict(self.counts)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, plus event fields and extras."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key in _RESERVED_ATTRS:
+                continue
+            if key == "fields" and isinstance(value, dict):
+                payload.update({k: _jsonable(v) for k, v in value.items()})
+            else:
+                payload[key] = _jsonable(value)
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, dict) and len(value) <= MAX_SUMMARY_ITEMS * 5:
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    return str(summarize(value))
+
+
+def parse_module_levels(spec: Optional[str]) -> Dict[str, str]:
+    """Parse "module=LEVEL,module=LEVEL" into {module: LEVEL}; bad entries are ignored."""
+    levels = {}
+    for part in (spec or "").split(","):
+        name, _, level = part.partition("=")
+        level = level.strip().upper()
+        if name.strip() and level in _LEVEL_NAMES:
+            levels[name.strip()] = level
+    return levels
+
+
+def configure_logging(module_levels: Optional[Dict[str, str]] = None, json_format: Optional[bool] = None,
+                      logger: Optional[logging.Logger] = None):
+    """
+    Apply per-module levels (LOG_LEVELS) and, with LOG_FORMAT=json, switch
+    logger's handlers (the root logger's by default) to JsonFormatter. Script
+    entry points call this once their handlers are attached; the web app gets
+    the same settings through main.py's LOGGING_CONFIG. Safe to call more
+    than once.
+    """
+    if module_levels is None:
+        module_levels = parse_module_levels(os.getenv("LOG_LEVELS"))
+    for name, level in module_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    if json_format is None:
+        json_format = os.getenv("LOG_FORMAT", "text").lower() == "json"
+    if json_format:
+        for handler in (logger or logging.getLogger()).handlers:
+            handler.setFormatter(JsonFormatter())
+
+
+# ------------------------------
+# Rotation and tailing
+# ------------------------------
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+@contextmanager
+def _exclusive(lock_file):
+    """Hold an exclusive lock on an open lock file (no-op without fcntl)."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class _SharedLogState:
+    """
+    name.log.lock of a log file: the exclusive lock taken for rollovers, and
+    in its first 16 bytes the file's rollover generation and approximate
+    size, shared by every process writing the file. The bytes are mapped
+    into memory, so reading or updating them costs no system call.
+    """
+
+    SIZE = 16
+
+    def __init__(self, path: str):
+        self.file = open(f"{path}.lock", "a+b")
+        if fcntl is None:
+            # No file locks: rollovers are only coordinated within one handler
+            self.memory = bytearray(self.SIZE)
+            return
+        with self.locked():
+            size = os.fstat(self.file.fileno()).st_size
+            if size < self.SIZE:
+                self.file.write(b"\0" * (self.SIZE - size))
+                self.file.flush()
+        self.memory = mmap.mmap(self.file.fileno(), self.SIZE)
+
+    def locked(self):
+        return _exclusive(self.file)
+
+    @property
+    def generation(self) -> int:
+        return struct.unpack_from("<q", self.memory, 0)[0]
+
+    @property
+    def size(self) -> int:
+        return struct.unpack_from("<q", self.memory, 8)[0]
+
+    @size.setter
+    def size(self, value: int):
+        struct.pack_into("<q", self.memory, 8, value)
+
+    def rotated(self):
+        """Record a rollover (with the lock held): writers reopen the file before their next record."""
+        struct.pack_into("<qq", self.memory, 0, self.generation + 1, 0)
+
+    def close(self):
+        if isinstance(self.memory, mmap.mmap):
+            self.memory.close()
+        self.file.close()
+
+
+@contextmanager
+def _log_file_lock(path: str):
+    """The lock a GzipRotatingFileHandler takes on path, for code outside a handler."""
+    shared = _SharedLogState(path)
+    try:
+        with shared.locked():
+            yield shared
+    finally:
+        shared.close()
+
+
+class GzipRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that also rolls over when the file is older than
+    rotate_hours, and gzips rotated segments (name.log.1.gz, ...).
+    backupCount is the retention: older segments are deleted on rollover.
+
+    Handlers in several processes can share one log file. Records are
+    appended without a lock (the file is opened for appending), and checking
+    for a rollover reads the generation and size shared through
+    name.log.lock, so a record costs no system call beyond its write. The
+    exclusive lock is taken only when the size or age calls for a rollover,
+    and every LOG_CHECK_SECONDS to correct the shared size and reopen a file
+    that was removed or replaced. A handler whose file another process
+    rotated sees the new generation and reopens the file before writing.
+    """
+
+    def __init__(self, filename, max_bytes: int, backup_count: int, rotate_hours: float = 0,
+                 encoding: str = "utf-8"):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding, delay=False)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = _gzip_rotator
+        self.rotate_seconds = rotate_hours * 3600
+        self.opened_at = self._file_started(filename)
+        self.shared = _SharedLogState(self.baseFilename)
+        self.generation = self.shared.generation
+        self.checked_at = None
+
+    @staticmethod
+    def _file_started(filename) -> float:
+        try:
+            # A non-empty file carried over from a previous run keeps its age
+            return os.path.getmtime(filename) if os.path.getsize(filename) else time.time()
+        except OSError:
+            return time.time()
+
+    def _reopen(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = self._open()
+        self.opened_at = self._file_started(self.baseFilename)
+        self.generation = self.shared.generation
+
+    def _check_file(self):
+        """With the lock held: reopen a file removed or replaced on disk and correct the shared size."""
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_ino != os.fstat(self.stream.fileno()).st_ino:
+            self._reopen()
+            stat = os.fstat(self.stream.fileno())
+        self.shared.size = stat.st_size
+        self.checked_at = time.monotonic()
+
+    def _rollover_due(self, length: int) -> bool:
+        size = self.shared.size
+        if self.maxBytes > 0 and size > 0 and size + length > self.maxBytes:
+            return True
+        if self.rotate_seconds and time.time() - self.opened_at >= self.rotate_seconds:
+            if size > 0:
+                return True
+            self.opened_at = time.time()
+        return False
+
+    def emit(self, record):
+        if self.shared is None:
+            return logging.FileHandler.emit(self, record)
+        try:
+            msg = self.format(record) + self.terminator
+            if self.shared.generation != self.generation:
+                self._reopen()
+            if (self.checked_at is None or time.monotonic() - self.checked_at >= LOG_CHECK_SECONDS
+                    or self._rollover_due(len(msg))):
+                with self.shared.locked():
+                    self._check_file()
+                    if self._rollover_due(len(msg)):
+                        self.doRollover()
+            self.stream.write(msg)
+            self.flush()
+            # Characters, not bytes, and unlocked across processes: _check_file corrects it
+            self.shared.size += len(msg)
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+        if self.shared is not None:
+            self.shared.rotated()
+            self.generation = self.shared.generation
+
+    def close(self):
+        self.acquire()
+        try:
+            super().close()
+            if self.shared is not None:
+                self.shared.close()
+                self.shared = None
+        finally:
+            self.release()
+
+
+_handlers: Dict[str, GzipRotatingFileHandler] = {}
+_handlers_lock = threading.Lock()
+
+
+def rotating_file_handler(filename: str, formatter: Optional[logging.Formatter] = None,
+                          max_mb: Optional[float] = None, backup_count: Optional[int] = None,
+                          rotate_hours: Optional[float] = None) -> GzipRotatingFileHandler:
+    """
+    Return this process's rotating handler for filename, creating it on first
+    use, so modules that log to the same file share one handler (two handlers
+    rotating the same file would clobber each other's segments).
+    """
+    path = os.path.abspath(filename)
+    with _handlers_lock:
+        handler = _handlers.get(path)
+        if handler is None or handler.shared is None:
+            handler = GzipRotatingFileHandler(
+                path,
+                max_bytes=int((LOG_MAX_MB if max_mb is None else max_mb) * 1024 * 1024),
+                backup_count=LOG_BACKUP_COUNT if backup_count is None else backup_count,
+                rotate_hours=LOG_ROTATE_HOURS if rotate_hours is None else rotate_hours
+            )
+            handler.setFormatter(formatter or logging.Formatter(LOG_FORMAT_TEXT))
+            _handlers[path] = handler
+        elif formatter is not None:
+            handler.setFormatter(formatter)
+        return handler
+
+
+def _in_use(handler: logging.Handler) -> bool:
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    return any(handler in logger.handlers for logger in loggers)
+
+
+def remove_handlers(logger: logging.Logger):
+    """
+    Detach all of logger's handlers and close the ones no other logger still
+    uses (a shared rotating handler stays open while another logger has it).
+    """
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        if _in_use(handler):
+            continue
+        handler.close()
+        with _handlers_lock:
+            for path, registered in list(_handlers.items()):
+                if registered is handler:
+                    del _handlers[path]
+
+
+def rotate_oversized_logs(logs_dir: str, max_mb: Optional[float] = None,
+                          backup_count: Optional[int] = None) -> List[str]:
+    """
+    Rotate *.log files over max_mb that no handler in this process owns
+    (files written directly, or by a process that has exited), the same way
+    the handler would. Returns the rotated paths.
+    """
+    max_bytes = (LOG_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    backup_count = LOG_BACKUP_COUNT if backup_count is None else backup_count
+    rotated = []
+    for name in sorted(os.listdir(logs_dir)):
+        path = os.path.abspath(os.path.join(logs_dir, name))
+        if not name.endswith(".log") or path in _handlers:
+            continue
+        try:
+            if os.path.getsize(path) <= max_bytes:
+                continue
+            with _log_file_lock(path) as shared:
+                if os.path.getsize(path) <= max_bytes:
+                    continue
+                for index in range(backup_count - 1, 0, -1):
+                    source = f"{path}.{index}.gz"
+                    if os.path.exists(source):
+                        os.replace(source, f"{path}.{index + 1}.gz")
+                if backup_count > 0:
+                    _gzip_rotator(path, f"{path}.1.gz")
+                else:
+                    os.remove(path)
+                open(path, "a").close()
+                shared.rotated()
+            rotated.append(path)
+        except OSError as e:
+            logging.getLogger(__name__).error("Could not rotate %s: %s", path, e)
+    return rotated
+
+
+def remove_expired_logs(logs_dir: str, max_age_days: Optional[float] = None) -> List[str]:
+    """
+    Delete log files and rotated segments not written to for max_age_days
+    (LOG_RETENTION_DAYS), so a quiet log does not keep old entries forever.
+    Live files owned by a handler in this process are kept. Returns the
+    removed paths.
+    """
+    max_age_days = LOG_RETENTION_DAYS if max_age_days is None else max_age_days
+    cutoff = time.time() - max_age_days * 86400
+    removed = []
+    for name in sorted(os.listdir(logs_dir)):
+        path = os.path.abspath(os.path.join(logs_dir, name))
+        live = name.endswith(".log")
+        if not (live or rotated_from(name)) or path in _handlers:
+            continue
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            with _log_file_lock(path if live else os.path.join(logs_dir, rotated_from(name))) as shared:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    if live:
+                        shared.rotated()
+                    removed.append(path)
+        except OSError as e:
+            logging.getLogger(__name__).error("Could not remove %s: %s", path, e)
+    return removed
+
+
+_SEGMENT_RE = re.compile(r"^(?P<base>.+\.log)\.(?P<index>\d+)\.gz$")
+
+
+def rotated_from(name: str) -> Optional[str]:
+    """The live log file name a rotated segment name (app.log.2.gz) belongs to, or None."""
+    match = _SEGMENT_RE.match(name)
+    return match.group("base") if match else None
+
+
+def log_segments(path: str) -> List[str]:
+    """The live file (if present) and its rotated segments, newest first."""
+    directory, base = os.path.split(os.path.abspath(path))
+    segments = []
+    for name in os.listdir(directory):
+        match = _SEGMENT_RE.match(name)
+        if match and match.group("base") == base:
+            segments.append((int(match.group("index")), os.path.join(directory, name)))
+    live = [os.path.abspath(path)] if os.path.exists(path) else []
+    return live + [segment for _, segment in sorted(segments)]
+
+
+def _tail_plain(path: str, lines: int) -> List[str]:
+    """Last lines of a plain file, reading fixed-size blocks backwards from the end."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= lines:
+            read_size = min(TAIL_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    text_lines = data.decode("utf-8", errors="replace").splitlines()
+    if position > 0:
+        text_lines = text_lines[1:]  # first line is partial
+    return text_lines[-lines:] if lines else []
+
+
+def _tail_gzip(path: str, lines: int) -> List[str]:
+    """Last lines of a gzip segment; streamed, holding only `lines` lines in memory."""
+    with gzip.open(path, "rt", encoding="utf-8", errors="replace") as f:
+        return [line.rstrip("\n") for line in deque(f, maxlen=lines)]
+
+
+def tail_log(path: str, lines: int = 500, include_rotated: bool = True) -> Dict[str, Any]:
+    """
+    Last `lines` lines of a log, continuing into rotated segments when the
+    live file has fewer.
+
+    Returns:
+        dict: {"lines": [...] oldest first, "segments": [paths read], "truncated": bool}
+    """
+    segments = log_segments(path) if include_rotated else [p for p in [os.path.abspath(path)] if os.path.exists(p)]
+    collected: List[str] = []
+    read = []
+    for segment in segments:
+        needed = lines - len(collected)
+        if needed <= 0:
+            break
+        chunk = _tail_gzip(segment, needed) if segment.endswith(".gz") else _tail_plain(segment, needed)
+        collected = chunk + collected
+        read.append(segment)
+    return {"lines": collected, "segments": read, "truncated": len(collected) >= lines}
@@ -0,0 +1,478 @@
+"""
+Daily metric cube shared by the YTD, weekly, monthly and annual analytics.
+
+Every dashboard metric has a ytd_query that returns a daily series
+("SELECT date_trunc_ymd(<date>) as date, <aggregate> as value WHERE ...").
+The cube refresh rewrites that query once per cycle into one query per
+category field, grouped by day, supervisor district and that field (never
+the cross-product of all fields, which can be huge), fetches only the days
+since the last refresh (plus a short lookback for late records), and stores
+one row per
+
+    (metric_id, district, field_name, field_value, day)
+
+in the metric_daily_cube table. district '0' is citywide and field_name ''
+is the metric total, so the cube holds every marginal the period views use.
+
+Measures are additive: COUNT/SUM metrics store the sum in value; AVG metrics
+(response times) store SUM in value and COUNT in weight so averages can be
+rolled up exactly (sum(value) / sum(weight)).
+
+Rollups to week, month, year, YTD and trend lines are plain pandas group-bys
+over a cube frame (see rollup, window_total and trend_series), so a new period
+type needs no new portal query.
+
+Configuration:
+    METRIC_CUBE_HISTORY_YEARS   Full years kept before the current one (default 2)
+    METRIC_CUBE_LOOKBACK_DAYS   Days re-fetched on each incremental refresh (default 14)
+"""
+
+import os
+import re
+import hashlib
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import psycopg2.extras
+
+from tools.db_utils import get_postgres_connection
+
+logger = logging.getLogger(__name__)
+
+METRIC_CUBE_HISTORY_YEARS = int(os.getenv("METRIC_CUBE_HISTORY_YEARS", "2"))
+METRIC_CUBE_LOOKBACK_DAYS = int(os.getenv("METRIC_CUBE_LOOKBACK_DAYS", "14"))
+
+DISTRICT_FIELD = "supervisor_district"
+CITYWIDE = "0"
+TOTAL_FIELD = ""
+CUBE_COLUMNS = ["metric_id", "district", "field_name", "field_value", "day", "value", "weight"]
+
+_YTD_QUERY_PATTERN = re.compile(
+    r"SELECT\s+date_trunc_\w+\((?P<date_field>.*?)\)\s+as\s+date\s*,\s*(?P<value>.*?)\s+as\s+value\s+"
+    r"WHERE\s+(?P<where>.*?)\s+GROUP\s+BY\s+.*$",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def _field_name(field) -> str:
+    return field.get("fieldName", "") if isinstance(field, dict) else (field or "")
+
+
+def cube_dimensions(query_data: Dict[str, Any]) -> List[str]:
+    """District (when the metric has one) followed by the metric's category fields."""
+    dimensions = []
+    for field in (query_data.get("location_fields") or []) + (query_data.get("category_fields") or []):
+        name = _field_name(field)
+        if name and name not in dimensions:
+            dimensions.append(name)
+    if DISTRICT_FIELD in dimensions:
+        dimensions.remove(DISTRICT_FIELD)
+        dimensions.insert(0, DISTRICT_FIELD)
+    return dimensions
+
+
+def _split_aggregate(value_expression: str):
+    """Return (measure, weight) SoQL expressions for an additive representation of the aggregate."""
+    avg_match = re.match(r"^\s*AVG\s*\((.*)\)\s*$", value_expression, re.IGNORECASE | re.DOTALL)
+    if avg_match:
+        inner = avg_match.group(1)
+        return f"SUM({inner})", f"COUNT({inner})", "avg"
+    return value_expression.strip(), None, "sum"
+
+
+def build_cube_query(ytd_query: str, dimensions: List[str], start_date, end_date) -> Optional[Dict[str, Any]]:
+    """
+    Rewrite a metric's ytd_query into the daily cube query for [start_date, end_date].
+
+    Returns:
+        dict: {"query", "aggregation"} or None if the query does not have the ytd_query shape
+    """
+    query = ytd_query.replace("date_trunc_y(date_sub_y(current_date, 1))", "last_year_start")
+    match = _YTD_QUERY_PATTERN.search(query.strip())
+    if not match:
+        return None
+
+    date_field = match.group("date_field").strip()
+    measure, weight, aggregation = _split_aggregate(match.group("value"))
+    where = match.group("where")
+    where = re.sub(r"\blast_year_start\b", f"'{start_date}'", where)
+    where = re.sub(r"\bcurrent_date\b", f"'{end_date}'", where)
+    # Clamp to the refresh window even if the query has its own (wider) bounds
+    where = f"({where}) AND {date_field} >= '{start_date}' AND {date_field} <= '{end_date}T23:59:59'"
+
+    select = [f"date_trunc_ymd({date_field}) as date", f"{measure} as value"]
+    if weight:
+        select.append(f"{weight} as weight")
+    select.extend(dimensions)
+    group_by = ["date"] + list(dimensions)
+
+    # Ordered by every grouped column: results are paged with LIMIT/OFFSET, which needs a total order
+    return {
+        "query": f"SELECT {', '.join(select)} WHERE {where} GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}",
+        "aggregation": aggregation
+    }
+
+
+def cube_groupings(dimensions: List[str]) -> List[List[str]]:
+    """
+    The dimension sets to query for a cube: district (when present) with one
+    category field at a time. Each marginal the cube stores is a sum over one
+    of them, and no query grows with the product of the fields' cardinalities.
+    """
+    district = [DISTRICT_FIELD] if DISTRICT_FIELD in dimensions else []
+    fields = [dimension for dimension in dimensions if dimension != DISTRICT_FIELD]
+    return [district + [field] for field in fields] or [district]
+
+
+def build_cube_slices(raw: pd.DataFrame, metric_id, dimensions: List[str]) -> pd.DataFrame:
+    """
+    Turn the fine-grained daily rows (day x district x category fields) into cube rows.
+
+    Produces the citywide total and per-field marginals, and the same per
+    supervisor district when the metric has one.
+    """
+    if raw is None or raw.empty:
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+
+    df = raw.copy()
+    df["day"] = pd.to_datetime(df["date"], errors="coerce").dt.normalize()
+    df = df[df["day"].notna()]
+    df["value"] = pd.to_numeric(df["value"], errors="coerce").fillna(0.0)
+    df["weight"] = pd.to_numeric(df["weight"], errors="coerce").fillna(0.0) if "weight" in df.columns else float("nan")
+    for dimension in dimensions:
+        if dimension not in df.columns:
+            df[dimension] = None
+        df[dimension] = df[dimension].fillna("").astype(str)
+
+    has_district = DISTRICT_FIELD in dimensions
+    scopes = [None, DISTRICT_FIELD] if has_district else [None]
+    slices = []
+    for scope in scopes:
+        for field in [TOTAL_FIELD] + dimensions:
+            if scope and field == DISTRICT_FIELD:
+                continue
+            keys = ([scope] if scope else []) + ([field] if field else []) + ["day"]
+            grouped = df.groupby(keys, sort=False, dropna=False)[["value", "weight"]].sum(min_count=1).reset_index()
+            grouped["district"] = grouped[scope] if scope else CITYWIDE
+            grouped["field_name"] = field
+            grouped["field_value"] = grouped[field] if field else ""
+            slices.append(grouped[["district", "field_name", "field_value", "day", "value", "weight"]])
+
+    cube = pd.concat(slices, ignore_index=True)
+    if has_district:
+        cube = cube[cube["district"] != ""]
+    cube.insert(0, "metric_id", str(metric_id))
+    cube["day"] = cube["day"].dt.date
+    return cube[CUBE_COLUMNS]
+
+
+def merge_cube_slices(slices: List[pd.DataFrame]) -> pd.DataFrame:
+    """Combine the cube rows built from each grouping; totals every grouping repeats are kept once."""
+    slices = [frame for frame in slices if not frame.empty]
+    if not slices:
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+    cube = pd.concat(slices, ignore_index=True)
+    return cube.drop_duplicates(subset=["metric_id", "district", "field_name", "field_value", "day"], ignore_index=True)
+
+
+# ------------------------------
+# Rollups
+# ------------------------------
+
+def _period_start(days: pd.Series, period_type: str) -> pd.Series:
+    days = pd.to_datetime(days)
+    if period_type == "day":
+        return days
+    if period_type == "week":
+        # Weeks are counted from January 1st, as in generate_weekly_analysis
+        year_start = days.dt.to_period("Y").dt.start_time
+        return year_start + pd.to_timedelta(((days - year_start).dt.days // 7) * 7, unit="D")
+    if period_type == "month":
+        return days.dt.to_period("M").dt.start_time
+    if period_type == "year":
+        return days.dt.to_period("Y").dt.start_time
+    raise ValueError(f"Unsupported period type: {period_type}")
+
+
+def _finish(grouped: pd.DataFrame, aggregation: str) -> pd.DataFrame:
+    if aggregation == "avg":
+        grouped["value"] = grouped["value"] / grouped["weight"].where(grouped["weight"] > 0)
+    return grouped.drop(columns=["weight"])
+
+
+def rollup(cube: pd.DataFrame, period_type: str, aggregation: str = "sum") -> pd.DataFrame:
+    """
+    Roll cube rows up to day, week, month or year.
+
+    Returns:
+        DataFrame with district, field_name, field_value, period_start, value
+    """
+    if cube.empty:
+        return pd.DataFrame(columns=["district", "field_name", "field_value", "period_start", "value"])
+    frame = cube.assign(period_start=_period_start(cube["day"], period_type))
+    grouped = frame.groupby(["district", "field_name", "field_value", "period_start"], sort=True)[["value", "weight"]].sum(min_count=1).reset_index()
+    return _finish(grouped, aggregation)
+
+
+def window_total(cube: pd.DataFrame, start, end, aggregation: str = "sum") -> pd.DataFrame:
+    """
+    Total (or weighted mean) of each district/field/value over the inclusive window [start, end].
+    """
+    days = pd.to_datetime(cube["day"])
+    frame = cube[(days >= pd.Timestamp(start)) & (days <= pd.Timestamp(end))]
+    grouped = frame.groupby(["district", "field_name", "field_value"], sort=True)[["value", "weight"]].sum(min_count=1).reset_index()
+    return _finish(grouped, aggregation)
+
+
+def trend_series(cube: pd.DataFrame, start, end, district: str = CITYWIDE, aggregation: str = "sum") -> Dict[str, float]:
+    """Daily metric total for one district as {YYYY-MM-DD: value}, the shape of ytd trend_data."""
+    frame = cube[(cube["district"] == district) & (cube["field_name"] == TOTAL_FIELD)]
+    days = pd.to_datetime(frame["day"])
+    frame = frame[(days >= pd.Timestamp(start)) & (days <= pd.Timestamp(end))]
+    daily = _finish(frame.groupby("day", sort=True)[["value", "weight"]].sum(min_count=1).reset_index(), aggregation)
+    return {pd.Timestamp(day).strftime("%Y-%m-%d"): float(value) for day, value in zip(daily["day"], daily["value"]) if pd.notnull(value)}
+
+
+def same_day_last_year(day: date) -> date:
+    """The same calendar day one year earlier (Feb 29 maps to Feb 28)."""
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, day=28)
+
+
+def ytd_results(cube: pd.DataFrame, as_of, aggregation: str = "sum") -> Dict[str, Dict[str, Any]]:
+    """
+    This-year vs last-year YTD per district, cut at as_of (or the last day with data, if earlier).
+
+    Returns:
+        dict: {district: {"thisYear", "lastYear", "lastDataDate"}}, the shape
+              generate_ytd_metrics uses; empty if there is no data up to as_of
+    """
+    as_of = pd.Timestamp(as_of).normalize()
+    totals = cube[cube["field_name"] == TOTAL_FIELD]
+    days = pd.to_datetime(totals["day"])
+    totals = totals[days <= as_of]
+    if totals.empty:
+        return {}
+
+    cutoff = min(as_of, pd.to_datetime(totals["day"]).max()).date()
+    this_year = window_total(totals, date(cutoff.year, 1, 1), cutoff, aggregation).set_index("district")["value"]
+    last_year = window_total(totals, date(cutoff.year - 1, 1, 1), same_day_last_year(cutoff), aggregation).set_index("district")["value"]
+
+    results = {}
+    for district in sorted(set(this_year.index) | set(last_year.index), key=lambda d: (len(d), d)):
+        this_value = this_year.get(district)
+        last_value = last_year.get(district)
+        results[district] = {
+            "lastYear": int(last_value) if pd.notnull(last_value) else 0,
+            "thisYear": int(this_value) if pd.notnull(this_value) else 0,
+            "lastDataDate": cutoff.strftime("%Y-%m-%d")
+        }
+    return results
+
+
+def last_data_date(cube: pd.DataFrame) -> Optional[str]:
+    """Latest day with data in the cube."""
+    if cube.empty:
+        return None
+    return pd.Timestamp(pd.to_datetime(cube["day"]).max()).strftime("%Y-%m-%d")
+
+
+# ------------------------------
+# Storage
+# ------------------------------
+
+def ensure_cube_tables(connection):
+    """Create the cube tables if this database predates them."""
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS metric_daily_cube (
+            metric_id TEXT NOT NULL,
+            district TEXT NOT NULL,
+            field_name TEXT NOT NULL,
+            field_value TEXT NOT NULL,
+            day DATE NOT NULL,
+            value DOUBLE PRECISION,
+            weight DOUBLE PRECISION,
+            PRIMARY KEY (metric_id, district, field_name, field_value, day)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS metric_daily_cube_metric_day_idx ON metric_daily_cube (metric_id, day)
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS metric_cube_state (
+            metric_id TEXT PRIMARY KEY,
+            query_hash TEXT NOT NULL,
+            aggregation TEXT NOT NULL,
+            start_date DATE NOT NULL,
+            last_day DATE,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    connection.commit()
+    cursor.close()
+
+
+def get_cube_state(connection, metric_id) -> Optional[Dict[str, Any]]:
+    cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute("SELECT * FROM metric_cube_state WHERE metric_id = %s", (str(metric_id),))
+    state = cursor.fetchone()
+    cursor.close()
+    return dict(state) if state else None
+
+
+def load_cube(connection, metric_id, start=None, end=None, district: Optional[str] = None,
+              field_name: Optional[str] = None) -> pd.DataFrame:
+    """Read cube rows for a metric, optionally limited to a window, district and field."""
+    conditions = ["metric_id = %s"]
+    params = [str(metric_id)]
+    for column, operator, value in (("day", ">=", start), ("day", "<=", end), ("district", "=", district), ("field_name", "=", field_name)):
+        if value is not None:
+            conditions.append(f"{column} {operator} %s")
+            params.append(value)
+
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {', '.join(CUBE_COLUMNS)} FROM metric_daily_cube WHERE {' AND '.join(conditions)}", params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return pd.DataFrame(rows, columns=CUBE_COLUMNS)
+
+
+def _replace_window(connection, metric_id, cube: pd.DataFrame, start, end):
+    cursor = connection.cursor()
+    cursor.execute(
+        "DELETE FROM metric_daily_cube WHERE metric_id = %s AND day >= %s AND day <= %s",
+        (str(metric_id), start, end)
+    )
+    rows = [
+        (r.metric_id, r.district, r.field_name, r.field_value, r.day,
+         None if pd.isna(r.value) else float(r.value), None if pd.isna(r.weight) else float(r.weight))
+        for r in cube.itertuples(index=False)
+    ]
+    if rows:
+        psycopg2.extras.execute_values(
+            cursor,
+            f"INSERT INTO metric_daily_cube ({', '.join(CUBE_COLUMNS)}) VALUES %s",
+            rows,
+            page_size=5000
+        )
+    cursor.close()
+    return len(rows)
+
+
+def _default_fetch(endpoint: str, query: str) -> Optional[pd.DataFrame]:
+    from tools.data_fetcher import set_dataset
+
+    context_variables = {}
+    result = set_dataset(context_variables, endpoint=endpoint, query=query)
+    if result.get("status") == "success" and "dataset" in context_variables:
+        return context_variables["dataset"]
+    logger.error(f"Cube query failed for {endpoint}: {result.get('error')}")
+    return None
+
+
+def refresh_metric_cube(metric_id, query_data: Dict[str, Any], endpoint: str, as_of=None,
+                        connection=None, fetch=None, full: bool = False) -> Dict[str, Any]:
+    """
+    Bring one metric's cube up to date with one portal query per category field.
+
+    The first refresh (or one after the ytd_query or its fields changed)
+    loads METRIC_CUBE_HISTORY_YEARS full years plus the current year; later
+    refreshes only re-fetch the last METRIC_CUBE_LOOKBACK_DAYS before the
+    previous last day.
+
+    Args:
+        metric_id: Numeric metric ID
+        query_data: Metric entry from dashboard_queries_enhanced.json
+        endpoint: Dataset endpoint
+        as_of: Last day to load (defaults to yesterday)
+        connection: Open database connection (one is opened if omitted)
+        fetch: fetch(endpoint, query) -> DataFrame, defaults to set_dataset
+        full: Force a full reload
+
+    Returns:
+        dict: {"status", "metric_id", "start", "end", "rows", "aggregation", "query"} or {"status": "error", "message"}
+    """
+    as_of = as_of or (date.today() - timedelta(days=1))
+    if isinstance(as_of, str):
+        as_of = datetime.strptime(as_of, "%Y-%m-%d").date()
+    fetch = fetch or _default_fetch
+    ytd_query = query_data.get("ytd_query")
+    if not ytd_query:
+        return {"status": "error", "message": f"Metric {metric_id} has no ytd_query"}
+
+    dimensions = cube_dimensions(query_data)
+    query_hash = hashlib.sha256(f"{ytd_query}|{','.join(dimensions)}".encode("utf-8")).hexdigest()
+    history_start = date(as_of.year - METRIC_CUBE_HISTORY_YEARS, 1, 1)
+
+    own_connection = connection is None
+    connection = connection or get_postgres_connection()
+    if connection is None:
+        return {"status": "error", "message": "Failed to connect to database"}
+
+    try:
+        ensure_cube_tables(connection)
+        state = get_cube_state(connection, metric_id)
+        if full or not state or state["query_hash"] != query_hash or not state.get("last_day") or state["start_date"] > history_start:
+            start = history_start
+        else:
+            start = max(history_start, state["last_day"] - timedelta(days=METRIC_CUBE_LOOKBACK_DAYS))
+
+        groupings = cube_groupings(dimensions)
+        cube_queries = [build_cube_query(ytd_query, grouping, start.isoformat(), as_of.isoformat()) for grouping in groupings]
+        if not cube_queries[0]:
+            return {"status": "error", "message": f"Metric {metric_id} ytd_query does not have the daily series shape"}
+
+        logger.info(f"Refreshing cube for metric {metric_id} from {start} to {as_of} with {len(cube_queries)} queries")
+        slices, source_rows = [], 0
+        for grouping, cube_query in zip(groupings, cube_queries):
+            raw = fetch(endpoint, cube_query["query"])
+            if raw is None:
+                return {"status": "error", "message": f"Cube query failed for metric {metric_id}"}
+            source_rows += len(raw)
+            slices.append(build_cube_slices(raw, metric_id, grouping))
+        cube = merge_cube_slices(slices)
+        cube_query = cube_queries[0]
+        if start == history_start:
+            # Full reload: drop anything outside the new window too
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM metric_daily_cube WHERE metric_id = %s", (str(metric_id),))
+            cursor.close()
+        rows = _replace_window(connection, metric_id, cube, start, as_of)
+
+        last_day = pd.to_datetime(cube["day"]).max().date() if not cube.empty else (state or {}).get("last_day")
+        cursor = connection.cursor()
+        cursor.execute("""
+            INSERT INTO metric_cube_state (metric_id, query_hash, aggregation, start_date, last_day, updated_at)
+            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (metric_id) DO UPDATE SET
+                query_hash = EXCLUDED.query_hash,
+                aggregation = EXCLUDED.aggregation,
+                start_date = EXCLUDED.start_date,
+                last_day = EXCLUDED.last_day,
+                updated_at = CURRENT_TIMESTAMP
+        """, (str(metric_id), query_hash, cube_query["aggregation"], history_start if start == history_start else state["start_date"], last_day))
+        cursor.close()
+        connection.commit()
+
+        logger.info(f"Cube for metric {metric_id}: {source_rows} source rows -> {rows} cube rows")
+        return {
+            "status": "success",
+            "metric_id": str(metric_id),
+            "start": start.isoformat(),
+            "end": as_of.isoformat(),
+            "rows": rows,
+            "aggregation": cube_query["aggregation"],
+            "query": cube_query["query"]
+        }
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"Error refreshing cube for metric {metric_id}: {e}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        if own_connection:
+            connection.close()
@@ -0,0 +1,237 @@
+"""
+Bounded, streaming execution of ad-hoc read queries for the backend query page.
+
+Rows are read through a named (server-side) cursor in batches of
+PG_QUERY_ITERSIZE, so the web worker holds one batch at a time however
+large the result is. Output is NDJSON or CSV chunks, or a capped list of
+dicts for the JSON view. Every query runs under a statement timeout and
+stops at a row cap and a byte cap; when a cap is hit the output ends with
+a truncation marker instead of failing. Limits a client passes in are
+clamped to the server-side maxima (PG_STATEMENT_TIMEOUT_MAX_MS,
+PG_QUERY_MAX_ROWS, PG_QUERY_MAX_MB); negative ones raise ValueError.
+
+    NDJSON: one object per row, then {"_meta": {"rows", "bytes", "truncated", "reason"}}
+    CSV:    header, rows, then "# truncated: ..." if a cap was hit
+"""
+
+import io
+import os
+import re
+import csv
+import json
+import uuid
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PG_QUERY_MAX_ROWS = int(os.getenv("PG_QUERY_MAX_ROWS", "100000"))
+PG_QUERY_MAX_MB = float(os.getenv("PG_QUERY_MAX_MB", "50"))
+PG_QUERY_ITERSIZE = int(os.getenv("PG_QUERY_ITERSIZE", "2000"))
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "30000"))
+PG_STATEMENT_TIMEOUT_MAX_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MAX_MS", "120000"))
+JSON_VIEW_MAX_ROWS = int(os.getenv("PG_QUERY_JSON_MAX_ROWS", "5000"))
+
+READ_PREFIXES = ("SELECT", "VALUES", "TABLE")
+FORMATS = ("ndjson", "csv")
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+def is_read_query(query: str) -> bool:
+    """True for statements that return rows and can run on a server-side cursor."""
+    statement = query.lstrip("( \n\t").upper()
+    if statement.startswith("WITH"):
+        # A data-modifying CTE has to be committed, so it takes the write path
+        return not _WRITE_RE.search(statement)
+    return statement.startswith(READ_PREFIXES)
+
+
+def _to_jsonable(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return value
+
+
+def bounded(value, default: int, maximum: int, name: str) -> int:
+    """A client-supplied limit: default when unset, clamped to maximum, never negative."""
+    if value is None or value == "":
+        return default
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"{name} must not be negative")
+    return min(value, maximum)
+
+
+def max_bytes_limit() -> int:
+    return int(PG_QUERY_MAX_MB * 1024 * 1024)
+
+
+def _set_timeout(connection, timeout_ms: Optional[int]):
+    # 0 would disable the timeout altogether, so it means "use the default" here
+    timeout_ms = bounded(timeout_ms or None, PG_STATEMENT_TIMEOUT_MS, PG_STATEMENT_TIMEOUT_MAX_MS, "timeout_ms")
+    # SET LOCAL only lasts for the current transaction, which the named cursor keeps open
+    cursor = connection.cursor()
+    cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+    cursor.close()
+
+
+def iter_rows(connection, query: str, parameters=None, itersize: Optional[int] = None,
+              timeout_ms: Optional[int] = None) -> Tuple[List[str], Iterator[tuple]]:
+    """
+    Run a read query on a named cursor.
+
+    Returns:
+        tuple: (column names, iterator of row tuples). The iterator fetches
+               itersize rows per round trip and closes the cursor when done
+               or when it is closed early.
+    """
+    _set_timeout(connection, timeout_ms)
+    cursor = connection.cursor(name=f"query_stream_{uuid.uuid4().hex[:12]}")
+    cursor.itersize = itersize or PG_QUERY_ITERSIZE
+    cursor.execute(query, parameters or None)
+
+    # A named cursor only has a description after the first fetch
+    first = cursor.fetchmany(cursor.itersize)
+    columns = [column[0] for column in cursor.description] if cursor.description else []
+
+    def rows():
+        try:
+            batch = first
+            while batch:
+                yield from batch
+                batch = cursor.fetchmany(cursor.itersize)
+        finally:
+            cursor.close()
+
+    return columns, rows()
+
+
+def _row_bytes_ndjson(columns, row) -> bytes:
+    return (json.dumps({c: _to_jsonable(v) for c, v in zip(columns, row)}, default=str) + "\n").encode("utf-8")
+
+
+def _row_bytes_csv(row) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow([_to_jsonable(v) for v in row])
+    return buffer.getvalue().encode("utf-8")
+
+
+def stream_query(connection, query: str, parameters=None, fmt: str = "ndjson",
+                 max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                 itersize: Optional[int] = None, timeout_ms: Optional[int] = None,
+                 close_connection: bool = True) -> Iterator[bytes]:
+    """
+    Yield the result of a read query as NDJSON or CSV chunks (about one
+    itersize batch each), ending with a truncation marker if a cap was hit.
+
+    Meant to be handed to a StreamingResponse: the connection is rolled back
+    and (by default) closed when the generator finishes or the client goes away.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    max_rows = bounded(max_rows, PG_QUERY_MAX_ROWS, PG_QUERY_MAX_ROWS, "max_rows")
+    max_bytes = bounded(max_bytes, max_bytes_limit(), max_bytes_limit(), "max_bytes")
+    itersize = itersize or PG_QUERY_ITERSIZE
+
+    rows_sent = 0
+    bytes_sent = 0
+    reason = None
+    rows = None
+    try:
+        try:
+            columns, rows = iter_rows(connection, query, parameters, itersize, timeout_ms)
+        except Exception as e:
+            logger.warning("Streaming query failed: %s", e)
+            error = {"_meta": {"error": str(e), "rows": 0}}
+            yield (json.dumps(error) + "\n").encode("utf-8") if fmt == "ndjson" else f"# error: {e}\n".encode("utf-8")
+            return
+
+        chunk = []
+        if fmt == "csv":
+            header = _row_bytes_csv(columns)
+            chunk.append(header)
+            bytes_sent += len(header)
+
+        for row in rows:
+            if rows_sent >= max_rows:
+                reason = "row_limit"
+                break
+            line = _row_bytes_ndjson(columns, row) if fmt == "ndjson" else _row_bytes_csv(row)
+            if bytes_sent + len(line) > max_bytes:
+                reason = "byte_limit"
+                break
+            chunk.append(line)
+            rows_sent += 1
+            bytes_sent += len(line)
+            if len(chunk) >= itersize:
+                yield b"".join(chunk)
+                chunk = []
+        if chunk:
+            yield b"".join(chunk)
+
+        if fmt == "ndjson":
+            meta = {"rows": rows_sent, "bytes": bytes_sent, "truncated": reason is not None, "reason": reason}
+            yield (json.dumps({"_meta": meta}) + "\n").encode("utf-8")
+        elif reason:
+            yield f"# truncated: {reason} after {rows_sent} rows\n".encode("utf-8")
+        logger.info("Streamed %d rows (%d bytes) as %s%s", rows_sent, bytes_sent, fmt, f", truncated by {reason}" if reason else "")
+    finally:
+        if rows is not None:
+            rows.close()
+        try:
+            connection.rollback()
+        except Exception:
+            pass
+        if close_connection:
+            connection.close()
+
+
+def fetch_capped(connection, query: str, parameters=None, max_rows: Optional[int] = None,
+                 timeout_ms: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Fetch at most max_rows rows of a read query as JSON-ready dicts.
+
+    Returns:
+        dict: {"columns", "results", "rowCount", "truncated"}
+    """
+    max_rows = bounded(max_rows, JSON_VIEW_MAX_ROWS, PG_QUERY_MAX_ROWS, "max_rows")
+    columns, rows = iter_rows(connection, query, parameters, min(PG_QUERY_ITERSIZE, max_rows + 1), timeout_ms)
+    results = []
+    truncated = False
+    try:
+        for row in rows:
+            if len(results) >= max_rows:
+                truncated = True
+                break
+            results.append({c: _to_jsonable(v) for c, v in zip(columns, row)})
+    finally:
+        rows.close()
+        connection.rollback()
+    return {"columns": columns, "results": results, "rowCount": len(results), "truncated": truncated}
+
+
+def explain_query(connection, query: str, parameters=None, timeout_ms: Optional[int] = None) -> Dict[str, Any]:
+    """
+    EXPLAIN (FORMAT JSON) a read query without running it.
+
+    Returns:
+        dict: {"plan", "estimated_rows", "estimated_cost"}
+    """
+    try:
+        _set_timeout(connection, timeout_ms)
+        cursor = connection.cursor()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", parameters or None)
+        plan = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        connection.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    top = plan[0]["Plan"]
+    return {"plan": plan, "estimated_rows": top.get("Plan Rows"), "estimated_cost": top.get("Total Cost")}
@@ -0,0 +1,379 @@
+"""
+Record/replay of outbound HTTP for offline, deterministic pipeline runs.
+
+Every external service the pipelines talk to goes through one of two HTTP
+stacks: requests (fetch_data_from_api against data.sfgov.org, and
+_make_dw_request / dw_request against Datawrapper) and httpx (the OpenAI
+client, and with it Swarm, and the Qdrant REST client). A Cassette hooks the
+transport layer of both, so those call sites need no changes:
+
+- mode "record" sends every request live and writes the response to the
+  cassette file (gzipped JSON lines, one interaction per line).
+- mode "replay" answers every request from the cassette and never touches
+  the network; a request with no recording raises CassetteMiss (surfaced by
+  httpx as a ConnectError).
+- mode "auto" replays what is recorded and records the rest.
+
+Requests are matched on method, URL (query parameters sorted) and a hash of
+the body; repeated identical requests replay their recordings in order.
+Prompts and SoQL queries often embed today's date, so a request with no
+exact match falls back to the next unused recording for the same method,
+host and path (strict=True disables this). Replays can sleep to simulate
+the service: latency="recorded" reuses the recorded durations, optionally
+scaled ("recorded:0.5"), and a number sleeps that many seconds per request.
+
+    with use_cassette("ytd", mode="replay", latency="recorded"):
+        generate_ytd_metrics(queries, output_dir)
+
+PostgreSQL is not intercepted; it is expected to run locally.
+"""
+
+import os
+import json
+import gzip
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPLAY_MODE = os.getenv("REPLAY_MODE", "replay")
+REPLAY_CASSETTE_DIR = os.getenv("REPLAY_CASSETTE_DIR", os.path.join(AI_DIR, "data", "benchmarks", "cassettes"))
+REPLAY_LATENCY = os.getenv("REPLAY_LATENCY", "")
+MODES = ("record", "replay", "auto")
+# Headers that describe the encoded transfer, not the decoded body that is stored
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """A replayed request has no recording in the cassette."""
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, query, ""))
+
+
+def route_of(method: str, url: str) -> str:
+    parts = urlsplit(url)
+    return f"{method.upper()} {parts.netloc.lower()}{parts.path}"
+
+
+def body_digest(body) -> str:
+    """Hash of a request body; JSON bodies are canonicalized so key order does not matter."""
+    if body is None:
+        return ""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def request_key(method: str, url: str, body) -> str:
+    return f"{method.upper()} {normalize_url(url)} {body_digest(body)}"
+
+
+def parse_latency(spec) -> Tuple[Optional[float], float]:
+    """
+    "" or None -> no injected latency; "recorded" or "recorded:0.5" -> the
+    recorded duration times the scale; a number -> that many seconds.
+    Returns (fixed_seconds, recorded_scale).
+    """
+    if spec in (None, "", 0, "0"):
+        return None, 0.0
+    if isinstance(spec, str) and spec.startswith("recorded"):
+        _, _, scale = spec.partition(":")
+        return None, float(scale or 1.0)
+    return float(spec), 0.0
+
+
+class Cassette:
+    """
+    One cassette file and the hooks that record to or replay from it.
+
+    Args:
+        path: The .jsonl.gz cassette file
+        mode: "record", "replay" or "auto"
+        latency: Injected latency for replayed requests (see parse_latency)
+        strict: Only replay exact matches, never the same-route fallback
+        passthrough_hosts: Hosts ("localhost:8000") whose requests go out live and are not recorded
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency=None, strict: bool = False,
+                 passthrough_hosts: Iterable[str] = ()):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}; expected one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self.fixed_latency, self.latency_scale = parse_latency(latency)
+        self.strict = strict
+        self.passthrough_hosts = {h.lower() for h in passthrough_hosts}
+        self.interactions: List[Dict[str, Any]] = []
+        self._by_key: Dict[str, List[int]] = defaultdict(list)
+        self._by_route: Dict[str, List[int]] = defaultdict(list)
+        self._key_cursor: Dict[str, int] = defaultdict(int)
+        self._used = set()
+        self._lock = threading.Lock()
+        self._file = None
+        # host -> {"requests", "seconds", "recorded", "replayed", "misses"}
+        self.host_stats: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"requests": 0, "seconds": 0.0, "recorded": 0, "replayed": 0, "misses": 0})
+        if mode != "record":
+            self._load()
+
+    # --- Storage -------------------------------------------------------------
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            if self.mode == "replay":
+                raise FileNotFoundError(f"Cassette not found: {self.path}; record it first with mode='record'")
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+        logger.info(f"Loaded {len(self.interactions)} recorded interactions from {self.path}")
+
+    def _index(self, interaction: Dict[str, Any]):
+        position = len(self.interactions)
+        self.interactions.append(interaction)
+        self._by_key[interaction["key"]].append(position)
+        self._by_route[interaction["route"]].append(position)
+
+    def _append(self, interaction: Dict[str, Any]):
+        with self._lock:
+            self._index(interaction)
+            self._used.add(len(self.interactions) - 1)
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = gzip.open(self.path, "wt" if self.mode == "record" else "at", encoding="utf-8")
+            self._file.write(json.dumps(interaction) + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # --- Matching ------------------------------------------------------------
+
+    def _find(self, key: str, route: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            positions = self._by_key.get(key)
+            if positions:
+                # Identical requests replay their recordings in order, then keep the last one
+                cursor = self._key_cursor[key]
+                position = positions[min(cursor, len(positions) - 1)]
+                self._key_cursor[key] = cursor + 1
+                self._used.add(position)
+                return self.interactions[position]
+            if self.strict:
+                return None
+            for position in self._by_route.get(route, ()):
+                if position not in self._used:
+                    self._used.add(position)
+                    return self.interactions[position]
+            return None
+
+    def _count(self, host: str, outcome: str, seconds: float):
+        with self._lock:
+            stats = self.host_stats[host]
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats[outcome] += 1
+
+    def _replay_delay(self, interaction: Dict[str, Any]) -> float:
+        if self.fixed_latency is not None:
+            return self.fixed_latency
+        return interaction.get("elapsed", 0.0) * self.latency_scale
+
+    def replay(self, method: str, url: str, body) -> Optional[Tuple[int, Dict[str, str], bytes, str]]:
+        """
+        The recorded (status, headers, content, reason) for a request, after any
+        injected latency; None if the request should go out live and be recorded.
+        """
+        host = urlsplit(url).netloc.lower()
+        if host in self.passthrough_hosts or self.mode == "record":
+            return None
+        started = time.perf_counter()
+        interaction = self._find(request_key(method, url, body), route_of(method, url))
+        if interaction is None:
+            if self.mode == "replay":
+                self._count(host, "misses", 0.0)
+                raise CassetteMiss(f"No recording for {method.upper()} {url}")
+            return None
+        delay = self._replay_delay(interaction)
+        if delay > 0:
+            time.sleep(delay)
+        self._count(host, "replayed", time.perf_counter() - started)
+        return (interaction["status"], interaction["headers"],
+                base64.b64decode(interaction["body"]), interaction.get("reason", ""))
+
+    def record(self, method: str, url: str, body, response: Tuple[int, Dict[str, str], bytes, str],
+               elapsed: float) -> Tuple[int, Dict[str, str], bytes, str]:
+        """Store a live response; returns it with the transfer-encoding headers dropped."""
+        host = urlsplit(url).netloc.lower()
+        status, headers, content, reason = response
+        headers = {k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS}
+        if host in self.passthrough_hosts:
+            return status, headers, content, reason
+        self._append({"key": request_key(method, url, body), "route": route_of(method, url),
+                      "method": method.upper(), "url": url, "status": status, "reason": reason,
+                      "headers": headers, "body": base64.b64encode(content).decode("ascii"),
+                      "elapsed": round(elapsed, 4)})
+        self._count(host, "recorded", elapsed)
+        return status, headers, content, reason
+
+    def handle(self, method: str, url: str, body, send):
+        """Replay one request, or perform it with send() -> (status, headers, content, reason) and record it."""
+        replayed = self.replay(method, url, body)
+        if replayed is not None:
+            return replayed
+        started = time.perf_counter()
+        response = send()
+        return self.record(method, url, body, response, time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {host: {**values, "seconds": round(values["seconds"], 3)} for host, values in self.host_stats.items()}
+
+    # --- Installation --------------------------------------------------------
+
+    def __enter__(self):
+        install(self)
+        return self
+
+    def __exit__(self, *exc):
+        uninstall(self)
+        self.close()
+        return False
+
+
+_active: Optional[Cassette] = None
+_install_lock = threading.Lock()
+_originals: Dict[str, Any] = {}
+
+
+def _requests_send(adapter, request, *args, **kwargs):
+    cassette = _active
+    original = _originals["requests"]
+    if cassette is None:
+        return original(adapter, request, *args, **kwargs)
+
+    def send():
+        live = original(adapter, request, *args, **kwargs)
+        return live.status_code, dict(live.headers), live.content, live.reason or ""
+
+    started = time.perf_counter()
+    status, headers, content, reason = cassette.handle(request.method, request.url, request.body, send)
+    response = requests.models.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content
+    response._content_consumed = True
+    response.reason = reason
+    response.url = request.url
+    response.request = request
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.elapsed = timedelta(seconds=time.perf_counter() - started)
+    response.connection = adapter
+    return response
+
+
+def _httpx_response(request, status, headers, content):
+    return httpx.Response(status, headers={k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS},
+                          content=content, request=request)
+
+
+def _httpx_handle(transport, request):
+    cassette = _active
+    original = _originals["httpx"]
+    if cassette is None:
+        return original(transport, request)
+
+    def send():
+        live = original(transport, request)
+        try:
+            content = live.read()
+        finally:
+            live.close()
+        return live.status_code, dict(live.headers), content, live.reason_phrase
+
+    try:
+        status, headers, content, _ = cassette.handle(request.method, str(request.url), request.read(), send)
+    except CassetteMiss as e:
+        raise httpx.ConnectError(str(e), request=request) from e
+    return _httpx_response(request, status, headers, content)
+
+
+async def _httpx_handle_async(transport, request):
+    cassette = _active
+    original = _originals["httpx_async"]
+    if cassette is None:
+        return await original(transport, request)
+    method, url, body = request.method, str(request.url), await request.aread()
+    try:
+        replayed = cassette.replay(method, url, body)
+    except CassetteMiss as e:
+        raise httpx.ConnectError(str(e), request=request) from e
+    if replayed is None:
+        started = time.perf_counter()
+        live = await original(transport, request)
+        try:
+            content = await live.aread()
+        finally:
+            await live.aclose()
+        replayed = cassette.record(method, url, body, (live.status_code, dict(live.headers), content,
+                                                       live.reason_phrase), time.perf_counter() - started)
+    status, headers, content, _ = replayed
+    return _httpx_response(request, status, headers, content)
+
+
+def install(cassette: Cassette):
+    """Route outbound requests/httpx traffic of this process through cassette."""
+    global _active
+    with _install_lock:
+        if _active is not None and _active is not cassette:
+            raise RuntimeError(f"Cassette {_active.path} is already active")
+        if not _originals:
+            _originals["requests"] = requests.adapters.HTTPAdapter.send
+            _originals["httpx"] = httpx.HTTPTransport.handle_request
+            _originals["httpx_async"] = httpx.AsyncHTTPTransport.handle_async_request
+            requests.adapters.HTTPAdapter.send = _requests_send
+            httpx.HTTPTransport.handle_request = _httpx_handle
+            httpx.AsyncHTTPTransport.handle_async_request = _httpx_handle_async
+        _active = cassette
+
+
+def uninstall(cassette: Optional[Cassette] = None):
+    """Stop intercepting; the transport hooks stay in place but pass everything through."""
+    global _active
+    with _install_lock:
+        if cassette is None or _active is cassette:
+            _active = None
+
+
+def cassette_path(name: str, cassette_dir: Optional[str] = None) -> str:
+    return os.path.join(cassette_dir or REPLAY_CASSETTE_DIR, f"{name}.jsonl.gz")
+
+
+def use_cassette(name: str, mode: Optional[str] = None, cassette_dir: Optional[str] = None,
+                 latency=None, **kwargs) -> Cassette:
+    """A Cassette for <cassette_dir>/<name>.jsonl.gz, with REPLAY_MODE / REPLAY_LATENCY as defaults."""
+    return Cassette(cassette_path(name, cassette_dir), mode=mode or REPLAY_MODE,
+                    latency=REPLAY_LATENCY if latency is None else latency, **kwargs)
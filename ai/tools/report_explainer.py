@@ -0,0 +1,238 @@
+"""
+Explanation stage of the monthly report pipeline.
+
+Builds the explainer-agent prompt for a monthly_reporting row, runs the agent
+and parses its JSON answer. explain_report_items() runs many rows concurrently
+with a bounded number of in-flight LLM calls and a per-call timeout; the
+database reads and writes stay in monthly_report.generate_explanations.
+
+The LLM client only needs a Swarm-style run(agent, messages,
+context_variables, stream) method, so tests can pass a stub client.
+"""
+
+import os
+import re
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from dateutil.relativedelta import relativedelta
+
+from tools.concurrency import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+EXPLANATION_CONCURRENCY = int(os.getenv("EXPLANATION_CONCURRENCY", "5"))
+EXPLANATION_TIMEOUT = float(os.getenv("EXPLANATION_TIMEOUT", "300"))
+
+
+def _comparison_months(item):
+    """Return (previous_month, recent_month) labels for a report item."""
+    report_date = item.get("report_date") or datetime.now().date()
+    if isinstance(report_date, str):
+        report_date = datetime.strptime(report_date, "%Y-%m-%d").date()
+
+    # The more recent month in the comparison is the month before the report date
+    previous_month_date = report_date - relativedelta(months=1)
+    comparison_month_date = previous_month_date - relativedelta(months=1)
+    return comparison_month_date.strftime("%B %Y"), previous_month_date.strftime("%B %Y")
+
+
+def build_explanation_prompt(item) -> str:
+    """Build the explainer agent prompt for a monthly_reporting row."""
+    recent_mean = item["recent_mean"]
+    comparison_mean = item["comparison_mean"]
+    percent_change = item["percent_change"]
+    previous_month, recent_month = _comparison_months(item)
+
+    delta = item.get("difference", recent_mean - comparison_mean)
+    direction = "increased" if delta > 0 else "decreased"
+    percent_change_str = f"{abs(percent_change):.2f}%" if percent_change is not None else "unknown percentage"
+
+    return f"""Please explain why the metric '{item["metric_name"]}' (ID: {item["metric_id"]})  {direction} from {comparison_mean} to {recent_mean} ({percent_change_str}) between {previous_month} and {recent_month} for district {item["district"]}.
+
+Use the available tools to research this change and provide a comprehensive explanation that can be included in a monthly newsletter for city residents.
+You should first look to supervisor district and see if there are localized trends in a particular neighborhood.  If so, you should include that in your explanation.
+Other than that, prefer to share anomalies or data-points that explain a large portion of the difference in the metric.
+
+Your response MUST be returned as a properly formatted JSON object with the following fields:
+- "explanation": A clear and thorough explanation of what happened (at least 3 paragraphs)
+- "trend_analysis": A discussion of how this change fits into longer-term trends
+- "charts": A list of chart references to include (if any)
+
+DO NOT include any additional content, headers, or formatting outside of this JSON structure. The data will be extracted directly for use in a report."""
+
+
+def _response_content(response) -> Optional[str]:
+    """Extract the text of the last message from a Swarm response."""
+    if hasattr(response, 'messages') and response.messages:
+        last_message = response.messages[-1]
+        if hasattr(last_message, 'content') and last_message.content:
+            return str(last_message.content)
+        if hasattr(last_message, 'text') and last_message.text:
+            return str(last_message.text)
+        if isinstance(last_message, dict) and last_message.get('content'):
+            return str(last_message['content'])
+        if isinstance(last_message, dict) and last_message.get('text'):
+            return str(last_message['text'])
+    if isinstance(response, str):
+        return response
+    return None
+
+
+def parse_explainer_response(response):
+    """
+    Parse the explainer agent's answer.
+
+    Returns:
+        tuple: (explanation, chart_data, explainer_metadata)
+    """
+    explanation = ""
+    chart_data = None
+    explainer_metadata = {}
+
+    response_content = _response_content(response) if response else None
+    if not response_content:
+        logger.warning("Could not extract response content")
+        return explanation, chart_data, explainer_metadata
+
+    try:
+        # First look for JSON content between ```json and ``` markers
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', response_content)
+        explainer_data = json.loads(json_match.group(1) if json_match else response_content)
+
+        explanation = explainer_data.get("explanation", "")
+        explainer_metadata = explainer_data
+
+        # Keep chart data separate
+        if "chart_data" in explainer_data:
+            chart_data = explainer_data["chart_data"]
+        elif "charts" in explainer_data:
+            chart_data = explainer_data["charts"]
+
+    except (json.JSONDecodeError, AttributeError) as json_err:
+        logger.warning(f"Failed to parse JSON from response: {json_err}")
+        logger.warning(f"Response content: {response_content[:500]}...")
+        explanation_match = re.search(r'EXPLANATION:\s*([\s\S]*?)(?:\Z|(?:TREND_ANALYSIS:|CHARTS:))', response_content)
+        if explanation_match:
+            explanation = explanation_match.group(1).strip()
+
+        trend_match = re.search(r'TREND_ANALYSIS:\s*([\s\S]*?)(?:\Z|CHARTS:)', response_content)
+        if trend_match:
+            explainer_metadata["trend_analysis"] = trend_match.group(1).strip()
+
+    return explanation, chart_data, explainer_metadata
+
+
+def _extract_chart_html(chart_data):
+    if not chart_data:
+        return None
+    if hasattr(chart_data, 'content'):
+        return chart_data.content
+    if isinstance(chart_data, dict) and 'content' in chart_data:
+        return chart_data['content']
+    if isinstance(chart_data, str) and ('<div' in chart_data or '<svg' in chart_data):
+        return chart_data
+    return None
+
+
+def _fallback_explanation(item) -> str:
+    """Explanation used when the agent gives nothing usable or times out."""
+    if item.get("explanation"):
+        return item.get("explanation")
+    previous_month, recent_month = _comparison_months(item)
+    percent_change = item.get("percent_change")
+    percent_change_str = f"{abs(percent_change):.2f}%" if percent_change is not None else "unknown percentage"
+    return f"Unable to generate an automated explanation for the change in {item['metric_name']} ({percent_change_str}) between {previous_month} and {recent_month}."
+
+
+def _existing_metadata(item) -> Dict[str, Any]:
+    existing_metadata = item.get("metadata", {}) or {}
+    if isinstance(existing_metadata, str):
+        try:
+            existing_metadata = json.loads(existing_metadata)
+        except json.JSONDecodeError:
+            existing_metadata = {}
+    return dict(existing_metadata)
+
+
+def explain_report_item(item, llm_client, agent, context_variables) -> Dict[str, Any]:
+    """
+    Run the explainer agent for one monthly_reporting row.
+
+    Args:
+        item: monthly_reporting row (mapping)
+        llm_client: Swarm-compatible client
+        agent: Explainer agent
+        context_variables: Base context variables (copied per item)
+
+    Returns:
+        dict: {"id", "explanation", "chart_html", "metadata"}
+    """
+    logger.info(f"Generating explanation for report_id={item['id']}, metric={item['metric_name']} (ID: {item['metric_id']}), group={item['group_value']}")
+
+    response = llm_client.run(
+        agent=agent,
+        messages=[{"role": "user", "content": build_explanation_prompt(item)}],
+        context_variables=dict(context_variables or {}),
+        stream=False
+    )
+    explanation, chart_data, explainer_metadata = parse_explainer_response(response)
+
+    # Validate the explanation
+    if explanation and len(explanation) < 10:
+        logger.warning(f"Extracted explanation is too short: {explanation}")
+        explanation = ""
+    elif len(explanation) > 5000:
+        logger.warning(f"Extracted explanation is too long ({len(explanation)} chars), truncating")
+        explanation = explanation[:5000] + "..."
+
+    if not explanation:
+        logger.warning(f"No explanation returned from agent for {item['metric_name']}")
+        explanation = _fallback_explanation(item)
+
+    metadata = _existing_metadata(item)
+    metadata.update(explainer_metadata)
+
+    return {
+        "id": item["id"],
+        "explanation": explanation,
+        "chart_html": _extract_chart_html(chart_data),
+        "metadata": metadata
+    }
+
+
+def explain_report_items(items, llm_client, agent, context_variables,
+                         max_concurrency: int = None, timeout: float = None) -> List[Dict[str, Any]]:
+    """
+    Explain many report items concurrently.
+
+    At most max_concurrency agent runs are in flight and each is limited to
+    timeout seconds; items that fail or time out get the fallback explanation.
+    Results come back in the same order as items.
+    """
+    max_concurrency = max_concurrency or EXPLANATION_CONCURRENCY
+    timeout = EXPLANATION_TIMEOUT if timeout is None else timeout
+
+    results = run_concurrently(
+        lambda item: explain_report_item(item, llm_client, agent, context_variables),
+        items,
+        max_workers=max_concurrency,
+        timeout=timeout,
+        name="explainer agent"
+    )
+
+    explanations = []
+    for task in results:
+        if task.ok:
+            explanations.append(task.result)
+        else:
+            item = task.item
+            explanations.append({
+                "id": item["id"],
+                "explanation": f"Error generating explanation for {item['metric_name']}: {task.error}",
+                "chart_html": None,
+                "metadata": _existing_metadata(item)
+            })
+    return explanations
@@ -2,6 +2,17 @@ import pandas as pd
 import chardet
 import os
 import json
+import hashlib
+import importlib.util
+from functools import lru_cache
+
+# Rows per chunk when reading registry CSV exports
+CSV_CHUNK_ROWS = int(os.getenv("RETIREMENT_CSV_CHUNK_ROWS", "200000"))
+# Sidecar directory, inside the data directory, for hashes, encodings and parsed frames
+INGEST_CACHE_DIR = ".ingest_cache"
+ALTERNATIVE_ENCODINGS = ['windows-1252', 'latin1', 'ISO-8859-1', 'utf-16']
+# Sources whose exports name the retirement beneficiary
+SOURCES_WITH_BENEFICIARIES = ['ACR_Retired', 'CAR_Registry_Retirements', 'Puro_Earth_Registry_Retirements', 'VCUs']
 
 def detect_encoding(file_path, num_bytes=100000):
     with open(file_path, 'rb') as f:
@@ -12,16 +23,15 @@ def detect_encoding(file_path, num_bytes=100000):
     print(f"Detected encoding for '{os.path.basename(file_path)}': {encoding} (Confidence: {confidence})")
     return encoding
 
-def read_csv_with_encoding(file_path):
+def read_csv_with_encoding(file_path, encoding=None):
     try:
-        encoding = detect_encoding(file_path)
+        encoding = encoding or detect_encoding(file_path)
         df = pd.read_csv(file_path, encoding=encoding)
         print(f"Successfully loaded '{os.path.basename(file_path)}' with encoding '{encoding}'.\n")
         return df
     except UnicodeDecodeError as e:
         print(f"UnicodeDecodeError while reading '{os.path.basename(file_path)}' with encoding '{encoding}': {e}")
-        alternative_encodings = ['windows-1252', 'latin1', 'ISO-8859-1', 'utf-16']
-        for alt_enc in alternative_encodings:
+        for alt_enc in ALTERNATIVE_ENCODINGS:
             try:
                 df = pd.read_csv(file_path, encoding=alt_enc)
                 print(f"Successfully loaded '{os.path.basename(file_path)}' with alternative encoding '{alt_enc}'.\n")
@@ -29,13 +39,108 @@ def read_csv_with_encoding(file_path):
             except UnicodeDecodeError as ex:
                 print(f"Failed with alternative encoding '{alt_enc}': {ex}")
         try:
-            df = pd.read_csv(file_path, encoding='utf-8', errors='replace')
+            df = pd.read_csv(file_path, encoding='utf-8', encoding_errors='replace')
             print(f"Loaded '{os.path.basename(file_path)}' with 'utf-8' encoding, replacing errors.\n")
             return df
         except Exception as final_e:
             print(f"Failed to load '{os.path.basename(file_path)}' even after handling errors: {final_e}\n")
             return None
 
+@lru_cache(maxsize=None)
+def frame_cache_format():
+    """Sidecar frame format: "parquet" when pyarrow is installed, else "pickle"; checked without importing it."""
+    return "parquet" if importlib.util.find_spec("pyarrow") is not None else "pickle"
+
+class IngestCache:
+    """
+    Sidecar cache for the registry exports in a data directory.
+
+    Files are identified by the SHA-256 of their contents; the hash itself is
+    only recomputed when a file's size or mtime changes. Per hash it keeps the
+    detected encoding and, per dataset column spec, the processed frame
+    (Date, Credits, Source, Beneficiary, Methodology) as a Parquet sidecar
+    (pickle when pyarrow is not installed). Unchanged exports are therefore
+    neither re-detected nor re-parsed.
+    """
+
+    def __init__(self, data_dir):
+        self.cache_dir = os.path.join(data_dir, INGEST_CACHE_DIR)
+        self.manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        self.manifest = {"files": {}, "encodings": {}}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, encoding='utf-8') as f:
+                    self.manifest.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable ingest cache manifest: {e}")
+        self.used_frames = set()
+
+    def file_hash(self, file_path):
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        entry = self.manifest["files"].get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.manifest["files"][key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                       "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def encoding(self, file_path, file_hash):
+        """The file's encoding, detected once per file content."""
+        encoding = self.manifest["encodings"].get(file_hash)
+        if encoding is None:
+            encoding = detect_encoding(file_path) or 'utf-8'
+            self.manifest["encodings"][file_hash] = encoding
+        return encoding
+
+    def set_encoding(self, file_hash, encoding):
+        self.manifest["encodings"][file_hash] = encoding
+
+    def frame_path(self, file_hash, spec):
+        spec_hash = hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        extension = "parquet" if frame_cache_format() == "parquet" else "pkl"
+        return os.path.join(self.cache_dir, f"{file_hash[:32]}_{spec_hash}.{extension}")
+
+    def load_frame(self, file_hash, spec):
+        path = self.frame_path(file_hash, spec)
+        self.used_frames.add(os.path.basename(path))
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_pickle(path)
+        except Exception as e:
+            print(f"Ignoring unreadable cached frame '{path}': {e}")
+            return None
+
+    def store_frame(self, file_hash, spec, df):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.frame_path(file_hash, spec)
+        temp_path = f"{path}.tmp"
+        if path.endswith(".parquet"):
+            df.to_parquet(temp_path, index=False)
+        else:
+            df.to_pickle(temp_path)
+        os.replace(temp_path, path)
+        self.used_frames.add(os.path.basename(path))
+
+    def save(self):
+        """Write the manifest and drop frames of exports that were replaced."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.manifest["files"] = {path: entry for path, entry in self.manifest["files"].items() if os.path.exists(path)}
+        live_hashes = {entry["sha256"] for entry in self.manifest["files"].values()}
+        self.manifest["encodings"] = {h: e for h, e in self.manifest["encodings"].items() if h in live_hashes}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".parquet", ".pkl")) and name not in self.used_frames:
+                os.remove(os.path.join(self.cache_dir, name))
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
 # Updated  function
 def process_dataset(df, date_col, credits_col, source_name, beneficiary_col=None, methodology_col=None):
     # Check if columns exist
@@ -110,6 +215,92 @@ def process_datasets(dataframes, datasets_info):
                 processed_dfs.append(processed_df)
     return processed_dfs
 
+def read_csv_chunks(file_path, encoding, columns, chunk_rows=CSV_CHUNK_ROWS):
+    """Read only the given columns of a CSV, as strings, in chunks of chunk_rows rows."""
+    wanted = set(columns)
+    return pd.read_csv(file_path, encoding=encoding, usecols=lambda col: col in wanted, dtype=str,
+                       chunksize=chunk_rows)
+
+def _process_csv(file_path, encoding, dataset, columns):
+    parts = []
+    for chunk in read_csv_chunks(file_path, encoding, columns):
+        parts.append(process_dataset(
+            chunk,
+            date_col=dataset['date_col'],
+            credits_col=dataset['credits_col'],
+            source_name=dataset['source_name'],
+            beneficiary_col=dataset.get('beneficiary_col'),
+            methodology_col=dataset.get('methodology_col')
+        ))
+        if any(col not in chunk.columns for col in columns):
+            # process_dataset already warned; the other chunks have the same header
+            break
+    if not parts:
+        return pd.DataFrame(columns=['Date', 'Credits', 'Source'])
+    return pd.concat(parts, ignore_index=True)
+
+def load_processed_dataset(data_dir, dataset, cache):
+    """
+    The processed frame of one dataset, from the ingest cache when its file is
+    unchanged; otherwise parsed (CSVs in typed chunks of the needed columns only)
+    and cached. Returns None if the file is missing or cannot be read.
+    """
+    file_path = os.path.join(data_dir, dataset['file_path'])
+    file_type = dataset['file_type']
+    if not os.path.exists(file_path):
+        print(f"File '{file_path}' does not exist.\n")
+        return None
+    if file_type not in ('csv', 'excel'):
+        print(f"Unsupported file type '{file_type}' for dataset '{dataset['name']}'")
+        return None
+
+    spec = {key: dataset.get(key) for key in ('file_type', 'date_col', 'credits_col', 'source_name',
+                                              'beneficiary_col', 'methodology_col')}
+    file_hash = cache.file_hash(file_path)
+    processed = cache.load_frame(file_hash, spec)
+    if processed is not None:
+        print(f"Using cached frame for '{file_path}' ({len(processed)} rows).\n")
+        return processed
+
+    columns = [col for col in (dataset['date_col'], dataset['credits_col'], dataset.get('beneficiary_col'),
+                               dataset.get('methodology_col')) if col]
+    try:
+        if file_type == 'excel':
+            wanted = set(columns)
+            df = pd.read_excel(file_path, usecols=lambda col: col in wanted)
+            processed = process_dataset(df, dataset['date_col'], dataset['credits_col'], dataset['source_name'],
+                                        dataset.get('beneficiary_col'), dataset.get('methodology_col'))
+        else:
+            detected = cache.encoding(file_path, file_hash)
+            for encoding in [detected] + [enc for enc in ALTERNATIVE_ENCODINGS if enc != detected]:
+                try:
+                    processed = _process_csv(file_path, encoding, dataset, columns)
+                    cache.set_encoding(file_hash, encoding)
+                    break
+                except UnicodeDecodeError as e:
+                    print(f"UnicodeDecodeError while reading '{os.path.basename(file_path)}' with encoding '{encoding}': {e}")
+            else:
+                print(f"Failed to load '{file_path}' with any encoding.\n")
+                return None
+    except Exception as e:
+        print(f"Failed to load '{file_path}': {e}\n")
+        return None
+
+    cache.store_frame(file_hash, spec, processed)
+    print(f"Successfully loaded '{file_path}' ({len(processed)} rows).\n")
+    return processed
+
+def load_datasets(data_dir, datasets_info):
+    """Processed frames of all datasets (the non-empty ones), re-parsing only exports that changed."""
+    cache = IngestCache(data_dir)
+    processed_dfs = []
+    for dataset in datasets_info:
+        processed_df = load_processed_dataset(data_dir, dataset, cache)
+        if processed_df is not None and not processed_df.empty:
+            processed_dfs.append(processed_df)
+    cache.save()
+    return processed_dfs
+
 def combine_processed_data(processed_dfs):
     if processed_dfs:
         combined_df = pd.concat(processed_dfs, ignore_index=True)
@@ -120,49 +311,102 @@ def combine_processed_data(processed_dfs):
         combined_df = pd.DataFrame(columns=['Date', 'Credits', 'Source'])
     return combined_df
 
-def aggregate_data(combined_df, current_date_str):
-    # Annual Aggregation (No Date Filter)
-    annual_aggregation = combined_df.resample('Y').sum().reset_index()
-    annual_aggregation['Date'] = annual_aggregation['Date'].dt.strftime('%Y')
-
-    # Aggregate by year and Source for the annual stacked bar chart (no filtering)
-    source_annual_aggregation = combined_df.groupby([pd.Grouper(freq='Y'), 'Source']).sum().reset_index()
-    source_annual_aggregation['Date'] = source_annual_aggregation['Date'].dt.strftime('%Y')
-
-    # Monthly Aggregation (Filter Last 5 Full Years)
-    current_date = pd.to_datetime(current_date_str)
-    cutoff_year = current_date.year - 5
-    cutoff_date = pd.to_datetime(f"{cutoff_year}-01-01")
+def _month_end_label(years, months):
+    return (pd.to_datetime(pd.DataFrame({'year': years, 'month': months, 'day': 1}))
+            + pd.offsets.MonthEnd(0)).dt.strftime('%Y-%m-%d')
 
-    # Filter the combined_df to include only data from January 1st, 5 years ago (for monthly charts)
-    filtered_combined_df = combined_df[combined_df.index >= cutoff_date]
-
-    # Aggregate by month (for filtered data)
-    monthly_aggregation = filtered_combined_df.resample('M').sum().reset_index()
-    monthly_aggregation['Date'] = monthly_aggregation['Date'].dt.strftime('%Y-%m-%d')
-
-    # Aggregate by Date and Source for stacked bar chart (for filtered data)
-    source_aggregation = filtered_combined_df.groupby([pd.Grouper(freq='M'), 'Source']).sum().reset_index()
-    source_aggregation['Date'] = source_aggregation['Date'].dt.strftime('%Y-%m-%d')
+def compute_aggregations(combined_df, current_date_str, target_year, target_month, methodology_since_year=None):
+    """
+    All aggregations of the report from a single grouped pass over the combined frame.
 
-    return annual_aggregation, source_annual_aggregation, monthly_aggregation, source_aggregation
-def aggregate_by_methodology(combined_df):
+    The combined frame is reduced once to credit sums per (year, month, source,
+    methodology, beneficiary), with beneficiaries kept only for the target
+    month; every output below is derived from that small frame.
 
-    # Filter data for the last 5 years
-    current_year = pd.to_datetime('now').year
-    cutoff_year = current_year - 5
-    filtered_df = combined_df[combined_df.index.year >= cutoff_year]
+    Returns:
+        dict: annual, source_annual, monthly, source_monthly, methodology and
+        top_beneficiaries ({source: top 10 frame})
+    """
+    methodology_since_year = methodology_since_year or pd.to_datetime('now').year - 5
+    cutoff_year = pd.to_datetime(current_date_str).year - 5
+
+    index = pd.DatetimeIndex(combined_df.index)
+    empty = pd.Series([None] * len(combined_df), index=combined_df.index, dtype=object)
+    frame = pd.DataFrame({
+        'Year': index.year,
+        'Month': index.month,
+        'Source': combined_df['Source'].to_numpy(),
+        'Methodology': combined_df.get('Methodology', empty).to_numpy(),
+        'Beneficiary': combined_df.get('Beneficiary', empty).to_numpy(),
+        'Credits': pd.to_numeric(combined_df['Credits']).to_numpy(),
+    })
+    in_target_month = (frame['Year'] == target_year) & (frame['Month'] == target_month)
+    frame['Beneficiary'] = frame['Beneficiary'].where(in_target_month)
+    grouped = frame.groupby(['Year', 'Month', 'Source', 'Methodology', 'Beneficiary'], dropna=False,
+                            sort=False)['Credits'].sum().reset_index()
+
+    by_month_source = grouped.groupby(['Year', 'Month', 'Source'])['Credits'].sum().reset_index()
+    by_month = by_month_source.groupby(['Year', 'Month'])['Credits'].sum()
+
+    # Annual totals, with empty years between the first and last as 0 (as resample('Y') gives)
+    by_year = by_month.groupby(level='Year').sum()
+    if not by_year.empty:
+        by_year = by_year.reindex(range(by_year.index.min(), by_year.index.max() + 1), fill_value=0)
+    annual = pd.DataFrame({'Date': by_year.index.astype(str), 'Credits': by_year.to_numpy()})
+
+    source_annual = by_month_source.groupby(['Year', 'Source'])['Credits'].sum().reset_index()
+    source_annual = source_annual.rename(columns={'Year': 'Date'})
+    source_annual['Date'] = source_annual['Date'].astype(str)
+
+    # Monthly totals from January 1st five years before current_date_str, gaps as 0
+    recent_months = by_month[by_month.index.get_level_values('Year') >= cutoff_year]
+    if not recent_months.empty:
+        first, last = recent_months.index.min(), recent_months.index.max()
+        months = pd.period_range(f"{first[0]}-{first[1]:02d}", f"{last[0]}-{last[1]:02d}", freq='M')
+        recent_months = recent_months.reindex(pd.MultiIndex.from_arrays([months.year, months.month],
+                                                                        names=['Year', 'Month']), fill_value=0)
+    monthly = pd.DataFrame({
+        'Date': _month_end_label(recent_months.index.get_level_values('Year'),
+                                 recent_months.index.get_level_values('Month')).to_numpy(),
+        'Credits': recent_months.to_numpy(),
+    })
+
+    source_monthly = by_month_source[by_month_source['Year'] >= cutoff_year].reset_index(drop=True)
+    source_monthly = pd.DataFrame({
+        'Date': _month_end_label(source_monthly['Year'], source_monthly['Month']).to_numpy(),
+        'Source': source_monthly['Source'].to_numpy(),
+        'Credits': source_monthly['Credits'].to_numpy(),
+    })
+
+    with_methodology = grouped[(grouped['Year'] >= methodology_since_year) & grouped['Methodology'].notna()]
+    methodology = with_methodology.groupby(['Year', 'Source', 'Methodology'])['Credits'].sum().reset_index()
 
-    # Ensure the 'Methodology' column exists
-    df_with_methodology = filtered_df.dropna(subset=['Methodology'])
+    top_beneficiaries = {}
+    if 'Beneficiary' not in combined_df.columns:
+        print("No beneficiary information available for any source.")
+    else:
+        with_beneficiary = grouped[grouped['Beneficiary'].notna()]
+        for source in SOURCES_WITH_BENEFICIARIES:
+            source_df = with_beneficiary[with_beneficiary['Source'] == source]
+            beneficiary_group = source_df.groupby('Beneficiary')['Credits'].sum().reset_index()
+            top_beneficiaries[source] = beneficiary_group.sort_values(by='Credits', ascending=False).head(10)
 
-    # Extract the year from the 'Date' index
-    df_with_methodology['Year'] = df_with_methodology.index.year
+    return {
+        'annual': annual,
+        'source_annual': source_annual,
+        'monthly': monthly,
+        'source_monthly': source_monthly,
+        'methodology': methodology,
+        'top_beneficiaries': top_beneficiaries,
+    }
 
-    # Group by 'Year', 'Source', and 'Methodology', aggregate 'Credits'
-    methodology_aggregation = df_with_methodology.groupby(['Year', 'Source', 'Methodology']).sum().reset_index()
+def aggregate_data(combined_df, current_date_str):
+    aggregations = compute_aggregations(combined_df, current_date_str, None, None)
+    return (aggregations['annual'], aggregations['source_annual'], aggregations['monthly'],
+            aggregations['source_monthly'])
 
-    return methodology_aggregation
+def aggregate_by_methodology(combined_df):
+    return compute_aggregations(combined_df, pd.to_datetime('now'), None, None)['methodology']
 
 def aggregate_emissions_data(emissions_df):
     # Ensure 'Year' is of type string to match with 'Date' in annual_aggregation
@@ -185,31 +429,7 @@ def aggregate_emissions_data(emissions_df):
     return emissions_aggregation
 
 def compute_top_beneficiaries(combined_df, target_year, target_month):
-    # Filter combined_df for target month and year
-    target_df = combined_df[
-        (combined_df.index.year == target_year) &
-        (combined_df.index.month == target_month)
-    ]
-
-    # Initialize a dictionary to store top beneficiaries per source
-    top_beneficiaries = {}
-
-    # List of sources with beneficiaries
-    sources_with_beneficiaries = ['ACR_Retired', 'CAR_Registry_Retirements', 'Puro_Earth_Registry_Retirements', 'VCUs']
-
-    for source in sources_with_beneficiaries:
-        source_df = target_df[target_df['Source'] == source]
-        if 'Beneficiary' in source_df.columns:
-            # Drop rows with missing Beneficiary
-            source_df = source_df.dropna(subset=['Beneficiary'])
-            # Group by Beneficiary and sum Credits
-            beneficiary_group = source_df.groupby('Beneficiary')['Credits'].sum().reset_index()
-            # Sort and take top 10
-            top_10 = beneficiary_group.sort_values(by='Credits', ascending=False).head(10)
-            top_beneficiaries[source] = top_10
-        else:
-            print(f"No beneficiary information available for source '{source}'.")
-    return top_beneficiaries
+    return compute_aggregations(combined_df, pd.to_datetime('now'), target_year, target_month)['top_beneficiaries']
 
 def generate_html(annual_aggregation, source_annual_aggregation, monthly_aggregation, source_aggregation, top_beneficiaries, methodology_aggregation):
     # Generate HTML tables for top beneficiaries
@@ -640,8 +860,8 @@ def main():
         }
     ]
 
-    # Read main data files
-    dataframes = read_data_files(data_dir, datasets_info)
+    # Load the processed datasets; exports unchanged since the last run come from the ingest cache
+    processed_dfs = load_datasets(data_dir, datasets_info)
 
     # Read annual emissions data
     emissions_df = read_annual_emissions(data_dir)
@@ -655,17 +875,21 @@ def main():
     else:
         emissions_aggregation = pd.DataFrame(columns=['Year', 'Emissions'])
 
-    # Process datasets
-    processed_dfs = process_datasets(dataframes, datasets_info)
-
     # Combine processed data
     combined_df = combine_processed_data(processed_dfs)
 
-    # Aggregate data
-    annual_aggregation, source_annual_aggregation, monthly_aggregation, source_aggregation = aggregate_data(combined_df, current_date_str)
-    # Aggregate by methodology
-    
-    methodology_aggregation = aggregate_by_methodology(combined_df)
+    # Compute top beneficiaries for this month
+    target_year = 2024
+    target_month = 9  # September
+
+    # All aggregations in one grouped pass
+    aggregations = compute_aggregations(combined_df, current_date_str, target_year, target_month)
+    annual_aggregation = aggregations['annual']
+    source_annual_aggregation = aggregations['source_annual']
+    monthly_aggregation = aggregations['monthly']
+    source_aggregation = aggregations['source_monthly']
+    methodology_aggregation = aggregations['methodology']
+    top_beneficiaries = aggregations['top_beneficiaries']
     
     # Merge aggregated emissions data with annual_aggregation
     if not emissions_aggregation.empty:
@@ -680,12 +904,6 @@ def main():
     annual_aggregation['Percentage'] = (annual_aggregation['Credits'] / annual_aggregation['Emissions']) * 100
     annual_aggregation['Percentage'] = annual_aggregation['Percentage'].round(1)  # Round to one decimal place
 
-    # Compute top beneficiaries
-    target_year = 2024
-    target_month = 9  # September
-
-    top_beneficiaries = compute_top_beneficiaries(combined_df, target_year, target_month)
-
     # Generate HTML content
     html_content = generate_html(
     annual_aggregation,
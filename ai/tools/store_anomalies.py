@@ -5,8 +5,9 @@ Functions to store anomaly detection results in PostgreSQL database.
 
 import os
 import json
+import hashlib
 import psycopg2
-from psycopg2.extras import Json, RealDictCursor
+from psycopg2.extras import Json, RealDictCursor, execute_values
 import logging
 import datetime
 from datetime import date
@@ -14,6 +15,8 @@ import pandas as pd
 from typing import Dict, List, Any, Optional, Union, Tuple
 from dateutil import parser
 from tools.db_utils import get_postgres_connection, execute_with_connection, CustomJSONEncoder
+from tools.anomaly_search import search_anomalies, anomaly_column_types, typed_value
+from tools.db_retention import get_archived_row
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -73,6 +76,7 @@ def create_anomalies_table(connection):
                         recent_data JSONB,
                         comparison_data JSONB,
                         district INTEGER,
+                        content_hash TEXT,
                         is_active BOOLEAN DEFAULT TRUE,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
@@ -104,6 +108,18 @@ def create_anomalies_table(connection):
                 cursor.execute("CREATE INDEX idx_anomalies_is_active ON anomalies (is_active)")
                 connection.commit()
                 logging.info("Added is_active column to anomalies table")
+            
+            # Check if content_hash column exists (used to skip rewriting unchanged results)
+            cursor.execute("""
+                SELECT EXISTS (
+                    SELECT FROM information_schema.columns 
+                    WHERE table_name = 'anomalies' AND column_name = 'content_hash'
+                );
+            """)
+            if not cursor.fetchone()[0]:
+                cursor.execute("ALTER TABLE anomalies ADD COLUMN content_hash TEXT")
+                connection.commit()
+                logging.info("Added content_hash column to anomalies table")
                 
             # Check if required indexes exist
             cursor.execute("""
@@ -124,6 +140,296 @@ def create_anomalies_table(connection):
         logging.error(traceback.format_exc())
         return False
 
+def anomaly_content_hash(result, recent_date, comparison_data, recent_data, caption) -> str:
+    """Fingerprint of everything an anomaly row shows, used to detect unchanged results."""
+    content = [
+        str(result['group_value']),
+        result['comparison_mean'],
+        result['recent_mean'],
+        result['difference'],
+        result.get('stdDev', 0),
+        bool(result.get('out_of_bounds', False)),
+        recent_date,
+        comparison_data,
+        recent_data,
+        caption,
+    ]
+    return hashlib.md5(json.dumps(content, sort_keys=True, cls=CustomJSONEncoder).encode('utf-8')).hexdigest()
+
+def anomaly_series(metadata):
+    """
+    The anomalies-table identity of a series (object, group field, period type,
+    district) and the metadata stored with its rows.
+    
+    Args:
+        metadata: Metadata about the anomaly detection run
+    
+    Returns:
+        dict: object_type, object_id, object_name, field_name, group_field_name,
+        period_type, district and metadata (JSON-serializable)
+    """
+    # Use the custom JSON encoder to serialize the entire results and metadata
+    serializable_metadata = json.loads(json.dumps(metadata, cls=CustomJSONEncoder))
+    
+    # Extract object information from metadata
+    object_type = metadata.get('object_type', 'unknown')
+    object_id = metadata.get('object_id', 'unknown')
+    object_name = metadata.get('object_name', metadata.get('title', 'unknown'))
+    field_name = metadata.get('numeric_field', 'unknown')
+    group_field_name = metadata.get('group_field', 'unknown')
+    period_type = metadata.get('period_type', 'month')
+    
+    # Ensure title is set in metadata
+    if 'title' not in serializable_metadata:
+        if object_name != 'unknown':
+            serializable_metadata['title'] = object_name
+        else:
+            # Generate a title based on available information
+            title_parts = []
+            if field_name != 'unknown':
+                title_parts.append(field_name)
+            if group_field_name != 'unknown':
+                title_parts.append(f"by {group_field_name}")
+            serializable_metadata['title'] = " - ".join(title_parts) if title_parts else "Anomaly Analysis"
+    
+    # Ensure object_name is set if not present
+    if 'object_name' not in serializable_metadata and 'title' in serializable_metadata:
+        serializable_metadata['object_name'] = serializable_metadata['title']
+    
+    # Get district from filter conditions if it exists
+    district = None
+    if 'filter_conditions' in metadata:
+        for condition in metadata['filter_conditions']:
+            field = condition.get('field', '').lower()
+            if field in ['district', 'police_district', 'supervisor_district']:
+                district = condition.get('value')
+                break
+    
+    # Series loaded from time_series_metadata carry its district column
+    if district is None:
+        district = metadata.get('district')
+    
+    # Default district to 0 if it's null
+    if district is None:
+        district = 0
+    else:
+        # Try to convert district to integer
+        try:
+            district = int(district)
+        except (ValueError, TypeError):
+            district = 0
+    
+    return {
+        'object_type': object_type,
+        'object_id': object_id,
+        'object_name': object_name,
+        'field_name': field_name,
+        'group_field_name': group_field_name,
+        'period_type': period_type,
+        'district': district,
+        'metadata': serializable_metadata,
+    }
+
+def _parse_period_date(value):
+    if isinstance(value, str):
+        return parser.parse(value).date()
+    return value
+
+def anomaly_rows(results, metadata, series=None):
+    """
+    Build the anomalies-table rows for one series' results.
+    
+    Args:
+        results: List of anomaly results
+        metadata: Metadata about the anomaly detection run
+        series: anomaly_series(metadata), if already computed
+    
+    Returns:
+        list: (group_value, content_hash, insert values) per result, the values
+        in the column order of INSERT_ANOMALY_COLUMNS
+    """
+    series = series or anomaly_series(metadata)
+    period_type = series['period_type']
+    
+    # Check for recent_period_end and get it if available
+    recent_period_end = None
+    if 'recent_period' in metadata and 'end' in metadata['recent_period']:
+        recent_period_end = metadata['recent_period']['end']
+        if isinstance(recent_period_end, str):
+            try:
+                recent_period_end = parser.parse(recent_period_end).date()
+            except:
+                pass
+    
+    rows = []
+    for result in results:
+        # Extract dates and counts from results
+        all_dates = result.get('dates', [])
+        all_counts = result.get('counts', [])
+        
+        # Initialize arrays for comparison and recent data
+        comparison_dates = []
+        comparison_counts = []
+        recent_dates = []
+        recent_counts = []
+        recent_date = recent_period_end  # Default to end of recent period
+        
+        # Organize data into comparison and recent periods
+        if 'recent_period' in metadata and 'comparison_period' in metadata:
+            recent_start = _parse_period_date(metadata['recent_period']['start'])
+            recent_end = _parse_period_date(metadata['recent_period']['end'])
+            comp_start = _parse_period_date(metadata['comparison_period']['start'])
+            comp_end = _parse_period_date(metadata['comparison_period']['end'])
+            
+            # Use recent_end as the recent_date field value
+            recent_date = recent_end
+            
+            # Group data by period based on date string
+            for i, date_str in enumerate(all_dates):
+                try:
+                    # Parse the date based on period_type
+                    if period_type == 'year':
+                        date_obj = datetime.datetime.strptime(date_str, "%Y").date()
+                    elif period_type == 'month':
+                        date_obj = datetime.datetime.strptime(f"{date_str}-01", "%Y-%m-%d").date()
+                    else:
+                        date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+                    
+                    # Add to appropriate arrays
+                    if comp_start <= date_obj <= comp_end:
+                        comparison_dates.append(date_str)
+                        comparison_counts.append(all_counts[i])
+                    elif recent_start <= date_obj <= recent_end:
+                        recent_dates.append(date_str)
+                        recent_counts.append(all_counts[i])
+                except (ValueError, TypeError):
+                    continue
+        
+        # Extract recent and comparison data for individual points
+        comparison_data = dict(zip(comparison_dates, comparison_counts))
+        recent_data = dict(zip(recent_dates, recent_counts))
+        
+        # Generate caption for the anomaly
+        percent_difference = abs((result['difference'] / result['comparison_mean']) * 100) if result['comparison_mean'] else 0
+        action = 'increase' if result['difference'] > 0 else 'drop' if result['difference'] < 0 else 'no change'
+        y_axis_label = metadata.get('y_axis_label', 'Value').lower()
+        
+        comparison_period_label = f"{comp_start.strftime('%B %Y')} to {comp_end.strftime('%B %Y')}"
+        recent_period_label = f"{recent_start.strftime('%B %Y')}"
+        
+        caption = (
+            f"In {recent_period_label}, there were {result['recent_mean']:,.0f} {result['group_value']} {y_axis_label} per month, "
+            f"compared to an average of {result['comparison_mean']:,.0f} per month over {comparison_period_label}, "
+            f"a {percent_difference:.1f}% {action}."
+        )
+        
+        # Each row carries its own caption in the metadata
+        row_metadata = series['metadata']
+        if isinstance(row_metadata, dict):
+            row_metadata = dict(row_metadata, caption=caption)
+        
+        content_hash = anomaly_content_hash(result, recent_date, comparison_data, recent_data, caption)
+        rows.append((str(result['group_value']), content_hash, (
+            result['group_value'],
+            series['group_field_name'],
+            period_type,
+            result['comparison_mean'],
+            result['recent_mean'],
+            result['difference'],
+            result.get('stdDev', 0),
+            result.get('out_of_bounds', False),
+            recent_date,
+            Json(json.loads(json.dumps(comparison_dates, cls=CustomJSONEncoder))),
+            Json(json.loads(json.dumps(comparison_counts, cls=CustomJSONEncoder))),
+            Json(json.loads(json.dumps(recent_dates, cls=CustomJSONEncoder))),
+            Json(json.loads(json.dumps(recent_counts, cls=CustomJSONEncoder))),
+            Json(row_metadata),
+            series['field_name'],
+            series['object_type'],
+            series['object_id'],
+            series['object_name'],
+            Json(recent_data),
+            Json(comparison_data),
+            str(series['district']),
+            content_hash,
+        )))
+    return rows
+
+INSERT_ANOMALY_COLUMNS = (
+    "group_value, group_field_name, period_type, comparison_mean, recent_mean, "
+    "difference, std_dev, out_of_bounds, recent_date, comparison_dates, "
+    "comparison_counts, recent_dates, recent_counts, metadata, field_name, "
+    "object_type, object_id, object_name, recent_data, comparison_data, district, content_hash"
+)
+
+SERIES_KEY_COLUMNS = ('object_type', 'object_id', 'object_name', 'group_field_name', 'period_type', 'district')
+
+def write_anomaly_rows(connection, batches, page_size=500):
+    """
+    Write the rows of many series in bulk: one lookup of their active rows,
+    batched inserts and one deactivation update, committed together.
+    
+    Args:
+        connection: PostgreSQL database connection
+        batches: List of (anomaly_series(...), anomaly_rows(...)) pairs
+        page_size: Rows per statement for the lookup and the inserts
+    
+    Groups whose result is identical to their active row (same content_hash)
+    are not rewritten; changed groups get a new row and the old one is
+    deactivated, as are active groups of these series missing from this run.
+    
+    Returns:
+        dict: {"inserted", "unchanged", "deactivated"}
+    """
+    if not batches:
+        return {"inserted": 0, "unchanged": 0, "deactivated": 0}
+    column_types = anomaly_column_types(connection)
+    
+    def series_key(series):
+        # Compared with the values read back, so typed as the columns are
+        return tuple(typed_value(column_types.get(column), series[column]) for column in SERIES_KEY_COLUMNS)
+    
+    keys = list(dict.fromkeys(series_key(series) for series, _ in batches))
+    columns = ", ".join(SERIES_KEY_COLUMNS)
+    with connection.cursor() as cursor:
+        # Current active rows of these series, by series and group, so unchanged groups are left alone
+        active = execute_values(cursor, f"""
+            SELECT a.id, {", ".join(f"a.{column}" for column in SERIES_KEY_COLUMNS)}, a.group_value, a.content_hash
+            FROM anomalies a
+            JOIN (VALUES %s) AS s ({columns}) USING ({columns})
+            WHERE a.is_active = TRUE
+        """, keys, page_size=page_size, fetch=True)
+        active_by_series = {}
+        for row in active:
+            row_id, key, group_value, content_hash = row[0], tuple(row[1:-2]), row[-2], row[-1]
+            active_by_series.setdefault(key, {}).setdefault(group_value, []).append((row_id, content_hash))
+        
+        inserts = []
+        unchanged_count = 0
+        stale_ids = []
+        for series, rows in batches:
+            active_by_group = active_by_series.pop(series_key(series), {})
+            for group_value, content_hash, values in rows:
+                # Skip the write when this group's active row already holds the same result
+                current = active_by_group.pop(group_value, [])
+                if len(current) == 1 and current[0][1] == content_hash:
+                    unchanged_count += 1
+                    continue
+                stale_ids.extend(row_id for row_id, _ in current)
+                inserts.append(values)
+            # Groups missing from this run lose their active row
+            for current in active_by_group.values():
+                stale_ids.extend(row_id for row_id, _ in current)
+        
+        if inserts:
+            execute_values(cursor, f"INSERT INTO anomalies ({INSERT_ANOMALY_COLUMNS}, is_active) VALUES %s",
+                           inserts, template="(" + ", ".join(["%s"] * 22) + ", TRUE)", page_size=page_size)
+        if stale_ids:
+            cursor.execute("UPDATE anomalies SET is_active = FALSE WHERE id = ANY(%s)", (stale_ids,))
+    
+    connection.commit()
+    return {"inserted": len(inserts), "unchanged": unchanged_count, "deactivated": len(stale_ids)}
+
 def store_anomalies_in_db(connection, results, metadata):
     """
     Store detected anomalies in the PostgreSQL database.
@@ -133,224 +439,32 @@ def store_anomalies_in_db(connection, results, metadata):
         results: List of anomaly results
         metadata: Metadata about the anomaly detection run
     
+    Groups whose result is identical to their active row (same content_hash)
+    are not rewritten; changed groups get a new row and the old one is
+    deactivated, as are active groups missing from this run.
+    
     Returns:
-        int: Number of anomalies stored
+        dict: {"inserted", "unchanged", "deactivated"}, or None if the write failed
     """
     if connection is None:
         logging.error("No database connection available")
-        return 0
+        return None
     
     try:
         # Check if the table exists
         if not create_anomalies_table(connection):
             logging.error("Cannot store anomalies - table does not exist")
-            return 0
-        
-        # Use the custom JSON encoder to serialize the entire results and metadata
-        serializable_metadata = json.loads(json.dumps(metadata, cls=CustomJSONEncoder))
-        
-        # Extract object information from metadata
-        object_type = metadata.get('object_type', 'unknown')
-        object_id = metadata.get('object_id', 'unknown')
-        object_name = metadata.get('object_name', metadata.get('title', 'unknown'))
-        field_name = metadata.get('numeric_field', 'unknown')
-        group_field_name = metadata.get('group_field', 'unknown')
-        period_type = metadata.get('period_type', 'month')
-        
-        # Ensure title is set in metadata
-        if 'title' not in serializable_metadata:
-            if object_name != 'unknown':
-                serializable_metadata['title'] = object_name
-            else:
-                # Generate a title based on available information
-                title_parts = []
-                if field_name != 'unknown':
-                    title_parts.append(field_name)
-                if group_field_name != 'unknown':
-                    title_parts.append(f"by {group_field_name}")
-                serializable_metadata['title'] = " - ".join(title_parts) if title_parts else "Anomaly Analysis"
-        
-        # Ensure object_name is set if not present
-        if 'object_name' not in serializable_metadata and 'title' in serializable_metadata:
-            serializable_metadata['object_name'] = serializable_metadata['title']
-        
-        # Get district from filter conditions if it exists
-        district = None
-        if 'filter_conditions' in metadata:
-            for condition in metadata['filter_conditions']:
-                field = condition.get('field', '').lower()
-                if field in ['district', 'police_district', 'supervisor_district']:
-                    district = condition.get('value')
-                    break
-        
-        # Default district to 0 if it's null
-        if district is None:
-            district = 0
-        else:
-            # Try to convert district to integer
-            try:
-                district = int(district)
-            except (ValueError, TypeError):
-                district = 0
-        
-        # Check for recent_period_end and get it if available
-        recent_period_end = None
-        if 'recent_period' in metadata and 'end' in metadata['recent_period']:
-            recent_period_end = metadata['recent_period']['end']
-            if isinstance(recent_period_end, str):
-                try:
-                    recent_period_end = parser.parse(recent_period_end).date()
-                except:
-                    pass
-        
-        # First, deactivate any existing active anomalies with the same parameters
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                UPDATE anomalies 
-                SET is_active = FALSE
-                WHERE object_type = %s 
-                AND object_id = %s
-                AND object_name = %s
-                AND group_field_name = %s
-                AND period_type = %s
-                AND district::TEXT = %s
-                AND is_active = TRUE
-            """, (object_type, object_id, object_name, group_field_name, period_type, str(district)))
-            
-        inserted_count = 0
-        
-        with connection.cursor() as cursor:
-            for result in results:
-                # Create a fully serialized copy of the result using our custom encoder
-                serializable_result = json.loads(json.dumps(result, cls=CustomJSONEncoder))
-                
-                # Extract dates and counts from results
-                all_dates = result.get('dates', [])
-                all_counts = result.get('counts', [])
-                
-                # Initialize arrays for comparison and recent data
-                comparison_dates = []
-                comparison_counts = []
-                recent_dates = []
-                recent_counts = []
-                recent_date = recent_period_end  # Default to end of recent period
-                
-                # Organize data into comparison and recent periods
-                if 'recent_period' in metadata and 'comparison_period' in metadata:
-                    recent_start = metadata['recent_period']['start']
-                    recent_end = metadata['recent_period']['end']
-                    comp_start = metadata['comparison_period']['start']
-                    comp_end = metadata['comparison_period']['end']
-                    
-                    # Parse dates if they're strings
-                    if isinstance(recent_start, str):
-                        recent_start = parser.parse(recent_start).date()
-                    if isinstance(recent_end, str):
-                        recent_end = parser.parse(recent_end).date()
-                    if isinstance(comp_start, str):
-                        comp_start = parser.parse(comp_start).date()
-                    if isinstance(comp_end, str):
-                        comp_end = parser.parse(comp_end).date()
-                    
-                    # Use recent_end as the recent_date field value
-                    recent_date = recent_end
-                    
-                    # Group data by period based on date string
-                    for i, date_str in enumerate(all_dates):
-                        try:
-                            # Parse the date based on period_type
-                            if period_type == 'year':
-                                date_obj = datetime.datetime.strptime(date_str, "%Y").date()
-                            elif period_type == 'month':
-                                date_obj = datetime.datetime.strptime(f"{date_str}-01", "%Y-%m-%d").date()
-                            else:
-                                date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
-                            
-                            # Add to appropriate arrays
-                            if comp_start <= date_obj <= comp_end:
-                                comparison_dates.append(date_str)
-                                comparison_counts.append(all_counts[i])
-                            elif recent_start <= date_obj <= recent_end:
-                                recent_dates.append(date_str)
-                                recent_counts.append(all_counts[i])
-                        except (ValueError, TypeError):
-                            continue
-                
-                # Add comparison and recent data to the serializable result
-                serializable_result['comparison_dates'] = comparison_dates
-                serializable_result['comparison_counts'] = comparison_counts
-                serializable_result['recent_dates'] = recent_dates
-                serializable_result['recent_counts'] = recent_counts
-                serializable_result['recent_date'] = recent_date
-                
-                # Extract recent and comparison data for individual points
-                recent_data = {}
-                comparison_data = {}
-                
-                # Store data points in their respective dictionaries
-                for i, date_str in enumerate(comparison_dates):
-                    comparison_data[date_str] = comparison_counts[i]
-                
-                for i, date_str in enumerate(recent_dates):
-                    recent_data[date_str] = recent_counts[i]
-                
-                # Generate caption for the anomaly
-                percent_difference = abs((result['difference'] / result['comparison_mean']) * 100) if result['comparison_mean'] else 0
-                action = 'increase' if result['difference'] > 0 else 'drop' if result['difference'] < 0 else 'no change'
-                y_axis_label = metadata.get('y_axis_label', 'Value').lower()
-                
-                comparison_period_label = f"{comp_start.strftime('%B %Y')} to {comp_end.strftime('%B %Y')}"
-                recent_period_label = f"{recent_start.strftime('%B %Y')}"
-                
-                caption = (
-                    f"In {recent_period_label}, there were {result['recent_mean']:,.0f} {result['group_value']} {y_axis_label} per month, "
-                    f"compared to an average of {result['comparison_mean']:,.0f} per month over {comparison_period_label}, "
-                    f"a {percent_difference:.1f}% {action}."
-                )
-                
-                # Add caption to metadata
-                if isinstance(serializable_metadata, dict):
-                    serializable_metadata['caption'] = caption
-                
-                cursor.execute("""
-                    INSERT INTO anomalies 
-                    (group_value, group_field_name, period_type, comparison_mean, recent_mean, 
-                     difference, std_dev, out_of_bounds, recent_date, comparison_dates, 
-                     comparison_counts, recent_dates, recent_counts, metadata, field_name, 
-                     object_type, object_id, object_name, recent_data, comparison_data, district, is_active)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE)
-                """, (
-                    result['group_value'],
-                    group_field_name,
-                    period_type,
-                    result['comparison_mean'],
-                    result['recent_mean'],
-                    result['difference'],
-                    result.get('stdDev', 0),
-                    result.get('out_of_bounds', False),
-                    recent_date,
-                    Json(serializable_result['comparison_dates']),
-                    Json(serializable_result['comparison_counts']),
-                    Json(serializable_result['recent_dates']),
-                    Json(serializable_result['recent_counts']),
-                    Json(serializable_metadata),
-                    field_name,
-                    object_type,
-                    object_id,
-                    object_name,
-                    Json(recent_data),
-                    Json(comparison_data),
-                    str(district)
-                ))
-                inserted_count += 1
+            return None
         
-        connection.commit()
-        logger.info("Successfully stored anomaly detection results in database")
-        return inserted_count
+        series = anomaly_series(metadata)
+        counts = write_anomaly_rows(connection, [(series, anomaly_rows(results, metadata, series))])
+        logger.info(f"Stored anomaly results: {counts['inserted']} written, {counts['unchanged']} unchanged, "
+                    f"{counts['deactivated']} deactivated")
+        return counts
     except Exception as e:
         logging.error(f"Error storing anomalies in database: {e}")
         connection.rollback()
-        return 0
+        return None
 
 def store_anomaly_data(
     results,
@@ -393,12 +507,20 @@ def store_anomaly_data(
             db_password=db_password
         )
         
-        if result["status"] == "success":
-            inserted_count = result["result"]
+        if result["status"] == "success" and result["result"] is not None:
+            counts = result["result"]
+            stored_count = counts["inserted"] + counts["unchanged"]
             return {
                 "status": "success",
-                "message": f"Successfully stored {inserted_count} anomalies in the database",
-                "anomalies_stored": inserted_count,
+                "message": f"Stored {stored_count} anomalies in the database "
+                           f"({counts['inserted']} written, {counts['unchanged']} unchanged)",
+                "anomalies_stored": stored_count,
+                "changes": counts,
+            }
+        elif result["status"] == "success":
+            return {
+                "status": "error",
+                "message": "Failed to store anomalies in the database"
             }
         else:
             return result
@@ -455,72 +577,22 @@ def get_anomalies(
         dict: Query results
     """
     def query_operation(connection):
-        # Create cursor with dictionary-like results
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        # Start building the query
-        query = "SELECT id, group_field_name, group_value, comparison_mean, recent_mean, difference, std_dev, out_of_bounds, created_at, metadata, district, object_id, period_type, is_active "
-        query += "FROM anomalies WHERE 1=1 "
-        params = []
-        
-        # Apply filters based on parameters
-        if only_anomalies:
-            query += "AND out_of_bounds = true "
-            
-        if only_active:
-            query += "AND is_active = true "
-            
-        if group_filter:
-            query += "AND group_value ILIKE %s "
-            params.append(f"%{group_filter}%")
-            
-        if date_start:
-            query += "AND created_at >= %s "
-            params.append(date_start)
-            
-        if date_end:
-            query += "AND created_at <= %s "
-            params.append(date_end)
-            
-        if metric_name:
-            # Filter by metric name in the metadata JSON
-            query += "AND metadata->>'object_name' ILIKE %s "
-            params.append(f"%{metric_name}%")
-        
-        if district_filter:
-            # Filter by district - ensure both sides are treated as text
-            query += "AND district::TEXT = %s "
-            params.append(str(district_filter))
-            
-        if metric_id:
-            # Filter by object_id
-            query += "AND object_id::TEXT = %s "
-            params.append(str(metric_id))
-        
-        if period_type:
-            # Filter by period_type
-            query += "AND period_type = %s "
-            params.append(period_type)
-        
-        # Different query types
-        if query_type == 'recent':
-            query += "ORDER BY created_at DESC "
-        elif query_type == 'by_group':
-            query += "ORDER BY group_value ASC, created_at DESC "
-        elif query_type == 'by_date':
-            query += "ORDER BY created_at ASC "
-        elif query_type == 'by_anomaly_severity':
-            query += "ORDER BY ABS(difference) DESC "
-        elif query_type == 'by_district':
-            query += "ORDER BY district ASC, created_at DESC "
-        
-        # Add limit
-        query += "LIMIT %s"
-        params.append(limit)
-        
-        # Execute query
-        cursor.execute(query, params)
-        results = cursor.fetchall()
+        # Indexed search: typed district/object_id comparisons, trigram ILIKE on group_value/object_name
+        results = search_anomalies(
+            connection,
+            cursor_factory=RealDictCursor,
+            query_type=query_type,
+            limit=limit,
+            group_filter=group_filter,
+            date_start=date_start,
+            date_end=date_end,
+            only_anomalies=only_anomalies,
+            metric_name=metric_name,
+            district=district_filter or None,
+            object_id=metric_id or None,
+            period_type=period_type,
+            only_active=only_active
+        )
         
         # Convert to list of dictionaries and handle datetime objects
         result_list = []
@@ -531,7 +603,6 @@ def get_anomalies(
                 row_dict['created_at'] = row_dict['created_at'].isoformat()
             result_list.append(row_dict)
         
-        cursor.close()
         return result_list
     
     result = execute_with_connection(
@@ -583,6 +654,10 @@ def get_anomaly_details(
         cursor.execute(query, (anomaly_id,))
         anomaly = cursor.fetchone()
         
+        if not anomaly:
+            # Old inactive versions are moved to the archive by retention
+            anomaly = get_archived_row(connection, "anomalies", anomaly_id)
+        
         if not anomaly:
             cursor.close()
             return None
@@ -11,8 +11,9 @@ from psycopg2.extras import Json
 import logging
 import pandas as pd
 from typing import Dict, List, Any, Optional, Union, Tuple
-from datetime import datetime
+from datetime import datetime, date
 from tools.db_utils import get_postgres_connection, execute_with_connection, CustomJSONEncoder
+from tools.chart_cache import invalidate_chart_cache
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -57,25 +58,167 @@ def extract_district_from_filter_conditions(filter_conditions: List[Dict[str, An
     
     return district
 
+TIME_SERIES_POINT_INDEX = "time_series_data_point_key"
+
+# Whether time_series_changes exists in this database, checked on the first write
+_changes_table: Optional[bool] = None
+
+
+def ensure_time_series_upsert_schema(connection):
+    """
+    Migration for the diff writer, run from init_postgres_db: removes the
+    duplicate points older writers left, builds the unique point key
+    concurrently and creates the change log table. Idempotent.
+    """
+    global _changes_table
+    autocommit = connection.autocommit
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT i.indisvalid FROM pg_index i
+                WHERE i.indexrelid = to_regclass(%s)
+            """, (TIME_SERIES_POINT_INDEX,))
+            index = cursor.fetchone()
+            if index is not None and not index[0]:
+                # Left behind by an interrupted concurrent build
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {TIME_SERIES_POINT_INDEX}")
+                index = None
+            if index is None:
+                cursor.execute("""
+                    DELETE FROM time_series_data a USING time_series_data b
+                    WHERE a.chart_id = b.chart_id
+                    AND COALESCE(a.group_value, '') = COALESCE(b.group_value, '')
+                    AND a.time_period = b.time_period
+                    AND a.id < b.id
+                """)
+                if cursor.rowcount:
+                    logging.info(f"Removed {cursor.rowcount} duplicate time series points before indexing")
+                cursor.execute(f"""
+                    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {TIME_SERIES_POINT_INDEX}
+                    ON time_series_data (chart_id, COALESCE(group_value, ''), time_period)
+                """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS time_series_changes (
+                    id SERIAL PRIMARY KEY,
+                    chart_id INTEGER,
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    inserted INTEGER,
+                    updated INTEGER,
+                    deleted INTEGER,
+                    unchanged INTEGER,
+                    metadata_changed BOOLEAN,
+                    changed_periods DATE[]
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS time_series_changes_chart_id_idx ON time_series_changes (chart_id, changed_at)")
+    finally:
+        connection.autocommit = autocommit
+    _changes_table = True
+
+
+def _has_changes_table(connection) -> bool:
+    global _changes_table
+    if _changes_table is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('time_series_changes') IS NOT NULL")
+            _changes_table = bool(cursor.fetchone()[0])
+        if not _changes_table:
+            logging.warning("time_series_changes does not exist; run init_postgres_db to log refreshes")
+    return _changes_table
+
+
+def _point_key(point) -> Tuple[Optional[str], Any]:
+    """(group_value, time_period as a date) identifying a point within a chart."""
+    period = point['time_period']
+    if isinstance(period, datetime):
+        period = period.date()
+    elif not isinstance(period, date):
+        period = pd.to_datetime(period).date()
+    group_value = point.get('group_value')
+    return (None if group_value is None else str(group_value)), period
+
+
+def _point_value(value) -> Optional[float]:
+    if value is None or pd.isna(value):
+        return None
+    return float(value)
+
+
+def diff_time_series_points(existing: Dict[Tuple, Tuple[int, Optional[float]]], chart_data) -> Dict[str, Any]:
+    """
+    Compare incoming points with the stored ones.
+    
+    Args:
+        existing: {(group_value, time_period): (row id, numeric_value)} for the chart
+        chart_data: List of data points ({'time_period', 'value', 'group_value'})
+    
+    Returns:
+        dict: {"upserts": [(group_value, time_period, value)], "inserted", "updated",
+               "unchanged", "deleted_ids", "changed_periods"}
+    """
+    incoming = {}
+    for point in chart_data:
+        incoming[_point_key(point)] = _point_value(point['value'])  # last one wins on duplicates
+
+    upserts = []
+    inserted = updated = unchanged = 0
+    changed_periods = set()
+    for key, value in incoming.items():
+        if key not in existing:
+            inserted += 1
+        elif existing[key][1] == value:
+            unchanged += 1
+            continue
+        else:
+            updated += 1
+        upserts.append((key[0], key[1], value))
+        changed_periods.add(key[1])
+
+    deleted_ids = [row_id for key, (row_id, _) in existing.items() if key not in incoming]
+    for key in existing:
+        if key not in incoming:
+            changed_periods.add(key[1])
+
+    return {
+        "upserts": upserts,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": unchanged,
+        "deleted_ids": deleted_ids,
+        "changed_periods": sorted(changed_periods),
+    }
+
+
 def store_time_series_in_db(connection, chart_data, metadata):
     """
     Store time series chart data in the PostgreSQL database.
     
+    A chart is identified by (object_type, object_id, object_name,
+    field_name, period_type, district, group_field) and keeps its chart_id
+    across refreshes. Only points whose value changed are written (updated
+    in place by row id, or inserted when new), points that disappeared are
+    deleted, and each refresh that changed anything adds one row to
+    time_series_changes. No DDL runs here; ensure_time_series_upsert_schema
+    is part of init_postgres_db.
+    
     Args:
         connection: PostgreSQL database connection
         chart_data: List of data points for the chart
         metadata: Metadata about the chart
     
     Returns:
-        int: Number of data points stored
+        dict: {"chart_id", "inserted", "updated", "deleted", "unchanged", "metadata_changed"},
+              or None if the write failed
     """
     if connection is None:
         logging.error("No database connection available")
-        return 0
+        return None
     
     try:
         # Start a transaction
         connection.autocommit = False
+        log_changes = _has_changes_table(connection)
         
         # Use the custom JSON encoder to serialize the entire metadata
         # This handles all nested date objects automatically
@@ -94,57 +237,111 @@ def store_time_series_in_db(connection, chart_data, metadata):
         # Get district from filter conditions if it exists
         district = extract_district_from_filter_conditions(serializable_metadata.get('filter_conditions', []))
         
-        # First, deactivate any existing active charts with the same parameters
+        descriptive = (executed_query_url, caption, serializable_metadata)
+        metadata_changed = False
+        
+        # Find the chart this refresh belongs to, locking it against a concurrent refresh
         with connection.cursor() as cursor:
             cursor.execute("""
-                UPDATE time_series_metadata 
-                SET is_active = FALSE
+                SELECT chart_id, executed_query_url, caption, metadata
+                FROM time_series_metadata
                 WHERE object_type = %s 
                 AND object_id = %s
                 AND object_name = %s
                 AND field_name = %s
                 AND period_type = %s
                 AND district = %s
+                AND group_field IS NOT DISTINCT FROM %s
                 AND is_active = TRUE
-            """, (object_type, object_id, object_name, field_name, period_type, district))
-            
-        # Then, insert the metadata to get a chart_id
-        chart_id = None
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO time_series_metadata (
-                    object_type, object_id, object_name, field_name, period_type,
-                    group_field, executed_query_url, caption, metadata, district, is_active
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE)
-                RETURNING chart_id
-            """, (
-                object_type, object_id, object_name, field_name, period_type,
-                group_field, executed_query_url, caption, Json(serializable_metadata), district
-            ))
-            chart_id = cursor.fetchone()[0]
+                ORDER BY chart_id DESC
+                FOR UPDATE
+            """, (object_type, object_id, object_name, field_name, period_type, district, group_field))
+            active = cursor.fetchall()
         
-        # Then insert each data point
-        inserted_count = 0
         with connection.cursor() as cursor:
-            for point in chart_data:
+            if active:
+                chart_id = active[0][0]
+                # Older writers left one active row per refresh; keep the newest
+                if len(active) > 1:
+                    cursor.execute("UPDATE time_series_metadata SET is_active = FALSE WHERE chart_id = ANY(%s)",
+                                   ([row[0] for row in active[1:]],))
+                if tuple(active[0][1:]) != descriptive:
+                    metadata_changed = True
+                    cursor.execute("""
+                        UPDATE time_series_metadata
+                        SET executed_query_url = %s, caption = %s, metadata = %s
+                        WHERE chart_id = %s
+                    """, (executed_query_url, caption, Json(serializable_metadata), chart_id))
+                cursor.execute("SELECT id, group_value, time_period, numeric_value FROM time_series_data WHERE chart_id = %s",
+                               (chart_id,))
+                existing = {(group_value, time_period): (row_id, value)
+                            for row_id, group_value, time_period, value in cursor.fetchall()}
+            else:
+                metadata_changed = True
                 cursor.execute("""
-                    INSERT INTO time_series_data (
-                        chart_id, time_period, numeric_value, group_value
-                    ) VALUES (%s, %s, %s, %s)
+                    INSERT INTO time_series_metadata (
+                        object_type, object_id, object_name, field_name, period_type,
+                        group_field, executed_query_url, caption, metadata, district, is_active
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE)
+                    RETURNING chart_id
                 """, (
-                    chart_id,
-                    point['time_period'],
-                    point['value'],
-                    point.get('group_value')
+                    object_type, object_id, object_name, field_name, period_type,
+                    group_field, executed_query_url, caption, Json(serializable_metadata), district
                 ))
-                inserted_count += 1
+                chart_id = cursor.fetchone()[0]
+                existing = {}
+        
+        diff = diff_time_series_points(existing, chart_data)
+        
+        with connection.cursor() as cursor:
+            # The chart row is locked, so the points read above are still the stored ones
+            updates = [(existing[(group_value, period)][0], value) for group_value, period, value in diff["upserts"]
+                       if (group_value, period) in existing]
+            inserts = [(chart_id, group_value, period, value) for group_value, period, value in diff["upserts"]
+                       if (group_value, period) not in existing]
+            if updates:
+                psycopg2.extras.execute_values(cursor, """
+                    UPDATE time_series_data AS t SET numeric_value = v.numeric_value
+                    FROM (VALUES %s) AS v (id, numeric_value)
+                    WHERE t.id = v.id
+                """, updates, template="(%s, %s::float)", page_size=1000)
+            if inserts:
+                psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO time_series_data (chart_id, group_value, time_period, numeric_value)
+                    VALUES %s
+                """, inserts, page_size=1000)
+            if diff["deleted_ids"]:
+                cursor.execute("DELETE FROM time_series_data WHERE id = ANY(%s)", (diff["deleted_ids"],))
+            
+            changed = bool(diff["upserts"] or diff["deleted_ids"] or metadata_changed)
+            if changed and log_changes:
+                cursor.execute("""
+                    INSERT INTO time_series_changes
+                    (chart_id, inserted, updated, deleted, unchanged, metadata_changed, changed_periods)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, (chart_id, diff["inserted"], diff["updated"], len(diff["deleted_ids"]), diff["unchanged"],
+                      metadata_changed, diff["changed_periods"]))
         
         connection.commit()
-        return inserted_count
+        
+        counts = {
+            "chart_id": chart_id,
+            "inserted": diff["inserted"],
+            "updated": diff["updated"],
+            "deleted": len(diff["deleted_ids"]),
+            "unchanged": diff["unchanged"],
+            "metadata_changed": metadata_changed,
+        }
+        logging.info(f"Time series {object_id}/{period_type}/district {district}: {counts}")
+        
+        # Cached chart API responses built from this chart are stale only if something changed
+        if changed:
+            invalidate_chart_cache(object_id=object_id, district=district, period_type=period_type)
+        return counts
     except Exception as e:
         logging.error(f"Error storing time series data in database: {e}")
         connection.rollback()
-        return 0
+        return None
 
 def get_biggest_deltas(
     current_period: str = None,
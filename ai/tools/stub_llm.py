@@ -0,0 +1,68 @@
+"""
+Deterministic stand-in for the Swarm client, for tests and offline runs.
+
+StubSwarmClient.run() has the same signature as swarm.Swarm.run() and returns
+a response with the same shape (messages, agent, context_variables). Replies
+come from a responder function of the last user message, and an optional
+delay simulates model latency.
+"""
+
+import json
+import threading
+import time
+from typing import Callable, List
+
+
+class StubResponse:
+    """Mirror of swarm.types.Response."""
+
+    def __init__(self, messages, agent=None, context_variables=None):
+        self.messages = messages
+        self.agent = agent
+        self.context_variables = context_variables or {}
+
+
+def default_responder(prompt: str) -> str:
+    """Return a JSON explanation that echoes a short fingerprint of the prompt."""
+    return json.dumps({
+        "explanation": f"Stub explanation for: {prompt[:80]}",
+        "trend_analysis": "Stub trend analysis.",
+        "charts": []
+    })
+
+
+class StubSwarmClient:
+    """
+    Swarm-compatible client that never calls a model.
+
+    Args:
+        responder: Function mapping the last user message to the reply text
+        delay: Seconds to sleep per call, or a function of the prompt returning seconds
+    """
+
+    def __init__(self, responder: Callable[[str], str] = None, delay=0.0):
+        self.responder = responder or default_responder
+        self.delay = delay
+        self.calls: List[str] = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def run(self, agent=None, messages=None, context_variables=None, stream=False, **kwargs):
+        messages = list(messages or [])
+        prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+
+        with self._lock:
+            self.calls.append(prompt)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            delay = self.delay(prompt) if callable(self.delay) else self.delay
+            if delay:
+                time.sleep(delay)
+            reply = {"role": "assistant", "content": self.responder(prompt), "sender": getattr(agent, "name", None)}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        return StubResponse(messages=[reply], agent=agent, context_variables=context_variables)
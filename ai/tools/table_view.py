@@ -0,0 +1,288 @@
+"""
+Cached, paginated table views over the chat session dataset.
+
+A view is a projection (columns), filter and sort applied to a dataset once.
+It gets a stable view ID derived from the dataset and the view spec, so asking
+for the same table again, or for another page of it, reuses the prepared frame
+and any pages already rendered instead of re-sorting and re-rendering.
+
+Pages are rendered as CSV or TSV by default (markdown is still available),
+and rows are trimmed to fit a token budget so a wide or long page cannot
+flood the agent's context.
+
+Views are keyed on a dataset key kept in the context ("dataset_key") rather
+than on the DataFrame object, because Swarm deep-copies the context on every
+run and the copy is a different object. Whatever stores a new dataset in the
+context drops the key, so a new dataset always gets new views. The store is
+bounded by TABLE_VIEW_MAX_VIEWS and drops the least recently used view.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROWS_PER_PAGE = 50
+TABLE_VIEW_TOKEN_BUDGET = int(os.getenv("TABLE_VIEW_TOKEN_BUDGET", "2000"))
+TABLE_VIEW_MAX_VIEWS = int(os.getenv("TABLE_VIEW_MAX_VIEWS", "32"))
+MAX_CACHED_PAGES = 20
+CHARS_PER_TOKEN = 4
+FORMATS = ("csv", "tsv", "markdown")
+
+_FILTER_OPS = {
+    "==": lambda s, v: s == v,
+    "!=": lambda s, v: s != v,
+    ">": lambda s, v: s > v,
+    ">=": lambda s, v: s >= v,
+    "<": lambda s, v: s < v,
+    "<=": lambda s, v: s <= v,
+    "contains": lambda s, v: s.astype(str).str.contains(str(v), case=False, na=False, regex=False),
+    "in": lambda s, v: s.isin(v if isinstance(v, (list, tuple, set)) else [v]),
+}
+
+
+def normalize_filters(filters) -> List[List[Any]]:
+    """
+    Accept filters as {column: value} (equality) or a list of [column, op, value].
+    """
+    if not filters:
+        return []
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+    if isinstance(filters, dict):
+        return [[column, "==", value] for column, value in filters.items()]
+    normalized = []
+    for condition in filters:
+        if isinstance(condition, dict):
+            condition = [condition.get("column"), condition.get("op", "=="), condition.get("value")]
+        column, op, value = condition
+        if op not in _FILTER_OPS:
+            raise ValueError(f"Unsupported filter operator '{op}'. Use one of: {', '.join(_FILTER_OPS)}")
+        normalized.append([column, op, value])
+    return normalized
+
+
+def _as_list(value) -> Optional[List[str]]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(",") if part.strip()]
+    return list(value)
+
+
+class TableView:
+    """A prepared (projected, filtered, sorted) frame with a cache of rendered pages."""
+
+    def __init__(self, view_id: str, source: pd.DataFrame, columns=None, sort_by=None,
+                 ascending=True, filters=None, dataset_key: Optional[str] = None):
+        self.view_id = view_id
+        self.source = source
+        self.dataset_key = dataset_key
+        self.columns = columns
+        self.sort_by = sort_by
+        self.ascending = ascending
+        self.filters = filters or []
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.frame = self._build()
+
+    @property
+    def total_rows(self) -> int:
+        return len(self.frame)
+
+    def _build(self) -> pd.DataFrame:
+        df = self.source
+        missing = [c for c in (self.columns or []) + (self.sort_by or []) + [f[0] for f in self.filters] if c not in df.columns]
+        if missing:
+            raise KeyError(f"Unknown column(s): {', '.join(missing)}. Available columns: {', '.join(map(str, df.columns))}")
+
+        if self.filters:
+            mask = pd.Series(True, index=df.index)
+            for column, op, value in self.filters:
+                mask &= _FILTER_OPS[op](df[column], value)
+            df = df[mask]
+        if self.sort_by:
+            df = df.sort_values(self.sort_by, ascending=self.ascending, kind="mergesort")
+        if self.columns:
+            df = df[self.columns]
+        return df
+
+    def render_page(self, page_number: int, rows_per_page: int = DEFAULT_ROWS_PER_PAGE,
+                    fmt: str = "csv", token_budget: Optional[int] = None) -> Dict[str, Any]:
+        """Render one page, trimming rows to the token budget. Rendered pages are cached."""
+        token_budget = token_budget or TABLE_VIEW_TOKEN_BUDGET
+        key = (page_number, rows_per_page, fmt, token_budget)
+        with self.lock:
+            if key in self.pages:
+                self.pages.move_to_end(key)
+                return self.pages[key]
+
+        start = (page_number - 1) * rows_per_page
+        page_df = self.frame.iloc[start:start + rows_per_page]
+        header, rows = _render_rows(page_df, fmt)
+
+        budget_chars = token_budget * CHARS_PER_TOKEN
+        used = len(header)
+        shown = []
+        for row in rows:
+            if shown and used + len(row) + 1 > budget_chars:
+                break
+            shown.append(row)
+            used += len(row) + 1
+
+        page = {
+            "table": "\n".join([header] + shown),
+            "first_row": start + 1 if shown else start,
+            "last_row": start + len(shown),
+            "rows_shown": len(shown),
+            "truncated": len(shown) < len(rows)
+        }
+        with self.lock:
+            self.pages[key] = page
+            while len(self.pages) > MAX_CACHED_PAGES:
+                self.pages.popitem(last=False)
+        return page
+
+
+def _render_rows(page_df: pd.DataFrame, fmt: str):
+    """Return (header, [row lines]) for a page; one line per row."""
+    if fmt == "markdown":
+        lines = page_df.to_markdown(index=False).split("\n")
+        return "\n".join(lines[:2]), lines[2:]
+
+    # Cell newlines would split a CSV record over several lines
+    page_df = page_df.copy()
+    for column in page_df.select_dtypes(include="object").columns:
+        page_df[column] = page_df[column].map(lambda v: v.replace("\n", " ").replace("\r", " ") if isinstance(v, str) else v)
+    text = page_df.to_csv(index=False, sep="\t" if fmt == "tsv" else ",", lineterminator="\n")
+    lines = text.rstrip("\n").split("\n")
+    return lines[0], lines[1:]
+
+
+_views = OrderedDict()
+_views_lock = threading.Lock()
+
+
+def dataset_key(context_variables: Dict[str, Any]) -> str:
+    """Return the key of the context's dataset, assigning one on first use."""
+    key = context_variables.get("dataset_key")
+    if not key:
+        key = "d" + uuid.uuid4().hex[:12]
+        context_variables["dataset_key"] = key
+    return key
+
+
+def _view_id(source: pd.DataFrame, spec: Dict[str, Any], key: Optional[str]) -> str:
+    material = json.dumps([key or id(source), list(source.shape), list(map(str, source.columns)), spec],
+                          sort_keys=True, default=str)
+    return "v" + hashlib.sha1(material.encode("utf-8")).hexdigest()[:10]
+
+
+def _matches(view: TableView, dataset, key: Optional[str]) -> bool:
+    # Without a dataset key only the very same DataFrame object can reuse a view
+    if key is None:
+        return dataset is None or view.source is dataset
+    if view.dataset_key != key:
+        return False
+    return dataset is None or (view.source.shape == dataset.shape and list(view.source.columns) == list(dataset.columns))
+
+
+def get_table_view(dataset, columns=None, sort_by=None, ascending=True, filters=None,
+                   dataset_key: Optional[str] = None) -> TableView:
+    """
+    Return the cached view of dataset for this spec, building it on first use.
+
+    Pass the context's dataset_key() so the view outlives copies of the context.
+    """
+    if not isinstance(dataset, pd.DataFrame):
+        dataset = pd.DataFrame(dataset)
+    columns = _as_list(columns)
+    sort_by = _as_list(sort_by)
+    filters = normalize_filters(filters)
+    if isinstance(ascending, list) and sort_by and len(ascending) != len(sort_by):
+        raise ValueError("ascending must have one entry per sort column")
+
+    spec = {"columns": columns, "sort_by": sort_by, "ascending": ascending, "filters": filters}
+    view_id = _view_id(dataset, spec, dataset_key)
+    with _views_lock:
+        view = _views.get(view_id)
+        if view is not None and _matches(view, dataset, dataset_key):
+            _views.move_to_end(view_id)
+            return view
+
+    view = TableView(view_id, dataset, columns=columns, sort_by=sort_by, ascending=ascending, filters=filters,
+                     dataset_key=dataset_key)
+    logger.info(f"Built table view {view_id}: {view.total_rows} of {len(dataset)} rows, columns={columns}, sort_by={sort_by}, filters={filters}")
+    with _views_lock:
+        _views[view_id] = view
+        while len(_views) > TABLE_VIEW_MAX_VIEWS:
+            _views.popitem(last=False)
+    return view
+
+
+def lookup_table_view(view_id: str, dataset=None, dataset_key: Optional[str] = None) -> Optional[TableView]:
+    """Return a previously built view, or None if it was evicted or its dataset changed."""
+    with _views_lock:
+        view = _views.get(view_id)
+        if view is None or not _matches(view, dataset, dataset_key):
+            return None
+        _views.move_to_end(view_id)
+        return view
+
+
+def format_view_page(view: TableView, page_number: int = 1, rows_per_page: int = DEFAULT_ROWS_PER_PAGE,
+                     fmt: str = "csv", token_budget: Optional[int] = None, title: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Render a page of a view as a chat tool result.
+
+    Returns:
+        dict: {"status", "content", "view_id", "pagination"} or {"error"}
+    """
+    if fmt not in FORMATS:
+        return {"error": f"Unsupported format '{fmt}'. Use one of: {', '.join(FORMATS)}"}
+    rows_per_page = max(1, int(rows_per_page or DEFAULT_ROWS_PER_PAGE))
+    total_rows = view.total_rows
+    total_pages = max(1, (total_rows + rows_per_page - 1) // rows_per_page)
+    if not (1 <= page_number <= total_pages):
+        return {"error": f"Invalid page number. Please specify a page between 1 and {total_pages}"}
+
+    page = view.render_page(page_number, rows_per_page, fmt, token_budget)
+
+    content = "\n---\n"
+    if title:
+        content += f"### {title}\n\n"
+    content += f"*View {view.view_id}: page {page_number} of {total_pages} (rows {page['first_row']}-{page['last_row']} of {total_rows:,})*\n\n"
+    content += page["table"] + "\n" if fmt == "markdown" else f"```{fmt}\n{page['table']}\n```\n"
+    if page["truncated"]:
+        content += f"\n*Page cut to {page['rows_shown']} rows to fit the token budget; request fewer columns or a smaller rows_per_page to see more.*\n"
+
+    nav_info = []
+    if page_number > 1:
+        nav_info.append(f"Previous: Page {page_number - 1}")
+    if page_number < total_pages:
+        nav_info.append(f"Next: Page {page_number + 1}")
+    if nav_info:
+        content += f"\n*{' | '.join(nav_info)}*\n"
+    content += "---\n"
+
+    return {
+        "status": "Table page formatted successfully",
+        "content": content,
+        "view_id": view.view_id,
+        "pagination": {
+            "view_id": view.view_id,
+            "total_rows": total_rows,
+            "current_page": page_number,
+            "rows_per_page": rows_per_page,
+            "total_pages": total_pages,
+            "format": fmt
+        }
+    }
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test script for concurrent tool-call execution in the agent loop.
+
+Uses a minimal stand-in for the Swarm client (the empty-Response and
+handle_function_result hooks that parallel_tool_calls relies on), so it
+runs without Swarm or any of the backing services.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from types import SimpleNamespace
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import agent_runtime
+from tools.agent_runtime import (context_writer, parallel_tool_calls, parse_tool_timeouts, plan_batches, tool_call_log,
+                                 take_tool_outcomes)
+
+
+class FakeSwarm:
+    def handle_tool_calls(self, tool_calls, functions, context_variables, debug):
+        assert tool_calls == []
+        return SimpleNamespace(messages=[], agent=None, context_variables={})
+
+    def handle_function_result(self, result, debug):
+        if isinstance(result, SimpleNamespace):
+            return result
+        return SimpleNamespace(value=str(result), agent=None, context_variables={})
+
+
+def _call(call_id, name, **arguments):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+def get_dashboard_metric(context_variables, metric_id=None):
+    time.sleep(0.3)
+    return {"metric": metric_id, "session": context_variables["session_id"]}
+
+
+def query_docs(context_variables, query=None):
+    time.sleep(0.3)
+    return f"docs for {query}"
+
+
+def query_anomalies_db(context_variables, limit=10):
+    time.sleep(0.3)
+    return f"{limit} anomalies"
+
+
+def test_turn_takes_as_long_as_the_slowest_call():
+    client = parallel_tool_calls(FakeSwarm())
+    calls = [_call("a", "get_dashboard_metric", metric_id=7), _call("b", "query_docs", query="permits"),
+             _call("c", "query_anomalies_db", limit=5), _call("d", "missing_tool")]
+    started = time.perf_counter()
+    response = client.handle_tool_calls(calls, [get_dashboard_metric, query_docs, query_anomalies_db],
+                                        {"session_id": "s1"}, False)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.6
+    # Messages come back in the order the model issued the calls
+    assert [m["tool_call_id"] for m in response.messages] == ["a", "b", "c", "d"]
+    assert response.messages[1]["content"] == "docs for permits"
+    assert response.messages[3]["content"] == "Error: Tool missing_tool not found."
+    assert "'session': 's1'" in response.messages[0]["content"]
+
+    # The streaming loop collects the raw results once, in call order
+    outcomes = take_tool_outcomes("s1")
+    assert [o["tool_call_id"] for o in outcomes] == ["a", "b", "c", "d"]
+    assert outcomes[0]["raw"] == {"metric": 7, "session": "s1"} and outcomes[0]["arguments"]["metric_id"] == 7
+    assert outcomes[3]["raw"] is None and outcomes[3]["error"] == "Tool missing_tool not found."
+    assert take_tool_outcomes("s1") == []
+
+    log = tool_call_log("s1")[-3:]
+    assert [entry["tool"] for entry in log] == ["get_dashboard_metric", "query_docs", "query_anomalies_db"]
+    assert all(entry["status"] == "ok" and entry["batch"] == 3 and entry["latency_ms"] >= 250 for entry in log)
+
+
+def test_context_writers_run_alone_and_in_order():
+    order = []
+    lock = threading.Lock()
+
+    def reader(context_variables):
+        with lock:
+            order.append(("read", context_variables.get("dataset")))
+        return "read"
+
+    @context_writer
+    def set_dataset(context_variables, value=None):
+        time.sleep(0.1)
+        context_variables["dataset"] = value
+        with lock:
+            order.append(("write", value))
+        return SimpleNamespace(value="set", agent="analyst", context_variables={"rows": 3})
+
+    calls = [_call("1", "reader"), _call("2", "set_dataset", value="permits"), _call("3", "reader")]
+    batches = plan_batches([{"func": f} for f in (reader, set_dataset, reader)])
+    assert [len(batch) for batch in batches] == [1, 1, 1]
+
+    response = parallel_tool_calls(FakeSwarm()).handle_tool_calls(calls, [reader, set_dataset], {}, False)
+    assert order == [("read", None), ("write", "permits"), ("read", "permits")]
+    assert response.agent == "analyst" and response.context_variables == {"rows": 3}
+
+
+def test_timeouts_and_errors_become_tool_messages():
+    def slow(context_variables):
+        time.sleep(1.0)
+        return "late"
+
+    def broken(context_variables):
+        raise ValueError("no such metric")
+
+    @context_writer
+    def slow_writer(context_variables):
+        time.sleep(0.4)
+        context_variables["dataset"] = "written"
+        return "set"
+
+    assert parse_tool_timeouts("slow=0.2, query_docs=20,bad=x,=3") == {"slow": 0.2, "query_docs": 20.0}
+    original = agent_runtime.AGENT_TOOL_TIMEOUTS
+    agent_runtime.AGENT_TOOL_TIMEOUTS = {"slow": 0.2, "slow_writer": 0.2}
+    try:
+        started = time.perf_counter()
+        response = parallel_tool_calls(FakeSwarm()).handle_tool_calls(
+            [_call("x", "slow"), _call("y", "broken")], [slow, broken], {"session_id": "s2"}, False)
+        assert time.perf_counter() - started < 0.8
+
+        # A context writer cannot be abandoned halfway, so it is never timed out
+        context = {}
+        written = parallel_tool_calls(FakeSwarm()).handle_tool_calls(
+            [_call("w", "slow_writer", kwargs="{}", args=[])], [slow_writer], context, False)
+        assert written.messages[0]["content"] == "set" and context == {"dataset": "written"}
+    finally:
+        agent_runtime.AGENT_TOOL_TIMEOUTS = original
+
+    assert response.messages[0]["content"].startswith("Error: slow failed")
+    assert response.messages[1]["content"] == "Error: broken failed: no such metric"
+    assert [entry["status"] for entry in tool_call_log("s2")] == ["timeout", "error"]
+
+
+if __name__ == "__main__":
+    test_turn_takes_as_long_as_the_slowest_call()
+    test_context_writers_run_alone_and_in_order()
+    test_timeouts_and_errors_become_tool_messages()
+    print("All agent runtime tests passed")
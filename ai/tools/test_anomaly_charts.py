@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script for anomaly chart rendering: analysis runs chart only the
+out-of-bounds groups, and any stored anomaly can be charted on request from
+its anomalies row.
+"""
+
+import os
+import sys
+from datetime import date
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.generateAnomalyCharts import (
+    generate_anomalies_summary_with_charts, anomaly_chart_inputs, render_anomaly_chart_page
+)
+
+METADATA = {
+    'title': 'Calls by neighborhood',
+    'y_axis_label': 'Calls',
+    'numeric_field': 'calls',
+    'group_field': 'neighborhood',
+    'period_type': 'month',
+    'recent_period': {'start': date(2025, 2, 1), 'end': date(2025, 2, 28)},
+    'comparison_period': {'start': date(2024, 11, 1), 'end': date(2025, 1, 31)},
+}
+
+
+def _result(group, recent, out_of_bounds):
+    return {'group_value': group, 'comparison_mean': 10.0, 'recent_mean': recent, 'difference': recent - 10.0,
+            'stdDev': 1.0, 'dates': ['2024-11', '2024-12', '2025-01', '2025-02'], 'counts': [9, 10, 11, recent],
+            'out_of_bounds': out_of_bounds}
+
+
+def test_summary_charts_only_out_of_bounds(tmp_path):
+    results = [_result('Mission', 30.0, True), _result('Tenderloin', 10.5, False), _result('SoMa', 9.5, False)]
+    html_content, markdown = generate_anomalies_summary_with_charts(results, METADATA, output_dir=str(tmp_path))
+
+    assert html_content.count('class="chart-container"') == 1
+    # plotly.js comes from the page's CDN script, not once per chart
+    assert html_content.count('<script src="https://cdn.plot.ly/plotly-latest.min.js">') == 1
+    assert len(html_content) < 100_000
+    assert 'Tenderloin' in html_content and '| SoMa |' in markdown
+    assert os.listdir(tmp_path) == []
+
+
+def test_chart_rendered_from_stored_row():
+    row = {
+        'id': 7, 'group_value': 'Tenderloin', 'period_type': 'month', 'field_name': 'calls',
+        'comparison_mean': 10.0, 'recent_mean': 10.5, 'difference': 0.5, 'std_dev': 1.0, 'out_of_bounds': False,
+        'comparison_dates': ['2024-11', '2024-12', '2025-01'], 'comparison_counts': [9, 10, 11],
+        'recent_dates': ['2025-02'], 'recent_counts': [10.5],
+        # Stored metadata holds the periods as ISO strings
+        'metadata': {'title': 'Calls by neighborhood', 'y_axis_label': 'Calls',
+                     'recent_period': {'start': '2025-02-01', 'end': '2025-02-28'},
+                     'comparison_period': {'start': '2024-11-01', 'end': '2025-01-31'}},
+    }
+    item, metadata = anomaly_chart_inputs(row)
+    assert item['dates'] == ['2024-11', '2024-12', '2025-01', '2025-02']
+    assert metadata['recent_period']['start'] == date(2025, 2, 1)
+
+    page = render_anomaly_chart_page(item, metadata)
+    assert page.startswith('<!DOCTYPE html>') and page.count('class="chart-container"') == 1
+    assert 'Trend of Total Calls in Tenderloin' in page
+    assert 'a 5.0% increase' in page
+
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_summary_charts_only_out_of_bounds(pathlib.Path(tempfile.mkdtemp()))
+    test_chart_rendered_from_stored_row()
+    print("All anomaly chart tests passed")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Test script for the fleet-wide anomaly scan.
+
+The scoring tests build a matrix from rows and compare it with the inline
+rule of tools.anomaly_detection; they run anywhere. The store test scores
+charts from a scratch schema of the configured PostgreSQL database and
+writes them twice; it is skipped when no database is reachable.
+"""
+
+import os
+import sys
+import uuid
+from datetime import date
+
+import numpy as np
+import pytest
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import anomaly_scan
+from tools.anomaly_scan import (SeriesMatrix, time_ranges, score, chart_results, register_detector, run_anomaly_scan,
+                                _chart_metadata)
+from tools.anomaly_detection import calculate_stats
+
+TODAY = date(2025, 3, 15)
+
+
+def _rows():
+    recent, comparison = time_ranges("month", TODAY)
+    months = anomaly_scan.period_starts(comparison["start"], recent["end"], "month")
+    rows = []
+    for i, month in enumerate(months):
+        # A spike in the recent month
+        rows.append((1, "Mission", month, 40.0 if month == months[-1] else 10.0 + i % 3))
+        # Starts mid-window and skips a month: zeros after its first point only
+        if i >= 10 and i != 15:
+            rows.append((1, "Tenderloin", month, 5.0 + (i % 2)))
+    # A flat series cannot be scored
+    rows += [(2, "Flat", month, 7.0) for month in months]
+    return months, rows, recent, comparison
+
+
+def test_scores_match_inline_rule():
+    months, rows, recent, comparison = _rows()
+    charts = {1: {"object_id": "a"}, 2: {"object_id": "b"}}
+    matrix = SeriesMatrix.from_rows("month", rows, recent, comparison, charts)
+    scores = score(matrix, min_diff=2)
+    results = chart_results(matrix, scores)
+
+    assert [r["group_value"] for r in results[1]] == ["Mission", "Tenderloin"]
+    assert results[2] == []  # std dev 0
+
+    for result in results[1]:
+        points = {month: value for _, group, month, value in rows if group == result["group_value"]}
+        first = min(points)
+        filled = [points.get(month, 0.0) for month in months if month >= first]
+        window = [month for month in months if month >= first]
+        comp = [v for m, v in zip(window, filled) if comparison["start"] <= m <= comparison["end"]]
+        rec = [v for m, v in zip(window, filled) if recent["start"] <= m <= recent["end"]]
+        expected_comp, expected_rec = calculate_stats(comp), calculate_stats(rec)
+        assert result["comparison_mean"] == pytest.approx(expected_comp["mean"])
+        assert result["recent_mean"] == pytest.approx(expected_rec["mean"])
+        assert result["stdDev"] == pytest.approx(expected_comp["stdDev"])
+        difference = expected_rec["mean"] - expected_comp["mean"]
+        assert result["out_of_bounds"] == (abs(difference) > expected_comp["stdDev"] * 2
+                                           and expected_comp["mean"] > 2 and expected_rec["mean"] > 2)
+        assert result["dates"][0] == first.strftime("%Y-%m") and len(result["counts"]) == len(filled)
+    assert results[1][0]["out_of_bounds"] is True
+
+    # Re-scoring with another threshold or detector reuses the loaded matrix
+    assert not score(matrix, min_diff=100)["out_of_bounds"].any()
+    register_detector("always")(lambda scores: np.ones(len(scores["difference"]), dtype=bool))
+    try:
+        flagged = score(matrix, "always")["out_of_bounds"]
+        assert flagged.tolist() == scores["scored"].tolist()
+    finally:
+        anomaly_scan.DETECTORS.pop("always")
+    with pytest.raises(ValueError):
+        score(matrix, "missing")
+
+
+def test_history_before_window_zero_fills_from_start():
+    months, rows, recent, comparison = _rows()
+    late = [row for row in rows if row[1] == "Tenderloin"]
+    matrix = SeriesMatrix.from_rows("month", late, recent, comparison, {1: {}},
+                                    started_before=[(1, "Tenderloin")])
+    filled = matrix.filled()
+    assert not np.isnan(filled).any()
+    assert filled[0, :10].tolist() == [0.0] * 10
+    assert filled[0, 15] == 0.0
+
+
+def test_category_charts_map_onto_inline_series():
+    recent, comparison = time_ranges("month", TODAY)
+    row = (7, "dashboard_metric_category", "42", "Fires by Neighborhood", "count", None,
+           "Fire Incidents <br> count by month by Neighborhood", "neighborhood", None, 3, None)
+    metadata = _chart_metadata(row, "month", recent, comparison)
+    # The identity generate_metric_analysis stores inline anomalies of this series under
+    assert (metadata["object_type"], metadata["object_id"], metadata["object_name"]) == \
+        ("dashboard_metric", "42", "Fire Incidents")
+    assert metadata["group_field"] == "neighborhood" and metadata["district"] == 3
+
+    other = _chart_metadata((8, "custom", "9", "Calls", "count", None, None, "call_type", "[]", 0, None),
+                            "month", recent, comparison)
+    assert (other["object_type"], other["object_name"]) == ("custom", "Calls")
+
+
+def test_scan_writes_and_rescores():
+    from tools.db_utils import get_postgres_connection
+    from tools import anomaly_search
+
+    connection = get_postgres_connection()
+    if connection is None:
+        pytest.skip("PostgreSQL is not reachable")
+
+    schema = f"test_scan_{uuid.uuid4().hex[:8]}"
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"SET search_path TO {schema}")
+        cursor.execute("""
+            CREATE TABLE time_series_metadata (
+                chart_id SERIAL PRIMARY KEY, object_type TEXT, object_id TEXT, object_name TEXT,
+                field_name TEXT, y_axis_label TEXT, period_type TEXT, chart_title TEXT, metadata JSONB,
+                filter_conditions JSONB, district INTEGER DEFAULT 0, group_field TEXT,
+                executed_query_url TEXT, caption TEXT, is_active BOOLEAN DEFAULT TRUE
+            );
+            CREATE TABLE time_series_data (
+                id SERIAL PRIMARY KEY, chart_id INTEGER, time_period DATE, group_value TEXT, numeric_value FLOAT
+            );
+            CREATE TABLE anomalies (
+                id SERIAL PRIMARY KEY, group_value TEXT, group_field_name TEXT, period_type TEXT,
+                comparison_mean FLOAT, recent_mean FLOAT, difference FLOAT, std_dev FLOAT, out_of_bounds BOOLEAN,
+                recent_date DATE, comparison_dates JSONB, comparison_counts JSONB, recent_dates JSONB,
+                recent_counts JSONB, metadata JSONB, field_name TEXT, object_type TEXT, object_id TEXT,
+                object_name TEXT, recent_data JSONB, comparison_data JSONB, district INTEGER,
+                content_hash TEXT, is_active BOOLEAN DEFAULT TRUE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cursor.execute("""
+            INSERT INTO time_series_metadata (object_type, object_id, object_name, field_name, period_type, group_field, district)
+            VALUES ('dashboard_metric', '1', 'Crimes', 'count', 'month', 'neighborhood', 3),
+                   ('dashboard_metric', '2', 'Calls', 'count', 'month', 'neighborhood', 0)
+        """)
+        _, rows, _, _ = _rows()
+        cursor.executemany("INSERT INTO time_series_data (chart_id, group_value, time_period, numeric_value) "
+                           "VALUES (%s, %s, %s, %s)", rows)
+        connection.commit()
+        anomaly_search._column_types.clear()
+        anomaly_scan._matrices.clear()
+
+        first = run_anomaly_scan("month", connection=connection, today=TODAY)
+        assert first["charts"] == 2 and first["scored"] == 2 and first["inserted"] == 2
+        assert first["reloaded"] is True
+
+        # Same data: nothing rewritten and nothing reloaded
+        second = run_anomaly_scan("month", connection=connection, today=TODAY)
+        assert second["reloaded"] is False
+        assert (second["inserted"], second["unchanged"], second["deactivated"]) == (0, 2, 0)
+
+        # A new threshold rewrites only the groups whose flag changed
+        third = run_anomaly_scan("month", params={"min_diff": 100}, connection=connection, today=TODAY)
+        assert third["out_of_bounds"] == 0
+        assert third["inserted"] == third["deactivated"] == first["out_of_bounds"]
+
+        cursor.execute("SELECT district, count(*) FROM anomalies WHERE is_active GROUP BY district")
+        assert dict(cursor.fetchall()) == {3: 2}
+    finally:
+        connection.rollback()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        connection.commit()
+        cursor.close()
+        connection.close()
+        anomaly_search._column_types.clear()
+        anomaly_scan._matrices.clear()
+
+
+if __name__ == "__main__":
+    test_scores_match_inline_rule()
+    test_history_before_window_zero_fills_from_start()
+    test_category_charts_map_onto_inline_series()
+    test_scan_writes_and_rescores()
+    print("All anomaly scan tests passed")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for the chart API response cache in tools/chart_cache.py.
+"""
+
+import os
+import sys
+import gzip
+import json
+from types import SimpleNamespace
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import chart_cache
+from tools.chart_cache import cached_chart_response, invalidate_chart_cache
+
+
+def _payload(object_id="4", district="0", period_type="month", points=60):
+    return {
+        "metadata": {"object_id": object_id, "district": district, "period_type": period_type},
+        "data": [{"time_period": f"2025-{i % 12 + 1:02d}-01", "group_value": f"g{i // 12}", "numeric_value": float(i)}
+                 for i in range(points)]
+    }
+
+
+class CountingBuilder:
+    """Chart payload builder that records how often the cache had to call it."""
+
+    def __init__(self, **payload_args):
+        self.calls = 0
+        self.payload_args = payload_args
+
+    def __call__(self):
+        self.calls += 1
+        return _payload(**self.payload_args)
+
+
+def _request(**headers):
+    return SimpleNamespace(headers={name.replace("_", "-"): value for name, value in headers.items()})
+
+
+def _metric_key(metric_id="4", district="0", period_type="month", groups=()):
+    return ("metric", metric_id, district, period_type, None, tuple(groups))
+
+
+def _reset():
+    invalidate_chart_cache()
+
+
+def test_repeat_request_is_a_hit():
+    """The second request is served from the cache, and a matching ETag gets a 304."""
+    _reset()
+    builder = CountingBuilder()
+    first = cached_chart_response(_request(), _metric_key(), builder)
+    second = cached_chart_response(_request(), _metric_key(), builder)
+    assert builder.calls == 1
+    assert first.body == second.body
+    assert json.loads(first.body)["data"] == _payload()["data"]
+
+    not_modified = cached_chart_response(_request(if_none_match=first.headers["etag"]), _metric_key(), builder)
+    assert not_modified.status_code == 304 and builder.calls == 1
+
+    compressed = cached_chart_response(_request(accept_encoding="gzip"), _metric_key(), builder)
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(compressed.body) == first.body
+
+
+def test_changed_inputs_miss():
+    """Another district, period or group selection builds its own entry; a write invalidates."""
+    _reset()
+    builder = CountingBuilder()
+    cached_chart_response(_request(), _metric_key(), builder)
+    cached_chart_response(_request(), _metric_key(district="3"), CountingBuilder(district="3"))
+    cached_chart_response(_request(), _metric_key(groups=("g1",)), builder)
+    assert builder.calls == 2
+
+    # store_time_series_in_db invalidates the metric/district/period it wrote
+    assert invalidate_chart_cache(object_id=4, district=0, period_type="month") == 2
+    cached_chart_response(_request(), _metric_key(), builder)
+    assert builder.calls == 3
+    # The other district was not touched
+    district_builder = CountingBuilder(district="3")
+    cached_chart_response(_request(), _metric_key(district="3"), district_builder)
+    assert district_builder.calls == 0
+
+
+def test_entries_expire_after_ttl():
+    """An entry older than CHART_CACHE_TTL is rebuilt."""
+    _reset()
+    builder = CountingBuilder()
+    cached_chart_response(_request(), _metric_key(), builder)
+    entry = chart_cache.get_cached_chart(_metric_key())
+    entry.created_at -= chart_cache.CHART_CACHE_TTL + 1
+
+    cached_chart_response(_request(), _metric_key(), builder)
+    assert builder.calls == 2
+    cached_chart_response(_request(), _metric_key(), builder)
+    assert builder.calls == 2
+
+
+if __name__ == "__main__":
+    test_repeat_request_is_a_hit()
+    test_changed_inputs_miss()
+    test_entries_expire_after_ttl()
+    print("All chart cache tests passed")
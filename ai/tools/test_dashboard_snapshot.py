@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for the cached backend dashboard snapshot.
+
+Uses a fake cursor for the statistics queries and a counting stand-in for
+compute_snapshot, so it runs without PostgreSQL or Qdrant.
+"""
+
+import os
+import sys
+import time
+import threading
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import dashboard_snapshot
+from tools.dashboard_snapshot import anomaly_status_split, estimated_row_counts, get_snapshot, refresh_snapshot
+
+
+class FakeCursor:
+    def __init__(self, responses):
+        self.responses = responses
+        self.executed = []
+        self.result = []
+
+    def execute(self, query, parameters=None):
+        self.executed.append(query)
+        for marker, rows in self.responses.items():
+            if marker in query:
+                self.result = rows
+                return
+        raise AssertionError(f"unexpected query: {query}")
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+
+def test_counts_come_from_reltuples():
+    cursor = FakeCursor({
+        "pg_class": [("anomalies", 120000), ("time_series_data", 4800000), ("time_series_metadata", -1)],
+        "COUNT(*) FROM time_series_metadata": [(37,)],
+    })
+    counts = estimated_row_counts(cursor)
+    assert counts["time_series_data"] == {"count": 4800000, "estimated": True}
+    # Never analyzed: counted exactly, and only that table
+    assert counts["time_series_metadata"] == {"count": 37, "estimated": False}
+    assert sum("COUNT(*)" in q for q in cursor.executed) == 1
+
+
+def test_anomaly_split_from_pg_stats():
+    cursor = FakeCursor({"pg_stats": [("{f,t}", [0.75, 0.25], 0.0)]})
+    assert anomaly_status_split(cursor, 120000) == {"out_of_bounds": 30000, "in_bounds": 90000, "total": 120000,
+                                                    "estimated": True}
+
+    cursor = FakeCursor({"pg_stats": [], "GROUP BY out_of_bounds": [(True, 4), (False, 6)]})
+    assert anomaly_status_split(cursor, 0)["total"] == 10
+
+
+def test_refresh_is_single_flight_and_rate_limited():
+    calls = []
+
+    def slow_compute(ai_dir):
+        calls.append(ai_dir)
+        time.sleep(0.2)
+        return {"datasets": {"count": len(calls), "change": 0.0}}
+
+    original = dashboard_snapshot.compute_snapshot
+    dashboard_snapshot.compute_snapshot = slow_compute
+    dashboard_snapshot._snapshot.update(data=None, computed_at=None)
+    try:
+        assert get_snapshot() is None
+        threads = [threading.Thread(target=refresh_snapshot, kwargs={"force": False}) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+
+        snapshot = get_snapshot()
+        assert snapshot["datasets"]["count"] == 1 and snapshot["age_seconds"] < 5 and not snapshot["stale"]
+
+        # A forced refresh right after the last one is served from the cache
+        assert refresh_snapshot(force=True)["datasets"]["count"] == 1
+        dashboard_snapshot._snapshot["computed_at"] -= dashboard_snapshot.DASHBOARD_SNAPSHOT_MIN_REFRESH_SECONDS + 1
+        assert refresh_snapshot(force=True)["datasets"]["count"] == 2
+    finally:
+        dashboard_snapshot.compute_snapshot = original
+        dashboard_snapshot._snapshot.update(data=None, computed_at=None)
+
+
+if __name__ == "__main__":
+    test_counts_come_from_reltuples()
+    test_anomaly_split_from_pg_stats()
+    test_refresh_is_single_flight_and_rate_limited()
+    print("All dashboard snapshot tests passed")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-memory dashboard metric store.
+
+Builds a small output/dashboard and data/dashboard tree in a temporary
+directory, so it needs nothing but the filesystem.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.dashboard_store import DashboardStore
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    return path
+
+
+def _tree():
+    base = tempfile.mkdtemp(prefix="dashboard_store_test_")
+    for district in range(3):
+        name = "Citywide" if district == 0 else f"District {district}"
+        _write(os.path.join(base, "output", "dashboard", str(district), "top_level.json"),
+               {"name": name, "categories": []})
+        for metric_id, category in ((1, "Crime"), (2, "Crime"), (10, "Housing")):
+            _write(os.path.join(base, "output", "dashboard", str(district), f"{metric_id}.json"),
+                   {"category": category, "metric_id": metric_id, "thisYear": district * 100 + metric_id})
+    _write(os.path.join(base, "data", "dashboard", "metric_id_mapping.json"),
+           {"1": {"category": "crime", "subcategory": "Crime", "name": "Incidents"}})
+    return base
+
+
+def test_lookups_are_indexed():
+    base = _tree()
+    try:
+        store = DashboardStore(base, check_seconds=60)
+        assert store.metric("2", "10.json")["thisYear"] == 210
+        assert store.metric(2, "10") is store.metric("2", "10.json")
+        assert store.top_level(0)["name"] == "Citywide"
+        assert store.metric_ids(1) == ["1", "2", "10"]
+        assert store.metric_ids(7) is None and store.metric(7, 1) is None
+        assert [d["name"] for d in store.districts()] == ["Citywide", "District 1", "District 2"]
+        assert sorted(store.metric_by_district(1)) == ["0", "1", "2"]
+        assert [m["thisYear"] for m in store.category_metrics("Crime", district=1)] == [101, 102]
+        assert len(store.category_metrics("Housing")) == 3
+        assert store.mapping()["1"]["name"] == "Incidents" and store.enhanced_queries() is None
+        assert json.loads(store.entry(0, 1).raw) == store.metric(0, 1)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def test_changed_files_are_reloaded():
+    base = _tree()
+    try:
+        store = DashboardStore(base, check_seconds=60)
+        store.refresh()
+        untouched = store.entry(1, 2)
+
+        # A write notification reloads just that file, without waiting for a check
+        path = _write(os.path.join(base, "output", "dashboard", "1", "1.json"), {"category": "Housing", "thisYear": 5})
+        assert store.notify_write(path)
+        assert store.metric(1, 1)["thisYear"] == 5
+        assert len(store.category_metrics("Housing", district=1)) == 2
+        assert not store.notify_write(os.path.join(base, "elsewhere", "1.json"))
+
+        # Writers in other processes are picked up by mtime on refresh
+        time.sleep(0.01)
+        _write(os.path.join(base, "output", "dashboard", "2", "2.json"), {"category": "Crime", "thisYear": 999})
+        _write(os.path.join(base, "output", "dashboard", "3", "top_level.json"), {"name": "District 3"})
+        os.remove(os.path.join(base, "output", "dashboard", "0", "10.json"))
+        with open(os.path.join(base, "output", "dashboard", "0", "1.json"), "w") as f:
+            f.write("{truncated")
+        assert store.refresh() == 4
+        assert store.entry(1, 2) is untouched
+        assert store.metric(2, 2)["thisYear"] == 999
+        assert store.metric(0, 10) is None and store.entry(0, 1).error
+        assert store.districts()[-1] == {"id": "3", "name": "District 3"}
+        assert store.refresh() == 0
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_lookups_are_indexed()
+    test_changed_files_are_reloaded()
+    print("All dashboard store tests passed")
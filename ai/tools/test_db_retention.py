@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script for retention and compaction of the versioned tables.
+
+The SQL builder tests run anywhere. The compaction test seeds a scratch
+schema with several generations of anomalies and time series charts in the
+configured PostgreSQL database; it is skipped when no database is reachable.
+"""
+
+import os
+import sys
+import uuid
+import datetime
+
+import pytest
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.db_retention import (
+    RETENTION_TABLES, build_doomed_query, build_move_query, drop_expired_partitions, get_archived_row,
+    retention_report, run_retention, _partition_name, _next_month
+)
+
+
+def test_doomed_query_ranks_inactive_versions_per_series():
+    sql = build_doomed_query(RETENTION_TABLES[1])
+    assert "PARTITION BY object_type, object_id, object_name, field_name, group_field, period_type, district" in sql
+    assert "ORDER BY created_at DESC, chart_id DESC" in sql
+    assert "WHERE is_active IS FALSE" in sql
+    # Ranked once per run; batches come from the candidate table
+    assert "LIMIT" not in sql
+
+
+def test_move_query_archives_with_blob_hash():
+    sql = build_move_query("anomalies", "id", "archive", ["id", "group_value", "created_at"], "metadata")
+    assert "DELETE FROM anomalies t USING retention_doomed d WHERE t.id = d.id RETURNING t.*" in sql
+    assert "INSERT INTO metadata_blobs (hash, body)" in sql and "ON CONFLICT (hash) DO NOTHING" in sql
+    assert "INSERT INTO anomalies_archive (id, group_value, created_at, metadata_hash)" in sql
+
+    delete_only = build_move_query("time_series_data", "chart_id", "delete")
+    assert "archive" not in delete_only and "metadata_blobs" not in delete_only
+
+    assert _partition_name("anomalies_archive", datetime.date(2024, 12, 1)) == "anomalies_archive_p202412"
+    assert _next_month(datetime.date(2024, 12, 1)) == datetime.date(2025, 1, 1)
+
+
+def _scratch_connection():
+    try:
+        from tools.db_utils import get_postgres_connection
+        connection = get_postgres_connection()
+    except Exception:
+        connection = None
+    if connection is None:
+        pytest.skip("PostgreSQL is not reachable")
+    return connection
+
+
+def test_compaction_keeps_generations_and_archives_the_rest():
+    connection = _scratch_connection()
+    schema = f"retention_test_{uuid.uuid4().hex[:8]}"
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"SET search_path TO {schema}")
+        cursor.execute("""
+            CREATE TABLE anomalies (
+                id SERIAL PRIMARY KEY, object_type TEXT, object_id TEXT, object_name TEXT, group_field_name TEXT,
+                group_value TEXT, period_type TEXT, district INTEGER, metadata JSONB, recent_data JSONB,
+                is_active BOOLEAN DEFAULT TRUE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE time_series_metadata (
+                chart_id SERIAL PRIMARY KEY, object_type TEXT, object_id TEXT, object_name TEXT, field_name TEXT,
+                group_field TEXT, period_type TEXT, district INTEGER, metadata JSONB,
+                is_active BOOLEAN DEFAULT TRUE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE time_series_data (
+                id SERIAL PRIMARY KEY, chart_id INTEGER REFERENCES time_series_metadata(chart_id),
+                time_period DATE, numeric_value FLOAT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # 10 runs, a month apart, of 5 groups each; only the latest run is active
+        cursor.execute("""
+            INSERT INTO anomalies (object_type, object_id, object_name, group_field_name, group_value, period_type,
+                                   district, metadata, recent_data, is_active, created_at)
+            SELECT 'dashboard_metric', '1', 'Calls', 'category', 'g' || g, 'month', 0,
+                   jsonb_build_object('object_name', 'Calls', 'run', run), jsonb_build_object('v', g * run),
+                   run = 10, now() - ((10 - run) || ' months')::interval
+            FROM generate_series(1, 10) AS run, generate_series(1, 5) AS g
+        """)
+        # The same metric charted whole and by category: two series, each keeping its own generations
+        cursor.execute("""
+            INSERT INTO time_series_metadata (object_type, object_id, object_name, field_name, group_field,
+                                              period_type, district, metadata, is_active, created_at)
+            SELECT 'dashboard_metric', '1', 'Calls', 'value', group_field, 'month', 0, '{"same": true}', run = 10,
+                   now() - ((10 - run) || ' months')::interval
+            FROM generate_series(1, 10) AS run, (VALUES (NULL), ('category')) AS g(group_field)
+        """)
+        cursor.execute("""
+            INSERT INTO time_series_data (chart_id, time_period, numeric_value, created_at)
+            SELECT chart_id, date '2024-01-01' + p, p, created_at FROM time_series_metadata, generate_series(0, 11) AS p
+        """)
+        connection.commit()
+
+        result = run_retention(connection, generations=2, mode="archive", batch_size=7, archive_months=0, vacuum=False)
+        assert result["tables"]["anomalies"]["rows"] == 35
+        assert result["tables"]["time_series_metadata"]["rows"] == 14
+        assert result["tables"]["time_series_data"]["rows"] == 168
+        # Archiving moves bytes; nothing is freed until partitions are dropped
+        assert result["bytes_archived"] > 0 and result["bytes_freed"] == 0
+        assert result["tables"]["anomalies"]["bytes_deleted"] == 0
+
+        cursor.execute("SELECT count(*) FROM anomalies")
+        assert cursor.fetchone()[0] == 15
+        cursor.execute("SELECT count(*) FROM anomalies_archive")
+        assert cursor.fetchone()[0] == 35
+        # One blob per anomaly run and a single blob shared by every chart version
+        cursor.execute("SELECT count(*) FROM metadata_blobs")
+        assert cursor.fetchone()[0] == 7 + 1
+        cursor.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = 'anomalies_archive'::regclass")
+        assert cursor.fetchone()[0] == 7 + 1
+
+        cursor.execute("SELECT min(id) FROM anomalies_archive")
+        archived = get_archived_row(connection, "anomalies", cursor.fetchone()[0])
+        assert archived["metadata"]["run"] == 1 and "metadata_hash" not in archived
+
+        # Archive partitions past the retention window are dropped whole
+        dropped = drop_expired_partitions(connection, "anomalies_archive", months=6)
+        assert dropped["partitions"] >= 3
+
+        report = retention_report(connection)
+        assert report["last_run"] and report["tables"]["anomalies"]["archive_mb"] > 0
+        assert report["reclaimed_mb_total"] == 0.0
+
+        # A second run finds nothing left to move
+        again = run_retention(connection, generations=2, mode="archive", archive_months=0, vacuum=False)
+        assert again["tables"]["anomalies"]["rows"] == 0
+    finally:
+        connection.rollback()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    test_doomed_query_ranks_inactive_versions_per_series()
+    test_move_query_archives_with_blob_hash()
+    test_compaction_keeps_generations_and_archives_the_rest()
+    print("All retention tests passed")
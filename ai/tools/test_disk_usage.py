@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for the cached disk usage accounting.
+
+Builds small directory trees in a temporary directory, so it needs nothing
+but the filesystem.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import disk_usage
+from tools.disk_usage import (
+    enforce_quota, ensure_scanned, poll_root, record_delete, record_write, register_root, remove_files,
+    tracked_files, usage
+)
+
+
+def _write(path, size, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def _tree():
+    base = tempfile.mkdtemp(prefix="disk_usage_test_")
+    for district in range(3):
+        for metric in range(4):
+            _write(os.path.join(base, "monthly", str(district), f"{metric}.md"), 100)
+    _write(os.path.join(base, "dashboard", "0", "top_level.json"), 50)
+    return base
+
+
+def _forget(name, base):
+    disk_usage._roots.pop(name, None)
+    disk_usage._scan_locks.pop(name, None)
+    shutil.rmtree(base, ignore_errors=True)
+
+
+def test_write_paths_update_counts_incrementally():
+    base = _tree()
+    try:
+        register_root("test_output", base)
+        assert usage("test_output") is None
+        initial = ensure_scanned("test_output")
+        assert (initial["bytes"], initial["files"]) == (1250, 13)
+        assert initial["directories"]["monthly"] == {"bytes": 1200, "files": 12}
+
+        # A new artifact and an overwrite that grows an existing one
+        record_write(_write(os.path.join(base, "annual", "0", "1.html"), 300))
+        record_write(_write(os.path.join(base, "monthly", "0", "0.md"), 150))
+        current = usage("test_output")
+        assert (current["bytes"], current["files"]) == (1600, 14)
+        assert current["directories"]["annual"] == {"bytes": 300, "files": 1}
+
+        deleted, freed = remove_files([os.path.join(base, "monthly", "1", "2.md")])
+        assert (deleted, freed) == (1, 100)
+        os.remove(os.path.join(base, "monthly", "1", "3.md"))
+        record_delete(os.path.join(base, "monthly", "1", "3.md"))
+        assert usage("test_output")["bytes"] == 1400 and usage("test_output")["files"] == 12
+
+        # Writes outside any registered root are ignored
+        record_write(__file__)
+        assert usage("test_output")["files"] == 12
+    finally:
+        _forget("test_output", base)
+
+
+def test_poll_picks_up_changes_from_other_writers():
+    base = _tree()
+    try:
+        register_root("test_poll", base)
+        ensure_scanned("test_poll")
+        assert poll_root("test_poll") == 0
+
+        # Changes made without record_write, as a subprocess would
+        _write(os.path.join(base, "monthly", "2", "9.md"), 70)
+        _write(os.path.join(base, "weekly", "report.json"), 30)
+        os.remove(os.path.join(base, "monthly", "0", "1.md"))
+        shutil.rmtree(os.path.join(base, "dashboard"))
+
+        assert poll_root("test_poll") == 4
+        current = usage("test_poll")
+        assert (current["bytes"], current["files"]) == (1200 + 70 + 30 - 100, 13)
+        assert "dashboard" not in current["directories"]
+        assert sorted(os.path.basename(p) for p, _, _ in tracked_files("test_poll", under=os.path.join(base, "weekly"))) \
+            == ["report.json"]
+    finally:
+        _forget("test_poll", base)
+
+
+def test_quota_deletes_oldest_eligible_files():
+    base = _tree()
+    try:
+        for i in range(5):
+            _write(os.path.join(base, "annual", f"old_{i}.png"), 200, mtime=1_000_000 + i)
+        _write(os.path.join(base, "annual", "keep.csv"), 200, mtime=900_000)
+        _write(os.path.join(base, "dashboard", "0", "old.json"), 200, mtime=800_000)
+
+        register_root("output", base, quota_mb=0, cleanup_filter=disk_usage._is_output_artifact)
+        total = ensure_scanned("output")["bytes"]
+        assert total == 1250 + 5 * 200 + 200 + 200
+        assert enforce_quota("output") == {"deleted": 0, "bytes_freed": 0}
+
+        # A quota 1000 bytes short: cleanup goes 10% below it, oldest artifacts first
+        disk_usage._roots["output"].quota_bytes = total - 1000
+        result = enforce_quota("output")
+        assert result == {"deleted": 7, "bytes_freed": 1000 + 200}
+        remaining = os.listdir(os.path.join(base, "annual"))
+        assert sorted(remaining) == ["keep.csv"]
+        assert os.path.exists(os.path.join(base, "dashboard", "0", "old.json"))
+        assert not usage("output")["over_quota"]
+    finally:
+        _forget("output", base)
+
+
+def test_rescan_sees_files_written_since_the_last_poll():
+    base = _tree()
+    try:
+        register_root("test_rescan", base)
+        ensure_scanned("test_rescan")
+        # Written by another process: not in the index until the next poll
+        late = _write(os.path.join(base, "monthly", "0", "late.html"), 10)
+        is_html = lambda path: path.endswith(".html")
+        assert tracked_files("test_rescan", is_html) == []
+        assert [p for p, _, _ in tracked_files("test_rescan", is_html, rescan=True)] == [late]
+        assert remove_files(p for p, _, _ in tracked_files("test_rescan", is_html, rescan=True)) == (1, 10)
+        assert not os.path.exists(late)
+    finally:
+        _forget("test_rescan", base)
+
+
+if __name__ == "__main__":
+    test_write_paths_update_counts_incrementally()
+    test_poll_picks_up_changes_from_other_writers()
+    test_quota_deletes_oldest_eligible_files()
+    test_rescan_sees_files_written_since_the_last_poll()
+    print("All disk usage tests passed")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test script for the Datawrapper chart registry against the local fake server.
+"""
+
+import os
+import sys
+import time
+import tempfile
+from unittest import mock
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.fake_datawrapper import FakeDatawrapperServer
+from tools import dw_registry
+from tools.dw_registry import ChartRegistry, publish_chart, publish_many
+
+CUSTOMIZATION = {"metadata": {"axes": {"keys": "time_period", "values": "numeric_value"}}}
+CSV_DATA = "time_period,numeric_value\n2025-01-31,3.0\n2025-02-28,4.0"
+
+
+def _run_with_fake_server(test):
+    with FakeDatawrapperServer() as server, tempfile.TemporaryDirectory() as temp_dir, \
+            mock.patch.dict(os.environ, {"DATAWRAPPER_API_BASE_URL": server.base_url, "DATAWRAPPER_API_KEY": "test-key"}):
+        registry = ChartRegistry(os.path.join(temp_dir, "registry.json"))
+        test(server, registry)
+
+
+def test_new_chart_then_reuse():
+    """A new chart takes create/upload/update/publish; an identical one takes no requests."""
+    def check(server, registry):
+        url = publish_chart("time_series:1:0:month", "Metric 1", CSV_DATA, CUSTOMIZATION, registry=registry)
+        assert url and url.endswith("/1/")
+        assert [method for method, _ in server.requests] == ["POST", "PUT", "PATCH", "POST"]
+
+        server.reset_requests()
+        assert publish_chart("time_series:1:0:month", "Metric 1", CSV_DATA, CUSTOMIZATION, registry=registry) == url
+        assert server.requests == []
+
+        # The registry survives a reload from disk
+        reloaded = ChartRegistry(registry.path)
+        assert publish_chart("time_series:1:0:month", "Metric 1", CSV_DATA, CUSTOMIZATION, registry=reloaded) == url
+        assert server.requests == []
+    _run_with_fake_server(check)
+
+
+def test_changed_data_only_uploads_and_republishes():
+    """A chart whose data changed keeps its Datawrapper chart and only re-uploads data."""
+    def check(server, registry):
+        publish_chart("time_series:2:0:month", "Metric 2", CSV_DATA, CUSTOMIZATION, registry=registry)
+        chart_count = len(server.charts)
+        server.reset_requests()
+
+        url = publish_chart("time_series:2:0:month", "Metric 2", CSV_DATA + "\n2025-03-31,5.0", CUSTOMIZATION, registry=registry)
+        assert url.endswith("/2/")
+        assert server.requests[0][0] == "PUT" and server.requests[1][0] == "POST"
+        assert len(server.requests) == 2
+        assert len(server.charts) == chart_count
+    _run_with_fake_server(check)
+
+
+def test_failed_calls_are_not_recorded():
+    """A failed upload or publish leaves the registry as it was, so the next run retries."""
+    def check(server, registry):
+        key = "time_series:3:0:month"
+        server.failures.add(("PUT", "/charts/fake00001/data"))
+        assert publish_chart(key, "Metric 3", CSV_DATA, CUSTOMIZATION, registry=registry) is None
+        assert registry.get(key) is None
+
+        server.failures.clear()
+        url = publish_chart(key, "Metric 3", CSV_DATA, CUSTOMIZATION, registry=registry)
+        assert url
+        recorded = dict(registry.get(key))
+
+        server.failures.add(("POST", f"/charts/{recorded['chart_id']}/publish"))
+        assert publish_chart(key, "Metric 3", CSV_DATA + "\n2025-03-31,5.0", CUSTOMIZATION, registry=registry) is None
+        assert registry.get(key) == recorded
+    _run_with_fake_server(check)
+
+
+def test_identical_content_under_different_keys_gets_its_own_chart():
+    """Two keys with the same data and config are never aliased to one chart."""
+    def check(server, registry):
+        first = publish_chart("time_series:4:0:month", "Metric", CSV_DATA, CUSTOMIZATION, registry=registry)
+        second = publish_chart("time_series:5:0:month", "Metric", CSV_DATA, CUSTOMIZATION, registry=registry)
+        assert first and second and first != second
+        assert registry.get("time_series:4:0:month")["chart_id"] != registry.get("time_series:5:0:month")["chart_id"]
+        assert len(server.charts) == 2
+    _run_with_fake_server(check)
+
+
+def test_publish_many_runs_concurrently():
+    """Many charts publish under the rate limiter and all get URLs."""
+    def check(server, registry):
+        tasks = {
+            i: (lambda i=i: publish_chart(f"time_series:{i}:0:month", f"Metric {i}", f"{CSV_DATA}\n2025-03-31,{i}", CUSTOMIZATION, registry=registry))
+            for i in range(10)
+        }
+        results = publish_many(tasks, max_workers=5)
+        assert all(results.values())
+        assert len(server.charts) == 10
+    original_limiter = dw_registry._rate_limiter
+    dw_registry._rate_limiter = dw_registry.RateLimiter(0)
+    try:
+        _run_with_fake_server(check)
+    finally:
+        dw_registry._rate_limiter = original_limiter
+
+
+def test_rate_limiter_spaces_requests():
+    """The token bucket allows a burst, then spaces out further acquisitions."""
+    limiter = dw_registry.RateLimiter(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - started >= 0.15
+
+
+if __name__ == "__main__":
+    test_new_chart_then_reuse()
+    test_changed_data_only_uploads_and_republishes()
+    test_failed_calls_are_not_recorded()
+    test_identical_content_under_different_keys_gets_its_own_chart()
+    test_publish_many_runs_concurrently()
+    test_rate_limiter_spaces_requests()
+    print("All Datawrapper registry tests passed")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for the concurrent eval runner.
+
+Uses a minimal stand-in for the Swarm client whose run() loop calls
+get_chat_completion and handle_tool_calls the way Swarm does, so it runs
+without Swarm or a model.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.eval_runner import compare_runs, load_run, model_cost, parse_model_prices, run_suite
+
+
+def set_dataset(context_variables, endpoint=None):
+    time.sleep(0.05)
+    return {"status": "success", "endpoint": endpoint}
+
+
+class FakeSwarm:
+    """Replies with a set_dataset call when the query mentions a dataset, then with text."""
+
+    def __init__(self, model="gpt-4o-2024-08-06", delay=0.2, prompt_tokens=1000):
+        self.model = model
+        self.delay = delay
+        self.prompt_tokens = prompt_tokens
+
+    def get_chat_completion(self, agent, history, context_variables, model_override, stream, debug):
+        time.sleep(self.delay)
+        wants_data = "dataset" in history[0]["content"] and not any(m["role"] == "tool" for m in history)
+        tool_calls = [{"id": "call_1", "type": "function",
+                       "function": {"name": "set_dataset", "arguments": json.dumps({"endpoint": "abc"})}}] \
+            if wants_data else None
+        message = {"role": "assistant", "content": None if tool_calls else "Done.", "tool_calls": tool_calls}
+        return SimpleNamespace(model=model_override or self.model, message=message,
+                               usage=SimpleNamespace(prompt_tokens=self.prompt_tokens, completion_tokens=50))
+
+    def handle_tool_calls(self, tool_calls, functions, context_variables, debug):
+        assert tool_calls == []
+        return SimpleNamespace(messages=[], agent=None, context_variables={})
+
+    def handle_function_result(self, result, debug):
+        return SimpleNamespace(value=json.dumps(result), agent=None, context_variables={})
+
+    def run(self, agent, messages, context_variables=None, model_override=None, max_turns=5, **kwargs):
+        history = list(messages)
+        start = len(history)
+        for _ in range(max_turns):
+            completion = self.get_chat_completion(agent, history, context_variables, model_override, False, False)
+            history.append(completion.message)
+            if not completion.message["tool_calls"]:
+                break
+            calls = [SimpleNamespace(id=c["id"], function=SimpleNamespace(**c["function"]))
+                     for c in completion.message["tool_calls"]]
+            history.extend(self.handle_tool_calls(calls, agent.functions, context_variables, False).messages)
+        return SimpleNamespace(messages=history[start:], agent=agent, context_variables=context_variables)
+
+
+AGENT = SimpleNamespace(name="Analyst", model="gpt-4o", instructions="Be brief.", functions=[set_dataset])
+SUITE = [{"id": f"data_{i}", "query": f"Set the dataset for case {i}", "expect_tools": ["set_dataset"]}
+         for i in range(3)] + [{"id": "chat", "query": "Hello there", "forbid_tools": ["set_dataset"]}]
+
+
+def test_suite_runs_concurrently_with_accounting():
+    base = tempfile.mkdtemp(prefix="eval_runner_test_")
+    try:
+        started = time.perf_counter()
+        result = run_suite(AGENT, SUITE, client=FakeSwarm(), workers=4, results_dir=base, label="unit")
+        # Four cases of up to two 0.2s model turns each finish in about one case's time
+        assert time.perf_counter() - started < 0.9
+
+        summary = result["summary"]
+        assert (summary["cases"], summary["passed"], summary["errors"]) == (4, 4, 0)
+        assert summary["turns"] == 7 and summary["prompt_tokens"] == 7000
+
+        header, rows = load_run(result["path"])
+        assert header["label"] == "unit" and header["summary"] == summary
+        data = next(row for row in rows if row["case_id"] == "data_0")
+        assert data["tools"] == ["set_dataset"] and data["turns"] == 2
+        assert data["model_calls"][0]["latency_ms"] >= 190 and data["model"] == "gpt-4o-2024-08-06"
+        assert [call["tool"] for call in data["tool_calls"]] == ["set_dataset"]
+        assert data["tool_calls"][0]["latency_ms"] >= 40
+        assert data["cost_usd"] == round(2 * model_cost("gpt-4o", 1000, 50), 6)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def test_comparison_flags_regressions():
+    assert parse_model_prices("custom=1/2, bad=x,gpt-4o=3/12") == {"custom": (1.0, 2.0), "gpt-4o": (3.0, 12.0)}
+    assert model_cost("gpt-4o-mini-2024-07-18", 1_000_000, 0) == 0.15
+    assert model_cost("unknown-model", 10, 10) is None
+
+    base = tempfile.mkdtemp(prefix="eval_runner_test_")
+    try:
+        baseline = run_suite(AGENT, SUITE, client=FakeSwarm(delay=0.05), results_dir=base)
+        same = compare_runs(baseline["rows"], baseline["rows"])
+        assert same["regressions"] == [] and same["changes"]["prompt_tokens"] == 0
+
+        # Longer instructions: more prompt tokens per call, slower calls
+        candidate = run_suite(AGENT, SUITE, client=FakeSwarm(delay=0.15, prompt_tokens=1500), results_dir=base,
+                              run_format="jsonl")
+        comparison = compare_runs(*(load_run(path)[1] for path in (baseline["path"], candidate["path"])))
+        assert comparison["changes"]["prompt_tokens"] == 0.5
+        flagged = " ".join(comparison["regressions"])
+        assert "prompt_tokens" in flagged and "cost_usd" in flagged and "wall_ms_p50" in flagged
+        assert comparison["cases"]["chat"]["tokens"] == [1050, 1550]
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_suite_runs_concurrently_with_accounting()
+    test_comparison_flags_regressions()
+    print("All eval runner tests passed")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for the prebuilt metric-change explanation bundles.
+
+Builds bundles from a temporary output/dashboard tree with stand-ins for the
+documentation search and the anomaly lookup, so it runs without Qdrant or
+PostgreSQL.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.explanation_bundle import (
+    BundleStore, build_explanation_bundles, bundle_key, bundle_prompt_context, column_metadata, doc_snippets,
+    metric_values, top_groups
+)
+
+QUERIES = {"crime": {"Crime": {"queries": {
+    "Total Police Incidents": {"id": 1, "endpoint": "wg3w-h783"},
+    "Arrests": {"id": 2, "endpoint": "missing-set"},
+}}}}
+
+
+def _metric_file(base, district, metric_id, this_year, last_year):
+    path = os.path.join(base, str(district), f"{metric_id}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    trend = {f"2024-{m:02d}-01": m * 10 for m in range(1, 13)}
+    trend.update({"2025-01-01": 130, "2025-02-01": 140})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"category": "Crime", "metric_name": "Total Police Incidents", "metric_id": "total_incidents",
+                   "thisYear": this_year, "lastYear": last_year, "lastDataDate": "2025-02-28",
+                   "queries": {"ytd_query": "SELECT ..."}, "trend_data": trend}, f)
+
+
+def test_bundle_parts_are_compact():
+    values = metric_values({"metric_name": "Calls", "thisYear": 120, "lastYear": 100, "lastDataDate": "2025-02-28",
+                            "queries": {"q": "..."}, "trend_data": {f"2024-{m:02d}-01": m for m in range(1, 13)}})
+    assert values["delta"] == 20 and values["percent_change"] == 20.0 and "queries" not in values
+    assert list(values["trend_tail"])[-1] == "2024-12-01"
+
+    rows = [{"id": i, "group_field_name": "district", "group_value": f"g{i}", "difference": d,
+             "comparison_mean": 10, "recent_mean": None if d is None else 10 + d, "out_of_bounds": False}
+            for i, d in enumerate([1.0, -9.0, 4.0, None, 7.5])]
+    assert [g["group_value"] for g in top_groups(rows, limit=3)] == ["g1", "g4", "g2"]
+
+    docs = {"results": [("Police Incidents", "word " * 500, "wg3w-h783", "a, b", ["a", "b"])]}
+    snippet = doc_snippets(docs)[0]
+    assert snippet["endpoint"] == "wg3w-h783" and len(snippet["text"]) <= 403
+
+    assert bundle_key("12.json", "citywide", None) == ("12", 0, "month")
+    assert bundle_key(3, "3", "year") == ("3", 3, "year")
+
+
+def test_build_and_read_bundles():
+    base = tempfile.mkdtemp(prefix="explanation_bundle_test_")
+    store = BundleStore(os.path.join(base, "bundles.sqlite"))
+    try:
+        dashboard_dir = os.path.join(base, "dashboard")
+        _metric_file(dashboard_dir, 0, 1, 1200, 1000)
+        _metric_file(dashboard_dir, 5, 1, 90, 100)
+        doc_calls, anomaly_calls = [], []
+
+        def docs_fn(metric_name, period_type):
+            doc_calls.append((metric_name, period_type))
+            return {"results": [("Police Incidents", "Incident reports", "wg3w-h783")]}
+
+        def anomalies_fn(metric_id, district, period_type):
+            anomaly_calls.append((metric_id, district, period_type))
+            return [{"id": 7, "group_field_name": "category", "group_value": "Larceny", "difference": 42.0,
+                     "comparison_mean": 100.0, "recent_mean": 142.0, "out_of_bounds": True}]
+
+        result = build_explanation_bundles(QUERIES, dashboard_dir, period_types=["month", "year"],
+                                           docs_fn=docs_fn, anomalies_fn=anomalies_fn, store=store)
+        assert result["bundles"] == 4 and result["metrics"] == 2
+        # Docs are searched once per metric and period type, not per district
+        assert len(doc_calls) == 4 and len(anomaly_calls) == 4
+
+        bundle = store.get("1.json", "5", "year")
+        assert bundle["metric"]["this_year"] == 90 and bundle["metric"]["percent_change"] == -10.0
+        assert bundle["top_groups"][0]["group_value"] == "Larceny"
+        assert bundle["docs"][0]["title"] == "Police Incidents"
+        assert bundle["columns"] == column_metadata("wg3w-h783")
+        assert store.get("1", "all", "month")["district"] == 0
+        assert store.get("2", 0, "month") is None
+
+        context = json.loads(bundle_prompt_context(bundle))
+        assert "built_at" not in context and context["endpoint"] == "wg3w-h783"
+    finally:
+        store.close()
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_bundle_parts_are_compact()
+    test_build_and_read_bundles()
+    print("All explanation bundle tests passed")
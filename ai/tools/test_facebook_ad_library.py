@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming Facebook Ad Library crawl, against a local stub
+of the ads_archive endpoint that serves three pages per search term.
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.facebook_ad_library import crawl_ads, load_ads_frame, export_ads_json, CHECKPOINT_FILE
+
+PAGES = 3
+ADS_PER_PAGE = 2
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        term, page = query.get("search_terms"), int(query.get("after", 0))
+        with self.server.lock:
+            self.server.requests.append((term, page, query.get("access_token")))
+            failing = (term, page) in self.server.failing
+        if failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        payload = {"data": [{"id": f"{term}-{page}-{i}", "page_name": term} for i in range(ADS_PER_PAGE)]}
+        if page + 1 < PAGES:
+            payload["paging"] = {"next": f"{self.server.url}/ads_archive?search_terms={term}&limit=2"
+                                         f"&after={page + 1}&access_token={query.get('access_token')}"}
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.lock = threading.Lock()
+    server.requests, server.failing = [], set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_terms_stream_to_disk_concurrently():
+    server = _server()
+    output_dir = tempfile.mkdtemp(prefix="fb_crawl_")
+    try:
+        summary = crawl_ads(["housing", "transit", "parks"], output_dir, access_token="secret",
+                            base_url=f"{server.url}/ads_archive", max_workers=3)
+        assert all(state["done"] and state["ads"] == PAGES * ADS_PER_PAGE for state in summary.values())
+        assert len(server.requests) == 3 * PAGES
+        assert all(token == "secret" for _, _, token in server.requests)
+        # The token is never written to disk
+        with open(os.path.join(output_dir, CHECKPOINT_FILE)) as f:
+            assert "secret" not in f.read()
+
+        frame = load_ads_frame(output_dir, chunk_rows=4)
+        assert len(frame) == 18 and frame["id"].is_unique
+        assert sorted(frame["search_terms"].unique()) == ["housing", "parks", "transit"]
+        assert export_ads_json(output_dir, os.path.join(output_dir, "ads.json"), ["parks"]) == 6
+
+        # A completed crawl is not fetched again
+        crawl_ads(["housing"], output_dir, access_token="secret", base_url=f"{server.url}/ads_archive")
+        assert len(server.requests) == 3 * PAGES
+    finally:
+        server.shutdown()
+
+
+def test_interrupted_crawl_resumes_from_checkpoint():
+    server = _server()
+    server.failing.add(("transit", 2))
+    output_dir = tempfile.mkdtemp(prefix="fb_crawl_")
+    try:
+        summary = crawl_ads(["housing", "transit"], output_dir, access_token="secret",
+                            base_url=f"{server.url}/ads_archive", retries=1, backoff=0)
+        assert summary["housing"]["done"] and "error" not in summary["housing"]
+        assert "error" in summary["transit"] and summary["transit"]["pages"] == 2
+        assert len(load_ads_frame(output_dir, ["transit"])) == 4
+
+        server.failing.clear()
+        del server.requests[:]
+        summary = crawl_ads(["housing", "transit"], output_dir, access_token="secret",
+                            base_url=f"{server.url}/ads_archive")
+        # Only the missing page was requested, with the checkpointed cursor
+        assert server.requests == [("transit", 2, "secret")]
+        assert summary["transit"]["done"] and summary["transit"]["ads"] == PAGES * ADS_PER_PAGE
+        frame = load_ads_frame(output_dir)
+        assert len(frame) == 12 and frame["id"].is_unique
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_terms_stream_to_disk_concurrently()
+    test_interrupted_crawl_resumes_from_checkpoint()
+    print("All Facebook Ad Library tests passed")
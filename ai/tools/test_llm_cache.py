@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed LLM response cache.
+"""
+
+import os
+import sys
+import time
+import tempfile
+from types import SimpleNamespace
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.llm_cache import LLMCache, cached_chat_completion, cached_swarm_run
+from tools.stub_llm import StubSwarmClient
+
+
+class FakeCompletions:
+    """Records chat.completions.create calls and answers with a dict-shaped completion."""
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return {
+            "model": kwargs["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"answer {len(self.calls)}"}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+        }
+
+
+def _fake_openai_client():
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+
+def _request(content="Summarize", temperature=0.1):
+    return {
+        "model": "gpt-4o",
+        "messages": [{"role": "system", "content": "You are terse."}, {"role": "user", "content": content}],
+        "temperature": temperature
+    }
+
+
+def test_chat_completion_hit_and_savings():
+    """A repeated request is answered from the cache and its tokens count as saved."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = LLMCache(os.path.join(temp_dir, "cache.sqlite"))
+        client = _fake_openai_client()
+
+        first = cached_chat_completion(client, cache=cache, **_request())
+        second = cached_chat_completion(client, cache=cache, **_request())
+
+        assert len(client.chat.completions.calls) == 1
+        assert first["choices"][0]["message"]["content"] == second.choices[0].message.content == "answer 1"
+        stats = cache.get_stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1
+        assert stats["saved_prompt_tokens"] == 100 and stats["saved_completion_tokens"] == 20
+
+
+def test_key_covers_prompt_and_temperature():
+    """Changing the prompt or the temperature is a different request."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = LLMCache(os.path.join(temp_dir, "cache.sqlite"))
+        client = _fake_openai_client()
+
+        cached_chat_completion(client, cache=cache, **_request())
+        cached_chat_completion(client, cache=cache, **_request(content="Summarize again"))
+        cached_chat_completion(client, cache=cache, **_request(temperature=0.7))
+        assert len(client.chat.completions.calls) == 3
+
+
+def test_bypass_refreshes_entry():
+    """bypass=True calls the model and replaces the stored answer."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = LLMCache(os.path.join(temp_dir, "cache.sqlite"))
+        client = _fake_openai_client()
+
+        cached_chat_completion(client, cache=cache, **_request())
+        cached_chat_completion(client, cache=cache, bypass=True, **_request())
+        third = cached_chat_completion(client, cache=cache, **_request())
+
+        assert len(client.chat.completions.calls) == 2
+        assert third.choices[0].message.content == "answer 2"
+        assert cache.get_stats()["bypassed"] == 1
+
+
+def test_ttl_and_size_bound():
+    """Expired entries miss, and the entry limit evicts the least recently used."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = LLMCache(os.path.join(temp_dir, "cache.sqlite"), max_entries=2)
+        cache.put("a", {"v": 1})
+        cache.put("b", {"v": 2})
+        time.sleep(0.01)
+        cache.get("a")
+        cache.put("c", {"v": 3})
+        assert cache.get("b") is None
+        assert cache.get("a") == {"v": 1}
+        assert cache.get_stats()["entries"] == 2
+
+        expiring = LLMCache(os.path.join(temp_dir, "cache.sqlite"), ttl=-1)
+        assert expiring.get("a") is None
+
+
+def test_swarm_run_cached_with_tool_schema():
+    """Agent runs are cached on instructions, tools and messages."""
+    def lookup(dataset_id: str):
+        """Look up a dataset."""
+        return dataset_id
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = LLMCache(os.path.join(temp_dir, "cache.sqlite"))
+        client = StubSwarmClient(responder=lambda prompt: '{"answer": 1}')
+        agent = SimpleNamespace(name="Analyst", model="gpt-4o", instructions="Analyze.", functions=[])
+        messages = [{"role": "user", "content": "Describe this dataset"}]
+
+        cached_swarm_run(client, agent, messages, cache=cache)
+        response = cached_swarm_run(client, agent, messages, cache=cache)
+        assert len(client.calls) == 1
+        assert response.messages[-1]["content"] == '{"answer": 1}'
+
+        agent_with_tools = SimpleNamespace(name="Analyst", model="gpt-4o", instructions="Analyze.", functions=[lookup])
+        cached_swarm_run(client, agent_with_tools, messages, cache=cache)
+        assert len(client.calls) == 2
+
+
+if __name__ == "__main__":
+    test_chat_completion_hit_and_savings()
+    test_key_covers_prompt_and_temperature()
+    test_bypass_refreshes_entry()
+    test_ttl_and_size_bound()
+    test_swarm_run_cached_with_tool_schema()
+    print("All LLM cache tests passed")
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Test script for the hot-path logging helpers, with a benchmark of the
+grouping and filtering paths at INFO.
+
+Run directly to print the benchmark:
+    python tools/test_log_utils.py
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import gzip
+import logging
+import tempfile
+from unittest import mock
+
+import pandas as pd
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import log_utils
+from tools.log_utils import (
+    IssueCounter, JsonFormatter, configure_logging, GzipRotatingFileHandler, log_event, log_segments, parse_module_levels,
+    remove_expired_logs, remove_handlers, rotate_oversized_logs, rotating_file_handler, summarize, tail_log
+)
+from tools.anomaly_detection import group_data_by_field_and_date, filter_data_by_date_and_conditions
+
+
+class ListHandler(logging.Handler):
+    """Keeps formatted records so tests can count and inspect them."""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def _capture(name, level=logging.INFO):
+    logger = logging.getLogger(name)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger, handler
+
+
+def _records(count, bad_every=2):
+    """Rows shaped like the portal returns them; every bad_every-th row has no date."""
+    return [
+        {
+            "month": None if i % bad_every == 0 else f"2024-{i % 12 + 1:02d}",
+            "incident_category": ["Assault", "Fraud", "Theft"][i % 3],
+            "value": str(i % 7),
+            "description": "x" * 200
+        }
+        for i in range(count)
+    ]
+
+
+class Explodes:
+    def __str__(self):
+        raise AssertionError("rendered a disabled log message")
+
+    __repr__ = __str__
+
+
+def test_summarize_is_lazy_and_bounded():
+    df = pd.DataFrame({"a": range(100_000), "b": ["text"] * 100_000})
+    text = str(summarize({"dataset": df, "chart_title": "Calls", "rows": list(range(500))}))
+    assert "<DataFrame 100000x2 columns=['a', 'b']>" in text
+    assert "<list len=500>" in text
+    assert len(text) < 200
+
+
+def test_disabled_level_builds_nothing():
+    logger, handler = _capture("test_log_utils.disabled", logging.WARNING)
+    log_event(logger, logging.INFO, "chart.start", context=Explodes())
+    logger.info("context: %s", summarize(Explodes()))
+    assert handler.lines == []
+
+
+def test_issue_counter_samples_then_summarizes():
+    logger, handler = _capture("test_log_utils.issues")
+    issues = IssueCounter(logger, "test_issue_counter", sample_limit=2, window=60)
+    for i in range(10_000):
+        issues.add("missing_date", {"id": i})
+    issues.add("bad_value", {"id": -1})
+    counts = issues.flush()
+
+    assert counts == {"missing_date": 10_000, "bad_value": 1}
+    # Two samples of missing_date, one of bad_value, one summary
+    assert len(handler.lines) == 4
+    assert "total=10001" in handler.lines[-1]
+
+    # The sample budget is shared across calls within the window
+    again = IssueCounter(logger, "test_issue_counter", sample_limit=2, window=60)
+    again.add("missing_date", {"id": 0})
+    again.flush()
+    assert len(handler.lines) == 5
+
+
+def test_grouping_logs_counts_not_records():
+    """50k rows with 25k bad dates produce a handful of lines, not one per row."""
+    _, handler = _capture("tools.anomaly_detection")
+    grouped = group_data_by_field_and_date(_records(50_000), "incident_category", "value", "month")
+    assert set(grouped) == {"Assault", "Fraud", "Theft"}
+    assert len(handler.lines) <= 6
+    assert any("missing_date" in line and "25000" in line for line in handler.lines)
+
+    handler.lines.clear()
+    data = [r for r in _records(5_000) if r["month"]]
+    kept = filter_data_by_date_and_conditions(data, [{"field": "incident_category", "operator": "==", "value": "Fraud"}])
+    assert len(kept) == len([r for r in data if r["incident_category"] == "Fraud"])
+    assert len(handler.lines) == 1
+
+
+def test_json_formatter_and_module_levels():
+    record = logging.LogRecord("tools.data_fetcher", logging.INFO, __file__, 1, "soda.fetch.done", None, None)
+    record.event = "soda.fetch.done"
+    record.fields = {"records": 12, "url": "https://data.sfgov.org/resource/x.json"}
+    payload = json.loads(JsonFormatter().format(record))
+    assert payload["event"] == "soda.fetch.done" and payload["records"] == 12
+    assert payload["logger"] == "tools.data_fetcher" and payload["level"] == "INFO"
+
+    levels = parse_module_levels("tools.data_fetcher=warning, tools.genChart=DEBUG,broken,x=LOUD")
+    assert levels == {"tools.data_fetcher": "WARNING", "tools.genChart": "DEBUG"}
+
+    # What the script entry points run once their handlers are attached
+    script_logger = logging.getLogger("test_log_utils.script")
+    handler = logging.StreamHandler(io.StringIO())
+    script_logger.addHandler(handler)
+    try:
+        configure_logging({"test_log_utils.quiet": "WARNING"}, json_format=True, logger=script_logger)
+        assert logging.getLogger("test_log_utils.quiet").level == logging.WARNING
+        assert isinstance(handler.formatter, JsonFormatter)
+    finally:
+        script_logger.removeHandler(handler)
+
+
+def _write_lines(logger, start, count):
+    for i in range(start, start + count):
+        logger.info("line %06d %s", i, "y" * 80)
+
+
+def test_rotation_gzips_and_keeps_backup_count():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "webchat.log")
+        handler = GzipRotatingFileHandler(path, max_bytes=10_000, backup_count=3)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("test_log_utils.rotation")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            _write_lines(logger, 0, 1000)
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+        segments = log_segments(path)
+        assert [os.path.basename(p) for p in segments] == ["webchat.log", "webchat.log.1.gz", "webchat.log.2.gz", "webchat.log.3.gz"]
+        assert os.path.getsize(path) <= 10_000
+        with gzip.open(segments[1], "rt") as f:
+            assert f.readline().startswith("line ")
+
+        # The tail runs across the live file into the newest segment, in order
+        tail = tail_log(path, lines=150)
+        numbers = [int(line.split()[1]) for line in tail["lines"]]
+        assert numbers == list(range(850, 1000))
+        assert 1 < len(tail["segments"]) < len(segments)
+        assert tail_log(path, lines=150, include_rotated=False)["lines"][-1].startswith("line 000999")
+
+
+def test_time_based_rotation():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "analysis.log")
+        handler = GzipRotatingFileHandler(path, max_bytes=0, backup_count=2, rotate_hours=1)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        record = logging.LogRecord("x", logging.INFO, __file__, 1, "hello", None, None)
+        handler.emit(record)
+        handler.opened_at -= 2 * 3600
+        handler.emit(record)
+        handler.close()
+        assert [os.path.basename(p) for p in log_segments(path)] == ["analysis.log", "analysis.log.1.gz"]
+
+
+def test_tail_reads_only_the_end_and_rotates_stray_logs():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "report_text_prompt.log")
+        with open(path, "w") as f:
+            for i in range(200_000):
+                f.write(f"entry {i}\n")
+        assert tail_log(path, lines=3)["lines"] == ["entry 199997", "entry 199998", "entry 199999"]
+
+        rotated = rotate_oversized_logs(temp_dir, max_mb=0.5, backup_count=2)
+        assert rotated == [os.path.abspath(path)]
+        assert os.path.getsize(path) == 0
+        assert tail_log(path, lines=1)["lines"] == ["entry 199999"]
+
+
+def test_handlers_in_two_processes_share_a_file():
+    """A handler whose file another process rotated reopens it instead of writing into the old segment."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "dashboard_metrics.log")
+        handlers = [GzipRotatingFileHandler(path, max_bytes=5_000, backup_count=50) for _ in range(2)]
+        for handler in handlers:
+            handler.setFormatter(logging.Formatter("%(message)s"))
+        try:
+            for i in range(400):
+                handlers[i % 2].emit(logging.LogRecord("x", logging.INFO, __file__, 1, f"line {i:06d} {'z' * 40}", None, None))
+        finally:
+            for handler in handlers:
+                handler.close()
+
+        lines = []
+        for segment in log_segments(path):
+            opener = gzip.open if segment.endswith(".gz") else open
+            with opener(segment, "rt") as f:
+                lines.extend(line.split()[1] for line in f)
+        assert sorted(lines) == [f"{i:06d}" for i in range(400)]
+        assert os.path.getsize(path) <= 5_000
+
+
+def test_records_take_no_lock_until_a_rollover_is_due():
+    """Between file checks, records are written without locking; the lock is taken to roll over."""
+    if log_utils.fcntl is None:
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        handler = GzipRotatingFileHandler(os.path.join(temp_dir, "api.log"), max_bytes=10_000, backup_count=3)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        record = logging.LogRecord("x", logging.INFO, __file__, 1, "z" * 99, None, None)
+        try:
+            with mock.patch.object(log_utils, "LOG_CHECK_SECONDS", 3600), \
+                    mock.patch.object(log_utils.fcntl, "flock", wraps=log_utils.fcntl.flock) as flock:
+                for _ in range(99):
+                    handler.emit(record)
+                # The first record checks the file once: lock and unlock
+                assert flock.call_count == 2
+                handler.emit(record)
+                handler.emit(record)
+                assert flock.call_count == 4
+        finally:
+            handler.close()
+        assert os.path.getsize(os.path.join(temp_dir, "api.log")) == 100
+        assert os.path.exists(os.path.join(temp_dir, "api.log.1.gz"))
+
+
+def test_removed_handlers_close_and_old_logs_expire():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        logger = logging.getLogger("test_log_utils.remove")
+        handler = rotating_file_handler(os.path.join(temp_dir, "metric_analysis.log"))
+        logger.addHandler(handler)
+        remove_handlers(logger)
+        assert handler.shared is None and handler.stream is None
+        assert rotating_file_handler(os.path.join(temp_dir, "metric_analysis.log")) is not handler
+
+        fresh, stale = os.path.join(temp_dir, "app.log"), os.path.join(temp_dir, "app.log.3.gz")
+        for path in (fresh, stale, os.path.join(temp_dir, "old.log")):
+            open(path, "w").close()
+        old = time.time() - 10 * 86400
+        os.utime(stale, (old, old))
+        os.utime(os.path.join(temp_dir, "old.log"), (old, old))
+        removed = remove_expired_logs(temp_dir, max_age_days=7)
+        assert sorted(map(os.path.basename, removed)) == ["app.log.3.gz", "old.log"]
+        assert os.path.exists(fresh)
+
+
+def benchmark(rows=200_000):
+    """Time grouping and filtering at INFO with a real stream handler attached."""
+    logger = logging.getLogger("tools.anomaly_detection")
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    data = _records(rows, bad_every=10)
+    started = time.perf_counter()
+    group_data_by_field_and_date(data, "incident_category", "value", "month")
+    filter_data_by_date_and_conditions([r for r in data if r["month"]],
+                                       [{"field": "incident_category", "operator": "!=", "value": "Fraud"}])
+    elapsed = time.perf_counter() - started
+    print(f"group + filter over {rows:,} rows at INFO: {elapsed:.2f}s, {len(stream.getvalue()):,} bytes of log")
+
+
+if __name__ == "__main__":
+    test_summarize_is_lazy_and_bounded()
+    test_disabled_level_builds_nothing()
+    test_issue_counter_samples_then_summarizes()
+    test_grouping_logs_counts_not_records()
+    test_json_formatter_and_module_levels()
+    test_rotation_gzips_and_keeps_backup_count()
+    test_time_based_rotation()
+    test_tail_reads_only_the_end_and_rotates_stray_logs()
+    test_handlers_in_two_processes_share_a_file()
+    test_records_take_no_lock_until_a_rollover_is_due()
+    test_removed_handlers_close_and_old_logs_expire()
+    print("All log utils tests passed")
+    benchmark()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Test script for the dataset metadata refresher in fetch_metadata.py.
+
+A local stub server plays the Socrata catalog and views APIs: it pages the
+catalog, answers conditional requests with 304 and records how many view
+requests were in flight at once.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Make the ai directory importable so "fetch_metadata" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+import fetch_metadata
+from fetch_metadata import (
+    refresh_metadata, discover_dataset_urls, render_dataset_info, http_cache_path, dataset_urls_path
+)
+
+IDS = [f"ab{i:02d}-cd{i:02d}" for i in range(7)]
+
+
+class StubSocrata:
+    def __init__(self):
+        self.views = {dataset_id: {"id": dataset_id, "name": f"Dataset {dataset_id}", "category": "Test",
+                                   "description": "", "rowsUpdatedAt": 1700000000,
+                                   "columns": [{"name": "A", "fieldName": "a", "dataTypeName": "text", "id": 1}]}
+                      for dataset_id in IDS}
+        self.requests = []
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                with stub.lock:
+                    stub.requests.append((parts.path, self.headers.get("If-None-Match")))
+                if parts.path == "/api/catalog/v1":
+                    query = parse_qs(parts.query)
+                    offset, limit = int(query["offset"][0]), int(query["limit"][0])
+                    results = [{"link": f"https://data.sfgov.org/Test/Dataset/{dataset_id}"}
+                               for dataset_id in sorted(stub.views)[offset:offset + limit]]
+                    return self._json({"results": results, "resultSetSize": len(stub.views)})
+
+                dataset_id = parts.path.rsplit("/", 1)[-1][:-len(".json")]
+                with stub.lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    etag = f'"{hash(json.dumps(stub.views[dataset_id], sort_keys=True))}"'
+                try:
+                    time.sleep(0.05)
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.end_headers()
+                    else:
+                        self._json(stub.views[dataset_id], {"ETag": etag})
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def view_requests(self):
+        with self.lock:
+            requests, self.requests = [r for r in self.requests if r[0].startswith("/api/views/")], []
+        return requests
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_catalog_paging_and_polite_concurrency():
+    stub = StubSocrata()
+    original = fetch_metadata.METADATA_MAX_PER_HOST
+    fetch_metadata.METADATA_MAX_PER_HOST = 2
+    fetch_metadata._host_limits.clear()
+    try:
+        urls = discover_dataset_urls(stub.base_url, page_size=3)
+        assert [u.rsplit("/", 1)[-1] for u in urls] == IDS
+        catalog = [path for path, _ in stub.requests if path == "/api/catalog/v1"]
+        assert len(catalog) == 3  # 3 + 3 + 1
+
+        with tempfile.TemporaryDirectory() as root:
+            tmp = os.path.join(root, "datasets")
+            summary = refresh_metadata(output_dir=tmp, base_url=stub.base_url, max_workers=6)
+            assert summary["written"] == len(IDS) and not summary["failed"]
+            assert 1 < stub.max_in_flight <= 2
+            # The URL list follows the output directory, beside it like the HTTP cache
+            assert dataset_urls_path(tmp) == os.path.join(root, "dataset_urls.json")
+            with open(dataset_urls_path(tmp), encoding="utf-8") as f:
+                assert json.load(f) == urls
+            with open(os.path.join(tmp, f"{IDS[0]}.json"), encoding="utf-8") as f:
+                info = json.load(f)
+            assert info["endpoint"] == IDS[0] and info["url"] == urls[0]
+            assert info["columns"][0]["tableColumnId"] == 1
+            assert info["rows_updated_at"] == "2023-11-14T22:13:20Z"
+    finally:
+        fetch_metadata.METADATA_MAX_PER_HOST = original
+        fetch_metadata._host_limits.clear()
+        stub.close()
+
+
+def test_revalidates_and_rewrites_only_changed_files():
+    stub = StubSocrata()
+    fetch_metadata._host_limits.clear()
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            tmp = os.path.join(root, "datasets")
+            urls = [f"https://data.sfgov.org/Test/Dataset/{dataset_id}" for dataset_id in IDS]
+            assert refresh_metadata(urls, output_dir=tmp, base_url=stub.base_url)["written"] == len(IDS)
+            assert all(etag is None for _, etag in stub.view_requests())
+            # Only dataset files live in the datasets directory; the cache sits beside it
+            assert sorted(os.listdir(tmp)) == sorted(f"{dataset_id}.json" for dataset_id in IDS)
+            assert os.path.dirname(http_cache_path(tmp)) == root
+            with open(http_cache_path(tmp), encoding="utf-8") as f:
+                assert len(json.load(f)) == len(IDS)
+            mtimes = {dataset_id: os.stat(os.path.join(tmp, f"{dataset_id}.json")).st_mtime_ns for dataset_id in IDS}
+
+            # One view changed, one file deleted: everything else is a 304 and left alone
+            stub.views[IDS[1]]["description"] = "Updated"
+            os.remove(os.path.join(tmp, f"{IDS[2]}.json"))
+            summary = refresh_metadata(urls, output_dir=tmp, base_url=stub.base_url)
+            assert (summary["written"], summary["not_modified"]) == (2, len(IDS) - 2)
+            conditional = {path.rsplit("/", 1)[-1]: etag for path, etag in stub.view_requests()}
+            assert conditional[f"{IDS[2]}.json"] is None
+            with open(os.path.join(tmp, f"{IDS[1]}.json"), encoding="utf-8") as f:
+                assert f.read() == render_dataset_info(
+                    fetch_metadata.dataset_info_from_view(stub.views[IDS[1]], urls[1]))
+            for dataset_id in IDS[3:]:
+                assert os.stat(os.path.join(tmp, f"{dataset_id}.json")).st_mtime_ns == mtimes[dataset_id]
+
+            # --force downloads everything but still only rewrites what differs
+            summary = refresh_metadata(urls, output_dir=tmp, base_url=stub.base_url, force=True)
+            assert (summary["written"], summary["unchanged"], summary["not_modified"]) == (0, len(IDS), 0)
+    finally:
+        fetch_metadata._host_limits.clear()
+        stub.close()
+
+
+if __name__ == "__main__":
+    test_catalog_paging_and_polite_concurrency()
+    test_revalidates_and_rewrites_only_changed_files()
+    print("All metadata refresh tests passed")
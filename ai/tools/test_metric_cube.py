@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test script for the daily metric cube query rewrite, slicing and rollups.
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.metric_cube import (
+    build_cube_query, build_cube_slices, cube_dimensions, cube_groupings, merge_cube_slices, rollup, window_total, trend_series, last_data_date,
+    same_day_last_year, ytd_results
+)
+
+QUERY_DATA = {
+    "id": 1,
+    "ytd_query": "SELECT date_trunc_ymd(Report_Datetime) as date, COUNT(*) as value WHERE Report_Datetime >= last_year_start AND Report_Datetime <= current_date GROUP BY date ORDER BY date",
+    "location_fields": [{"fieldName": "supervisor_district"}],
+    "category_fields": [{"fieldName": "incident_category"}, {"fieldName": "supervisor_district"}]
+}
+
+
+def _raw():
+    """Fine-grained rows as the cube query returns them (strings, like the portal)."""
+    rows = []
+    for day in pd.date_range("2024-12-30", "2025-01-09"):
+        for district in ("1", "2"):
+            for category in ("Assault", "Fraud"):
+                rows.append({
+                    "date": day.strftime("%Y-%m-%dT00:00:00.000"),
+                    "value": "2" if category == "Assault" else "1",
+                    "supervisor_district": district,
+                    "incident_category": category
+                })
+    return pd.DataFrame(rows)
+
+
+def test_cube_query_groups_by_all_dimensions():
+    dimensions = cube_dimensions(QUERY_DATA)
+    assert dimensions == ["supervisor_district", "incident_category"]
+
+    cube_query = build_cube_query(QUERY_DATA["ytd_query"], dimensions, "2023-01-01", "2025-01-09")
+    query = cube_query["query"]
+    assert cube_query["aggregation"] == "sum"
+    assert "Report_Datetime >= '2023-01-01'" in query and "Report_Datetime <= '2025-01-09'" in query
+    # A total order, so LIMIT/OFFSET pages neither skip nor repeat rows
+    assert query.endswith("GROUP BY date, supervisor_district, incident_category "
+                          "ORDER BY date, supervisor_district, incident_category")
+    assert "last_year_start" not in query and "current_date" not in query
+
+
+def test_per_field_queries_build_the_same_cube():
+    dimensions = ["supervisor_district", "incident_category", "priority"]
+    assert cube_groupings(dimensions) == [["supervisor_district", "incident_category"], ["supervisor_district", "priority"]]
+    assert cube_groupings(["supervisor_district"]) == [["supervisor_district"]]
+    assert cube_groupings([]) == [[]]
+
+    raw = _raw()
+    raw["priority"] = ["A", "B", "C"] * (len(raw) // 3) + ["A"] * (len(raw) % 3)
+    key = ["district", "field_name", "field_value", "day"]
+    # What the portal returns for each grouping: the fine rows summed over the other fields
+    per_field = []
+    for grouping in cube_groupings(dimensions):
+        frame = raw.assign(value=raw["value"].astype(float)).groupby(["date"] + grouping, as_index=False)["value"].sum()
+        per_field.append(build_cube_slices(frame, 1, grouping))
+    merged = merge_cube_slices(per_field).sort_values(key, ignore_index=True)
+    expected = build_cube_slices(raw, 1, dimensions).sort_values(key, ignore_index=True)
+    pd.testing.assert_frame_equal(merged, expected, check_dtype=False)
+
+
+def test_avg_metrics_store_sum_and_count():
+    ytd_query = "SELECT date_trunc_ymd(received_datetime) as date, AVG(response_minutes) as value WHERE received_datetime >= last_year_start GROUP BY date"
+    cube_query = build_cube_query(ytd_query, [], "2024-01-01", "2025-01-09")
+    assert cube_query["aggregation"] == "avg"
+    assert "SUM(response_minutes) as value, COUNT(response_minutes) as weight" in cube_query["query"]
+
+    raw = pd.DataFrame({"date": ["2025-01-01", "2025-01-02"], "value": ["30", "10"], "weight": ["3", "1"]})
+    cube = build_cube_slices(raw, 10, [])
+    totals = window_total(cube, "2025-01-01", "2025-01-02", aggregation="avg")
+    # Exact weighted mean (40 / 4), not the mean of the daily means
+    assert totals["value"].iloc[0] == 10.0
+
+
+def test_slices_hold_totals_and_marginals():
+    cube = build_cube_slices(_raw(), 1, cube_dimensions(QUERY_DATA))
+
+    citywide_total = cube[(cube["district"] == "0") & (cube["field_name"] == "")]
+    assert len(citywide_total) == 11
+    assert set(citywide_total["value"]) == {6.0}
+
+    by_district = cube[(cube["district"] == "0") & (cube["field_name"] == "supervisor_district")]
+    assert set(by_district["field_value"]) == {"1", "2"}
+
+    district_categories = cube[(cube["district"] == "2") & (cube["field_name"] == "incident_category")]
+    assert set(district_categories["field_value"]) == {"Assault", "Fraud"}
+    # Districts do not break down by district again
+    assert cube[(cube["district"] == "1") & (cube["field_name"] == "supervisor_district")].empty
+    assert last_data_date(cube) == "2025-01-09"
+
+
+def test_rollups_and_trend():
+    cube = build_cube_slices(_raw(), 1, cube_dimensions(QUERY_DATA))
+
+    monthly = rollup(cube, "month")
+    citywide = monthly[(monthly["district"] == "0") & (monthly["field_name"] == "")]
+    assert list(citywide["value"]) == [12.0, 54.0]
+
+    weekly = rollup(cube, "week")
+    january = weekly[(weekly["district"] == "0") & (weekly["field_name"] == "") & (weekly["period_start"] >= "2025-01-01")]
+    # Weeks count from January 1st: Jan 1-7 and Jan 8-9
+    assert list(january["period_start"].dt.strftime("%m-%d")) == ["01-01", "01-08"]
+    assert list(january["value"]) == [42.0, 12.0]
+
+    ytd = window_total(cube, "2025-01-01", "2025-01-09")
+    district_1 = ytd[(ytd["district"] == "1") & (ytd["field_name"] == "")]
+    assert district_1["value"].iloc[0] == 27.0
+
+    trend = trend_series(cube, "2025-01-01", "2025-01-03")
+    assert trend == {"2025-01-01": 6.0, "2025-01-02": 6.0, "2025-01-03": 6.0}
+
+
+def test_ytd_results_cut_at_last_data_day():
+    """YTD compares Jan 1 to the last day with data against the same span last year."""
+    cube = build_cube_slices(_raw(), 1, cube_dimensions(QUERY_DATA))
+    results = ytd_results(cube, "2025-01-20")
+
+    # Data ends Jan 9, so both years are cut there
+    assert results["0"] == {"lastYear": 0, "thisYear": 54, "lastDataDate": "2025-01-09"}
+    assert results["1"]["thisYear"] == 27 and results["2"]["thisYear"] == 27
+
+    # An earlier target date is a local re-cut, no new data needed
+    assert ytd_results(cube, "2025-01-03")["0"]["thisYear"] == 18
+    assert ytd_results(cube, "2024-12-01") == {}
+
+
+def test_ytd_results_last_year_window_and_means():
+    """Last year stops on the same calendar day, and AVG metrics use exact means."""
+    days = pd.date_range("2023-01-01", "2024-03-01")
+    raw = pd.DataFrame({"date": days.strftime("%Y-%m-%d"), "value": ["2"] * len(days), "weight": ["1"] * len(days)})
+    cube = build_cube_slices(raw, 10, [])
+
+    assert same_day_last_year(pd.Timestamp("2024-02-29").date()).isoformat() == "2023-02-28"
+    results = ytd_results(cube, "2024-02-29")
+    assert results["0"]["lastDataDate"] == "2024-02-29"
+
+    sums = build_cube_slices(raw.drop(columns="weight"), 11, [])
+    totals = ytd_results(sums, "2024-02-29")["0"]
+    assert totals["thisYear"] == 60 * 2 and totals["lastYear"] == 59 * 2
+
+    means = ytd_results(cube, "2024-02-29", aggregation="avg")["0"]
+    assert means["thisYear"] == 2 and means["lastYear"] == 2
+
+
+if __name__ == "__main__":
+    test_cube_query_groups_by_all_dimensions()
+    test_per_field_queries_build_the_same_cube()
+    test_avg_metrics_store_sum_and_count()
+    test_slices_hold_totals_and_marginals()
+    test_rollups_and_trend()
+    test_ytd_results_cut_at_last_data_day()
+    test_ytd_results_last_year_window_and_means()
+    print("All metric cube tests passed")
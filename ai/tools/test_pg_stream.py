@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Test script for streaming, capped execution of ad-hoc PostgreSQL queries.
+
+Uses a fake psycopg2 connection whose named cursor generates rows on demand,
+so a "million-row" result never exists in memory.
+"""
+
+import os
+import sys
+import json
+from datetime import date
+from decimal import Decimal
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.pg_stream import (
+    is_read_query, stream_query, fetch_capped, explain_query, PG_QUERY_MAX_ROWS, PG_STATEMENT_TIMEOUT_MS,
+    PG_STATEMENT_TIMEOUT_MAX_MS
+)
+
+
+class FakeCursor:
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.itersize = 2000
+        self.description = None
+        self.position = 0
+        self.closed = False
+
+    def execute(self, query, parameters=None):
+        self.connection.executed.append((self.name, query, parameters))
+        if query.startswith("EXPLAIN"):
+            self.plan = ([{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 1234567, "Total Cost": 42.5}}],)
+
+    def fetchone(self):
+        return self.plan
+
+    def fetchmany(self, size):
+        self.description = (("id",), ("day",), ("value",))
+        self.connection.max_batch = max(self.connection.max_batch, size)
+        end = min(self.position + size, self.connection.total_rows)
+        batch = [(i, date(2024, 1, 1), Decimal("1.5")) for i in range(self.position, end)]
+        self.position = end
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, total_rows):
+        self.total_rows = total_rows
+        self.executed = []
+        self.cursors = []
+        self.max_batch = 0
+        self.rolled_back = False
+        self.closed = False
+
+    def cursor(self, name=None, cursor_factory=None):
+        cursor = FakeCursor(self, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+
+def test_read_query_detection():
+    assert is_read_query("  select * from anomalies")
+    assert is_read_query("WITH x AS (SELECT 1) SELECT * FROM x")
+    assert not is_read_query("WITH x AS (DELETE FROM anomalies RETURNING id) SELECT * FROM x")
+    assert not is_read_query("UPDATE anomalies SET is_active = false")
+
+
+def test_ndjson_streams_in_batches_with_row_cap():
+    connection = FakeConnection(total_rows=1_000_000)
+    chunks = stream_query(connection, "SELECT * FROM time_series_data", fmt="ndjson", max_rows=5000, itersize=1000)
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+
+    assert len(lines) == 5001
+    assert json.loads(lines[0]) == {"id": 0, "day": "2024-01-01", "value": 1.5}
+    meta = json.loads(lines[-1])["_meta"]
+    assert meta["rows"] == 5000 and meta["truncated"] is True and meta["reason"] == "row_limit"
+
+    # Rows came through a named cursor one batch at a time, under a timeout
+    assert connection.executed[0][1].startswith("SET LOCAL statement_timeout")
+    assert connection.executed[1][0].startswith("query_stream_")
+    assert connection.max_batch == 1000
+    assert connection.rolled_back and connection.closed
+    assert all(cursor.closed for cursor in connection.cursors)
+
+
+def test_csv_byte_cap_and_marker():
+    connection = FakeConnection(total_rows=100_000)
+    text = b"".join(stream_query(connection, "SELECT * FROM t", fmt="csv", max_bytes=10_000)).decode("utf-8")
+    lines = text.splitlines()
+    assert lines[0] == "id,day,value"
+    assert lines[-1].startswith("# truncated: byte_limit after")
+    assert len(text) <= 10_000 + 100
+
+
+def test_small_result_is_not_truncated():
+    connection = FakeConnection(total_rows=3)
+    lines = b"".join(stream_query(connection, "SELECT * FROM t")).decode("utf-8").splitlines()
+    assert json.loads(lines[-1])["_meta"]["truncated"] is False
+    assert len(lines) == 4
+
+    fetched = fetch_capped(FakeConnection(total_rows=10_000), "SELECT * FROM t", max_rows=50)
+    assert fetched["rowCount"] == 50 and fetched["truncated"] is True
+    assert fetched["columns"] == ["id", "day", "value"]
+
+
+def test_client_disconnect_releases_connection():
+    connection = FakeConnection(total_rows=1_000_000)
+    chunks = stream_query(connection, "SELECT * FROM t", itersize=100)
+    next(chunks)
+    chunks.close()
+    assert connection.rolled_back and connection.closed
+
+
+def test_client_limits_are_clamped_and_validated():
+    """A client cannot raise the timeout or row cap past the server maximum, or pass negatives."""
+    connection = FakeConnection(total_rows=10)
+    explain_query(connection, "SELECT 1", timeout_ms=10 ** 9)
+    assert connection.executed[0][2] == (PG_STATEMENT_TIMEOUT_MAX_MS,)
+    connection = FakeConnection(total_rows=10)
+    explain_query(connection, "SELECT 1", timeout_ms=0)
+    assert connection.executed[0][2] == (PG_STATEMENT_TIMEOUT_MS,)
+
+    connection = FakeConnection(total_rows=PG_QUERY_MAX_ROWS + 10)
+    lines = b"".join(stream_query(connection, "SELECT * FROM t", max_rows=10 ** 9, itersize=10_000)).splitlines()
+    assert json.loads(lines[-1])["_meta"]["rows"] == PG_QUERY_MAX_ROWS
+
+    for bad in ({"max_rows": -1}, {"timeout_ms": -5}):
+        try:
+            fetch_capped(FakeConnection(total_rows=10), "SELECT * FROM t", **bad)
+        except ValueError as e:
+            assert "must not be negative" in str(e)
+        else:
+            raise AssertionError(f"Expected ValueError for {bad}")
+    assert fetch_capped(FakeConnection(total_rows=10), "SELECT * FROM t", max_rows=0)["rowCount"] == 0
+
+
+def test_explain_preview():
+    connection = FakeConnection(total_rows=0)
+    explained = explain_query(connection, "SELECT * FROM time_series_data")
+    assert explained["estimated_rows"] == 1234567
+    assert connection.executed[-1][1] == "EXPLAIN (FORMAT JSON) SELECT * FROM time_series_data"
+
+
+if __name__ == "__main__":
+    test_read_query_detection()
+    test_ndjson_streams_in_batches_with_row_cap()
+    test_csv_byte_cap_and_marker()
+    test_small_result_is_not_truncated()
+    test_client_disconnect_releases_connection()
+    test_client_limits_are_clamped_and_validated()
+    test_explain_preview()
+    print("All pg stream tests passed")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Test script for HTTP record/replay and the pipeline benchmark harness.
+
+Records against a throwaway local HTTP server, shuts it down, and replays,
+so it needs no network access or external services.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import requests
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.benchmark import PIPELINES, Pipeline, run_pipeline
+from tools.replay import Cassette, CassetteMiss, request_key
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload):
+        time.sleep(0.05)
+        self.server.hits += 1
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply({"path": self.path, "hit": self.server.hits})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._reply({"echo": json.loads(self.rfile.read(length) or b"null"), "hit": self.server.hits})
+
+
+def _server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.hits = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_record_then_replay_offline():
+    base = tempfile.mkdtemp(prefix="replay_test_")
+    path = os.path.join(base, "unit.jsonl.gz")
+    server, url = _server()
+    try:
+        with Cassette(path, mode="record") as cassette:
+            first = requests.get(f"{url}/resource/abc.json", params={"b": 2, "$query": "SELECT * WHERE day = '2025-01-01'"})
+            second = requests.get(f"{url}/resource/abc.json", params={"b": 2, "$query": "SELECT * WHERE day = '2025-01-01'"})
+            with httpx.Client() as client:
+                posted = client.post(f"{url}/v1/chat/completions", json={"model": "gpt-4o", "messages": ["hi"]})
+        assert server.hits == 3 and cassette.stats()[url[7:]]["recorded"] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    try:
+        with Cassette(path, mode="replay", latency="recorded:0.5") as cassette:
+            started = time.perf_counter()
+            # Same query with the parameters in another order: an exact match, and repeats replay in order
+            replayed = [requests.get(f"{url}/resource/abc.json", params={"$query": "SELECT * WHERE day = '2025-01-01'", "b": 2})
+                        for _ in range(2)]
+            assert time.perf_counter() - started >= 0.05
+            with httpx.Client() as client:
+                # A date embedded in the body changed: falls back to the next unused recording for the route
+                assert client.post(f"{url}/v1/chat/completions", json={"model": "gpt-4o", "messages": ["hi 2"]}).json() \
+                    == posted.json()
+                # Key order differs, the JSON body is the same
+                echoed = client.post(f"{url}/v1/chat/completions", json={"messages": ["hi"], "model": "gpt-4o"})
+                try:
+                    client.get(f"{url}/never/recorded")
+                    assert False, "expected a miss"
+                except httpx.ConnectError:
+                    pass
+        assert [r.json() for r in replayed] == [first.json(), second.json()]
+        assert replayed[1].json()["hit"] == 1 and echoed.json() == posted.json()
+        assert echoed.headers["content-type"] == "application/json"
+        stats = cassette.stats()[url[7:]]
+        assert (stats["replayed"], stats["misses"]) == (4, 1)
+
+        with Cassette(path, mode="replay", strict=True):
+            try:
+                requests.get(f"{url}/resource/abc.json", params={"$query": "SELECT * WHERE day = '2025-02-01'"})
+                assert False, "expected a miss"
+            except CassetteMiss:
+                pass
+        assert request_key("get", f"{url}/a?y=1&x=2", None) == request_key("GET", f"{url}/a?x=2&y=1", None)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def test_benchmark_reports_stages_and_http():
+    base = tempfile.mkdtemp(prefix="benchmark_test_")
+    server, url = _server()
+
+    def fetch(options, output_dir):
+        for _ in range(3):
+            requests.get(f"{url}/resource/x.json")
+        sum(i * i for i in range(200_000))
+
+    def toy(options, output_dir):
+        with open(os.path.join(output_dir, "out.json"), "w") as f:
+            json.dump(benchmark_toy_fetch(options, output_dir), f)
+
+    global benchmark_toy_fetch
+    benchmark_toy_fetch = fetch
+    PIPELINES["toy"] = Pipeline("toy", toy, [(__name__, "benchmark_toy_fetch")])
+    try:
+        recorded = run_pipeline("toy", {"mode": "record", "cassette_dir": base})
+        assert recorded["error"] is None and recorded["http"][url[7:]]["recorded"] == 3
+        server.shutdown()
+        server.server_close()
+
+        replayed = run_pipeline("toy", {"mode": "replay", "cassette_dir": base, "latency": "0.02"})
+        assert replayed["error"] is None and replayed["http"][url[7:]]["replayed"] == 3
+        assert replayed["stages"]["benchmark_toy_fetch"]["calls"] == 1
+        assert replayed["stages"]["benchmark_toy_fetch"]["seconds"] >= 0.06
+        assert replayed["wall_seconds"] >= replayed["http_seconds"] >= 0.06
+        assert replayed["cpu_seconds"] > 0 and replayed["peak_rss_mb"] > 0
+        # The wrapper is removed after the run
+        assert not hasattr(benchmark_toy_fetch, "__wrapped__")
+    finally:
+        PIPELINES.pop("toy", None)
+        shutil.rmtree(base, ignore_errors=True)
+
+
+benchmark_toy_fetch = None
+
+
+if __name__ == "__main__":
+    test_record_then_replay_offline()
+    test_benchmark_reports_stages_and_http()
+    print("All replay tests passed")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Test script for the concurrent monthly report explanation stage, using the stub LLM client.
+"""
+
+import os
+import sys
+import json
+import time
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.stub_llm import StubSwarmClient
+from tools.report_explainer import explain_report_items, parse_explainer_response
+
+
+def _items(count):
+    return [
+        {
+            "id": i,
+            "metric_name": f"Metric {i}",
+            "metric_id": str(100 + i),
+            "group_value": None,
+            "district": "0",
+            "recent_mean": 10.0 + i,
+            "comparison_mean": 10.0,
+            "percent_change": 10.0 * i,
+            "report_date": "2025-05-01",
+            "metadata": json.dumps({"source": "test"})
+        }
+        for i in range(count)
+    ]
+
+
+def test_results_keep_input_order():
+    """Results line up with the input rows and merge the existing metadata."""
+    client = StubSwarmClient(delay=lambda prompt: 0.05 if "Metric 0'" in prompt else 0.0)
+    results = explain_report_items(_items(5), client, agent=None, context_variables={}, max_concurrency=5)
+
+    assert [r["id"] for r in results] == [0, 1, 2, 3, 4]
+    assert all(r["explanation"].startswith("Stub explanation") for r in results)
+    assert results[2]["metadata"]["source"] == "test"
+    assert results[2]["metadata"]["trend_analysis"] == "Stub trend analysis."
+    assert "between March 2025 and April 2025" in client.calls[0]
+
+
+def test_runs_concurrently():
+    """Ten slow calls with ten workers take about as long as one call."""
+    client = StubSwarmClient(delay=0.2)
+    started = time.perf_counter()
+    results = explain_report_items(_items(10), client, agent=None, context_variables={}, max_concurrency=10)
+    elapsed = time.perf_counter() - started
+
+    assert len(results) == 10
+    assert elapsed < 1.0
+    assert client.max_in_flight > 1
+
+
+def test_concurrency_is_bounded():
+    """No more than max_concurrency calls are in flight at once."""
+    client = StubSwarmClient(delay=0.05)
+    explain_report_items(_items(8), client, agent=None, context_variables={}, max_concurrency=3)
+    assert client.max_in_flight <= 3
+
+
+def test_timeout_falls_back():
+    """A call that exceeds the timeout gets an error explanation instead of blocking the batch."""
+    client = StubSwarmClient(delay=lambda prompt: 1.0 if "Metric 1'" in prompt else 0.0)
+    results = explain_report_items(_items(3), client, agent=None, context_variables={}, max_concurrency=3, timeout=0.2)
+
+    assert results[1]["explanation"].startswith("Error generating explanation for Metric 1")
+    assert results[0]["explanation"].startswith("Stub explanation")
+    assert results[2]["explanation"].startswith("Stub explanation")
+
+
+def test_timed_out_calls_keep_their_slot():
+    """A call abandoned at its timeout still counts as in flight until it returns."""
+    client = StubSwarmClient(delay=0.4)
+    results = explain_report_items(_items(4), client, agent=None, context_variables={}, max_concurrency=2, timeout=0.1)
+
+    assert all(r["explanation"].startswith("Error generating explanation") for r in results)
+    assert client.max_in_flight <= 2
+
+
+def test_parse_fenced_json():
+    """JSON wrapped in a ```json fence is parsed, and charts become chart data."""
+    content = "```json\n" + json.dumps({"explanation": "Because of X.", "charts": ["chart"]}) + "\n```"
+    client = StubSwarmClient(responder=lambda prompt: content)
+    response = client.run(messages=[{"role": "user", "content": "why?"}])
+    explanation, chart_data, metadata = parse_explainer_response(response)
+
+    assert explanation == "Because of X."
+    assert chart_data == ["chart"]
+    assert metadata["charts"] == ["chart"]
+
+
+if __name__ == "__main__":
+    test_results_keep_input_order()
+    test_runs_concurrently()
+    test_concurrency_is_bounded()
+    test_timeout_falls_back()
+    test_timed_out_calls_keep_their_slot()
+    test_parse_fenced_json()
+    print("All report explainer tests passed")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for the retirement data ingestion: cached encodings and parsed
+frames for unchanged exports, and the single-pass aggregations.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import retirementdata
+from tools.retirementdata import load_datasets, combine_processed_data, compute_aggregations
+
+DATASET = {
+    'name': 'ACR_Retired', 'file_path': 'ACR_Retired.csv', 'file_type': 'csv',
+    'date_col': 'Date Issued (GMT)', 'credits_col': 'Quantity of Credits', 'source_name': 'ACR_Retired',
+    'beneficiary_col': 'Account Holder', 'methodology_col': 'Project Type',
+}
+
+
+def _write_export(path, rows):
+    frame = pd.DataFrame(rows, columns=['Date Issued (GMT)', 'Quantity of Credits', 'Account Holder',
+                                        'Project Type', 'Unused'])
+    frame.to_csv(path, index=False, encoding='latin1')
+
+
+def test_unchanged_exports_are_not_reparsed(tmp_path, monkeypatch):
+    export = tmp_path / 'ACR_Retired.csv'
+    _write_export(export, [['2024-09-03', '100', 'Café Co', 'Forestry', 'x'],
+                           ['2024-09-10', '50', 'Café Co', 'Forestry', 'y'],
+                           ['not a date', '5', 'Other', 'Forestry', 'z']])
+    detections, reads = [], []
+    detect, read = retirementdata.detect_encoding, retirementdata.read_csv_chunks
+    monkeypatch.setattr(retirementdata, 'detect_encoding', lambda *a, **k: detections.append(a) or detect(*a, **k))
+    monkeypatch.setattr(retirementdata, 'read_csv_chunks', lambda *a, **k: reads.append(a) or read(*a, chunk_rows=1))
+
+    first = load_datasets(str(tmp_path), [DATASET])[0]
+    assert list(first['Credits']) == [100.0, 50.0] and first['Beneficiary'].iloc[0] == 'Café Co'
+    assert 'Unused' not in first.columns
+
+    second = load_datasets(str(tmp_path), [DATASET])[0]
+    pd.testing.assert_frame_equal(first.reset_index(drop=True), second.reset_index(drop=True))
+    assert (len(detections), len(reads)) == (1, 1)
+
+    # A changed export is parsed again and its old frame dropped
+    _write_export(export, [['2024-09-03', '70', 'Café Co', 'Forestry', 'x']])
+    third = load_datasets(str(tmp_path), [DATASET])[0]
+    assert list(third['Credits']) == [70.0] and len(reads) == 2
+    frames = [name for name in os.listdir(tmp_path / '.ingest_cache') if name != 'manifest.json']
+    assert len(frames) == 1
+
+
+def test_single_pass_matches_per_aggregation_scans():
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.integers(0, 365 * 8, 2000), unit='D')
+    frame = pd.DataFrame({
+        'Date': dates,
+        'Credits': rng.integers(1, 1000, 2000).astype(float),
+        'Source': rng.choice(['ACR_Retired', 'VCUs', 'GSF_Registry_Credits'], 2000),
+        'Methodology': rng.choice(['Forestry', 'Cookstoves', np.nan], 2000),
+        'Beneficiary': rng.choice(['A', 'B', 'C', np.nan], 2000),
+    })
+    combined = combine_processed_data([frame])
+    result = compute_aggregations(combined, '2024-10-11', 2024, 9, methodology_since_year=2019)
+
+    credits = combined[['Credits']]
+    annual = credits.resample('YE').sum()
+    assert result['annual']['Date'].tolist() == annual.index.strftime('%Y').tolist()
+    assert result['annual']['Credits'].tolist() == annual['Credits'].tolist()
+
+    recent = combined[combined.index >= '2019-01-01']
+    monthly = recent[['Credits']].resample('ME').sum()
+    assert result['monthly']['Date'].tolist() == monthly.index.strftime('%Y-%m-%d').tolist()
+    assert result['monthly']['Credits'].tolist() == monthly['Credits'].tolist()
+
+    source_monthly = recent.groupby([pd.Grouper(freq='ME'), 'Source'])['Credits'].sum()
+    assert result['source_monthly']['Credits'].tolist() == source_monthly.tolist()
+    assert result['source_annual']['Credits'].sum() == combined['Credits'].sum()
+
+    methodology = combined[combined.index.year >= 2019].dropna(subset=['Methodology'])
+    methodology = methodology.groupby([methodology.index.year, 'Source', 'Methodology'])['Credits'].sum()
+    assert result['methodology']['Credits'].tolist() == methodology.tolist()
+
+    target = combined[(combined.index.year == 2024) & (combined.index.month == 9) & (combined['Source'] == 'VCUs')]
+    top = target.dropna(subset=['Beneficiary']).groupby('Beneficiary')['Credits'].sum().sort_values(ascending=False)
+    assert result['top_beneficiaries']['VCUs']['Credits'].tolist() == top.head(10).tolist()
+    assert set(result['top_beneficiaries']) == set(retirementdata.SOURCES_WITH_BENEFICIARIES)
+
+
+if __name__ == "__main__":
+    # The cache test needs pytest's tmp_path and monkeypatch fixtures
+    import pytest
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test script for the cached, paginated table views used by the chat agents.
+"""
+
+import os
+import copy
+import sys
+import time
+
+import pandas as pd
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools.table_view import get_table_view, lookup_table_view, format_view_page, dataset_key
+
+
+def _dataset(rows=100_000):
+    return pd.DataFrame({
+        "incident_id": range(rows),
+        "category": [["Assault", "Burglary", "Fraud"][i % 3] for i in range(rows)],
+        "supervisor_district": [i % 11 + 1 for i in range(rows)],
+        "description": ["Reported\nat night" if i % 2 else "Reported by phone" for i in range(rows)]
+    })
+
+
+def test_view_is_cached_and_stable():
+    """The same spec over the same dataset returns the same view and ID."""
+    df = _dataset(1000)
+    view = get_table_view(df, columns="incident_id,category", sort_by="incident_id", ascending=False)
+    again = get_table_view(df, columns=["incident_id", "category"], sort_by=["incident_id"], ascending=False)
+    assert view is again
+    assert lookup_table_view(view.view_id, df) is view
+
+    # A new dataset never reuses a view of the old one
+    assert lookup_table_view(view.view_id, df.copy()) is None
+
+
+def test_view_survives_context_deepcopy():
+    """Swarm deep-copies the context each run; the dataset key keeps the same view."""
+    context = {"dataset": _dataset(1000)}
+    view = get_table_view(context["dataset"], sort_by="incident_id", dataset_key=dataset_key(context))
+    format_view_page(view, 1)
+
+    copied = copy.deepcopy(context)
+    assert copied["dataset"] is not context["dataset"]
+    key = dataset_key(copied)
+    assert key == context["dataset_key"]
+    assert get_table_view(copied["dataset"], sort_by="incident_id", dataset_key=key) is view
+    assert lookup_table_view(view.view_id, copied["dataset"], dataset_key=key) is view
+
+    # A new dataset drops the key and gets new views
+    copied["dataset"] = _dataset(500)
+    copied.pop("dataset_key")
+    assert lookup_table_view(view.view_id, copied["dataset"], dataset_key=dataset_key(copied)) is None
+    assert get_table_view(copied["dataset"], sort_by="incident_id", dataset_key=dataset_key(copied)) is not view
+
+
+def test_projection_filter_sort_and_paging():
+    """Pages come from the filtered, sorted projection, as CSV."""
+    df = _dataset(1000)
+    view = get_table_view(df, columns=["incident_id", "category"], sort_by="incident_id", ascending=False,
+                          filters=[["category", "==", "Fraud"], ["supervisor_district", "<=", 5]])
+    result = format_view_page(view, 2, rows_per_page=10)
+
+    table = result["content"].split("```csv\n")[1].split("\n```")[0].split("\n")
+    assert table[0] == "incident_id,category"
+    assert len(table) == 11
+    ids = [int(line.split(",")[0]) for line in table[1:]]
+    assert ids == sorted(ids, reverse=True)
+    assert all(line.endswith(",Fraud") for line in table[1:])
+    assert result["pagination"]["total_rows"] == view.total_rows
+    assert result["pagination"]["current_page"] == 2
+
+
+def test_token_budget_trims_rows():
+    """A page larger than the token budget is cut short and says so."""
+    df = _dataset(1000)
+    view = get_table_view(df)
+    result = format_view_page(view, 1, rows_per_page=50, token_budget=100)
+
+    table = result["content"].split("```csv\n")[1].split("\n```")[0]
+    assert len(table) <= 100 * 4
+    assert "Page cut to" in result["content"]
+    # Cell newlines do not break CSV records
+    assert all(line.count(",") == 3 for line in table.split("\n"))
+
+
+def test_unknown_column_is_reported():
+    df = _dataset(10)
+    try:
+        get_table_view(df, columns=["nope"])
+    except KeyError as e:
+        assert "nope" in str(e)
+    else:
+        raise AssertionError("Expected KeyError for unknown column")
+
+
+def test_later_pages_reuse_sorted_frame():
+    """Paging a 100k-row sorted view does not re-sort, and a repeated page is served from cache."""
+    df = _dataset()
+    started = time.perf_counter()
+    view = get_table_view(df, sort_by=["category", "incident_id"])
+    format_view_page(view, 1)
+    first = time.perf_counter() - started
+
+    started = time.perf_counter()
+    view = get_table_view(df, sort_by=["category", "incident_id"])
+    format_view_page(view, 2)
+    format_view_page(view, 2)
+    later = time.perf_counter() - started
+
+    assert later < first
+    assert view.pages
+
+
+if __name__ == "__main__":
+    test_view_is_cached_and_stable()
+    test_view_survives_context_deepcopy()
+    test_projection_filter_sort_and_paging()
+    test_token_budget_trims_rows()
+    test_unknown_column_is_reported()
+    test_later_pages_reuse_sorted_frame()
+    print("All table view tests passed")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Test script for the diff-based time series and anomaly writers.
+
+The diff tests run anywhere. The refresh test writes a chart twice into a
+scratch schema of the configured PostgreSQL database and compares the WAL
+generated by a full write with that of a one-point refresh; it is skipped
+when no database is reachable.
+"""
+
+import os
+import sys
+import uuid
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+# Make the ai directory importable so "tools.*" resolves when run from anywhere
+ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ai_dir not in sys.path:
+    sys.path.insert(0, ai_dir)
+
+from tools import store_time_series
+from tools.store_time_series import diff_time_series_points, store_time_series_in_db
+from tools.store_anomalies import anomaly_content_hash
+
+
+def _points(months=24, groups=("Mission", "Tenderloin", None), bump=None):
+    points = []
+    for m in range(months):
+        for g, group in enumerate(groups):
+            value = float(100 + m + 10 * g)
+            if bump and bump == (m, group):
+                value += 1
+            points.append({"time_period": pd.Timestamp(2023 + m // 12, m % 12 + 1, 1), "value": value,
+                           "group_value": group})
+    return points
+
+
+def _stored(points):
+    return {(p["group_value"], p["time_period"].date()): (i, p["value"]) for i, p in enumerate(points)}
+
+
+def test_diff_writes_only_changed_points():
+    previous = _points()
+    diff = diff_time_series_points(_stored(previous), _points(bump=(23, "Mission")))
+    assert (diff["inserted"], diff["updated"], diff["unchanged"]) == (0, 1, 71)
+    assert diff["upserts"] == [("Mission", date(2024, 12, 1), 124.0)]
+    assert diff["deleted_ids"] == [] and diff["changed_periods"] == [date(2024, 12, 1)]
+
+
+def test_diff_inserts_new_and_deletes_missing_points():
+    previous = _points(months=12)
+    incoming = [p for p in _points(months=13) if p["group_value"] != "Tenderloin"]
+    diff = diff_time_series_points(_stored(previous), incoming)
+    assert diff["inserted"] == 2 and diff["updated"] == 0 and diff["unchanged"] == 24
+    assert len(diff["deleted_ids"]) == 12
+
+    # Strings and datetimes address the same point; NaN matches a stored NULL
+    stored = {(None, date(2024, 1, 1)): (7, None)}
+    same = diff_time_series_points(stored, [{"time_period": "2024-01-01", "value": float("nan")}])
+    assert same["unchanged"] == 1 and not same["upserts"]
+    moved = diff_time_series_points(stored, [{"time_period": datetime(2024, 1, 1, 0, 0), "value": 3}])
+    assert moved["updated"] == 1
+
+
+def test_anomaly_content_hash_tracks_shown_values():
+    result = {"group_value": "Mission", "comparison_mean": 10.0, "recent_mean": 15.0, "difference": 5.0,
+              "stdDev": 1.2, "out_of_bounds": True}
+    base = anomaly_content_hash(result, date(2024, 12, 31), {"2024-01": 10}, {"2024-12": 15}, "caption")
+    assert base == anomaly_content_hash(dict(result), date(2024, 12, 31), {"2024-01": 10}, {"2024-12": 15}, "caption")
+    assert base != anomaly_content_hash({**result, "recent_mean": 15.5}, date(2024, 12, 31),
+                                        {"2024-01": 10}, {"2024-12": 15}, "caption")
+
+
+def _scratch_connection():
+    try:
+        from tools.db_utils import get_postgres_connection
+        connection = get_postgres_connection()
+    except Exception:
+        connection = None
+    if connection is None:
+        pytest.skip("PostgreSQL is not reachable")
+    return connection
+
+
+def _wal_bytes(connection, write):
+    cursor = connection.cursor()
+    cursor.execute("SELECT pg_current_wal_insert_lsn()")
+    start = cursor.fetchone()[0]
+    write()
+    cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s)", (start,))
+    size = int(cursor.fetchone()[0])
+    connection.commit()
+    cursor.close()
+    return size
+
+
+def test_refresh_rewrites_one_point():
+    connection = _scratch_connection()
+    schema = f"time_series_upsert_test_{uuid.uuid4().hex[:8]}"
+    cursor = connection.cursor()
+    metadata = {"object_type": "dashboard_metric", "object_id": "1", "object_name": "Calls",
+                "field_name": "value", "period_type": "month", "filter_conditions": []}
+    try:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"SET search_path TO {schema}")
+        cursor.execute("""
+            CREATE TABLE time_series_metadata (
+                chart_id SERIAL PRIMARY KEY, object_type TEXT, object_id TEXT, object_name TEXT, field_name TEXT,
+                period_type TEXT, metadata JSONB, district INTEGER DEFAULT 0, group_field TEXT,
+                executed_query_url TEXT, caption TEXT, is_active BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE time_series_data (
+                id SERIAL PRIMARY KEY, chart_id INTEGER REFERENCES time_series_metadata(chart_id),
+                time_period DATE, group_value TEXT, numeric_value FLOAT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        connection.commit()
+        store_time_series.ensure_time_series_upsert_schema(connection)
+
+        points = _points(months=120, groups=[f"g{i}" for i in range(20)])
+        first = {}
+        full_wal = _wal_bytes(connection, lambda: first.update(store_time_series_in_db(connection, points, metadata)))
+        assert first["inserted"] == 2400
+
+        refreshed = _points(months=120, groups=[f"g{i}" for i in range(20)], bump=(119, "g3"))
+        second = {}
+        refresh_wal = _wal_bytes(connection, lambda: second.update(store_time_series_in_db(connection, refreshed, metadata)))
+        assert second["chart_id"] == first["chart_id"]
+        assert (second["updated"], second["unchanged"], second["inserted"], second["deleted"]) == (1, 2399, 0, 0)
+        assert refresh_wal * 10 < full_wal
+
+        cursor.execute("SELECT count(*) FROM time_series_data")
+        assert cursor.fetchone()[0] == 2400
+        cursor.execute("SELECT updated, changed_periods FROM time_series_changes ORDER BY id DESC LIMIT 1")
+        assert cursor.fetchone() == (1, [date(2032, 12, 1)])
+
+        # Category charts of one metric differ only by object_name and group_field
+        by_field = {}
+        for field in ("supervisor_district", "call_type"):
+            category = {**metadata, "object_type": "dashboard_metric_category", "object_name": f"Calls by {field}",
+                        "group_field": field}
+            by_field[field] = store_time_series_in_db(connection, _points(months=3, groups=[field]), category)
+        assert by_field["supervisor_district"]["chart_id"] != by_field["call_type"]["chart_id"]
+        cursor.execute("SELECT count(*) FROM time_series_data WHERE chart_id = %s",
+                       (by_field["supervisor_district"]["chart_id"],))
+        assert cursor.fetchone()[0] == 3
+    finally:
+        connection.rollback()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        connection.commit()
+        cursor.close()
+        connection.close()
+        store_time_series._changes_table = None
+
+
+if __name__ == "__main__":
+    test_diff_writes_only_changed_points()
+    test_diff_inserts_new_and_deletes_missing_points()
+    test_anomaly_content_hash_tracks_shown_values()
+    test_refresh_rewrites_one_point()
+    print("All time series upsert tests passed")
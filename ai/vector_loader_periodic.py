@@ -12,6 +12,7 @@ import qdrant_client
 from qdrant_client.http import models as rest
 from dotenv import load_dotenv
 import tiktoken  # For counting tokens
+from tools.log_utils import rotating_file_handler
 
 # ------------------------------
 # Configure Logging
@@ -45,7 +46,7 @@ class ColoredFormatter(logging.Formatter):
         return formatter.format(record)
 
 # Configure handlers
-file_handler = logging.FileHandler(log_file)
+file_handler = rotating_file_handler(log_file)
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
 console_handler = logging.StreamHandler(sys.stdout)
@@ -11,6 +11,7 @@ from qdrant_client.http import models as rest
 from dotenv import load_dotenv
 import tiktoken  # For counting tokens
 from tools.data_processing import format_columns, serialize_columns, convert_to_timestamp
+from tools.log_utils import rotating_file_handler
 import shutil
 
 # ------------------------------
@@ -20,7 +21,7 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(message)s',
     handlers=[
-        logging.FileHandler("logs/vector_loader.log", mode='w'),
+        rotating_file_handler("logs/vector_loader.log"),
         logging.StreamHandler(sys.stdout)
     ]
 )
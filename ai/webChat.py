@@ -13,6 +13,9 @@ from tools.vector_query import query_docs  #
 from tools.genChart import generate_time_series_chart
 from tools.retirementdata import read_csv_with_encoding
 from tools.genGhostPost import generate_ghost_post
+from tools.table_view import get_table_view, lookup_table_view, format_view_page, dataset_key
+from tools.agent_runtime import parallel_tool_calls, context_writer, take_tool_outcomes
+from tools.dashboard_store import get_dashboard_store
 from pathlib import Path
 # Import FastAPI and related modules
 from fastapi import APIRouter, Request, Cookie
@@ -119,8 +122,8 @@ if not openai_api_key:
 # Initialize OpenAI client for direct API calls
 openai.api_key = openai_api_key
 
-# Initialize the Swarm client
-swarm_client = Swarm()
+# Initialize the Swarm client; the tool calls of one turn run concurrently
+swarm_client = parallel_tool_calls(Swarm())
 client = OpenAI()
 
 qdrant = qdrant_client.QdrantClient(host="localhost", port=6333)
@@ -171,21 +174,16 @@ def save_notes_to_file(notes_text, filename="combined_notes.txt"):
 def load_and_combine_notes():
     logger = logging.getLogger(__name__)
     
-    script_dir = Path(__file__).parent
-    dashboard_dir = script_dir / 'output' / 'dashboard'
+    store = get_dashboard_store()
     combined_text = ""
     districts_processed = 0
     
-    # Process each district folder (0-11)
+    # Process each district's top_level.json (0-11)
     for district_num in range(12):  # Include all districts 0-11
-        district_dir = dashboard_dir / str(district_num)
-        top_level_file = district_dir / 'top_level.json'
+        district_data = store.top_level(district_num)
         
-        if top_level_file.exists():
+        if district_data is not None:
             try:
-                with open(top_level_file, 'r', encoding='utf-8') as f:
-                    district_data = json.load(f)
-                
                 district_name = district_data.get("name", f"District {district_num}")
                 combined_text += f"\n{'='*80}\n{district_name} Metrics Summary\n{'='*80}\n\n"
                 
@@ -459,35 +457,25 @@ def get_dashboard_metric(context_variables, district_number=0, metric_id=None):
         if district_number < 0 or district_number > 11:
             return {"error": f"Invalid district number: {district_number}. Must be between 0 (citywide) and 11."}
         
-        # Construct the base path - looking one level up from the script
         script_dir = Path(__file__).parent
-        dashboard_dir = script_dir / 'output' / 'dashboard'
+        store = get_dashboard_store()
         
-        logger.info(f"Looking for dashboard data in: {dashboard_dir}")
-        
-        # If metric_id is None, return the top-level district summary
+        # If metric_id is None, return the district's top_level.json summary
         if metric_id is None:
-            file_path = dashboard_dir / f"district_{district_number}.json"
-            logger.info(f"Fetching top-level dashboard data for district {district_number} from {file_path}")
+            entry = store.top_level_entry(district_number)
+            logger.info(f"Fetching top-level dashboard data for district {district_number}")
         else:
-            # Metric ID is provided, look in the district-specific folder
-            district_folder = dashboard_dir / str(district_number)
-            
             # If metric_id doesn't end with .json, add it
             if not metric_id.endswith('.json'):
                 metric_id = f"{metric_id}.json"
-                
-            file_path = district_folder / metric_id
-            logger.info(f"Fetching specific metric '{metric_id}' for district {district_number} from {file_path}")
+            entry = store.entry(district_number, metric_id)
+            logger.info(f"Fetching specific metric '{metric_id}' for district {district_number}")
         
         # Check if the file exists
-        if not file_path.exists():
+        if entry is None or entry.error is not None:
             # If specific metric file doesn't exist, list available metrics
             if metric_id is not None:
-                available_metrics = []
-                district_folder = dashboard_dir / str(district_number)
-                if district_folder.exists():
-                    available_metrics = [f.name for f in district_folder.glob('*.json')]
+                available_metrics = [f"{key}.json" for key in store.metric_ids(district_number) or []]
                 
                 return {
                     "error": f"Metric '{metric_id}' not found for district {district_number}",
@@ -496,9 +484,8 @@ def get_dashboard_metric(context_variables, district_number=0, metric_id=None):
             else:
                 return {"error": f"Dashboard data not found for district {district_number}"}
         
-        # Read and parse the JSON file
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        file_path = entry.path
+        data = entry.data
         
         # Add metadata about the source
         result = {
@@ -531,12 +518,9 @@ def get_dashboard_metric(context_variables, district_number=0, metric_id=None):
                 logger.info(f"Using metric_id as a number: {metric_id_number}")
             else:
                 # Try to find the ID from the dashboard_queries_enhanced.json file
-                queries_file = script_dir / 'data' / 'dashboard' / 'dashboard_queries_enhanced.json'
-                if queries_file.exists():
+                queries_data = store.enhanced_queries()
+                if queries_data is not None:
                     try:
-                        with open(queries_file, 'r', encoding='utf-8') as f:
-                            queries_data = json.load(f)
-                        
                         # Look for the metric name in the queries data
                         for category in queries_data.values():
                             for subcategory in category.values():
@@ -563,9 +547,9 @@ def get_dashboard_metric(context_variables, district_number=0, metric_id=None):
                         if not metric_id_number:
                             logger.info(f"Could not find metric ID for '{base_metric_name}' in dashboard_queries_enhanced.json")
                     except Exception as e:
-                        logger.error(f"Error reading dashboard_queries_enhanced.json: {str(e)}")
+                        logger.error(f"Error searching dashboard_queries_enhanced.json: {str(e)}")
                 else:
-                    logger.info(f"dashboard_queries_enhanced.json not found at {queries_file}")
+                    logger.info("dashboard_queries_enhanced.json not found")
                 
                 if not metric_id_number:
                     logger.info(f"Could not determine metric ID number from {base_metric_name}")
@@ -1272,110 +1256,59 @@ def load_and_combine_climate_data():
 
     return vera_df
 
-def format_table(context_variables, title=None):
+def _table_dataset(context_variables):
+    """Return the session dataset as a DataFrame, or an error dict."""
+    data = context_variables.get("dataset")
+    if data is None:
+        logger.error("No dataset found in context")
+        return {"error": "No dataset found in context"}
+
+    # If it's a dict with 'status' or 'error', return that directly
+    if isinstance(data, dict):
+        if 'error' in data:
+            logger.error(f"Error in data: {data['error']}")
+            return {"error": data['error']}
+        if 'status' in data:
+            return {"status": data['status']}
+
+    if not isinstance(data, pd.DataFrame):
+        data = pd.DataFrame(data)
+        context_variables["dataset"] = data
+        context_variables.pop("dataset_key", None)
+    return data
+
+
+@context_writer
+def format_table(context_variables, title=None, columns=None, sort_by=None, ascending=True, filters=None,
+                 format="csv", rows_per_page=50, token_budget=None):
     """
-    Formats data from context_variables into a markdown table with an optional title.
+    Shows the first page of a cached table view of the dataset.
     Args:
         context_variables: The context variables containing the dataset
         title: Optional title for the table
+        columns: Columns to include (list or comma-separated string); all columns if omitted
+        sort_by: Column(s) to sort by
+        ascending: Sort direction (bool, or one bool per sort column)
+        filters: {column: value} for equality, or a list of [column, op, value] with op in
+                 ==, !=, >, >=, <, <=, contains, in
+        format: "csv" (default), "tsv" or "markdown"
+        rows_per_page: Rows per page
+        token_budget: Approximate token limit for the rendered page
     Returns:
-        The formatted table as markdown
+        The formatted page plus a view_id for format_table_page
     """
-    logger.info(f"""
-=== format_table called ===
-Title: {title}
-Context variables keys: {list(context_variables.keys())}
-""")
-    
     try:
-        data = context_variables.get("dataset")
-        logger.info(f"""
-Data retrieved from context:
-Type: {type(data)}
-Is None: {data is None}
-""")
-            
-        if data is None:
-            logger.error("No dataset found in context")
-            return {"error": "No dataset found in context"}
-            
-        # If it's a dict with 'status' or 'error', return that directly
+        data = _table_dataset(context_variables)
         if isinstance(data, dict):
-            logger.info(f"Data is dict with keys: {list(data.keys())}")
-            if 'error' in data:
-                logger.error(f"Error in data: {data['error']}")
-                return {"error": data['error']}
-            if 'status' in data:
-                logger.info(f"Status in data: {data['status']}")
-                return {"status": data['status']}
-        
-        # Format as DataFrame
-        import pandas as pd
-        if isinstance(data, pd.DataFrame):
-            df = data
-            logger.info(f"""
-DataFrame details:
-Shape: {df.shape}
-Columns: {df.columns.tolist()}
-""")
-        else:
-            logger.info(f"Converting data to DataFrame from type: {type(data)}")
-            df = pd.DataFrame(data)
+            return data
+
+        view = get_table_view(data, columns=columns, sort_by=sort_by, ascending=ascending, filters=filters,
+                              dataset_key=dataset_key(context_variables))
+        result = format_view_page(view, 1, rows_per_page=rows_per_page, fmt=format, token_budget=token_budget, title=title)
+        if "pagination" in result:
+            context_variables["table_pagination"] = result["pagination"]
+        return result
 
-        # Get total row count
-        total_rows = len(df)
-        rows_per_page = 50
-        
-        logger.info(f"""
-Pagination details:
-Total rows: {total_rows}
-Rows per page: {rows_per_page}
-""")
-        
-        # Start with padding and separator
-        markdown = "\n---\n"
-        
-        if title:
-            markdown += f"### {title}\n\n"
-        
-        # Add dataset size info
-        if total_rows > rows_per_page:
-            markdown += f"*Showing first {rows_per_page} of {total_rows} rows*\n\n"
-            # Take only first 50 rows for display
-            display_df = df.head(rows_per_page)
-        else:
-            markdown += f"*Total rows: {total_rows}*\n\n"
-            display_df = df
-            
-        # Convert DataFrame to markdown and add padding
-        table_md = display_df.to_markdown(index=False)
-        markdown += table_md + "\n"
-        
-        # Add pagination info if needed
-        if total_rows > rows_per_page:
-            remaining = total_rows - rows_per_page
-            markdown += f"\n*{remaining:,} more rows not shown*\n"
-        
-        # Add bottom padding and separator
-        markdown += "---\n"
-        
-        logger.info(f"""
-Generated markdown:
-Length: {len(markdown)}
-Preview: {markdown[:500]}...
-""")
-        
-        # Store pagination info in context for potential follow-up
-        context_variables["table_pagination"] = {
-            "total_rows": total_rows,
-            "current_page": 1,
-            "rows_per_page": rows_per_page,
-            "total_pages": (total_rows + rows_per_page - 1) // rows_per_page
-        }
-        
-        # Return the markdown directly - no more direct response bypass
-        return {"status": "Table formatted successfully", "content": markdown}
-        
     except Exception as e:
         logger.error(f"Error formatting table: {str(e)}", exc_info=True)
         return {"error": f"Error formatting table: {str(e)}"}
@@ -1383,73 +1316,48 @@ Preview: {markdown[:500]}...
 # New function to get dashboard metric data
 
 # Add a new function to handle pagination
-def format_table_page(context_variables, page_number, title=None):
+@context_writer
+def format_table_page(context_variables, page_number, title=None, view_id=None, format=None, token_budget=None):
     """
-    Formats a specific page of the dataset.
+    Formats a specific page of a table view.
     Args:
         context_variables: The context variables containing the dataset
         page_number: The page number to display (1-based)
         title: Optional title for the table
+        view_id: View returned by format_table (defaults to the last table shown)
+        format: "csv", "tsv" or "markdown" (defaults to the format of the last page)
+        token_budget: Approximate token limit for the rendered page
     Returns:
-        Status message for the LLM
+        The formatted page and pagination info
     """
     try:
-        data = context_variables.get("dataset")
-        if data is None:
-            return {"error": "No dataset found in context"}
-            
-        import pandas as pd
-        if isinstance(data, pd.DataFrame):
-            df = data
-        else:
-            df = pd.DataFrame(data)
+        data = _table_dataset(context_variables)
+        if isinstance(data, dict):
+            return data
 
         pagination = context_variables.get("table_pagination", {})
-        if not pagination:
+        if not pagination and not view_id:
             return {"error": "No pagination info found. Please display the table first."}
 
-        rows_per_page = pagination["rows_per_page"]
-        total_rows = len(df)
-        total_pages = (total_rows + rows_per_page - 1) // rows_per_page
-
-        if not (1 <= page_number <= total_pages):
-            return {"error": f"Invalid page number. Please specify a page between 1 and {total_pages}"}
+        view_id = view_id or pagination.get("view_id")
+        key = dataset_key(context_variables)
+        view = lookup_table_view(view_id, data, dataset_key=key) if view_id else None
+        if view is None:
+            # Evicted or the dataset changed: fall back to an unsorted view of the current dataset
+            view = get_table_view(data, dataset_key=key)
+
+        result = format_view_page(
+            view,
+            int(page_number),
+            rows_per_page=pagination.get("rows_per_page", 50),
+            fmt=format or pagination.get("format", "csv"),
+            token_budget=token_budget,
+            title=title
+        )
+        if "pagination" in result:
+            context_variables["table_pagination"] = result["pagination"]
+        return result
 
-        start_idx = (page_number - 1) * rows_per_page
-        end_idx = min(start_idx + rows_per_page, total_rows)
-        
-        markdown = "\n---\n"
-        
-        if title:
-            markdown += f"### {title}\n\n"
-        
-        markdown += f"*Page {page_number} of {total_pages} (rows {start_idx + 1}-{end_idx} of {total_rows})*\n\n"
-            
-        # Get the rows for this page
-        display_df = df.iloc[start_idx:end_idx]
-        table_md = display_df.to_markdown(index=False)
-        markdown += table_md + "\n"
-        
-        # Add navigation info
-        nav_info = []
-        if page_number > 1:
-            nav_info.append(f"Previous: Page {page_number - 1}")
-        if page_number < total_pages:
-            nav_info.append(f"Next: Page {page_number + 1}")
-        
-        if nav_info:
-            markdown += f"\n*{' | '.join(nav_info)}*\n"
-        
-        markdown += "---\n"
-        
-        # Store the formatted table in context for direct streaming
-        context_variables["last_formatted_table"] = markdown
-        
-        # Update pagination info
-        context_variables["table_pagination"]["current_page"] = page_number
-        
-        return {"status": "Table page formatted successfully", "pagination": context_variables["table_pagination"]}
-        
     except Exception as e:
         logger.error(f"Error formatting table page: {str(e)}")
         return {"error": f"Error formatting table page: {str(e)}"}
@@ -1528,6 +1436,7 @@ def set_dataset_in_context(context_variables, dataset):
     Sets the dataset in the context variables and updates the agent's instructions with the column names.
     """
     context_variables["dataset"] = dataset
+    context_variables.pop("dataset_key", None)
     
     # Retrieve and update column names in the agent's instructions
     columns = get_columns(context_variables).get("columns", [])
@@ -1666,7 +1575,7 @@ def get_session(session_id: str = Cookie(None)):
         sessions[new_session_id] = {
             "messages": [],
             "agent": Researcher_agent,  # Start with researcher
-            "context_variables": {"dataset": combined_df["dataset"],"notes": combined_notes}  # Initialize context_variables
+            "context_variables": {"dataset": combined_df["dataset"],"notes": combined_notes, "session_id": new_session_id}  # Initialize context_variables
         }
         return sessions[new_session_id]
 
@@ -1787,7 +1696,7 @@ Agent: {agent_name}
             sessions[session_id] = {
                 "messages": [],
                 "agent": agent,
-                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes}
+                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes, "session_id": session_id}
             }
             logger.info(f"Created new session: {session_id} with agent: {agent_name}")
         else:
@@ -1854,7 +1763,7 @@ async def reset_conversation(request: Request, session_id: str = Cookie(None)):
             sessions[session_id] = {
                 "messages": [],
                 "agent": Researcher_agent,  # Reset to default agent
-                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes}
+                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes, "session_id": session_id}
             }
             response = JSONResponse({"status": "success"})
             
@@ -1889,7 +1798,7 @@ async def reset_conversation(request: Request, session_id: str = Cookie(None)):
             sessions[session_id] = {
                 "messages": [],
                 "agent": Researcher_agent,  # Reset to default agent
-                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes}
+                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes, "session_id": session_id}
             }
             
             # Return response with session ID
@@ -1973,7 +1882,7 @@ async def switch_agent(request: Request, session_id: str = Cookie(None)):
             sessions[session_id] = {
                 "messages": [],
                 "agent": agent,
-                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes}
+                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes, "session_id": session_id}
             }
             logger.info(f"Created new session: {session_id} with agent: {agent_name}")
             
@@ -2010,6 +1919,90 @@ async def switch_agent(request: Request, session_id: str = Cookie(None)):
             content={"status": "error", "message": f"Error switching agent: {str(e)}"}
         )
 
+def _parse_chart_data(chart_data):
+    """Chart data of a chart tool result as JSON-serializable data."""
+    if not isinstance(chart_data, str):
+        return chart_data
+    try:
+        return json.loads(chart_data)
+    except json.JSONDecodeError:
+        # If it's not valid JSON, it might be a Python string representation
+        try:
+            # Replace Python literals with JSON equivalents
+            safe_str = chart_data.replace("True", "true").replace("False", "false").replace("None", "null")
+            # Remove any datetime objects that might cause issues
+            safe_str = re.sub(r'datetime\.date\([^)]+\)', '"date"', safe_str)
+            safe_str = re.sub(r'datetime\.datetime\([^)]+\)', '"datetime"', safe_str)
+            return json.loads(safe_str)
+        except Exception as e:
+            logger.error(f"Failed to parse chart data string: {e}")
+            # Fall back to a simplified version
+            return {"error": "Could not parse chart data"}
+
+def tool_outcome_messages(outcome, sender, session_data):
+    """Stream messages for one tool call Swarm ran (an agent_runtime outcome): transfers, tables and charts."""
+    function_name = outcome["tool_name"]
+    result = outcome["raw"]
+    if outcome["error"]:
+        logger.error(f"""
+=== Tool Error ===
+Function: {function_name}
+Error: {outcome['error']}
+""")
+        return
+    logger.info(f"""
+=== Tool Result ===
+Function: {function_name}
+Result: {str(result)[:500]}{'...' if len(str(result)) > 500 else ''}
+""")
+    # Check if this is an agent transfer function
+    if function_name in ['transfer_to_analyst_agent', 'transfer_to_researcher_agent']:
+        # Update the current agent
+        session_data['agent'] = result
+        logger.info(f"""
+=== Agent Transfer ===
+New Agent: {result.name}
+""")
+        # Add a system message about the transfer
+        yield json.dumps({
+            "type": "content",
+            "sender": "System",
+            "content": f"Transferring to {result.name} Agent..."
+        }) + "\n"
+    # If the result has content (like from format_table), send it as a message
+    elif isinstance(result, dict) and "content" in result:
+        yield json.dumps({"type": "content", "sender": sender, "content": result["content"]}) + "\n"
+    # Handle chart messages
+    elif isinstance(result, dict) and result.get("type") == "chart":
+        logger.info(f"""
+=== Chart Message Detected ===
+Chart ID: {result.get("chart_id")}
+Chart Type: {result.get("chart_type")}
+Chart Data: {str(result.get("chart_data"))[:200]}...
+Chart HTML Length: {len(result.get("chart_html", ""))}
+""")
+        try:
+            message = {
+                "type": "chart",
+                "sender": sender,
+                "chart_id": result.get("chart_id"),
+                "chart_type": result.get("chart_type"),
+                "chart_data": _parse_chart_data(result.get("chart_data")),
+                "chart_html": result.get("chart_html")
+            }
+            # Ensure the message is JSON serializable
+            json_message = json.dumps(message)
+            yield json_message + "\n"
+            logger.info("Chart message sent to client")
+        except Exception as e:
+            logger.error(f"Error sending chart message: {str(e)}")
+            # Send a fallback message instead
+            yield json.dumps({
+                "type": "content",
+                "sender": sender,
+                "content": f"Error generating chart: {str(e)}"
+            }) + "\n"
+
 async def generate_response(user_input, session_data):
     logger.info(f"""
 === Starting Agent Response ===
@@ -2020,8 +2013,13 @@ Timestamp: {datetime.now().isoformat()}
     
     messages = session_data["messages"]
     agent = session_data["agent"]
-    context_variables = session_data.get("context_variables") or {}
+    context_variables = session_data.get("context_variables")
+    if context_variables is None:
+        context_variables = session_data["context_variables"] = {}
+    session_id = context_variables.get("session_id")
     current_function_name = None  # Initialize at the top level
+    # Drop outcomes left by an earlier response that ended early
+    take_tool_outcomes(session_id)
 
     # Append user message
     messages.append({"role": "user", "content": user_input})
@@ -2044,6 +2042,18 @@ Timestamp: {datetime.now().isoformat()}
         incomplete_tool_call = None
 
         for chunk in response_generator:
+            # Swarm runs a turn's tool calls (concurrently, see tools.agent_runtime) between chunks
+            for outcome in take_tool_outcomes(session_id):
+                for message in tool_outcome_messages(outcome, assistant_message["sender"], session_data):
+                    yield message
+
+            # The run's final state: Swarm worked on a copy of the context
+            if "response" in chunk:
+                context_variables.update(chunk["response"].context_variables)
+                if chunk["response"].agent:
+                    session_data['agent'] = chunk["response"].agent
+                continue
+
             # Handle tool calls first
             if "tool_calls" in chunk and chunk["tool_calls"] is not None:
                 for tool_call in chunk["tool_calls"]:
@@ -2082,136 +2092,6 @@ Arguments: {json.dumps(arguments_json, indent=2)}
                         message = json.dumps(incomplete_tool_call) + "\n"
                         yield message
 
-                        # Process the function call
-                        function_to_call = function_mapping.get(current_function_name)
-                        if function_to_call:
-                            try:
-                                # Special handling for generate_chart_message function
-                                if current_function_name == 'generate_chart_message':
-                                    # Extract chart_data and chart_type from arguments_json
-                                    chart_data = arguments_json.get('chart_data')
-                                    chart_type = arguments_json.get('chart_type', 'anomaly')
-                                    
-                                    # Call the function with the correct arguments
-                                    result = function_to_call(chart_data=chart_data, chart_type=chart_type)
-                                else:
-                                    # IMPROVED ARGUMENT HANDLING for other functions
-                                    # Check if we have the args/kwargs pattern that needs special handling
-                                    if 'args' in arguments_json and 'kwargs' in arguments_json:
-                                        # Handle case where kwargs is a JSON string
-                                        if isinstance(arguments_json['kwargs'], str) and arguments_json['kwargs'].startswith('{'):
-                                            try:
-                                                # Parse the kwargs JSON string into a dict
-                                                kwargs_dict = json.loads(arguments_json['kwargs'])
-                                                # Call function with parsed kwargs
-                                                logger.info(f"Calling {current_function_name} with extracted kwargs: {kwargs_dict}")
-                                                result = function_to_call(context_variables, **kwargs_dict)
-                                            except json.JSONDecodeError:
-                                                # If kwargs can't be parsed as JSON, use it as is
-                                                logger.warning(f"Couldn't parse kwargs as JSON: {arguments_json['kwargs']}")
-                                                result = function_to_call(context_variables, **arguments_json)
-                                        else:
-                                            # Standard call if kwargs is not a JSON string
-                                            result = function_to_call(context_variables, **arguments_json)
-                                    else:
-                                        # Standard function call with normal arguments
-                                        # Remove context_variables from arguments_json if it exists
-                                        if 'context_variables' in arguments_json:
-                                            del arguments_json['context_variables']
-                                        result = function_to_call(context_variables, **arguments_json)
-                                
-                                logger.info(f"""
-=== Tool Result ===
-Function: {current_function_name}
-Result: {str(result)[:500]}{'...' if len(str(result)) > 500 else ''}
-""")
-                                # Check if this is an agent transfer function
-                                if current_function_name in ['transfer_to_analyst_agent', 'transfer_to_researcher_agent']:
-                                    # Update the current agent
-                                    session_data['agent'] = result
-                                    logger.info(f"""
-=== Agent Transfer ===
-New Agent: {result.name}
-""")
-                                    # Add a system message about the transfer
-                                    transfer_message = {
-                                        "type": "content",
-                                        "sender": "System",
-                                        "content": f"Transferring to {result.name} Agent..."
-                                    }
-                                    yield json.dumps(transfer_message) + "\n"
-                                    
-                                # If the result has content (like from format_table), send it as a message
-                                elif isinstance(result, dict) and "content" in result:
-                                    message = {
-                                        "type": "content",
-                                        "sender": assistant_message["sender"],
-                                        "content": result["content"]
-                                    }
-                                    yield json.dumps(message) + "\n"
-                                # Handle chart messages
-                                elif isinstance(result, dict) and result.get("type") == "chart":
-                                    logger.info(f"""
-=== Chart Message Detected ===
-Chart ID: {result.get("chart_id")}
-Chart Type: {result.get("chart_type")}
-Chart Data: {str(result.get("chart_data"))[:200]}...
-Chart HTML Length: {len(result.get("chart_html", ""))}
-""")
-                                    try:
-                                        # Ensure all chart data is JSON serializable
-                                        chart_data = result.get("chart_data")
-                                        
-                                        # If chart_data is a string, try to parse it as JSON
-                                        if isinstance(chart_data, str):
-                                            try:
-                                                # Try to parse it as JSON
-                                                chart_data = json.loads(chart_data)
-                                            except json.JSONDecodeError:
-                                                # If it's not valid JSON, it might be a Python string representation
-                                                # Try to evaluate it safely
-                                                try:
-                                                    # Replace Python literals with JSON equivalents
-                                                    safe_str = chart_data.replace("True", "true").replace("False", "false").replace("None", "null")
-                                                    # Remove any datetime objects that might cause issues
-                                                    safe_str = re.sub(r'datetime\.date\([^)]+\)', '"date"', safe_str)
-                                                    safe_str = re.sub(r'datetime\.datetime\([^)]+\)', '"datetime"', safe_str)
-                                                    chart_data = json.loads(safe_str)
-                                                except Exception as e:
-                                                    logger.error(f"Failed to parse chart data string: {e}")
-                                                    # Fall back to a simplified version
-                                                    chart_data = {"error": "Could not parse chart data"}
-                                        
-                                        message = {
-                                            "type": "chart",
-                                            "sender": assistant_message["sender"],
-                                            "chart_id": result.get("chart_id"),
-                                            "chart_type": result.get("chart_type"),
-                                            "chart_data": chart_data,
-                                            "chart_html": result.get("chart_html")
-                                        }
-                                        
-                                        # Ensure the message is JSON serializable
-                                        json_message = json.dumps(message)
-                                        yield json_message + "\n"
-                                        logger.info("Chart message sent to client")
-                                    except Exception as e:
-                                        logger.error(f"Error sending chart message: {str(e)}")
-                                        # Send a fallback message instead
-                                        fallback_message = {
-                                            "type": "content",
-                                            "sender": assistant_message["sender"],
-                                            "content": f"Error generating chart: {str(e)}"
-                                        }
-                                        yield json.dumps(fallback_message) + "\n"
-                            except Exception as e:
-                                logger.error(f"""
-=== Tool Error ===
-Function: {current_function_name}
-Error: {str(e)}
-""")
-                                raise
-
                         incomplete_tool_call = None
                         current_function_name = None
                     except json.JSONDecodeError:
@@ -2315,7 +2195,7 @@ async def index(request: Request, session_id: str = Cookie(None)):
             sessions[session_id] = {
                 "messages": [],
                 "agent": anomaly_explainer_agent,
-                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes}
+                "context_variables": {"dataset": combined_df["dataset"], "notes": combined_notes, "session_id": session_id}
             }
         
         # Add a system message with the metric data